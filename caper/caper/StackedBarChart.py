@@ -1,42 +1,71 @@
-from collections import defaultdict
 import logging
 import time
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
 
-def StackedBarChart(sample, fa_cmap):
-    start_time = time.time()
-    df = pd.DataFrame(sample)
-    df['Sample_name'] = df['Sample_name'].astype(str)
-    _na_values = ['NA', 'None', 'Not Provided', '']
-    df = df[df['Classification'].notna() & ~df['Classification'].isin(_na_values)]
-    corder = {'ecDNA':0, 'FAN': 1, 'BFB': 2, 'Complex-non-cyclic':3, 'Complex non-cyclic':4, 'Linear amplification':5, 'Linear':6, 'Virus':7, 'None':100}
-    classes = ['ecDNA', 'FAN', 'BFB', 'Complex non-cyclic', 'Complex-non-cyclic', 'Linear amplification', 'Linear', 'Virus', 'None']
+# Plotting order of the classifications; anything else sorts after these.
+CLASS_ORDER = {'ecDNA':0, 'FAN': 1, 'BFB': 2, 'Complex-non-cyclic':3, 'Complex non-cyclic':4, 'Linear amplification':5, 'Linear':6, 'Virus':7, 'None':100}
+CLASSES = ['ecDNA', 'FAN', 'BFB', 'Complex non-cyclic', 'Complex-non-cyclic', 'Linear amplification', 'Linear', 'Virus', 'None']
+_NA_VALUES = ['NA', 'None', 'Not Provided', '']
+
+
+def sorted_class_counts(df):
+    """
+    Return one row per sample and classification with its count, in plotting order.
 
-    seen_classes = set(df['Classification'])
-    if None in seen_classes:
-        seen_classes.remove(None)
+    Zero-count rows are added for the classes no sample has (on the first
+    sample) and a "None" row for every sample with an unnumbered amplicon, so
+    every class gets a trace.  Rows are ordered by classification, then by the
+    sample's count of each class in CLASSES order (most first), then by sample
+    name; the sort is one np.lexsort over the count matrix rather than a
+    Python key per row.
+    """
+    counts = pd.crosstab(df['Sample_name'], df['Classification'])
+    names = counts.index.to_numpy(dtype=object)
 
-    none_samps = set(df[df['AA_amplicon_number'].isna()]['Sample_name'])
+    nonzero = counts.stack()
+    nonzero = nonzero[nonzero > 0]
+    missing = list(set(CLASSES).difference(counts.columns))
+    none_samps = df.loc[df['AA_amplicon_number'].isna(), 'Sample_name'].unique()
 
-    df2 = df.groupby(['Sample_name','Classification'])['Classification'].count().reset_index(name='Count')
-    for x in set(classes).difference(seen_classes):
-        df2.loc[len(df2)] = [df2['Sample_name'][0], x, 0]
+    sample_pos = np.concatenate([
+        counts.index.get_indexer(nonzero.index.get_level_values(0)),
+        np.zeros(len(missing), dtype=np.intp),
+        counts.index.get_indexer(none_samps),
+    ])
+    classification = np.concatenate([
+        nonzero.index.get_level_values(1).to_numpy(dtype=object),
+        np.array(missing, dtype=object),
+        np.full(len(none_samps), 'None', dtype=object),
+    ])
+    count = np.concatenate([
+        nonzero.to_numpy(dtype=np.int64),
+        np.zeros(len(missing) + len(none_samps), dtype=np.int64),
+    ])
 
-    for x in none_samps:
-        df2.loc[len(df2)] = [x, "None", 0]
+    # np.lexsort sorts by its last key first.  counts.index is sorted, so a
+    # sample's position in it is also its rank by name.
+    class_counts = counts.reindex(columns=CLASSES, fill_value=0).to_numpy()[sample_pos]
+    class_rank = pd.Series(classification).map(CLASS_ORDER).fillna(99).to_numpy()
+    order = np.lexsort([sample_pos] + [-class_counts[:, i] for i in reversed(range(len(CLASSES)))] + [class_rank])
 
-    class_count_per_sample = defaultdict(lambda: defaultdict(int))
-    for _, row in df2.iterrows(): # 1 loop 
-        class_count_per_sample[row['Sample_name']][row['Classification']] = row['Count']
+    return pd.DataFrame({
+        'Sample_name': names[sample_pos[order]],
+        'Classification': classification[order],
+        'Count': count[order],
+    })
+
+
+def StackedBarChart(sample, fa_cmap):
+    start_time = time.time()
+    df = pd.DataFrame(sample)
+    df['Sample_name'] = df['Sample_name'].astype(str)
+    df = df[df['Classification'].notna() & ~df['Classification'].isin(_NA_VALUES)]
 
-    # df2['Sample_name_trunc'] = df2['Sample_name'].apply(lambda x: x[0:10] + "..." if len(x) > 10 else x)
-    cc_tuples = {x: [-y[c] for c in classes] for x, y in class_count_per_sample.items()} 
-    sort_col = [(corder.get(row['Classification'], 99), cc_tuples[row['Sample_name']], row['Sample_name']) for _, row in df2.iterrows()] # 1 loop
-    df2['sort_order_col'] = sort_col
-    df2.sort_values(inplace=True, by=['sort_order_col']) # 1 loop
+    df2 = sorted_class_counts(df)
     ordered_name_set = df2['Sample_name'].unique()
 
     if len(df2['Sample_name']) < 10:
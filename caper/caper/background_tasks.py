@@ -100,14 +100,15 @@ def cleanup_stale_temp_dirs(
     if not os.path.isdir(tmp_root):
         return 0
 
-    # Collect the absolute temp_dir paths of all currently-running tasks.
+    # Collect the absolute temp_dir paths of all currently-running tasks, and
+    # the directories queued jobs (caper/job_queue.py) will read.
     active_temp_dirs: set[str] = set()
     try:
         col = _get_tasks_collection()
-        for doc in col.find({'state': 'running', 'temp_dir': {'$exists': True, '$ne': None}}):
-            td = doc.get('temp_dir')
-            if td:
-                active_temp_dirs.add(os.path.realpath(os.path.abspath(td)))
+        for doc in col.find({'state': {'$in': ['running', 'queued']}}, {'temp_dir': 1, 'keep_dirs': 1}):
+            for td in [doc.get('temp_dir')] + list(doc.get('keep_dirs') or []):
+                if td:
+                    active_temp_dirs.add(os.path.realpath(os.path.abspath(td)))
     except Exception:
         logging.exception("cleanup_stale_temp_dirs: failed to query MongoDB — skipping cleanup")
         return 0
@@ -146,6 +147,11 @@ class BackgroundTaskTracker:
     Thin wrapper around :class:`~concurrent.futures.ThreadPoolExecutor` that
     records every submitted task in MongoDB so all gunicorn workers can see
     the same status.
+
+    With *queue_kind* set and the job queue enabled (``settings.JOB_QUEUE``),
+    submissions go to the durable queue in caper/job_queue.py instead and are
+    run by ``manage.py run_workers``; calls that cannot be queued still run
+    on the thread pool.
     """
 
     def __init__(
@@ -154,16 +160,21 @@ class BackgroundTaskTracker:
         thread_name_prefix: str = 'caper_worker',
         cleanup_interval_seconds: int = _CLEANUP_INTERVAL_SECONDS,
         tmp_root: str = _DEFAULT_TMP_ROOT,
+        queue_kind: str = None,
     ):
         self._executor = ThreadPoolExecutor(
             max_workers=max_workers,
             thread_name_prefix=thread_name_prefix,
         )
         self._max_workers = max_workers
+        self._queue_kind = queue_kind
         self._col = None  # lazy
         self._cleanup_interval = cleanup_interval_seconds
         self._tmp_root = tmp_root
-        self._start_cleanup_daemon()
+        # Only one tracker per process needs to sweep tmp_root; secondary
+        # pools pass cleanup_interval_seconds=None.
+        if cleanup_interval_seconds:
+            self._start_cleanup_daemon()
 
     def _collection(self):
         if self._col is None:
@@ -179,9 +190,18 @@ class BackgroundTaskTracker:
     # Public interface
     # ------------------------------------------------------------------
 
-    def submit(self, fn, *args, task_label: str = None, temp_dir: str = None, **kwargs):
+    def submit(self, fn, *args, task_label: str = None, temp_dir: str = None,
+               task_id: str = None, queue: bool = True, **kwargs):
         """Submit *fn* to the thread pool and record it in MongoDB.
 
+        Returns the Future, or the task id when the call went to the job
+        queue instead (see the class docstring); ``queue=False`` keeps it on
+        the thread pool.
+
+        task_id: id for the task record; generated if omitted.  Callers that
+        hand the id out before the task finishes (job status endpoints) pass
+        their own.
+
         temp_dir: if provided, its absolute path is stored in the task record
         so the periodic cleanup daemon can skip directories that belong to
         running tasks.  The directory is also removed in a finally block after
@@ -191,7 +211,15 @@ class BackgroundTaskTracker:
         if task_label is None:
             task_label = getattr(fn, '__name__', str(fn))
 
-        task_id = uuid.uuid4().hex
+        if queue and self._queue_kind is not None:
+            from .job_queue import try_enqueue
+            queued_id = try_enqueue(self._queue_kind, fn, *args, task_label=task_label,
+                                    task_id=task_id, temp_dir=temp_dir, **kwargs)
+            if queued_id is not None:
+                return queued_id
+
+        if task_id is None:
+            task_id = uuid.uuid4().hex
         now = datetime.datetime.utcnow()
 
         doc = {
@@ -240,15 +268,18 @@ class BackgroundTaskTracker:
             return {
                 'is_busy': False,
                 'active_count': 0,
+                'queued_count': 0,
                 'max_workers': self._max_workers,
                 'tasks': [],
             }
 
-        # Purge stale tasks (tasks stuck as 'running' beyond the threshold)
+        # Purge stale tasks (tasks stuck as 'running' beyond the threshold).
+        # Queued jobs hold a lease instead; the worker daemons reap those.
         cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=_STALE_THRESHOLD_SECONDS)
         try:
             col.update_many(
-                {'state': 'running', 'updated_at': {'$lt': cutoff}},
+                {'state': 'running', 'updated_at': {'$lt': cutoff},
+                 'lease_expires_at': {'$exists': False}},
                 {'$set': {'state': 'stale', 'updated_at': datetime.datetime.utcnow()}},
             )
         except Exception:
@@ -263,17 +294,62 @@ class BackgroundTaskTracker:
                     'state': doc.get('state', 'running'),
                     'started_at': doc.get('started_at', ''),
                     'worker_pid': doc.get('worker_pid'),
+                    'progress': doc.get('progress'),
                 })
         except Exception:
             logging.exception("Failed to query background tasks")
 
+        # Jobs waiting for the worker daemon (caper/job_queue.py).
+        queued_count = 0
+        try:
+            queued_count = col.count_documents({'state': 'queued'})
+        except Exception:
+            logging.exception("Failed to count queued background tasks")
+
         return {
             'is_busy': len(active) > 0,
             'active_count': len(active),
+            'queued_count': queued_count,
             'max_workers': self._max_workers,
             'tasks': active,
         }
 
+    def update_progress(self, task_id: str, **progress):
+        """Record progress fields for a running task.
+
+        Also refreshes ``updated_at``, so a long task that reports progress is
+        not swept up as stale by :meth:`get_status`.
+        """
+        col = self._collection()
+        if col is None:
+            return
+        fields = {f'progress.{key}': value for key, value in progress.items()}
+        fields['updated_at'] = datetime.datetime.utcnow()
+        try:
+            col.update_one({'_id': task_id}, {'$set': fields})
+        except Exception:
+            logging.exception(f"Failed to record progress for background task {task_id}")
+
+    def get_task(self, task_id: str):
+        """Return the serialisable record of one task, or None if unknown."""
+        col = self._collection()
+        if col is None:
+            return None
+        try:
+            doc = col.find_one({'_id': task_id})
+        except Exception:
+            logging.exception(f"Failed to query background task {task_id}")
+            return None
+        if doc is None:
+            return None
+        return {
+            'id': doc['_id'],
+            'label': doc.get('label', ''),
+            'state': doc.get('state', 'running'),
+            'started_at': doc.get('started_at', ''),
+            'progress': doc.get('progress'),
+        }
+
     # ------------------------------------------------------------------
     # Delegation to the underlying executor
     # ------------------------------------------------------------------
@@ -325,7 +401,8 @@ class BackgroundTaskTracker:
 # Module-level singleton – import this in views.py and views_apis.py
 # ---------------------------------------------------------------------------
 
-_thread_executor = BackgroundTaskTracker(max_workers=4, thread_name_prefix='caper_worker')
+_thread_executor = BackgroundTaskTracker(max_workers=4, thread_name_prefix='caper_worker',
+                                         queue_kind='maintenance')
 
 
 def get_background_task_status() -> dict:
@@ -1,5 +1,7 @@
 from django.conf import settings
 
+from .page_cache import invalidate_all_pages
+
 
 def _get_settings_collection():
     """Get or create the settings collection handle"""
@@ -15,6 +17,8 @@ def set_shutdown_pending(status):
         {'$set': {'shutdown_pending': status}},
         upsert=True
     )
+    # The flag is rendered into every page, including cached ones.
+    invalidate_all_pages()
 
 
 def get_shutdown_pending():
@@ -34,6 +38,8 @@ def set_registration_disabled(status):
         {'$set': {'registration_disabled': status}},
         upsert=True
     )
+    # The flag is rendered into every page, including cached ones.
+    invalidate_all_pages()
 
 
 def get_registration_disabled():
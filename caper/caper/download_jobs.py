@@ -0,0 +1,437 @@
+"""
+Background builds of batch sample download archives.
+
+Large batch downloads, and every emailed one, used to build their zip inside
+the request on a sync gunicorn worker — minutes of GridFS reads and deflate
+competing with the page traffic LoadShedMiddleware is trying to protect.
+Here the request only authorizes the selection and submits a job; the archive
+is built on a small dedicated :class:`BackgroundTaskTracker` pool and stored
+in GridFS.
+
+Finished archives are cached in the ``download_artifacts`` collection under
+the hash of what they contain: (project id, project version, project name,
+sample names) for every selected project, see :func:`artifact_key`.  The
+cache document is also the coalescing point: ``find_one_and_update`` with
+``$setOnInsert`` lets exactly one request claim a build, and identical
+requests arriving while it runs attach to the same job instead of starting
+their own.
+
+Artifact document::
+
+    {
+      '_id':        <artifact key>,
+      'state':      'building' | 'ready' | 'failed',
+      'job_id':     <id of the build task, also its background_tasks _id>,
+      'selection':  [{'project_id', 'project_name', 'version', 'samples'}],
+      'filename':   <zip name without .zip>,
+      'file_id':    <GridFS id of the zip, once ready>,
+      'size':       <bytes>,
+      'counts':     {project_id: samples in the archive},
+      'waiters':    <requests coalesced onto the running build>,
+      'notify':     [{'username', 'email'}] to email when the build finishes,
+      'expires_at': <when a ready artifact may be purged>,
+      'updated_at': <heartbeat while building>,
+    }
+
+Job ids are unguessable and only handed to callers that passed the access
+check for the whole selection, so the job status and download endpoints
+treat the id itself as the credential.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from .background_tasks import BackgroundTaskTracker, _STALE_THRESHOLD_SECONDS
+from .zip_stream import ZipStreamReader, iter_zip_stream
+
+BUILDING = 'building'
+READY = 'ready'
+FAILED = 'failed'
+
+# How long a finished archive is served from cache before it is purged.
+ARTIFACT_TTL_SECONDS = int(os.getenv('DOWNLOAD_ARTIFACT_TTL_SECONDS', 24 * 60 * 60))
+# Archive builds are I/O-bound but long; two at a time keeps them from
+# starving project aggregation of database bandwidth.
+DOWNLOAD_JOB_WORKERS = int(os.getenv('DOWNLOAD_JOB_WORKERS', 2))
+# Selections of more samples than this are built as a job even when the
+# client asked for the zip directly; smaller ones stream from the request.
+SYNC_MAX_SAMPLES = int(os.getenv('BATCH_DOWNLOAD_SYNC_MAX_SAMPLES', 25))
+# Expired artifacts purged per submission, so cleanup cost stays bounded.
+_PURGE_BATCH = 20
+# Report archive progress (and heartbeat) every this many bytes written.
+_PROGRESS_BYTES = 16 * 1024 * 1024
+
+_download_executor = BackgroundTaskTracker(
+    max_workers=DOWNLOAD_JOB_WORKERS,
+    thread_name_prefix='caper_download',
+    cleanup_interval_seconds=None,
+    queue_kind='download',
+)
+
+_artifacts_col = None
+
+
+def _get_artifacts_collection():
+    """Lazily obtain the download_artifacts collection (primary reads)."""
+    global _artifacts_col
+    if _artifacts_col is None:
+        from .utils import db_handle_primary, get_collection_handle
+        col = get_collection_handle(db_handle_primary, 'download_artifacts')
+        col.create_index('job_id')
+        col.create_index('expires_at')
+        _artifacts_col = col
+    return _artifacts_col
+
+
+def _get_fs():
+    from .utils import fs_handle
+    return fs_handle
+
+
+def selection_entry(project, sample_names):
+    """Describe the samples requested from one (already authorized) project."""
+    return {
+        'project_id': str(project['_id']),
+        'project_name': project.get('project_name', ''),
+        'version': str(project.get('update_date') or project.get('date') or ''),
+        'samples': list(dict.fromkeys(sample_names)),
+    }
+
+
+def artifact_key(selection):
+    """
+    Hash identifying the archive built for *selection*.
+
+    Independent of the order projects and samples were selected in, and of
+    duplicates; any change of project version or name gives a new key.
+    """
+    canonical = sorted(
+        [entry['project_id'], entry['version'], entry['project_name'],
+         sorted(set(entry['samples']))]
+        for entry in selection
+    )
+    payload = json.dumps(canonical, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _utcnow():
+    return datetime.datetime.utcnow()
+
+
+def _is_stale(doc, now):
+    updated = doc.get('updated_at')
+    return updated is None or (now - updated).total_seconds() > _STALE_THRESHOLD_SECONDS
+
+
+def _purge_expired(col, fs, now):
+    """Drop a bounded number of expired artifacts and their GridFS files."""
+    try:
+        expired = list(col.find(
+            {'expires_at': {'$lt': now}}, {'file_id': 1}).limit(_PURGE_BATCH))
+    except Exception:
+        logging.exception("download_jobs: failed to query expired artifacts")
+        return
+    for doc in expired:
+        try:
+            if col.delete_one({'_id': doc['_id'], 'expires_at': {'$lt': now}}).deleted_count \
+                    and doc.get('file_id'):
+                fs.delete(ObjectId(doc['file_id']))
+        except Exception:
+            logging.exception(f"download_jobs: failed to purge artifact {doc['_id']}")
+
+
+def _claim(col, fs, key, selection, zip_filename, recipient, now):
+    """
+    Attach this request to the artifact for *key*.
+
+    Returns:
+        tuple: (job_id, action, doc) where action is 'build' when this request
+        must start the build, 'ready' when a cached archive can be served,
+        or 'wait' when it has been coalesced onto a running build.
+    """
+    notify = [recipient] if recipient else []
+    for _ in range(5):
+        job_id = uuid.uuid4().hex
+        doc = col.find_one_and_update(
+            {'_id': key},
+            {'$setOnInsert': {
+                'state': BUILDING, 'job_id': job_id, 'selection': selection,
+                'filename': zip_filename, 'waiters': 0, 'notify': notify,
+                'created_at': now, 'updated_at': now,
+            }},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if doc is None:
+            return job_id, 'build', None
+
+        if doc.get('state') == READY and doc['expires_at'] > now:
+            return doc['job_id'], 'ready', doc
+
+        if doc.get('state') == BUILDING and not _is_stale(doc, now):
+            update = {'$inc': {'waiters': 1}}
+            if recipient:
+                update['$push'] = {'notify': recipient}
+            # Guarded on state: if the build finished since the read above,
+            # loop and take the 'ready' branch instead.
+            if col.update_one({'_id': key, 'job_id': doc['job_id'], 'state': BUILDING},
+                              update).matched_count:
+                return doc['job_id'], 'wait', doc
+            continue
+
+        # Failed, expired, or a builder that stopped heartbeating: take the
+        # build over.
+        if col.update_one(
+                {'_id': key, 'job_id': doc['job_id']},
+                {'$set': {'state': BUILDING, 'job_id': job_id, 'selection': selection,
+                          'filename': zip_filename, 'waiters': 0, 'notify': notify,
+                          'updated_at': now},
+                 '$unset': {'error': '', 'file_id': '', 'expires_at': ''}}).matched_count:
+            if doc.get('file_id'):
+                fs.delete(ObjectId(doc['file_id']))
+            return job_id, 'build', None
+    raise RuntimeError(f"Could not claim download artifact {key}")
+
+
+def submit_batch_download(selection, zip_filename, recipient=None):
+    """
+    Build (or reuse) the archive for *selection* in the background.
+
+    Args:
+        selection (list): :func:`selection_entry` dicts; the caller has
+            already checked the user may read every project in it
+        zip_filename (str): archive name without '.zip', used if this request
+            starts the build
+        recipient (dict): ``{'username', 'email'}`` to email a download link
+            to once the archive is ready, or None
+
+    Returns:
+        str: the job id, valid for :func:`get_job` and :func:`open_artifact`
+    """
+    col = _get_artifacts_collection()
+    fs = _get_fs()
+    now = _utcnow()
+    _purge_expired(col, fs, now)
+
+    key = artifact_key(selection)
+    job_id, action, doc = _claim(col, fs, key, selection, zip_filename, recipient, now)
+
+    if action == 'build':
+        try:
+            _download_executor.submit(
+                _build_artifact, key, job_id,
+                task_id=job_id,
+                task_label=f"Batch download: {sum(len(e['samples']) for e in selection)} samples",
+            )
+        except Exception as e:
+            _mark_failed(col, key, job_id, e)
+            raise
+    elif action == 'ready':
+        logging.info(f"Batch download {key[:12]} served from cache (job {job_id})")
+        record_downloads(doc.get('counts') or {})
+        if recipient:
+            _download_executor.submit(
+                _email_artifact, doc, recipient,
+                task_label=f"Batch download email: {recipient['username']}",
+            )
+    else:
+        logging.info(f"Batch download {key[:12]} coalesced onto running job {job_id}")
+    return job_id
+
+
+def record_downloads(counts, times=1):
+    """Add ``counts[project_id] * times`` sample downloads per project."""
+    from . import project_counters
+    for project_id, count in counts.items():
+        project_counters.increment(project_id, 'sample_downloads', count * times)
+
+
+def _mark_failed(col, key, job_id, error):
+    """Fail build *job_id* of artifact *key*, and so every request waiting on it."""
+    now = _utcnow()
+    try:
+        col.update_one({'_id': key, 'job_id': job_id},
+                       {'$set': {'state': FAILED, 'error': str(error), 'updated_at': now,
+                                 'expires_at': now}})
+    except Exception:
+        logging.exception(f"Could not mark download job {job_id} failed")
+
+
+def _build_artifact(key, job_id):
+    """Background task: build the archive for artifact *key* into GridFS."""
+    col = _get_artifacts_collection()
+    fs = _get_fs()
+    doc = col.find_one({'_id': key, 'job_id': job_id})
+    if doc is None:
+        logging.warning(f"Download job {job_id} was superseded before it started")
+        return
+
+    def _heartbeat(**progress):
+        _download_executor.update_progress(job_id, **progress)
+        col.update_one({'_id': key, 'job_id': job_id},
+                       {'$set': {'updated_at': _utcnow()}})
+
+    file_id = None
+    try:
+        from .views import batch_zip_members
+        _heartbeat(stage='resolving', samples=0)
+        members, counts = batch_zip_members(
+            doc['selection'],
+            progress=lambda done: _heartbeat(stage='resolving', samples=done))
+        _heartbeat(stage='archiving', samples=sum(counts.values()), bytes=0)
+
+        size = 0
+
+        def _chunks():
+            nonlocal size
+            reported = 0
+            for chunk in iter_zip_stream(members):
+                size += len(chunk)
+                if size - reported >= _PROGRESS_BYTES:
+                    _heartbeat(stage='archiving', bytes=size)
+                    reported = size
+                yield chunk
+
+        file_id = fs.put(ZipStreamReader(_chunks()),
+                         filename=f"{doc['filename']}.zip",
+                         contentType='application/zip',
+                         download_artifact=key)
+
+        now = _utcnow()
+        before = col.find_one_and_update(
+            {'_id': key, 'job_id': job_id},
+            {'$set': {'state': READY, 'file_id': file_id, 'size': size,
+                      'counts': counts, 'updated_at': now,
+                      'expires_at': now + datetime.timedelta(seconds=ARTIFACT_TTL_SECONDS)},
+             '$unset': {'notify': ''}},
+            return_document=ReturnDocument.BEFORE,
+        )
+    except Exception as e:
+        logging.exception(f"Download job {job_id} failed: {e}")
+        if file_id is not None:
+            fs.delete(file_id)
+        _mark_failed(col, key, job_id, e)
+        raise
+
+    if before is None:
+        # Another worker took the build over while this one looked stale.
+        logging.warning(f"Download job {job_id} was superseded; discarding its archive")
+        fs.delete(file_id)
+        return
+
+    _download_executor.update_progress(job_id, stage='done', bytes=size)
+    logging.info(f"Download job {job_id} built {size:,} bytes for {1 + before.get('waiters', 0)} request(s)")
+    record_downloads(counts, times=1 + before.get('waiters', 0))
+    artifact = dict(before, file_id=file_id, size=size)
+    for recipient in before.get('notify') or []:
+        _email_artifact(artifact, recipient)
+
+
+def _email_artifact(artifact, recipient):
+    """Copy a finished archive to S3 and email *recipient* a presigned link."""
+    from django.conf import settings
+    from django.core.mail import EmailMessage
+    from .utils import get_s3_client
+
+    zip_filename = artifact['filename']
+    s3_client = get_s3_client()
+    bucket_name = settings.S3_DOWNLOADS_BUCKET
+    s3_key = f"batch_downloads/{recipient['username']}/{uuid.uuid4()}/{zip_filename}.zip"
+    try:
+        s3_client.upload_fileobj(_get_fs().get(ObjectId(artifact['file_id'])), bucket_name, s3_key)
+        presigned_url = s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket_name, 'Key': s3_key},
+            ExpiresIn=604800  # 7 days in seconds
+        )
+        email_body = f"""
+Dear {recipient['username']},
+
+Your batch sample download is ready!
+
+Download URL: {presigned_url}
+
+Filename: {zip_filename}.zip
+
+This link will expire in 7 days.
+
+Best regards,
+{settings.SITE_TITLE} Team
+{settings.SITE_URL}
+"""
+        EmailMessage(
+            f"Your batch sample download is ready - {zip_filename}",
+            email_body,
+            settings.EMAIL_HOST_USER,
+            [recipient['email']],
+            reply_to=[settings.EMAIL_HOST_USER]
+        ).send(fail_silently=False)
+        logging.info(f"Download link emailed to {recipient['email']}")
+    except Exception:
+        logging.exception(f"Failed to email batch download {zip_filename} to {recipient['email']}")
+        try:
+            s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
+        except Exception:
+            logging.exception(f"Error cleaning up S3 file {s3_key}")
+
+
+_JOB_STATES = {BUILDING: 'running', READY: 'completed', FAILED: 'failed'}
+
+
+def get_job(job_id):
+    """
+    Return the status of download job *job_id*, or None if it is unknown.
+
+    ``state`` is 'running', 'completed' or 'failed'; ``progress`` carries the
+    build stage and counters while it runs.
+    """
+    doc = _get_artifacts_collection().find_one(
+        {'job_id': job_id}, {'selection': 0, 'notify': 0})
+    task = _download_executor.get_task(job_id)
+    if doc is None and task is None:
+        return None
+
+    if doc is not None:
+        state = _JOB_STATES.get(doc.get('state'), 'failed')
+        if state == 'running' and _is_stale(doc, _utcnow()):
+            state = 'stale'
+    else:
+        state = task['state']
+    status = {
+        'id': job_id,
+        'state': state,
+        'progress': task.get('progress') if task else None,
+    }
+    if doc is not None:
+        status['filename'] = f"{doc.get('filename', 'batch_samples')}.zip"
+        if state == 'completed':
+            status['size'] = doc.get('size')
+            status['expires_at'] = doc['expires_at'].isoformat(timespec='seconds')
+        if state == 'failed' and doc.get('error'):
+            status['error'] = doc['error']
+    return status
+
+
+def open_artifact(job_id):
+    """
+    Open the finished archive of job *job_id*.
+
+    Returns:
+        tuple or None: (GridOut, filename), or None if the job is unknown,
+        unfinished or its archive has expired.
+    """
+    doc = _get_artifacts_collection().find_one({'job_id': job_id, 'state': READY})
+    if doc is None or doc['expires_at'] < _utcnow():
+        return None
+    try:
+        return _get_fs().get(ObjectId(doc['file_id'])), f"{doc['filename']}.zip"
+    except Exception:
+        logging.exception(f"Archive of download job {job_id} is missing from GridFS")
+        return None
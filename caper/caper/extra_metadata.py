@@ -3,8 +3,10 @@ import time
 import os
 
 import pandas as pd
+from pymongo import UpdateOne
 
 from .utils import *
+from .page_cache import invalidate_project_pages
 
 
 def _has_metadata_value(value):
@@ -190,79 +192,171 @@ def _read_metadata_file(metadata_file=None, file_path=None):
         raise ValueError("Invalid file source. Provide either 'metadata_file' or 'file_path'.")
 
 
-def _apply_metadata_to_runs(project_runs, metadata_lookup, old_extra_metadata=None, remap_name_to_alias=False):
+_IDENTITY_COLUMNS = {'sample_name', 'original_sample_name', 'sample_name_alias'}
+_TOP_LEVEL_COLUMNS = {
+    'cancer_type': 'Cancer_type',
+    'sample_type': 'Sample_type',
+    'tissue_of_origin': 'Tissue_of_origin',
+}
+
+# Changed samples written per update when only their sub-documents are $set.
+METADATA_PATHS_PER_UPDATE = 500
+
+
+def _metadata_row_update(row):
+    """
+    Work out once what a metadata row writes onto each sample it matches.
+
+    Returns:
+        tuple: (extra, fields, alias) - entries for 'extra_metadata_from_csv'
+               in write order, top-level sample fields, and the usable
+               sample_name_alias (or None)
+    """
+    extra = {}
+    fields = {}
+
+    original_name = _metadata_value(row, 'original_sample_name')
+    if not _has_metadata_value(original_name):
+        original_name = _metadata_value(row, 'sample_name')
+    if _has_metadata_value(original_name):
+        extra["original_sample_name"] = str(original_name)
+
+    sample_name_alias = _metadata_value(row, 'sample_name_alias')
+    if _has_metadata_value(sample_name_alias):
+        extra["sample_name_alias"] = str(sample_name_alias)
+    else:
+        sample_name_alias = None
+
+    for key, value in row.items():
+        normalized_key = str(key).lower()
+        if normalized_key not in _IDENTITY_COLUMNS:
+            extra[key] = value
+        if normalized_key in _TOP_LEVEL_COLUMNS:
+            fields[_TOP_LEVEL_COLUMNS[normalized_key]] = value
+
+    return extra, fields, sample_name_alias
+
+
+def _match_samples_to_metadata(project_runs, metadata_lookup):
+    """
+    Join the samples of *project_runs* to *metadata_lookup* on sample name.
+
+    Returns:
+        pd.DataFrame: one row per matched sample with 'sample_key',
+                      'position', 'sample_name' and 'row_id' (index into
+                      the list of lookup rows, which is returned alongside)
+    """
+    rows = list(metadata_lookup.values())
+    samples = pd.DataFrame(
+        [(sample_key, position, sample.get('Sample_name'))
+         for sample_key, sample_list in project_runs.items()
+         for position, sample in enumerate(sample_list)],
+        columns=['sample_key', 'position', 'sample_name'],
+    )
+    if samples.empty or not rows:
+        return pd.DataFrame(columns=['sample_key', 'position', 'sample_name', 'row_id']), rows
+
+    # Names without a value are never matched.  Lookup keys are always strings
+    # (see _build_metadata_lookup_from_dataframe) and MongoDB values are
+    # strings too, but be defensive in case either side is numeric.
+    samples = samples[samples['sample_name'].astype(bool)]
+    samples = samples.assign(sample_name=samples['sample_name'].astype(str))
+
+    lookup = pd.DataFrame({'sample_name': list(metadata_lookup), 'row_id': range(len(rows))})
+    matched = samples.merge(lookup, on='sample_name', how='inner', sort=False)
+    # An empty row carries nothing to apply.
+    non_empty = pd.Series([bool(row) for row in rows])
+    return matched[matched['row_id'].map(non_empty).astype(bool)], rows
+
+
+def _apply_metadata_to_runs(project_runs, metadata_lookup, old_extra_metadata=None, remap_name_to_alias=False,
+                            changed=None):
     """
     Helper function to apply metadata to project runs.
 
+    Samples are joined to the metadata in one pandas merge on sample name, and
+    what each metadata row writes is worked out once per row rather than once
+    per sample.
+
     Args:
         project_runs (dict): The 'runs' field of the project
         metadata_lookup (dict): Dictionary mapping sample_name -> metadata row
         old_extra_metadata (dict, optional): Existing metadata to preserve
+        changed (list, optional): if given, receives (sample_key, position)
+            of every sample whose contents actually changed
 
     Returns:
         int: Number of samples updated
     """
-    samples_updated = 0
+    matched, rows = _match_samples_to_metadata(project_runs, metadata_lookup)
+    if matched.empty:
+        return 0
 
     old_metadata_lookup = _build_retained_metadata_lookup(old_extra_metadata)
+    row_updates = {}
 
-    for sample_key, sample_list in project_runs.items():
-        for sample in sample_list:
-            sample_name = sample.get('Sample_name')
-            if not sample_name:
-                continue
-            # Normalise to str: lookup keys are always strings (see
-            # _build_metadata_lookup_from_dataframe) and MongoDB values are
-            # strings too, but be defensive in case either side is numeric.
-            sample_name = str(sample_name)
-
-            # O(1) lookup instead of O(n) nested iteration
-            row = metadata_lookup.get(sample_name)
-            if not row:
-                # If no metadata found for this sample, keep existing metadata if it exists in sample['Sample_metadata_JSON']
-                
-                continue
-
-            samples_updated += 1
-
-            if "extra_metadata_from_csv" not in sample:
-                sample["extra_metadata_from_csv"] = {}
-
-            # If there is old metadata for this sample, preserve it
-            old_metadata = old_metadata_lookup.get(sample_name)
-            if old_metadata:
-                sample["extra_metadata_from_csv"].update(old_metadata)
-
-            original_name = _metadata_value(row, 'original_sample_name')
-            if not _has_metadata_value(original_name):
-                original_name = _metadata_value(row, 'sample_name')
-            if _has_metadata_value(original_name):
-                sample["extra_metadata_from_csv"]["original_sample_name"] = str(original_name)
-
-            sample_name_alias = _metadata_value(row, 'sample_name_alias')
-            if _has_metadata_value(sample_name_alias):
-                sample["extra_metadata_from_csv"]["sample_name_alias"] = str(sample_name_alias)
-
-            # Update with new metadata
-            for key, value in row.items():
-                normalized_key = str(key).lower()
-                if normalized_key not in {
-                        'sample_name', 'original_sample_name', 'sample_name_alias'}:
-                    sample["extra_metadata_from_csv"][key] = value
-                if normalized_key == 'cancer_type':
-                    sample["Cancer_type"] = value
-                if normalized_key == 'sample_type':
-                    sample["Sample_type"] = value
-                if normalized_key == 'tissue_of_origin':
-                    sample["Tissue_of_origin"] = value
-
-            # Metadata attachment and sample renaming are separate operations.
-            # When remapping is declined, retain the name supplied by the new
-            # project archive instead of silently restoring metadata['sample_name'].
-            if remap_name_to_alias and _has_metadata_value(sample_name_alias):
-                sample["Sample_name"] = str(sample_name_alias)
-
-    return samples_updated
+    for sample_key, position, sample_name, row_id in matched.itertuples(index=False, name=None):
+        position = int(position)
+        sample = project_runs[sample_key][position]
+        if row_id not in row_updates:
+            row_updates[row_id] = _metadata_row_update(rows[row_id])
+        extra, fields, sample_name_alias = row_updates[row_id]
+
+        if changed is not None:
+            before = (dict(sample.get("extra_metadata_from_csv") or {}),
+                      {field: sample.get(field) for field in (*_TOP_LEVEL_COLUMNS.values(), 'Sample_name')})
+
+        sample_extra = sample.setdefault("extra_metadata_from_csv", {})
+
+        # If there is old metadata for this sample, preserve it
+        old_metadata = old_metadata_lookup.get(sample_name)
+        if old_metadata:
+            sample_extra.update(old_metadata)
+
+        # Update with new metadata
+        sample_extra.update(extra)
+        sample.update(fields)
+
+        # Metadata attachment and sample renaming are separate operations.
+        # When remapping is declined, retain the name supplied by the new
+        # project archive instead of silently restoring metadata['sample_name'].
+        if remap_name_to_alias and sample_name_alias is not None:
+            sample["Sample_name"] = sample_name_alias
+
+        if changed is not None:
+            after = (sample_extra, {field: sample.get(field) for field in before[1]})
+            if after != before:
+                changed.append((sample_key, position))
+
+    return len(matched)
+
+
+def changed_sample_updates(project_runs, changed):
+    """
+    Targeted ``$set`` documents for the samples listed in *changed*.
+
+    Each document sets at most ``METADATA_PATHS_PER_UPDATE`` paths of the form
+    ``runs.<sample_key>.<position>``, so a metadata edit writes only the samples
+    it touched instead of the whole ``runs`` dict.
+
+    Returns:
+        list or None: the ``$set`` documents, or None when a sample key cannot
+                      be used in a field path (contains '.' or starts with '$')
+                      and ``runs`` has to be written whole
+    """
+    sets = []
+    current = {}
+    for sample_key, position in changed:
+        sample_key = str(sample_key)
+        if '.' in sample_key or sample_key.startswith('$'):
+            return None
+        current[f'runs.{sample_key}.{position}'] = project_runs[sample_key][position]
+        if len(current) >= METADATA_PATHS_PER_UPDATE:
+            sets.append(current)
+            current = {}
+    if current:
+        sets.append(current)
+    return sets
 
 
 def process_metadata(request, project_id, remap_name_to_alias=False):
@@ -299,15 +393,25 @@ def process_metadata(request, project_id, remap_name_to_alias=False):
         runs = project.get('runs', {})
 
         # Apply metadata to runs
-        samples_updated = _apply_metadata_to_runs(runs, metadata_lookup, remap_name_to_alias=remap_name_to_alias)
-
-        logging.info(f"Updated {samples_updated} samples with metadata for project {project_id}")
-
-        # Update the project document in the database
-        collection_handle.update_one(
-            {'_id': ObjectId(project_id)},
-            {'$set': {'runs': runs}}
-        )
+        changed = []
+        samples_updated = _apply_metadata_to_runs(runs, metadata_lookup, remap_name_to_alias=remap_name_to_alias,
+                                                  changed=changed)
+
+        logging.info(f"Updated {samples_updated} samples with metadata for project {project_id} "
+                     f"({len(changed)} changed)")
+
+        # Write back only the changed samples; fall back to the whole runs
+        # dict if a sample key cannot be addressed as a field path.
+        query = {'_id': ObjectId(project_id)}
+        sets = changed_sample_updates(runs, changed)
+        if sets is None:
+            collection_handle.update_one(query, {'$set': {'runs': runs, 'sample_index': build_sample_index(runs),
+                                                          'sample_metadata_available': runs_have_sample_metadata(runs)}})
+        elif sets:
+            sets[-1]['sample_index'] = build_sample_index(runs)
+            sets[-1]['sample_metadata_available'] = runs_have_sample_metadata(runs)
+            collection_handle.bulk_write([UpdateOne(query, {'$set': paths}) for paths in sets])
+        invalidate_project_pages(project_id)
         return "complete"
 
     except Exception as e:
@@ -315,7 +419,8 @@ def process_metadata(request, project_id, remap_name_to_alias=False):
         return f"Error processing file: {str(e)}"
 
 
-def process_metadata_no_request(project_runs, metadata_file=None, old_extra_metadata=None, file_path=None, remap_name_to_alias=False):
+def process_metadata_no_request(project_runs, metadata_file=None, old_extra_metadata=None, file_path=None, remap_name_to_alias=False,
+                                changed=None):
     """
     Updates the 'runs' field of a project dictionary with metadata from an uploaded file or a file path.
 
@@ -324,6 +429,8 @@ def process_metadata_no_request(project_runs, metadata_file=None, old_extra_meta
         metadata_file (UploadedFile, optional): The metadata file uploaded by the user.
         old_extra_metadata (dict, optional): Existing extra metadata to be preserved.
         file_path (str, optional): The path to the metadata file on disk.
+        changed (list, optional): Receives (sample_key, position) of every
+            sample whose contents changed; see _apply_metadata_to_runs.
 
     Returns:
         dict: The updated 'runs' dictionary with appended metadata.
@@ -343,6 +450,7 @@ def process_metadata_no_request(project_runs, metadata_file=None, old_extra_meta
             project_runs,
             metadata_lookup,
             remap_name_to_alias=remap_name_to_alias,
+            changed=changed,
         )
         logging.info(f"process_metadata_no_request: Applied old metadata - took {time.time() - start_time:.4f}s")
         return project_runs
@@ -362,7 +470,8 @@ def process_metadata_no_request(project_runs, metadata_file=None, old_extra_meta
             f"process_metadata_no_request: Metadata dict built in {dict_build_time - file_read_time:.4f}s ({len(metadata_lookup)} samples)")
 
         # Apply metadata to runs
-        samples_updated = _apply_metadata_to_runs(project_runs, metadata_lookup, old_extra_metadata, remap_name_to_alias=remap_name_to_alias)
+        samples_updated = _apply_metadata_to_runs(project_runs, metadata_lookup, old_extra_metadata, remap_name_to_alias=remap_name_to_alias,
+                                                  changed=changed)
 
         end_time = time.time()
         logging.info(
@@ -460,8 +569,31 @@ def has_sample_metadata(project):
     """
     if not project or 'runs' not in project:
         return False
-    for sample_list in project['runs'].values():
+    return runs_have_sample_metadata(project['runs'])
+
+
+def runs_have_sample_metadata(runs):
+    """
+    Checks if any feature in *runs* carries sample metadata.
+
+    Stored on the project as ``sample_metadata_available`` whenever ``runs``
+    is written, so listings can show it without reading ``runs``.
+    """
+    for sample_list in (runs or {}).values():
         for sample in sample_list:
             if 'extra_metadata_from_csv' in sample:
                 return True
     return False
+
+
+# Server-side equivalent of runs_have_sample_metadata, for a $project stage:
+# evaluated inside MongoDB so runs never leaves the server.
+SAMPLE_METADATA_AVAILABLE_EXPR = {'$anyElementTrue': [{'$map': {
+    'input': {'$objectToArray': {'$ifNull': ['$runs', {}]}},
+    'as': 'run',
+    'in': {'$anyElementTrue': [{'$map': {
+        'input': {'$ifNull': ['$$run.v', []]},
+        'as': 'feature',
+        'in': {'$ne': [{'$type': '$$feature.extra_metadata_from_csv'}, 'missing']},
+    }}]},
+}}]}
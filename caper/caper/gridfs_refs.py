@@ -0,0 +1,136 @@
+"""
+Index of which project documents reference which GridFS files.
+
+Finding unreferenced GridFS files used to mean walking every project
+document, ``runs`` included, into a Python set and diffing it against all of
+``fs.files``.  Instead, every place that stores GridFS ids on a project
+records them here as it writes them::
+
+    gridfs_refs: {
+      'file_id':    <ObjectId of the fs.files document>,
+      'project_id': <project _id, as str>,
+      'path':       <where the id sits, e.g. 'tarfile' or 'runs.sample_1.0.AA PNG file'>,
+    }
+
+so purge-local-db.py can find orphans with one ``$lookup`` anti-join from
+``fs.files`` and cleanup_orphaned_projects.py can tell which of a project's
+files no other project uses.
+
+The index is additive: rewriting ``runs`` without new file ids does not
+touch it, and an entry that outlives its reference only keeps a file alive.
+A missing entry is the dangerous direction, so a failed write flags the
+project ``gridfs_refs_stale`` and the purge re-indexes flagged projects
+before it looks for orphans.
+"""
+
+import logging
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .project_version_cleanup import GRIDFS_FILE_KEYS, object_id_from_gridfs_value
+
+logger = logging.getLogger(__name__)
+
+REFS_COLLECTION = 'gridfs_refs'
+STALE_FLAG = 'gridfs_refs_stale'
+
+_refs_col = None
+
+
+def _get_refs_collection():
+    """Lazily obtain the gridfs_refs collection (primary reads and writes)."""
+    global _refs_col
+    if _refs_col is None:
+        from .utils import db_handle_primary, get_collection_handle
+        col = get_collection_handle(db_handle_primary, REFS_COLLECTION)
+        col.create_index([('file_id', 1), ('project_id', 1), ('path', 1)], unique=True)
+        col.create_index('project_id')
+        _refs_col = col
+    return _refs_col
+
+
+def iter_gridfs_refs(value, path='', parent_key=None):
+    """Yield ``(file_id, path)`` for every GridFS id stored in *value*."""
+    if parent_key in GRIDFS_FILE_KEYS:
+        oid = object_id_from_gridfs_value(value)
+        if oid is not None:
+            yield oid, path
+        return
+
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from iter_gridfs_refs(child, f'{path}.{key}' if path else str(key), key)
+    elif isinstance(value, (list, tuple)):
+        for index, child in enumerate(value):
+            yield from iter_gridfs_refs(child, f'{path}.{index}', parent_key)
+
+
+def ref_updates(project_id, document):
+    """Upserts recording every GridFS id in *document* against *project_id*."""
+    project_id = str(project_id)
+    ops = []
+    for file_id, path in iter_gridfs_refs(document):
+        ref = {'file_id': file_id, 'project_id': project_id, 'path': path}
+        ops.append(UpdateOne(ref, {'$setOnInsert': ref}, upsert=True))
+    return ops
+
+
+def record_project_refs(project_id, document):
+    """
+    Record the GridFS ids in *document* (a project, or the fields just
+    ``$set`` on it) as referenced by *project_id*.
+
+    Never raises: on failure the project is flagged for re-indexing instead.
+    """
+    ops = ref_updates(project_id, document)
+    if not ops:
+        return 0
+    try:
+        _get_refs_collection().bulk_write(ops, ordered=False)
+        return len(ops)
+    except Exception as e:
+        logger.error(f"Could not record GridFS references of project {project_id}: {e}")
+        try:
+            from .utils import collection_handle_primary
+            collection_handle_primary.update_one(
+                {'_id': ObjectId(str(project_id))}, {'$set': {STALE_FLAG: True}})
+        except Exception:
+            logger.exception(f"Could not flag project {project_id} for GridFS re-indexing")
+        return 0
+
+
+def drop_project_refs(project_id):
+    """Forget every reference held by *project_id* (its document or payload is gone)."""
+    try:
+        _get_refs_collection().delete_many({'project_id': str(project_id)})
+    except Exception as e:
+        # A leftover reference only keeps files alive until the next rebuild.
+        logger.warning(f"Could not drop GridFS references of project {project_id}: {e}")
+
+
+def referenced_elsewhere(project_id, file_ids):
+    """
+    Return those of *file_ids* that a project other than *project_id* references.
+
+    A version made by appending samples shares its parent's sample files, so a
+    version's payload may only be deleted where no other version uses it.
+    Projects flagged stale are read directly, since their entries may be
+    missing.  If the lookup fails every id is returned: keeping a file is safe.
+    """
+    file_ids = {ObjectId(str(file_id)) for file_id in file_ids}
+    if not file_ids:
+        return set()
+    project_id = str(project_id)
+    try:
+        shared = set(_get_refs_collection().distinct(
+            'file_id', {'file_id': {'$in': list(file_ids)}, 'project_id': {'$ne': project_id}}))
+        from .utils import collection_handle_primary
+        for doc in collection_handle_primary.find({STALE_FLAG: True}):
+            if str(doc['_id']) != project_id:
+                shared.update(file_ids.intersection(oid for oid, _ in iter_gridfs_refs(doc)))
+        return shared
+    except Exception as e:
+        logger.warning(f"Could not check which GridFS files of project {project_id} are shared, "
+                       f"keeping all of them: {e}")
+        return file_ids
@@ -0,0 +1,472 @@
+"""
+Durable job queue for background work, kept in the background_tasks collection.
+
+Background work used to run only on :class:`BackgroundTaskTracker` thread
+pools inside whichever gunicorn worker took the request.  A worker recycled
+by ``max_requests`` or killed by the timeout took its jobs with it, and they
+were only noticed later as ``stale``; aggregation also took the CPUs (and the
+GIL) that page requests were waiting for.
+
+With the queue on, a submission is written to ``background_tasks`` instead::
+
+    {
+      '_id':          <task id>,
+      'label':        <task label>,
+      'state':        'queued' -> 'running' -> 'completed' | 'failed'
+                      (failed attempts go back to 'queued' until max_attempts),
+      'kind':         'download' | 'aggregation' | 'maintenance',
+      'priority':     PRIORITY[kind]; lower is claimed first,
+      'handler':      'caper.views:_process_and_aggregate_files',
+      'args':         [...], 'kwargs': {...},
+      'attempts':     <claims so far>, 'max_attempts': <int>,
+      'run_after':    <not claimed before this (retry backoff)>,
+      'lease_owner':  <worker id>, 'lease_expires_at': <datetime>,
+      'keep_dirs':    [<absolute dirs the job reads>], 'temp_dir': <removed when done>,
+      'last_error':   <repr of the latest failure>,
+      'queued_at':    <datetime>,
+    }
+
+``manage.py run_workers`` claims jobs into a process pool of niced processes.
+A claim takes a lease of ``JOB_LEASE_SECONDS`` which the daemon renews every
+poll while the job runs (the heartbeat).  A job whose lease runs out - its
+daemon was killed, or its host died - is put back in the queue by whichever
+daemon notices first, as is a job that raised; both wait an exponential
+backoff and give up after ``max_attempts`` claims.  Outcome writes are
+guarded by the lease owner, so a daemon that lost its lease cannot overwrite
+the retry's result.
+
+Aggregation (:func:`submit_aggregation`) is queued when ``AGGREGATION_QUEUE``
+or ``JOB_QUEUE`` is on; downloads and maintenance, submitted through their
+:class:`BackgroundTaskTracker`, when ``JOB_QUEUE`` is.  Aggregation and some
+maintenance (extraction, the project files report) read the web host's local
+``tmp/`` tree, so a daemon serving them must run there, in the same working
+directory.  Download builds only touch MongoDB, GridFS and S3, so
+``run_workers --kinds download`` can run on other hosts and scale separately
+from the web tier.
+
+Arguments are stored as BSON: a Django user is stored as its primary key and
+looked up again in the worker.  A call that cannot be stored (an unsupported
+argument or a closure, a document over the size limit) or a failed insert
+runs on the thread pool as before, as does everything when the queue is off.
+
+Queued records have no ``updated_at``, so the one-hour TTL index on
+background_tasks does not expire a job that is still waiting; it is set while
+the job runs and when it finishes.
+"""
+
+import datetime
+import importlib
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from .background_tasks import _get_tasks_collection, _remove_temp_dir, _thread_executor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+KIND_DOWNLOAD = 'download'
+KIND_AGGREGATION = 'aggregation'
+KIND_MAINTENANCE = 'maintenance'
+KINDS = (KIND_DOWNLOAD, KIND_AGGREGATION, KIND_MAINTENANCE)
+
+# Claim order when a daemon serves several kinds: downloads are short and a
+# user is polling for them; maintenance only runs when nothing else waits.
+PRIORITY = {KIND_DOWNLOAD: 0, KIND_AGGREGATION: 10, KIND_MAINTENANCE: 20}
+# Claims per job before it is marked failed.  Aggregation rolls a failed edit
+# back itself, so it is only retried when its worker died (lease expired).
+MAX_ATTEMPTS = {KIND_DOWNLOAD: 3, KIND_AGGREGATION: 2, KIND_MAINTENANCE: 3}
+
+JOB_LEASE_SECONDS = int(os.getenv('CAPER_JOB_LEASE_SECONDS', 120))
+RETRY_BASE_SECONDS = int(os.getenv('CAPER_JOB_RETRY_BASE_SECONDS', 30))
+RETRY_MAX_SECONDS = 30 * 60
+
+# Only functions in these packages can be named as a job's handler.
+_HANDLER_PACKAGES = ('caper.',)
+
+_USER_KEY = '__job_user__'
+
+_col = None
+
+
+def _jobs_collection():
+    """Lazily obtain background_tasks with the indexes the workers claim by."""
+    global _col
+    if _col is None:
+        col = _get_tasks_collection()
+        col.create_index([('state', 1), ('priority', 1), ('run_after', 1)])
+        col.create_index([('state', 1), ('lease_expires_at', 1)])
+        _col = col
+    return _col
+
+
+def _utcnow():
+    return datetime.datetime.utcnow()
+
+
+# ---------------------------------------------------------------------------
+# Argument encoding
+# ---------------------------------------------------------------------------
+
+def encode_value(value):
+    """
+    Convert a job argument to something BSON can store.
+
+    Raises:
+        TypeError: for values that cannot be queued (the call then runs on
+                   the thread pool instead)
+    """
+    from django.contrib.auth import get_user_model
+
+    if value is None or isinstance(value, (str, bool, int, float, bytes, ObjectId, datetime.datetime)):
+        return value
+    if isinstance(value, get_user_model()):
+        return {_USER_KEY: value.pk}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError('job argument dicts must have str keys')
+        return {key: encode_value(item) for key, item in value.items()}
+    raise TypeError(f'{type(value).__name__} cannot be queued')
+
+
+def decode_value(value):
+    """Inverse of :func:`encode_value` (tuples come back as lists)."""
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if isinstance(value, dict):
+        if set(value) == {_USER_KEY}:
+            from django.contrib.auth import get_user_model
+            return get_user_model().objects.get(pk=value[_USER_KEY])
+        return {key: decode_value(item) for key, item in value.items()}
+    return value
+
+
+def handler_name(fn):
+    """Return the ``module:qualname`` a worker resolves *fn* by."""
+    name = f'{fn.__module__}:{fn.__qualname__}'
+    if '<' in fn.__qualname__ or not fn.__module__.startswith(_HANDLER_PACKAGES):
+        raise TypeError(f'{name} is not a module-level caper function')
+    return name
+
+
+def resolve_handler(name):
+    module_name, _, qualname = name.partition(':')
+    if not module_name.startswith(_HANDLER_PACKAGES):
+        raise ValueError(f'refusing to run handler {name}')
+    target = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        target = getattr(target, attr)
+    return target
+
+
+# ---------------------------------------------------------------------------
+# Web side
+# ---------------------------------------------------------------------------
+
+def queue_enabled(kind):
+    """Whether jobs of *kind* go to the queue under the current settings."""
+    if getattr(settings, 'JOB_QUEUE', False):
+        return True
+    return kind == KIND_AGGREGATION and getattr(settings, 'AGGREGATION_QUEUE', False)
+
+
+def enqueue(fn, *args, task_label=None, task_id=None, kind=KIND_AGGREGATION, temp_dir=None, keep_dirs=(),
+            max_attempts=None, **kwargs):
+    """
+    Queue ``fn(*args, **kwargs)`` for the worker daemon.
+
+    temp_dir: removed once the job has finished for good, as with
+    :meth:`BackgroundTaskTracker.submit`.
+    keep_dirs: directories the job will read; the temp-dir cleanup leaves
+    them alone while the job is queued or running.
+
+    Returns:
+        str: the task id
+
+    Raises:
+        TypeError: if *fn* or an argument cannot be queued
+    """
+    now = _utcnow()
+    doc = {
+        '_id': task_id or uuid.uuid4().hex,
+        'label': task_label or getattr(fn, '__name__', str(fn)),
+        'state': QUEUED,
+        'kind': kind,
+        'priority': PRIORITY[kind],
+        'handler': handler_name(fn),
+        'args': encode_value(list(args)),
+        'kwargs': encode_value(kwargs),
+        'attempts': 0,
+        'max_attempts': max_attempts or MAX_ATTEMPTS[kind],
+        'run_after': now,
+        'keep_dirs': [os.path.abspath(d) for d in keep_dirs],
+        'temp_dir': os.path.abspath(temp_dir) if temp_dir is not None else None,
+        'queued_at': now,
+        'queued_by_pid': os.getpid(),
+    }
+    _jobs_collection().insert_one(doc)
+    logger.info(f"Queued {doc['kind']} job {doc['_id']} ({doc['label']})")
+    return doc['_id']
+
+
+def try_enqueue(kind, fn, *args, task_label=None, **kwargs):
+    """
+    :func:`enqueue` if jobs of *kind* are queued and this call can be.
+
+    Returns:
+        str or None: the task id, or None when the caller should run the
+        call itself
+    """
+    if not queue_enabled(kind):
+        return None
+    try:
+        return enqueue(fn, *args, task_label=task_label, kind=kind, **kwargs)
+    except Exception as e:
+        logger.warning(f"Could not queue {task_label}, running it in this process instead: {e}")
+        return None
+
+
+def submit_aggregation(fn, *args, task_label=None, keep_dirs=(), **kwargs):
+    """
+    Run a project aggregation job off the web tier when the queue is enabled.
+
+    Falls back to ``_thread_executor`` when the queue is off or the call cannot
+    be queued, so callers do not need to care which path was taken.
+    """
+    task_id = try_enqueue(KIND_AGGREGATION, fn, *args, task_label=task_label, keep_dirs=keep_dirs, **kwargs)
+    if task_id is not None:
+        return task_id
+    return _thread_executor.submit(fn, *args, task_label=task_label, queue=False, **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# Worker daemon
+# ---------------------------------------------------------------------------
+
+def new_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def retry_delay(attempts):
+    """Seconds to wait before claim number ``attempts + 1``."""
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def claim_next(worker_id, kinds=KINDS):
+    """
+    Lease the next due job of *kinds* to *worker_id*, or return None.
+
+    Jobs are taken by priority, then by when they became due.
+    """
+    now = _utcnow()
+    return _jobs_collection().find_one_and_update(
+        {'state': QUEUED, 'kind': {'$in': list(kinds)}, 'run_after': {'$lte': now}},
+        {'$set': {
+            'state': RUNNING,
+            'started_at': now.isoformat(timespec='seconds'),
+            'updated_at': now,
+            'worker_pid': os.getpid(),
+            'worker_host': socket.gethostname(),
+            'lease_owner': worker_id,
+            'lease_expires_at': now + datetime.timedelta(seconds=JOB_LEASE_SECONDS),
+        },
+         '$inc': {'attempts': 1}},
+        sort=[('priority', 1), ('run_after', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def heartbeat(worker_id, task_ids):
+    """
+    Renew *worker_id*'s leases on *task_ids*.
+
+    Returns:
+        int: leases renewed; fewer than ``len(task_ids)`` means another daemon
+        has reclaimed a job this one still runs (its result will be dropped)
+    """
+    if not task_ids:
+        return 0
+    now = _utcnow()
+    result = _jobs_collection().update_many(
+        {'_id': {'$in': list(task_ids)}, 'lease_owner': worker_id, 'state': RUNNING},
+        {'$set': {'updated_at': now,
+                  'lease_expires_at': now + datetime.timedelta(seconds=JOB_LEASE_SECONDS)}})
+    if result.matched_count < len(task_ids):
+        logger.warning(f"Worker {worker_id} lost the lease on {len(task_ids) - result.matched_count} job(s)")
+    return result.matched_count
+
+
+def _requeue_or_fail(doc, error, owner):
+    """
+    Record a failed attempt of *doc*: back to the queue after a backoff, or
+    failed for good once it has used its attempts.  Guarded on *owner*.
+
+    Returns:
+        str: the state written (QUEUED or FAILED), or None if the lease had
+        already passed to someone else
+    """
+    now = _utcnow()
+    attempts = doc.get('attempts', 1)
+    if attempts < doc.get('max_attempts', 1):
+        update = {
+            '$set': {'state': QUEUED, 'last_error': error,
+                     'run_after': now + datetime.timedelta(seconds=retry_delay(attempts))},
+            '$unset': {'lease_owner': '', 'lease_expires_at': '', 'updated_at': ''},
+        }
+        state = QUEUED
+    else:
+        update = {
+            '$set': {'state': FAILED, 'last_error': error, 'error': error, 'updated_at': now},
+            '$unset': {'lease_owner': '', 'lease_expires_at': ''},
+        }
+        state = FAILED
+    result = _jobs_collection().update_one(
+        {'_id': doc['_id'], 'state': RUNNING, 'lease_owner': owner}, update)
+    if not result.matched_count:
+        return None
+    if state == FAILED and doc.get('temp_dir'):
+        _remove_temp_dir(doc['temp_dir'])
+    return state
+
+
+def reap_expired_leases():
+    """
+    Put running jobs whose lease has run out back in the queue (or fail them).
+
+    Returns:
+        int: jobs reaped
+    """
+    col = _jobs_collection()
+    reaped = 0
+    expired = col.find({'state': RUNNING, 'lease_expires_at': {'$lt': _utcnow()}},
+                       {'args': 0, 'kwargs': 0})
+    for doc in expired:
+        state = _requeue_or_fail(doc, 'lease expired: worker stopped heartbeating', doc.get('lease_owner'))
+        if state is not None:
+            reaped += 1
+            logger.warning(f"Job {doc['_id']} ({doc.get('label')}) lost its worker; now {state}")
+    return reaped
+
+
+def _init_worker(niceness):
+    """Pool process initializer: lower CPU priority and set up Django."""
+    if niceness:
+        try:
+            os.nice(niceness)
+        except OSError as e:
+            logger.warning(f"Could not renice job worker {os.getpid()}: {e}")
+    import django
+    django.setup()
+
+
+def run_job(handler, args, kwargs):
+    """Execute one claimed job (in a pool process)."""
+    fn = resolve_handler(handler)
+    fn(*decode_value(args), **decode_value(kwargs))
+
+
+def _finish(doc, error, worker_id):
+    """Record the outcome of one attempt of *doc*."""
+    label = f"Job {doc['_id']} ({doc.get('label')})"
+    try:
+        if error is None:
+            result = _jobs_collection().update_one(
+                {'_id': doc['_id'], 'state': RUNNING, 'lease_owner': worker_id},
+                {'$set': {'state': COMPLETED, 'updated_at': _utcnow()},
+                 '$unset': {'lease_owner': '', 'lease_expires_at': ''}})
+            state = COMPLETED if result.matched_count else None
+            if state and doc.get('temp_dir'):
+                _remove_temp_dir(doc['temp_dir'])
+        else:
+            state = _requeue_or_fail(doc, repr(error), worker_id)
+    except Exception:
+        logger.exception(f"Failed to record the outcome of {label}")
+        return
+    if state is None:
+        logger.warning(f"{label} finished after losing its lease; outcome dropped")
+    elif error is None:
+        logger.info(f"{label} completed")
+    else:
+        logger.error(f"{label} attempt {doc.get('attempts')} failed ({state}): {error!r}")
+
+
+def _default_executor(concurrency, niceness):
+    import multiprocessing
+    # spawn, not fork: the daemon holds MongoDB clients and threads.
+    return ProcessPoolExecutor(max_workers=concurrency,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(niceness,))
+
+
+def run_workers(concurrency=None, niceness=None, kinds=KINDS, poll_interval=2.0,
+                stop=None, executor_factory=None, worker_id=None):
+    """
+    Claim and run queued jobs until *stop* (a threading.Event) is set.
+
+    At most *concurrency* jobs run at once, each in a pool process at
+    *niceness*.  Every poll the daemon renews its leases and reaps expired
+    ones.  On stop no new jobs are claimed and running ones are waited for.
+    A pool process dying fails the attempts it had and the pool is rebuilt.
+    """
+    concurrency = concurrency or getattr(settings, 'AGGREGATION_WORKERS', 2)
+    niceness = getattr(settings, 'AGGREGATION_NICENESS', 10) if niceness is None else niceness
+    stop = stop or threading.Event()
+    executor_factory = executor_factory or _default_executor
+    worker_id = worker_id or new_worker_id()
+
+    logger.info(f"Job workers {worker_id} starting: kinds={list(kinds)} "
+                f"concurrency={concurrency} nice={niceness}")
+    running = {}  # future -> job document
+    executor = executor_factory(concurrency, niceness)
+    try:
+        while not stop.is_set() or running:
+            if running:
+                done, _ = wait(list(running), timeout=poll_interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    doc = running.pop(future)
+                    error = future.exception()
+                    broken = broken or isinstance(error, BrokenProcessPool)
+                    _finish(doc, error, worker_id)
+                if broken:
+                    for future, doc in list(running.items()):
+                        running.pop(future)
+                        _finish(doc, RuntimeError('job worker process died'), worker_id)
+                    executor.shutdown(wait=False)
+                    executor = executor_factory(concurrency, niceness)
+            elif not stop.is_set():
+                stop.wait(poll_interval)
+
+            try:
+                heartbeat(worker_id, [doc['_id'] for doc in running.values()])
+                reap_expired_leases()
+            except Exception:
+                logger.exception("Could not renew or reap job leases")
+
+            while not stop.is_set() and len(running) < concurrency:
+                try:
+                    doc = claim_next(worker_id, kinds)
+                except Exception:
+                    logger.exception("Could not claim a queued job")
+                    break
+                if doc is None:
+                    break
+                logger.info(f"Starting job {doc['_id']} ({doc.get('label')}), attempt {doc['attempts']}")
+                running[executor.submit(run_job, doc['handler'], doc['args'], doc['kwargs'])] = doc
+    finally:
+        executor.shutdown(wait=True)
+    logger.info(f"Job workers {worker_id} stopped")
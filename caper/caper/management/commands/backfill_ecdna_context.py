@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from caper.tar_utils import ecDNA_context_from_project_tar
+from caper.utils import collection_handle, collection_handle_primary
+
+
+# Only what is needed to find the tarball; never pull runs.
+PROJECTION = {'project_name': 1, 'tarfile': 1, 'tarfile_index': 1}
+
+
+class Command(BaseCommand):
+    help = ('Store ecDNA_context on projects ingested before it was harvested at extraction time. '
+            'Safe to re-run: only projects without the field are read, and a value stored '
+            'meanwhile is never overwritten.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', '-j', type=int, default=4,
+                            help='Tarballs read concurrently')
+        parser.add_argument('--limit', type=int, default=0,
+                            help='Stop after this many projects (0 = all)')
+        parser.add_argument('--project', action='append', default=[],
+                            help='Only this project _id (repeatable)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be stored without writing')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        workers = max(1, options['workers'])
+
+        query = {'delete': False, 'ecDNA_context': {'$exists': False}}
+        if options['project']:
+            try:
+                query['_id'] = {'$in': [ObjectId(p) for p in options['project']]}
+            except Exception as e:
+                raise CommandError(f'Invalid project id: {e}')
+        cursor = collection_handle.find(query, PROJECTION)
+        if options['limit']:
+            cursor = cursor.limit(options['limit'])
+        projects = list(cursor)
+        self.stdout.write(f'{len(projects)} projects without ecDNA_context')
+
+        stored = failed = 0
+        # Threads rather than processes: the work is GridFS reads and zlib
+        # inflation, both of which release the GIL, and the Mongo clients are
+        # shared instead of reconnected per worker.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._harvest, project): project for project in projects}
+            for future in as_completed(futures):
+                project = futures[future]
+                name = project.get('project_name', project['_id'])
+                try:
+                    ecDNA_context = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{name}: could not read tarball: {e}')
+                    continue
+                if not dry_run:
+                    collection_handle_primary.update_one(
+                        {'_id': project['_id'], 'ecDNA_context': {'$exists': False}},
+                        {'$set': {'ecDNA_context': ecDNA_context}},
+                    )
+                stored += 1
+                self.stdout.write(f'{name}: {len(ecDNA_context)} entries')
+
+        verb = 'Would store' if dry_run else 'Stored'
+        self.stdout.write(self.style.SUCCESS(f'{verb} ecDNA_context on {stored} projects ({failed} failed)'))
+
+    @staticmethod
+    def _harvest(project):
+        if 'tarfile' not in project:
+            return {}
+        return ecDNA_context_from_project_tar(project)
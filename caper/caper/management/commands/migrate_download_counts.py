@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from caper.utils import collection_handle, get_date_short
+
+
+FIELDS = ('project_downloads', 'sample_downloads')
+
+
+class Command(BaseCommand):
+    help = ('Convert legacy integer project_downloads/sample_downloads counts to the '
+            'per-day {date: count} format. Safe to re-run: only integer values are touched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be converted without writing')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Updates per bulk write')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        # Legacy totals have no date; they are attributed to the day of migration,
+        # as admin_stats used to do when it converted them on page load.
+        today = get_date_short()
+
+        for field in FIELDS:
+            query = {field: {'$type': 'number'}}
+            converted = 0
+            batch = []
+            for project in collection_handle.find(query, {field: 1}):
+                count = int(project[field])
+                # Guarded on the type so a download recorded meanwhile (which
+                # converts the value itself) is not overwritten.
+                batch.append(UpdateOne(
+                    {'_id': project['_id'], field: {'$type': 'number'}},
+                    {'$set': {field: {today: count} if count else {}}},
+                ))
+                if len(batch) >= batch_size:
+                    converted += self._write(batch, dry_run)
+                    batch = []
+            if batch:
+                converted += self._write(batch, dry_run)
+
+            verb = 'Would convert' if dry_run else 'Converted'
+            self.stdout.write(self.style.SUCCESS(f'{verb} {converted} {field} values'))
+
+    @staticmethod
+    def _write(batch, dry_run):
+        if dry_run:
+            return len(batch)
+        return collection_handle.bulk_write(batch, ordered=False).modified_count
@@ -0,0 +1,50 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from caper import job_queue
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs from the background_tasks collection in a local '
+            'process pool.  Aggregation and maintenance need one daemon per web host, run '
+            'from the same working directory as gunicorn; download workers can run anywhere. '
+            'SIGTERM/SIGINT finish running jobs and exit.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', '-c', type=int, default=settings.AGGREGATION_WORKERS,
+                            help='Jobs run at once (default: CAPER_AGGREGATION_WORKERS)')
+        parser.add_argument('--nice', type=int, default=settings.AGGREGATION_NICENESS,
+                            help='CPU niceness added to worker processes (default: CAPER_AGGREGATION_NICENESS)')
+        parser.add_argument('--kinds', default=','.join(job_queue.KINDS),
+                            help='Comma-separated job kinds to run, claimed in priority order '
+                                 f'(default: {",".join(job_queue.KINDS)})')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds between checks for new jobs')
+
+    def handle(self, *args, **options):
+        kinds = [kind.strip() for kind in options['kinds'].split(',') if kind.strip()]
+        unknown = set(kinds) - set(job_queue.KINDS)
+        if unknown or not kinds:
+            raise CommandError(f"--kinds must be drawn from {', '.join(job_queue.KINDS)}")
+        stop = threading.Event()
+
+        def _stop(signum, frame):
+            self.stdout.write(f'Received signal {signum}; finishing running jobs')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Running job workers for {', '.join(kinds)} "
+            f"(concurrency={options['concurrency']}, nice={options['nice']})"))
+        job_queue.run_workers(
+            concurrency=max(1, options['concurrency']),
+            niceness=options['nice'],
+            kinds=kinds,
+            poll_interval=options['poll_interval'],
+            stop=stop,
+        )
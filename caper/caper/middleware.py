@@ -11,6 +11,7 @@ a request we are about to shed.
 Neither one touches the database, the cache or a template.
 """
 
+import bisect
 import ctypes
 import logging
 import multiprocessing
@@ -30,6 +31,7 @@ logger = logging.getLogger(__name__)
 # --------------------------------------------------------------------------
 
 HEALTH_PATHS = frozenset(('/healthz', '/healthz/'))
+METRICS_PATHS = frozenset(('/healthz/metrics', '/healthz/metrics/'))
 
 
 class HealthCheckMiddleware:
@@ -53,6 +55,10 @@ class HealthCheckMiddleware:
     the target by IP, so a health check would otherwise depend on that IP being
     listed in ALLOWED_HOSTS -- a hidden way for an instance replacement to take
     the site down.
+
+    /healthz/metrics is answered here for the same reasons: it reads the load
+    shedder's shared-memory counters (see render_metrics) and nothing else, so
+    a scrape costs microseconds and still works while page traffic is shed.
     """
 
     def __init__(self, get_response):
@@ -63,6 +69,10 @@ class HealthCheckMiddleware:
             response = HttpResponse('ok\n', content_type='text/plain')
             response['Cache-Control'] = 'no-store'
             return response
+        if request.path in METRICS_PATHS and METRICS_ENABLED:
+            response = HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+            response['Cache-Control'] = 'no-store'
+            return response
         return self.get_response(request)
 
 
@@ -146,6 +156,18 @@ SLOT_STALE_SECONDS = float(os.getenv('AMPREPO_SLOT_STALE_SECONDS', '900'))
 
 ENABLED = os.getenv('AMPREPO_LOAD_SHED', 'on').lower() not in ('off', 'false', '0')
 
+# Adaptive mode (see _adapt_limits): the three caps above become ceilings, and
+# the limits actually enforced follow the service time of governed page
+# requests.  Off by default; the static caps are what the incident numbers in
+# this file were measured against.
+ADAPTIVE = os.getenv('AMPREPO_ADAPTIVE_LIMITS', 'off').lower() in ('on', 'true', '1')
+
+# How far above its normal level latency may rise before the limits back off.
+# p50 catches the whole site slowing down (DocumentDB, aggregation threads
+# contending for the CPU); p95 catches a growing tail before the median moves.
+ADAPTIVE_P50_TOLERANCE = float(os.getenv('AMPREPO_ADAPTIVE_P50_TOLERANCE', '2.0'))
+ADAPTIVE_P95_TOLERANCE = float(os.getenv('AMPREPO_ADAPTIVE_P95_TOLERANCE', '2.0'))
+
 # Verified-crawler exemption (see _is_verified_crawler).
 VERIFY_CRAWLERS = os.getenv('AMPREPO_VERIFY_CRAWLERS', 'on').lower() not in ('off', 'false', '0')
 
@@ -171,6 +193,11 @@ _SEARCH_HOST_PREFIXES = (
     'baidu.', 'search.',
 )
 
+# Whether /healthz/metrics is served (see render_metrics).  The counters say
+# nothing about any user or project, but the endpoint can be turned off on a
+# deployment that does not scrape it.
+METRICS_ENABLED = os.getenv('AMPREPO_METRICS', 'on').lower() not in ('off', 'false', '0')
+
 _RETRY_AFTER_REFERRED = '10'
 _RETRY_AFTER_UNREFERRED = '60'
 
@@ -290,12 +317,13 @@ def _inflight(now):
     return total, pages, downloads
 
 
-def _try_admit(slot, request_class, now):
+def _try_admit(slot, request_class, now, limits):
     """Count in flight and take the slot in one critical section.
 
     Counting and claiming have to be atomic together, or two workers both see
     the last free place and both take it.  Returns (admitted, counts); a lock
-    timeout admits, per the fail-open rule above.
+    timeout admits, per the fail-open rule above.  `limits` is
+    (general, unreferred pages, unreferred downloads), from _effective_limits.
 
     Unreferred downloads count against the general cap as well as their own.
     Without that, a full page cap plus a full download cap could between them
@@ -307,12 +335,12 @@ def _try_admit(slot, request_class, now):
     try:
         counts = _inflight(now)
         total, pages, downloads = counts
-        if total >= PAGE_CONCURRENCY:
+        page_limit, unreferred_limit, download_limit = limits
+        if total >= page_limit:
             return False, counts
-        if request_class == _PAGE_UNREFERRED and pages >= UNREFERRED_CONCURRENCY:
+        if request_class == _PAGE_UNREFERRED and pages >= unreferred_limit:
             return False, counts
-        if (request_class == _DOWNLOAD_UNREFERRED
-                and downloads >= UNREFERRED_DOWNLOAD_CONCURRENCY):
+        if request_class == _DOWNLOAD_UNREFERRED and downloads >= download_limit:
             return False, counts
         _slot_started[slot] = now
         _slot_class[slot] = request_class
@@ -326,6 +354,137 @@ def _release(slot):
     _slot_class[slot] = _EXEMPT
 
 
+# --- adaptive limits ------------------------------------------------------
+#
+# The right cap depends on how expensive a page is at the moment: with
+# DocumentDB slow, or aggregation threads busy on the same vCPUs, six
+# concurrent page views can take longer each than nine did an hour earlier, and
+# admitting more of them only lengthens every one.  In adaptive mode the limits
+# follow the service time of governed page requests, AIMD-style:
+#
+#   * every _ADAPTIVE_INTERVAL, the p50 and p95 of pages completed in the last
+#     _ADAPTIVE_WINDOW are compared with their long-run baselines;
+#   * if either has risen past its tolerance, every limit is multiplied by
+#     _ADAPTIVE_BACKOFF -- the site starts shedding earlier;
+#   * otherwise every limit grows by one, back up to its static cap.
+#
+# The static caps stay ceilings, so adaptive mode can only ever shed *more*
+# than the static configuration, and never below one request per cap.
+#
+# A baseline follows a faster period straight down and a slower one up only
+# gradually (_ADAPTIVE_BASELINE_RISE per tick), so sustained congestion is
+# never mistaken for normal in the minutes it takes to matter.
+#
+# Downloads are not sampled: their duration is the client's bandwidth, not the
+# server's health.  They are still limited, by the same factor as pages.
+#
+# Service times are kept per slot row like the metrics, written only by the
+# row's owner.  The recalculation is done by whichever worker first notices it
+# is due, under a lock taken without blocking; if that lock is ever stuck, the
+# limits stop being refreshed, go stale, and the static caps apply again.
+
+_ADAPTIVE_INTERVAL = 5.0
+_ADAPTIVE_WINDOW = 30.0
+_ADAPTIVE_MIN_SAMPLES = 10
+_ADAPTIVE_BACKOFF = 0.75
+_ADAPTIVE_BASELINE_RISE = 0.01
+_ADAPTIVE_STALE = _ADAPTIVE_INTERVAL * 12
+_SAMPLES_PER_SLOT = 32
+
+_sample_finished = multiprocessing.Array(ctypes.c_double, _SLOT_COUNT * _SAMPLES_PER_SLOT, lock=False)
+_sample_seconds = multiprocessing.Array(ctypes.c_double, _SLOT_COUNT * _SAMPLES_PER_SLOT, lock=False)
+_sample_next = multiprocessing.Array(ctypes.c_int, _SLOT_COUNT, lock=False)
+
+# [updated at, baseline p50, baseline p95, general, unreferred, download]; a
+# limit of 0.0 means "not set yet", i.e. the static cap.
+_ADAPTIVE_UPDATED, _ADAPTIVE_BASE_P50, _ADAPTIVE_BASE_P95, _ADAPTIVE_LIMITS = 0, 1, 2, 3
+_adaptive_state = multiprocessing.Array(ctypes.c_double, _ADAPTIVE_LIMITS + 3, lock=False)
+_adaptive_lock = multiprocessing.Lock()
+
+
+def _static_limits():
+    return PAGE_CONCURRENCY, UNREFERRED_CONCURRENCY, UNREFERRED_DOWNLOAD_CONCURRENCY
+
+
+def _effective_limits(now):
+    """(general, unreferred pages, unreferred downloads) to enforce now."""
+    ceilings = _static_limits()
+    if not ADAPTIVE or now - _adaptive_state[_ADAPTIVE_UPDATED] > _ADAPTIVE_STALE:
+        return ceilings
+    limits = []
+    for i, ceiling in enumerate(ceilings):
+        limit = _adaptive_state[_ADAPTIVE_LIMITS + i]
+        limits.append(ceiling if limit <= 0.0 else max(1, min(ceiling, int(limit))))
+    return tuple(limits)
+
+
+def _record_service_time(slot, request_class, seconds, now):
+    if request_class not in (_PAGE, _PAGE_UNREFERRED):
+        return
+    i = _sample_next[slot]
+    cell = slot * _SAMPLES_PER_SLOT + i
+    _sample_seconds[cell] = seconds
+    _sample_finished[cell] = now
+    _sample_next[slot] = (i + 1) % _SAMPLES_PER_SLOT
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _maybe_adapt(now):
+    """Recalculate the limits if they are due.  Never blocks, never raises."""
+    if not ADAPTIVE or now - _adaptive_state[_ADAPTIVE_UPDATED] < _ADAPTIVE_INTERVAL:
+        return
+    if not _adaptive_lock.acquire(block=False):
+        return
+    try:
+        if now - _adaptive_state[_ADAPTIVE_UPDATED] >= _ADAPTIVE_INTERVAL:
+            _adapt_limits(now)
+    except Exception:
+        logger.exception('could not recalculate adaptive load shed limits')
+    finally:
+        _adaptive_lock.release()
+
+
+def _adapt_limits(now):
+    """One AIMD step.  Caller holds _adaptive_lock."""
+    state = _adaptive_state
+    recent = sorted(
+        _sample_seconds[i] for i in range(_SLOT_COUNT * _SAMPLES_PER_SLOT)
+        if _sample_finished[i] > 0.0 and now - _sample_finished[i] <= _ADAPTIVE_WINDOW)
+
+    congested = False
+    if len(recent) >= _ADAPTIVE_MIN_SAMPLES:
+        p50, p95 = _percentile(recent, 0.5), _percentile(recent, 0.95)
+        for index, observed, tolerance in ((_ADAPTIVE_BASE_P50, p50, ADAPTIVE_P50_TOLERANCE),
+                                           (_ADAPTIVE_BASE_P95, p95, ADAPTIVE_P95_TOLERANCE)):
+            baseline = state[index]
+            if baseline > 0.0 and observed > baseline * tolerance:
+                congested = True
+            if baseline <= 0.0 or observed < baseline:
+                state[index] = observed
+            else:
+                state[index] = baseline + _ADAPTIVE_BASELINE_RISE * (observed - baseline)
+    # Too few samples to judge means too little traffic to need limiting.
+
+    ceilings = _static_limits()
+    was_stale = now - state[_ADAPTIVE_UPDATED] > _ADAPTIVE_STALE
+    for i, ceiling in enumerate(ceilings):
+        limit = state[_ADAPTIVE_LIMITS + i]
+        if limit <= 0.0 or was_stale:
+            limit = float(ceiling)
+        if congested:
+            limit = max(1.0, limit * _ADAPTIVE_BACKOFF)
+        else:
+            limit = min(float(ceiling), limit + 1.0)
+        state[_ADAPTIVE_LIMITS + i] = limit
+    state[_ADAPTIVE_UPDATED] = now
+    if congested:
+        logger.info('adaptive load shed limits backed off to %s (p50 %.3fs, p95 %.3fs)',
+                    _effective_limits(now), p50, p95)
+
+
 # --- verified crawler exemption -------------------------------------------
 
 # Search indexers must keep working: they send no Referer, so without this they
@@ -400,7 +559,7 @@ _shed_last_log = 0.0
 _SHED_LOG_INTERVAL = 60.0
 
 
-def _record_shed(kind, counts):
+def _record_shed(kind, counts, limits):
     """Count sheds, logging a summary at most once a minute.
 
     Per-request logging would put thousands of lines a minute into the error log
@@ -416,18 +575,226 @@ def _record_shed(kind, counts):
         return
     _shed_last_log = now
     total, pages, downloads = counts
+    page_limit, unreferred_limit, download_limit = limits
     logger.warning(
         'load shed since last report: %d page, %d unreferred-sample, '
         '%d unreferred-download (in flight: %d/%d total, %d/%d sample, '
         '%d/%d download)',
         _shed_counts['page'], _shed_counts['unreferred'], _shed_counts['download'],
-        total, PAGE_CONCURRENCY, pages, UNREFERRED_CONCURRENCY,
-        downloads, UNREFERRED_DOWNLOAD_CONCURRENCY,
+        total, page_limit, pages, unreferred_limit, downloads, download_limit,
     )
     for key in _shed_counts:
         _shed_counts[key] = 0
 
 
+# --- admission metrics ----------------------------------------------------
+#
+# The shed log above says *that* the caps bit; tuning PAGE_CONCURRENCY and
+# UNREFERRED_CONCURRENCY needs the distributions behind it: how much governed
+# traffic is admitted per class, which cap sheds what, how long admission takes
+# and how long an admitted request then holds its worker.
+#
+# The counters live in shared memory next to the slot table, and for the same
+# reason: gunicorn recycles a worker every ~2000 requests (max_requests), and
+# process-local counters would reset at every recycle -- and differ depending on
+# which worker answered the scrape.  Each slot row carries its own counters,
+# written only by the process that owns the row, so recording takes no lock and
+# cannot wedge on one.  A row is never zeroed when a new process claims it, so
+# the sums over all rows only ever grow, across recycles and killed workers
+# alike, which is what Prometheus counters require.  They reset only when the
+# master restarts, which a scraper sees as an ordinary counter reset.
+#
+# Besides the cumulative counters, each row keeps a ring of per-minute
+# admitted/shed buckets, so the endpoint can also report recent rates to someone
+# reading it with curl during an incident, with no Prometheus in between.
+
+_METRIC_CLASSES = (_PAGE, _PAGE_UNREFERRED, _DOWNLOAD_UNREFERRED)
+_METRIC_CLASS_LABELS = ('page', 'unreferred_page', 'unreferred_download')
+_SHED_CAPS = ('page', 'unreferred', 'download')     # _shed_reason values
+_NCLASSES = len(_METRIC_CLASSES)
+_NCAPS = len(_SHED_CAPS)
+
+# Upper bounds, in seconds.  Admission is lock arithmetic plus, on the shed
+# path, a dead-slot sweep; anything past a few milliseconds means lock
+# contention.  Durations run from a cached page to gunicorn's 900s timeout.
+_ADMISSION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+_RING_MINUTES = 15
+_RATE_WINDOWS = (1, 5, 15)
+
+
+def _shared_doubles(n):
+    return multiprocessing.Array(ctypes.c_double, n, lock=False)
+
+
+_m_admitted = _shared_doubles(_SLOT_COUNT * _NCLASSES)
+_m_shed = _shared_doubles(_SLOT_COUNT * _NCLASSES * _NCAPS)
+# One cell per finite bucket plus one for +Inf, not cumulative; the cumulative
+# `le` series are summed at render time.
+_m_admission_hist = _shared_doubles(_SLOT_COUNT * _NCLASSES * (len(_ADMISSION_BUCKETS) + 1))
+_m_admission_sum = _shared_doubles(_SLOT_COUNT * _NCLASSES)
+_m_duration_hist = _shared_doubles(_SLOT_COUNT * _NCLASSES * (len(_DURATION_BUCKETS) + 1))
+_m_duration_sum = _shared_doubles(_SLOT_COUNT * _NCLASSES)
+_m_ring_minute = multiprocessing.Array(ctypes.c_longlong, _SLOT_COUNT * _RING_MINUTES, lock=False)
+_m_ring_admitted = _shared_doubles(_SLOT_COUNT * _RING_MINUTES * _NCLASSES)
+_m_ring_shed = _shared_doubles(_SLOT_COUNT * _RING_MINUTES * _NCLASSES)
+
+
+def _observe(hist, total, buckets, cell, value):
+    width = len(buckets) + 1
+    hist[cell * width + bisect.bisect_left(buckets, value)] += 1
+    total[cell] += value
+
+
+def _ring_cell(slot, now):
+    """This row's bucket for the current minute, emptied if it holds an old one."""
+    minute = int(now // 60)
+    row = slot * _RING_MINUTES + minute % _RING_MINUTES
+    if _m_ring_minute[row] != minute:
+        for c in range(_NCLASSES):
+            _m_ring_admitted[row * _NCLASSES + c] = 0.0
+            _m_ring_shed[row * _NCLASSES + c] = 0.0
+        _m_ring_minute[row] = minute
+    return row
+
+
+def _metrics_served(slot, request_class, admission_seconds, duration_seconds, now):
+    """Record an admitted request once its response is built.  Never raises."""
+    try:
+        c = request_class - 1
+        cell = slot * _NCLASSES + c
+        _m_admitted[cell] += 1
+        _observe(_m_admission_hist, _m_admission_sum, _ADMISSION_BUCKETS, cell, admission_seconds)
+        _observe(_m_duration_hist, _m_duration_sum, _DURATION_BUCKETS, cell, duration_seconds)
+        _m_ring_admitted[_ring_cell(slot, now) * _NCLASSES + c] += 1
+    except Exception:
+        logger.exception('could not record load shed metrics')
+
+
+def _metrics_shed(slot, request_class, kind, admission_seconds, now):
+    """Record a shed request.  Never raises."""
+    try:
+        c = request_class - 1
+        cell = slot * _NCLASSES + c
+        _m_shed[cell * _NCAPS + _SHED_CAPS.index(kind)] += 1
+        _observe(_m_admission_hist, _m_admission_sum, _ADMISSION_BUCKETS, cell, admission_seconds)
+        _m_ring_shed[_ring_cell(slot, now) * _NCLASSES + c] += 1
+    except Exception:
+        logger.exception('could not record load shed metrics')
+
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+_CAP_LABELS = tuple(f'{{cap="{cap}"}}' for cap in _SHED_CAPS)
+
+
+def _fmt(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _bound(value):
+    return repr(float(value))
+
+
+def _class_sums(array, width=1):
+    """Sum a per-slot array over rows: one list of `width` values per class."""
+    sums = [[0.0] * width for _ in range(_NCLASSES)]
+    for slot in range(_SLOT_COUNT):
+        for c in range(_NCLASSES):
+            base = (slot * _NCLASSES + c) * width
+            row = sums[c]
+            for i in range(width):
+                row[i] += array[base + i]
+    return sums
+
+
+def _histogram_lines(lines, name, help_text, hist, total, buckets):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    counts = _class_sums(hist, len(buckets) + 1)
+    sums = _class_sums(total)
+    for c, label in enumerate(_METRIC_CLASS_LABELS):
+        running = 0.0
+        for bound, count in zip(buckets + ('+Inf',), counts[c]):
+            running += count
+            le = bound if bound == '+Inf' else _bound(bound)
+            lines.append(f'{name}_bucket{{class="{label}",le="{le}"}} {_fmt(running)}')
+        lines.append(f'{name}_sum{{class="{label}"}} {repr(sums[c][0])}')
+        lines.append(f'{name}_count{{class="{label}"}} {_fmt(running)}')
+
+
+def render_metrics(now=None):
+    """The shedder's state and counters in the Prometheus text format.
+
+    Reads shared memory without the slot lock.  A scrape taken mid-update may
+    be one request behind, which is not worth making a scrape contend with
+    admission for -- or hang on a lock a killed worker left held.
+    """
+    now = time.time() if now is None else now
+    lines = []
+
+    def gauge(name, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(f'{name}{labels} {_fmt(value)}' for labels, value in samples)
+
+    total, pages, downloads = _inflight(now)
+    gauge('amprepo_load_shed_enabled', 'Whether the load shedder is enforcing its caps.',
+          [('', int(ENABLED))])
+    gauge('amprepo_load_shed_in_flight', 'Governed requests holding a slot, by cap.',
+          list(zip(_CAP_LABELS, (total, pages, downloads))))
+    gauge('amprepo_load_shed_limit', 'Configured concurrency cap.',
+          list(zip(_CAP_LABELS, _static_limits())))
+    gauge('amprepo_load_shed_effective_limit',
+          'Concurrency cap being enforced; below the configured one while adaptive mode backs off.',
+          list(zip(_CAP_LABELS, _effective_limits(now))))
+    gauge('amprepo_load_shed_adaptive_baseline_seconds',
+          'Long-run page service time the adaptive limits compare against (0 until measured).',
+          [('{quantile="0.5"}', _adaptive_state[_ADAPTIVE_BASE_P50]),
+           ('{quantile="0.95"}', _adaptive_state[_ADAPTIVE_BASE_P95])])
+    gauge('amprepo_load_shed_worker_slots', 'Slot table rows claimed by a live process.',
+          [('', sum(1 for i in range(_SLOT_COUNT) if _pid_alive(_slot_pids[i])))])
+
+    admitted = _class_sums(_m_admitted)
+    lines.append('# HELP amprepo_load_shed_admitted_total Governed requests admitted, by request class.')
+    lines.append('# TYPE amprepo_load_shed_admitted_total counter')
+    for c, label in enumerate(_METRIC_CLASS_LABELS):
+        lines.append(f'amprepo_load_shed_admitted_total{{class="{label}"}} {_fmt(admitted[c][0])}')
+
+    shed = _class_sums(_m_shed, _NCAPS)
+    lines.append('# HELP amprepo_load_shed_shed_total Governed requests shed, by request '
+                 'class and the cap that turned them away.')
+    lines.append('# TYPE amprepo_load_shed_shed_total counter')
+    for c, label in enumerate(_METRIC_CLASS_LABELS):
+        for k, cap in enumerate(_SHED_CAPS):
+            lines.append(f'amprepo_load_shed_shed_total{{class="{label}",cap="{cap}"}} {_fmt(shed[c][k])}')
+
+    _histogram_lines(lines, 'amprepo_load_shed_admission_seconds',
+                     'Time from entering the shedder to the admit or shed decision.',
+                     _m_admission_hist, _m_admission_sum, _ADMISSION_BUCKETS)
+    _histogram_lines(lines, 'amprepo_load_shed_request_duration_seconds',
+                     'Time an admitted request spent in the rest of the stack.',
+                     _m_duration_hist, _m_duration_sum, _DURATION_BUCKETS)
+
+    minute = int(now // 60)
+    recent = {'admitted': [[0.0] * len(_RATE_WINDOWS) for _ in range(_NCLASSES)],
+              'shed': [[0.0] * len(_RATE_WINDOWS) for _ in range(_NCLASSES)]}
+    for row in range(_SLOT_COUNT * _RING_MINUTES):
+        age = minute - _m_ring_minute[row]
+        for w, window in enumerate(_RATE_WINDOWS):
+            if 0 <= age < window:
+                for c in range(_NCLASSES):
+                    recent['admitted'][c][w] += _m_ring_admitted[row * _NCLASSES + c]
+                    recent['shed'][c][w] += _m_ring_shed[row * _NCLASSES + c]
+    for outcome in ('admitted', 'shed'):
+        gauge(f'amprepo_load_shed_recent_{outcome}',
+              f'Governed requests {outcome} in the last `window` minutes (including the current one).',
+              [(f'{{class="{label}",window="{window}m"}}', recent[outcome][c][w])
+               for c, label in enumerate(_METRIC_CLASS_LABELS)
+               for w, window in enumerate(_RATE_WINDOWS)])
+    return '\n'.join(lines) + '\n'
+
+
 class LoadShedMiddleware:
     """
     Reserve worker capacity by shedding surplus page and direct-download traffic.
@@ -449,6 +816,9 @@ class LoadShedMiddleware:
     the response is 503 with Retry-After and never 403: it says "later", which
     is also what keeps search engines from treating it as a reason to deindex.
 
+    With AMPREPO_ADAPTIVE_LIMITS=on the caps become ceilings and the limits
+    enforced below them follow page service times (see _adapt_limits).
+
     Deliberately *not* done here: lowering gunicorn's timeout.  Sync workers do
     not heartbeat during a request, so that value has to cover the longest
     legitimate upload.
@@ -466,34 +836,47 @@ class LoadShedMiddleware:
         if slot is None:
             return self.get_response(request)
 
-        now = time.time()
-        admitted, counts = _try_admit(slot, request_class, now)
+        entered = now = time.time()
+        _maybe_adapt(now)
+        limits = _effective_limits(now)
+        admitted, counts = _try_admit(slot, request_class, now, limits)
         if not admitted:
             # Retry once, having first released whatever a killed worker was
             # still holding.  Nothing is rejected until that has happened.
             _reap_dead_slots(now)
-            admitted, counts = _try_admit(slot, request_class, now)
+            admitted, counts = _try_admit(slot, request_class, now, limits)
 
         if not admitted:
             if _is_verified_crawler(request):
-                return self.get_response(request)
-            kind = self._shed_reason(request_class, counts)
-            _record_shed(kind, counts)
+                return self._serve(request, slot, request_class, entered)
+            kind = self._shed_reason(request_class, counts, limits)
+            _record_shed(kind, counts, limits)
+            now = time.time()
+            _metrics_shed(slot, request_class, kind, now - entered, now)
             return self._busy(kind)
 
         try:
-            return self.get_response(request)
+            return self._serve(request, slot, request_class, entered)
         finally:
             _release(slot)
 
+    def _serve(self, request, slot, request_class, entered):
+        started = time.time()
+        try:
+            return self.get_response(request)
+        finally:
+            now = time.time()
+            _metrics_served(slot, request_class, started - entered, now - started, now)
+            _record_service_time(slot, request_class, now - started, now)
+
     @staticmethod
-    def _shed_reason(request_class, counts):
+    def _shed_reason(request_class, counts, limits):
         """Which cap turned this away -- for the log line and the Retry-After."""
         _, pages, downloads = counts
-        if request_class == _PAGE_UNREFERRED and pages >= UNREFERRED_CONCURRENCY:
+        _, unreferred_limit, download_limit = limits
+        if request_class == _PAGE_UNREFERRED and pages >= unreferred_limit:
             return 'unreferred'
-        if (request_class == _DOWNLOAD_UNREFERRED
-                and downloads >= UNREFERRED_DOWNLOAD_CONCURRENCY):
+        if request_class == _DOWNLOAD_UNREFERRED and downloads >= download_limit:
             return 'download'
         return 'page'
 
@@ -0,0 +1,204 @@
+"""
+Project-update emails to a project's subscribers.
+
+Every new version of a project used to email its subscribers from the
+thread that created it, one at a time: a ``User`` lookup (two when the
+subscriber was stored by email), a ``user_preferences`` read and an
+``EmailMessage.send`` - a new SMTP connection and login - per address.  On a
+popular project that was seconds of SMTP latency added to every update.
+
+:func:`dispatch_project_update` now takes the update off the caller's thread
+(onto the maintenance pool, or the durable job queue when ``JOB_QUEUE`` is
+on), and :func:`send_project_update` then:
+
+  * resolves every subscriber's user and preferences with one query each
+  * renders the template once
+  * sends all messages over one connection, reconnecting and retrying the
+    unsent ones with exponential backoff if the server drops it; a message
+    refused on its own is logged and skipped
+
+Which backend sends is ``settings.EMAIL_BACKEND``; Django's locmem and file
+backends work here like SMTP, so tests and development need no mail server.
+"""
+
+import logging
+import os
+import smtplib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.template.loader import render_to_string
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE = 'contacts/project_updated_mail_template.html'
+
+NOTIFY_SEND_ATTEMPTS = int(os.getenv('CAPER_NOTIFY_SEND_ATTEMPTS', 4))
+NOTIFY_RETRY_BASE_SECONDS = float(os.getenv('CAPER_NOTIFY_RETRY_BASE_SECONDS', 2))
+
+
+def _find_users(identifiers):
+    """Return ``[(username, email)]`` for users matching any of *identifiers* by username or email."""
+    User = get_user_model()
+    return list(User.objects.filter(Q(username__in=identifiers) | Q(email__in=identifiers))
+                .values_list('username', 'email'))
+
+
+def _find_preferences(emails):
+    """Return ``{email: preferences}`` for the users with stored preferences."""
+    from .user_preferences import user_preferences_handle
+    cursor = user_preferences_handle.find({'email': {'$in': list(emails)}},
+                                          {'email': 1, 'onProjectUpdate': 1})
+    return {prefs['email']: prefs for prefs in cursor}
+
+
+def resolve_recipients(subscribers):
+    """
+    Return the addresses of *subscribers* that want project-update emails.
+
+    A subscriber is stored as a username or an email.  One that matches a
+    user is emailed at that user's address unless their ``onProjectUpdate``
+    preference is off (a user without stored preferences gets the default,
+    on); one that matches no user is emailed as stored.  Order is kept and
+    each address appears once.
+    """
+    subscribers = [s for s in dict.fromkeys(subscribers or []) if s]
+    if not subscribers:
+        return []
+
+    emails_by_username, user_emails = {}, set()
+    for username, email in _find_users(subscribers):
+        emails_by_username[username] = email
+        user_emails.add(email)
+    preferences = _find_preferences(user_emails - {'', None})
+
+    recipients = []
+    for subscriber in subscribers:
+        # Usernames first, as get_user_obj resolves them.
+        if subscriber in emails_by_username or subscriber in user_emails:
+            address = emails_by_username.get(subscriber, subscriber)
+            if not address:
+                continue
+            if not preferences.get(address, {}).get('onProjectUpdate', True):
+                logger.info(f"Skipping project update email to {address}: opted out")
+                continue
+        else:
+            address = subscriber
+        if address not in recipients:
+            recipients.append(address)
+    return recipients
+
+
+def _is_connection_error(error):
+    """True if *error* ends the connection, rather than failing the one message it was raised for."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # SMTPException is an OSError too; the rest of those are refusals of one message.
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def send_messages(messages, attempts=None, retry_base_seconds=None):
+    """
+    Send *messages* over one connection of the configured email backend.
+
+    A message the server refuses (a bad recipient, say) is logged and skipped.
+    If the connection itself fails, it is closed and reopened after an
+    exponential backoff and the messages not yet sent are retried, up to
+    *attempts* connections in all.
+
+    Returns:
+        int: the number of messages sent
+
+    Raises:
+        Exception: the last connection error, if no message could be sent at
+        all; once some have gone out the rest are logged instead, so that a
+        retry of the whole job does not email anyone twice
+    """
+    attempts = attempts or NOTIFY_SEND_ATTEMPTS
+    retry_base_seconds = NOTIFY_RETRY_BASE_SECONDS if retry_base_seconds is None else retry_base_seconds
+    pending = list(messages)
+    sent = 0
+    for attempt in range(1, attempts + 1):
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            # One message per call so a dropped connection leaves exactly the
+            # unsent ones in pending.
+            while pending:
+                try:
+                    sent += connection.send_messages(pending[:1]) or 0
+                except Exception as e:
+                    if _is_connection_error(e):
+                        raise
+                    logger.error(f"Could not send email to {', '.join(pending[0].to)}: {e}")
+                pending.pop(0)
+            return sent
+        except Exception as e:
+            if attempt == attempts:
+                logger.error(f"Gave up on {len(pending)} emails after {attempts} attempts: {e}")
+                if sent:
+                    return sent
+                raise
+            delay = retry_base_seconds * 2 ** (attempt - 1)
+            logger.warning(f"Email connection failed with {len(pending)} emails unsent, "
+                           f"retrying in {delay:.0f}s: {e}")
+            time.sleep(delay)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+    return sent
+
+
+def send_project_update(project_name, new_project_id, sample_count, subscribers):
+    """
+    Email the *subscribers* of a project that it has a new version.
+
+    Returns:
+        int: the number of emails sent
+    """
+    recipients = resolve_recipients(subscribers)
+    if not recipients:
+        logger.info(f"No subscribers to notify for project {project_name}")
+        return 0
+
+    html_message = render_to_string(TEMPLATE, {
+        'SITE_TITLE': settings.SITE_TITLE,
+        'SITE_URL': settings.SITE_URL,
+        'project_name': project_name,
+        'new_project_id': str(new_project_id),
+        'sample_count': sample_count,
+    })
+    subject = f"Project {project_name} on {settings.SITE_TITLE} has been updated"
+    messages = []
+    for address in recipients:
+        email = EmailMessage(
+            subject,
+            html_message,
+            settings.EMAIL_HOST_USER_SECRET,
+            [address],
+            reply_to=[settings.EMAIL_HOST_USER_SECRET]
+        )
+        email.content_subtype = "html"
+        messages.append(email)
+
+    sent = send_messages(messages)
+    logger.info(f"Sent {sent} project update emails for project {project_name}")
+    return sent
+
+
+def dispatch_project_update(project_name, new_project_id, sample_count, subscribers):
+    """Queue :func:`send_project_update` to run off the calling thread."""
+    from .background_tasks import _thread_executor
+
+    subscribers = list(subscribers or [])
+    if not subscribers:
+        return None
+    return _thread_executor.submit(
+        send_project_update, project_name, str(new_project_id), sample_count, subscribers,
+        task_label=f'Project update emails: {new_project_id}',
+    )
@@ -0,0 +1,170 @@
+"""
+Rendered-page cache for sample pages.
+
+``sample_page`` is the route crawlers hit hardest, and rendering it costs a
+sample lookup, a Plotly figure, IGV track construction, a filesystem stat and
+a template render.  Its output only changes when the project does, so the
+rendered HTML is cached here, keyed by::
+
+    (project identifier as in the URL, sample name, filter_plots, auth scope, host)
+
+The auth scope is 'anon' for anonymous requests and the user id otherwise:
+the page header carries the user's name, and private projects must never be
+served across users.
+
+The ``{% csrf_token %}`` in the page header belongs to one visitor, so it is
+cached as a placeholder and filled in from ``get_token`` on every hit, which
+also sets that visitor's csrftoken cookie.
+
+Every entry carries a weak ETag (a hash of the HTML, which differs between
+responses only in that token) and the time it was rendered.  A request whose
+``If-None-Match`` matches gets a 304 straight from the cache, before any
+database work.
+
+Invalidation: projects are edited in place (name, visibility, members, runs),
+so callers that change a project call :func:`invalidate_project_pages`.  That
+records an invalidation time for the project; entries rendered before it are
+treated as misses.  Site-wide template state (shutdown banner, registration
+mode) goes through :func:`invalidate_all_pages`.  Entries also expire after
+``SAMPLE_PAGE_CACHE_SECONDS`` regardless, which bounds staleness from any
+update path that does not invalidate.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.middleware.csrf import get_token
+from django.utils.http import http_date
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_ALIAS = 'pages'
+SAMPLE_PAGE_CACHE_SECONDS = int(os.getenv('SAMPLE_PAGE_CACHE_SECONDS', '600'))
+
+_SITE_STAMP_KEY = 'pages:site_invalidated'
+
+# The hidden input {% csrf_token %} renders, and what its value is cached as.
+_CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+_CSRF_PLACEHOLDER = b'__CAPER_CSRF_TOKEN__'
+
+
+def _cache():
+    return caches[PAGE_CACHE_ALIAS]
+
+
+def _invalidation_key(project_id):
+    return f'pages:invalidated:{project_id}'
+
+
+def auth_scope(request):
+    """Cache partition for *request*'s user: 'anon' or 'user:<id>'."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anon'
+    return f'user:{user.pk}'
+
+
+def sample_page_key(request, project_name, sample_name, filter_plots):
+    raw = '\x1f'.join([
+        str(project_name), str(sample_name), '1' if filter_plots else '0',
+        auth_scope(request), request.get_host(),
+    ])
+    return 'pages:sample:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _not_modified(request, entry):
+    """True if the client's If-None-Match already names *entry*."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return entry['etag'] in (tag.strip() for tag in header.split(','))
+
+
+def _with_validators(response, entry):
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['rendered_at'])
+    # Pages for signed-in users name the user; keep them out of shared caches.
+    response['Cache-Control'] = 'private, no-cache' if entry['scope'] != 'anon' else 'no-cache'
+    return response
+
+
+def get_cached_page(request, key):
+    """
+    Answer *request* from the cache if possible.
+
+    Returns:
+        HttpResponse or None: a 304 or a 200 with the cached HTML, or None on
+        a miss (absent, expired, or rendered before its project was last
+        invalidated).
+    """
+    try:
+        cache = _cache()
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        stamps = cache.get_many([_invalidation_key(entry['project_id']), _SITE_STAMP_KEY])
+    except Exception as e:
+        logger.warning(f"Page cache unavailable: {e}")
+        return None
+    if any(stamp >= entry['rendered_at'] for stamp in stamps.values()):
+        return None
+
+    if _not_modified(request, entry):
+        return _with_validators(HttpResponseNotModified(), entry)
+    content = entry['content']
+    if _CSRF_PLACEHOLDER in content:
+        content = content.replace(_CSRF_PLACEHOLDER, get_token(request).encode('ascii'))
+    return _with_validators(HttpResponse(content, content_type=entry['content_type']), entry)
+
+
+def store_page(request, key, project_id, response):
+    """
+    Cache a freshly rendered 200 *response* and attach its validators.
+
+    Returns the response to send: a 304 if the client already has this exact
+    page, otherwise *response* with ETag/Last-Modified set.
+    """
+    if response.status_code != 200 or response.streaming:
+        return response
+    content = _CSRF_INPUT_RE.sub(rb'\g<1>' + _CSRF_PLACEHOLDER + rb'\g<2>', response.content)
+    entry = {
+        'content': content,
+        'content_type': response.get('Content-Type', 'text/html; charset=utf-8'),
+        'etag': 'W/"' + hashlib.sha256(content).hexdigest()[:32] + '"',
+        'rendered_at': time.time(),
+        'project_id': str(project_id),
+        'scope': auth_scope(request),
+    }
+    try:
+        _cache().set(key, entry, SAMPLE_PAGE_CACHE_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not cache page {request.path}: {e}")
+    if _not_modified(request, entry):
+        return _with_validators(HttpResponseNotModified(), entry)
+    return _with_validators(response, entry)
+
+
+def invalidate_project_pages(project_id):
+    """Drop every cached page of *project_id* (any sample, any user)."""
+    try:
+        # Entries live at most SAMPLE_PAGE_CACHE_SECONDS, so the stamp only
+        # has to outlive them.  The +1 s covers entries stored in the same
+        # second on a host with a slightly different clock.
+        _cache().set(_invalidation_key(project_id), time.time() + 1, SAMPLE_PAGE_CACHE_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not invalidate cached pages of project {project_id}: {e}")
+
+
+def invalidate_all_pages():
+    """Drop every cached page, e.g. after a site banner or mode change."""
+    try:
+        _cache().set(_SITE_STAMP_KEY, time.time() + 1, SAMPLE_PAGE_CACHE_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not invalidate cached pages: {e}")
@@ -0,0 +1,236 @@
+"""
+View and download counters, kept out of the project documents.
+
+Every first visit per session used to ``$inc`` ``views`` on the project
+document and read it back, and every download rewrote ``project_downloads``
+or ``sample_downloads`` there.  On a popular public project that is a stream
+of writes to one large document (``runs`` included) that page reads and edits
+contend with.
+
+Counts now go to the small ``project_counters`` collection, one document per
+project version::
+
+    {
+      '_id':               <project _id, as str>,
+      'views':             <int>,
+      'downloads':         <int>,
+      'project_downloads': {<YYYY-MM-DD>: <int>},
+      'sample_downloads':  {<YYYY-MM-DD>: <int>},
+    }
+
+and never by a read-modify-write: :func:`increment` adds to a per-process
+accumulator, and a daemon thread flushes it every ``COUNTER_FLUSH_SECONDS``
+as one unordered ``bulk_write`` of upserting ``$inc`` updates.  A crash loses
+at most one interval of counts from that worker, which is acceptable for
+statistics.
+
+Counts already stored on a project document (``views``, ``downloads`` and the
+per-day dicts, including counts carried over from earlier versions) stay
+there as a base; readers add the counter document on top with
+:func:`with_counts` or :func:`merge_counts`.  Page reads go through the
+Django cache for ``COUNTER_CACHE_SECONDS``, so a displayed count may lag by
+that much plus one flush interval.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FLUSH_SECONDS = float(os.getenv('COUNTER_FLUSH_SECONDS', 5))
+COUNTER_CACHE_SECONDS = int(os.getenv('COUNTER_CACHE_SECONDS', 30))
+
+# Per-day download buckets; the other counted fields are plain totals.
+DATED_FIELDS = ('project_downloads', 'sample_downloads')
+TOTAL_FIELDS = ('views', 'downloads')
+
+_lock = threading.Lock()
+_pending = defaultdict(Counter)     # project id -> {field path: count}
+_flusher = None
+_flusher_pid = None
+
+_counters_col = None
+
+
+def _get_counters_collection():
+    """Lazily obtain the project_counters collection (primary reads and writes)."""
+    global _counters_col
+    if _counters_col is None:
+        from .utils import db_handle_primary, get_collection_handle
+        _counters_col = get_collection_handle(db_handle_primary, 'project_counters')
+    return _counters_col
+
+
+def _cache_key(project_id):
+    return f'project_counters:{project_id}'
+
+
+def _today():
+    from .utils import get_date_short
+    return get_date_short()
+
+
+def increment(project_id, field, count=1):
+    """
+    Count *count* events of *field* against *project_id*.
+
+    *field* is one of :data:`TOTAL_FIELDS` or :data:`DATED_FIELDS`; dated
+    fields are bucketed under today's date.  Nothing is written here.
+    """
+    if count <= 0:
+        return
+    path = f'{field}.{_today()}' if field in DATED_FIELDS else field
+    with _lock:
+        _ensure_flusher()
+        _pending[str(project_id)][path] += count
+
+
+def _ensure_flusher():
+    """Start this process's flush thread (again, after a fork).  Caller holds _lock."""
+    global _flusher, _flusher_pid
+    pid = os.getpid()
+    if _flusher is not None and _flusher_pid == pid and _flusher.is_alive():
+        return
+    if _flusher_pid != pid:
+        # Forked from a process that had counts pending; those are its to flush.
+        _pending.clear()
+    _flusher_pid = pid
+    _flusher = threading.Thread(target=_flush_loop, name='caper_counter_flush', daemon=True)
+    _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(COUNTER_FLUSH_SECONDS)
+        flush()
+
+
+def flush():
+    """Write this process's accumulated counts.  Returns the number of projects written."""
+    global _pending
+    with _lock:
+        if not _pending:
+            return 0
+        batch, _pending = _pending, defaultdict(Counter)
+    ops = [UpdateOne({'_id': project_id}, {'$inc': dict(counts)}, upsert=True)
+           for project_id, counts in batch.items()]
+    try:
+        _get_counters_collection().bulk_write(ops, ordered=False)
+    except Exception as e:
+        logger.warning(f"Could not flush counters for {len(ops)} projects, retrying next interval: {e}")
+        with _lock:
+            for project_id, counts in batch.items():
+                _pending[project_id].update(counts)
+        return 0
+    return len(ops)
+
+
+atexit.register(flush)
+
+
+def _pending_counts(project_id):
+    with _lock:
+        counts = _pending.get(str(project_id))
+        return dict(counts) if counts else {}
+
+
+def get_counts(project_id, cached=True):
+    """
+    Return the counter document of *project_id* (without ``_id``), or ``{}``.
+
+    With *cached*, the stored document may be up to ``COUNTER_CACHE_SECONDS``
+    old.  Counts this process has not flushed yet are always included.
+    """
+    key = _cache_key(project_id)
+    stored = cache.get(key) if cached else None
+    if stored is None:
+        stored = _get_counters_collection().find_one({'_id': str(project_id)}, {'_id': 0}) or {}
+        if cached:
+            cache.set(key, stored, COUNTER_CACHE_SECONDS)
+    pending = _pending_counts(project_id)
+    if not pending:
+        return stored
+    counts = {field: dict(value) if isinstance(value, dict) else value
+              for field, value in stored.items()}
+    for path, count in pending.items():
+        field, _, day = path.partition('.')
+        if day:
+            bucket = counts.setdefault(field, {})
+            bucket[day] = bucket.get(day, 0) + count
+        else:
+            counts[field] = counts.get(field, 0) + count
+    return counts
+
+
+def _merge_dated(base, extra):
+    """Add per-day counts *extra* to a project's stored *base* (dict or legacy int)."""
+    if not extra:
+        return base
+    if isinstance(base, (int, float)):
+        # Undated legacy total; migrate_download_counts converts these.
+        merged = {'legacy': int(base)} if base else {}
+    else:
+        merged = dict(base or {})
+    for day, count in extra.items():
+        merged[day] = merged.get(day, 0) + count
+    return merged
+
+
+def _apply(project, counts):
+    for field in TOTAL_FIELDS:
+        if counts.get(field) or field in project:
+            project[field] = (project.get(field) or 0) + counts.get(field, 0)
+    for field in DATED_FIELDS:
+        if counts.get(field):
+            project[field] = _merge_dated(project.get(field), counts[field])
+    return project
+
+
+def with_counts(project, cached=True):
+    """
+    Return ``(views, downloads)`` for *project*: its stored base plus its counters.
+
+    Pass ``cached=False`` when carrying the totals into a new version, so
+    they are exact as of this process's last flush.
+    """
+    if not cached:
+        flush()
+    counts = get_counts(project['_id'], cached=cached)
+    return ((project.get('views') or 0) + counts.get('views', 0),
+            (project.get('downloads') or 0) + counts.get('downloads', 0))
+
+
+def merge_counts(projects):
+    """
+    Add the counters of every project in *projects* to its document, in place.
+
+    One query for the whole list; used by the admin statistics pages.
+    """
+    by_id = {str(p['_id']): p for p in projects}
+    if not by_id:
+        return projects
+    flush()
+    for counts in _get_counters_collection().find({'_id': {'$in': list(by_id)}}):
+        _apply(by_id[counts.pop('_id')], counts)
+    return projects
+
+
+
+def clear_totals(project_id):
+    """
+    Drop *project_id*'s counted views and downloads.
+
+    For a version that becomes current again with totals carried over from
+    the version it replaces: those totals already include what it counted
+    before it was superseded.
+    """
+    _get_counters_collection().update_one(
+        {'_id': str(project_id)}, {'$unset': {field: '' for field in TOTAL_FIELDS}})
+    cache.delete(_cache_key(project_id))
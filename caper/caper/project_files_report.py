@@ -0,0 +1,262 @@
+"""
+Background builds of the admin project files report.
+
+The report says, for every current project, where its payload lives (a local
+tarball, an S3 tarball, the GridFS tarball and its size) and which stored
+files match a name pattern.  It used to be built inside the request: every
+project document loaded whole (``runs`` included), then one S3 ``head_object``
+and one ``list_objects_v2`` per project, serially, which took minutes and held
+a gunicorn worker for all of it.
+
+Here the request only inserts the report document and submits a task.  The
+task
+
+* lists the S3 download prefix once, paginated, and buckets keys by project,
+* streams projects with :data:`_REPORT_PROJECTION` in batches,
+* resolves each batch's GridFS tarball sizes with one aggregate over
+  ``fs.files``,
+
+and appends each batch's rows to the report as it goes, so the page can poll
+:func:`get_report_progress` and show partial results.
+
+Report document (``project_files_reports``)::
+
+    {
+      'file_pattern':            <substring searched for>,
+      'created_at', 'created_by',
+      'status':                  'running' | 'complete' | 'failed',
+      'total_projects':          <current projects when the build started>,
+      'processed':               <projects reported so far>,
+      'project_reports':         [<one row per project, see _project_row>],
+      's3_enabled':              <bool>,
+      'projects_with_local_tar': <int>,
+      'projects_with_s3_tar':    <int>,
+      'projects_with_gridfs_tar': <int>,
+      'updated_at':              <heartbeat while running>,
+      'completed_at', 'error',
+    }
+"""
+
+import datetime
+import logging
+import os
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+
+from .background_tasks import _STALE_THRESHOLD_SECONDS, _thread_executor
+from .tar_index import member_names
+from .tar_utils import list_project_tar_contents, load_project_tar_index
+from .utils import collection_handle, db_handle, db_handle_primary, get_s3_client
+
+logger = logging.getLogger(__name__)
+
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+# Projects per GridFS size lookup and per incremental write to the report.
+_BATCH_SIZE = 200
+
+# Everything the report reads from a project document.
+_REPORT_PROJECTION = {
+    'project_name': 1, 'private': 1, 'tarfile': 1, 'tarfile_index': 1,
+}
+
+
+def _reports_collection():
+    return db_handle_primary['project_files_reports']
+
+
+def _s3_enabled():
+    return bool(getattr(settings, 'USE_S3_DOWNLOADS', False))
+
+
+def start_report(file_pattern, username):
+    """Insert a running report for *file_pattern* and build it in the background.
+
+    Returns the report id (str).
+    """
+    now = timezone.now()
+    report = {
+        'file_pattern': file_pattern,
+        'created_at': now,
+        'created_by': username,
+        'status': RUNNING,
+        'total_projects': collection_handle.count_documents({'current': True, 'delete': False}),
+        'processed': 0,
+        'project_reports': [],
+        's3_enabled': _s3_enabled(),
+        'projects_with_local_tar': 0,
+        'projects_with_s3_tar': 0,
+        'projects_with_gridfs_tar': 0,
+        'updated_at': now,
+    }
+    report_id = _reports_collection().insert_one(report).inserted_id
+    _thread_executor.submit(
+        _build_report, report_id, file_pattern,
+        task_label=f'project_files_report:{file_pattern}',
+    )
+    logger.info(f"Started project files report {report_id} for pattern '{file_pattern}' by {username}")
+    return str(report_id)
+
+
+def get_report_progress(report_id):
+    """Return the status fields of a report (without its rows), or None."""
+    report = _reports_collection().find_one(
+        {'_id': ObjectId(report_id)}, {'project_reports': 0})
+    if report is None:
+        return None
+    status = report.get('status', COMPLETE)
+    updated_at = report.get('updated_at')
+    if status == RUNNING and updated_at is not None:
+        if timezone.is_naive(updated_at):
+            updated_at = timezone.make_aware(updated_at, datetime.timezone.utc)
+        if (timezone.now() - updated_at).total_seconds() > _STALE_THRESHOLD_SECONDS:
+            # The worker building it went away (restart, deploy).
+            status = FAILED
+    return {
+        'status': status,
+        'processed': report.get('processed', report.get('total_projects', 0)),
+        'total_projects': report.get('total_projects', 0),
+        'projects_with_local_tar': report.get('projects_with_local_tar', 0),
+        'projects_with_s3_tar': report.get('projects_with_s3_tar', 0),
+        'projects_with_gridfs_tar': report.get('projects_with_gridfs_tar', 0),
+        'error': report.get('error'),
+    }
+
+
+def _list_s3_objects(file_pattern):
+    """List the S3 download prefix once; return ``{project_id: (has_tar, matching keys)}``."""
+    prefix = settings.S3_DOWNLOADS_BUCKET_PATH
+    by_project = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=settings.S3_DOWNLOADS_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            project_id, _, relative_key = obj['Key'][len(prefix):].partition('/')
+            if not relative_key:
+                continue
+            has_tar, matching = by_project.setdefault(project_id, (False, []))
+            if relative_key == f'{project_id}.tar.gz':
+                by_project[project_id] = (True, matching)
+            if file_pattern in obj['Key']:
+                matching.append(relative_key)
+    return by_project
+
+
+def _gridfs_sizes(file_ids):
+    """Return ``{file_id: length}`` for the GridFS files that exist, in one query."""
+    ids = []
+    for file_id in file_ids:
+        try:
+            ids.append(ObjectId(file_id))
+        except Exception:
+            continue
+    if not ids:
+        return {}
+    cursor = db_handle['fs.files'].aggregate([
+        {'$match': {'_id': {'$in': ids}}},
+        {'$project': {'length': 1}},
+    ])
+    return {str(doc['_id']): doc.get('length', 0) for doc in cursor}
+
+
+def _local_project_path(project_id):
+    if os.path.exists(f"../tmp/{project_id}/"):
+        return f"../tmp/{project_id}/"
+    return f"tmp/{project_id}/"
+
+
+def _project_row(project, file_pattern, s3_objects, gridfs_sizes):
+    project_id = str(project['_id'])
+    row = {
+        'project_id': project_id,
+        'project_name': project.get('project_name', 'Unknown'),
+        'is_private': project.get('private', True),
+        'has_local_tar': False,
+        'has_s3_tar': False,
+        'gridfs_tar_size': None,
+        'local_ecDNA_files': [],
+        's3_ecDNA_files': [],
+        'gridfs_ecDNA_files': [],
+    }
+
+    local_path = _local_project_path(project_id)
+    row['has_local_tar'] = os.path.exists(f"{local_path}{project_id}.tar.gz")
+    if os.path.exists(local_path):
+        for root, dirs, files in os.walk(local_path):
+            for file in files:
+                if file_pattern in file:
+                    row['local_ecDNA_files'].append(os.path.abspath(os.path.join(root, file)))
+
+    if s3_objects is not None:
+        row['has_s3_tar'], row['s3_ecDNA_files'] = s3_objects.get(project_id, (False, []))
+
+    if 'tarfile' in project:
+        row['gridfs_tar_size'] = gridfs_sizes.get(str(project['tarfile']))
+        try:
+            index = load_project_tar_index(project)
+            if index is not None:
+                names = member_names(index)
+            elif row['gridfs_tar_size'] is not None:
+                names = list_project_tar_contents(project_id)
+            else:
+                names = []
+            row['gridfs_ecDNA_files'] = [name for name in names if file_pattern in name]
+        except Exception as e:
+            logger.error(f"Failed to list GridFS tar contents for project {project_id}: {e}")
+    return row
+
+
+def _write_batch(report_id, rows):
+    _reports_collection().update_one({'_id': report_id}, {
+        '$push': {'project_reports': {'$each': rows}},
+        '$inc': {
+            'processed': len(rows),
+            'projects_with_local_tar': sum(1 for r in rows if r['has_local_tar']),
+            'projects_with_s3_tar': sum(1 for r in rows if r['has_s3_tar']),
+            'projects_with_gridfs_tar': sum(1 for r in rows if r['gridfs_tar_size'] is not None),
+        },
+        '$set': {'updated_at': timezone.now()},
+    })
+
+
+def _build_report(report_id, file_pattern):
+    reports = _reports_collection()
+    try:
+        s3_objects = None
+        if _s3_enabled():
+            try:
+                s3_objects = _list_s3_objects(file_pattern)
+            except Exception as e:
+                logger.error(f"Failed to list S3 objects for the project files report: {e}")
+                reports.update_one({'_id': report_id}, {'$set': {'s3_enabled': False}})
+
+        cursor = collection_handle.find(
+            {'current': True, 'delete': False}, _REPORT_PROJECTION,
+            batch_size=_BATCH_SIZE)
+        batch = []
+        for project in cursor:
+            batch.append(project)
+            if len(batch) >= _BATCH_SIZE:
+                _report_batch(report_id, batch, file_pattern, s3_objects)
+                batch = []
+        if batch:
+            _report_batch(report_id, batch, file_pattern, s3_objects)
+
+        reports.update_one({'_id': report_id}, {'$set': {
+            'status': COMPLETE, 'completed_at': timezone.now(), 'updated_at': timezone.now(),
+        }})
+        logger.info(f"Project files report {report_id} complete")
+    except Exception as e:
+        logger.exception(f"Project files report {report_id} failed")
+        reports.update_one({'_id': report_id}, {'$set': {
+            'status': FAILED, 'error': str(e), 'updated_at': timezone.now(),
+        }})
+        raise
+
+
+def _report_batch(report_id, projects, file_pattern, s3_objects):
+    sizes = _gridfs_sizes(p['tarfile'] for p in projects if 'tarfile' in p)
+    _write_batch(report_id, [_project_row(p, file_pattern, s3_objects, sizes) for p in projects])
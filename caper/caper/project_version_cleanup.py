@@ -3,6 +3,7 @@ from bson import ObjectId
 
 GRIDFS_FILE_KEYS = {
     'tarfile',
+    'tarfile_index',
     'AA PNG file',
     'AA PDF file',
     'Feature BED file',
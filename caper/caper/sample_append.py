@@ -0,0 +1,390 @@
+"""
+Appending samples to an existing project without re-aggregating it.
+
+Adding samples through the add-samples API used to download the project's
+whole current tarball, run the aggregator over the old and new results
+together and create the new version from scratch, re-extracting and
+re-uploading every sample's files to GridFS.  Adding three samples to a
+2,000-sample project cost as much as uploading all 2,003.
+
+:func:`append_samples` aggregates only the uploaded samples and builds the
+new version from the current one:
+
+  * the new samples get run keys after the project's highest ``sample_N``
+    and are added to a copy of the existing ``runs``; the rows of existing
+    samples, GridFS file ids included, are reused unchanged, so both
+    versions point at the same blobs
+  * only the new samples' files are uploaded to GridFS
+  * the new version's tarball is the old one streamed member by member from
+    GridFS (never extracted) with the new samples' members added and
+    ``run.json`` and ``aggregated_results.csv`` merged, so downloads still
+    get one archive of the whole project
+
+Anything the full re-aggregation would decide differently -- a sample name
+already in the project, a different reference genome, an archive member in
+both tarballs, a project with no stored tarball -- raises
+:class:`AppendFallback` before anything is written, and the caller takes the
+full path instead.
+
+Removing samples before a re-aggregation is the same kind of rewrite in the
+other direction: :func:`write_tar_without_samples` copies a project tarball
+from one stream to another, dropping the removed samples' directories,
+instead of extracting it to disk, deleting them and compressing the rest.
+"""
+
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import uuid
+
+from bson import ObjectId
+from django.conf import settings
+
+from . import gridfs_refs, project_counters
+from .tar_index import COMPRESS_LEVEL, normalize_member_name
+from .tar_safety import safe_extractall
+
+logger = logging.getLogger(__name__)
+
+RUN_JSON = 'results/run.json'
+AGGREGATED_CSV = 'results/aggregated_results.csv'
+
+_RUN_KEY_RE = re.compile(r'^sample_(\d+)$')
+_NOT_PROVIDED = {None, '', 'NA', 'Not Provided'}
+
+# Fields of the current version that do not carry over to the new one, matching
+# what a version built by the full path starts without.  The S3 sync state
+# belongs to the old tarball: a copied s3_synced would stop the new one from
+# ever being uploaded.
+_NOT_CARRIED = frozenset({
+    '_id', 'linkid', 'privateKey', 'featured', 'delete_user', 'delete_date',
+    'project_downloads', 'sample_downloads', 'tarfile_index', gridfs_refs.STALE_FLAG,
+    's3_synced', 's3_sync_lock',
+})
+
+
+class AppendFallback(Exception):
+    """The samples cannot be appended in place; re-aggregate the whole project."""
+
+
+def _first_row(rows):
+    return rows[0] if rows else {}
+
+
+def sample_names(runs):
+    """Return the sample names in *runs*, stored (``Sample_name``) or raw (``Sample name``) rows alike."""
+    names = set()
+    for rows in runs.values():
+        row = _first_row(rows)
+        name = row.get('Sample_name', row.get('Sample name'))
+        if name is not None:
+            names.add(str(name))
+    return names
+
+
+def reference_genomes(runs):
+    """Return the reference genomes named by the feature rows of *runs*."""
+    return {
+        str(ref)
+        for rows in runs.values()
+        for row in rows
+        for ref in (row.get('Reference_version', row.get('Reference version')),)
+        if ref not in _NOT_PROVIDED
+    }
+
+
+def check_appendable(new_runs, *existing):
+    """
+    Raise AppendFallback if *new_runs* cannot simply be added to the project.
+
+    Args:
+        new_runs (dict): runs of the uploaded samples, as aggregated
+        *existing (dict): the project's runs, stored or as in its run.json
+
+    Raises:
+        AppendFallback: naming the first conflict found
+    """
+    new_names = sample_names(new_runs)
+    for runs in existing:
+        duplicates = new_names & sample_names(runs)
+        if duplicates:
+            raise AppendFallback(f"samples already in the project: {', '.join(sorted(duplicates))}")
+    references = reference_genomes(new_runs)
+    for runs in existing:
+        references |= reference_genomes(runs)
+    if len(references) > 1:
+        raise AppendFallback(f"multiple reference genomes: {', '.join(sorted(references))}")
+
+
+def renumber_runs(new_runs, *existing):
+    """
+    Give the runs in *new_runs* keys after the highest ``sample_N`` in *existing*.
+
+    The aggregator numbers its own output from ``sample_1``, which would
+    collide with the project's keys.  Order within *new_runs* is kept.
+    """
+    numbers = [int(m.group(1)) for runs in existing for key in runs
+               for m in (_RUN_KEY_RE.match(str(key)),) if m]
+    start = max(numbers, default=0) + 1
+    return {f'sample_{start + i}': rows for i, rows in enumerate(new_runs.values())}
+
+
+def merge_aggregated_csv(old_csv, new_csv):
+    """
+    Merge two aggregated_results.csv files into one, sorted by sample name.
+
+    Columns are the old file's followed by any only the new one has; cells
+    missing from a row are left empty.
+    """
+    old_reader = csv.DictReader(io.StringIO(old_csv.decode('utf-8')))
+    new_reader = csv.DictReader(io.StringIO(new_csv.decode('utf-8')))
+    rows = list(old_reader) + list(new_reader)
+    fields = list(old_reader.fieldnames or [])
+    fields += [f for f in (new_reader.fieldnames or []) if f not in fields]
+
+    rows.sort(key=lambda row: row.get('Sample name') or '')
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=fields, restval='', lineterminator='\r\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode('utf-8')
+
+
+def _add_bytes(tar, info, data):
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_appended_tar(old_fileobj, new_tar_path, dst_path, runs):
+    """
+    Write the old project tarball plus the new samples' members to *dst_path*.
+
+    *old_fileobj* is read as a stream, so a GridFS file can be passed
+    directly.  It is decompressed by GzipFile rather than tarfile's 'r|gz',
+    which stops at the end of the first gzip member and so cannot read the
+    block-compressed tarballs store_project_tarball writes.
+    ``results/run.json`` is replaced by ``{'runs': runs}`` and
+    ``results/aggregated_results.csv`` by the merge of both archives'; every
+    other member is copied as is.  The output is an uncompressed tar, which
+    store_project_tarball block-compresses on its way into GridFS.
+
+    Args:
+        old_fileobj: the current project tarball (.tar.gz)
+        new_tar_path (str): the aggregated tarball of the new samples
+        dst_path (str): where to write the combined archive
+        runs (dict): run.json ``runs`` of the combined archive
+
+    Raises:
+        AppendFallback: if a file other than those two is in both archives
+    """
+    new_files = set()
+    new_csv = None
+    with tarfile.open(new_tar_path, 'r:gz') as new_tar:
+        for member in new_tar:
+            name = normalize_member_name(member.name)
+            if name == AGGREGATED_CSV:
+                new_csv = new_tar.extractfile(member).read()
+            elif not member.isdir():
+                new_files.add(name)
+
+    run_json = json.dumps({'runs': runs}, indent=2, sort_keys=True).encode('utf-8')
+    written = set()
+    with tarfile.open(dst_path, 'w') as dst:
+        with gzip.GzipFile(fileobj=old_fileobj, mode='rb') as old_stream, \
+                tarfile.open(fileobj=old_stream, mode='r|') as old_tar:
+            for member in old_tar:
+                name = normalize_member_name(member.name)
+                if name in new_files and name != RUN_JSON:
+                    raise AppendFallback(f'{name} is in both the project and the new upload')
+                if name == RUN_JSON:
+                    _add_bytes(dst, member, run_json)
+                elif name == AGGREGATED_CSV and new_csv is not None:
+                    _add_bytes(dst, member, merge_aggregated_csv(old_tar.extractfile(member).read(), new_csv))
+                    new_csv = None
+                elif member.isfile():
+                    dst.addfile(member, old_tar.extractfile(member))
+                else:
+                    dst.addfile(member)
+                written.add(name)
+
+        with tarfile.open(new_tar_path, 'r:gz') as new_tar:
+            for member in new_tar:
+                name = normalize_member_name(member.name)
+                if name in written or name == RUN_JSON:
+                    continue
+                if name == AGGREGATED_CSV:
+                    _add_bytes(dst, member, new_tar.extractfile(member).read())
+                elif member.isfile():
+                    dst.addfile(member, new_tar.extractfile(member))
+                else:
+                    dst.addfile(member)
+                written.add(name)
+
+
+def removed_sample_prefixes(samples):
+    """Return the member paths, under results/, that hold the files of *samples*."""
+    prefixes = []
+    for sample in samples:
+        prefixes += [
+            f'results/other_files/{sample}_classification',
+            f'results/AA_outputs/{sample}_AA_results',
+            f'results/AA_outputs/extracted_from_zips/{sample}_AA_results',
+        ]
+    return tuple(prefixes)
+
+
+def write_tar_without_samples(src_fileobj, dst_path, samples):
+    """
+    Copy a project tarball to *dst_path* without the directories of *samples*.
+
+    One pass from *src_fileobj*, read as a gzip stream (a GridFS file can be
+    passed directly; block-compressed tarballs are read as in
+    write_appended_tar), to a gzip stream at *dst_path*; nothing is extracted.
+
+    Returns:
+        int: the number of members dropped
+    """
+    prefixes = removed_sample_prefixes(samples)
+    dropped = 0
+    with open(dst_path, 'wb') as raw, \
+            gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=COMPRESS_LEVEL) as compressed, \
+            tarfile.open(fileobj=compressed, mode='w|') as dst, \
+            gzip.GzipFile(fileobj=src_fileobj, mode='rb') as src_stream, \
+            tarfile.open(fileobj=src_stream, mode='r|') as src:
+        for member in src:
+            name = normalize_member_name(member.name)
+            if any(name == p or name.startswith(p + '/') for p in prefixes):
+                dropped += 1
+            elif member.isfile():
+                dst.addfile(member, src.extractfile(member))
+            else:
+                dst.addfile(member)
+    return dropped
+
+
+def _union(old, new):
+    return list(set(old or []) | set(new or []))
+
+
+def append_samples(project, uploaded_file_path, work_dir, previous_versions):
+    """
+    Create a new version of *project* with the samples in an uploaded archive added.
+
+    Args:
+        project (dict): the current version, with its runs
+        uploaded_file_path (str): AmpliconSuite results archive of the new samples
+        work_dir (str): scratch directory; removed on return
+        previous_versions (list): ``previous_versions`` of the new version
+
+    Returns:
+        InsertOneResult of the new version, or None if the aggregator rejected
+        the upload
+
+    Raises:
+        AppendFallback: if the project has to be re-aggregated as a whole
+    """
+    # sys.path is already primed for AGGREGATOR_DEV_PATH in settings.py
+    from AmpliconSuiteAggregator import Aggregator
+    from .background_tasks import _thread_executor
+    from .extra_metadata import runs_have_sample_metadata
+    from .site_stats import add_project_to_site_statistics
+    from .tar_utils import read_project_tar_member, store_project_tarball
+    from .utils import (
+        build_sample_index, collection_handle, ecDNA_context_from_directory, fs_handle,
+        get_date, normalize_visibility_field, replace_underscore_keys,
+    )
+    from .views import (
+        get_project_classifications, get_project_oncogenes, get_tool_versions,
+        samples_to_dict, store_feature_files, sync_project_tarball_to_s3,
+    )
+
+    if not project.get('tarfile') or not project.get('runs'):
+        raise AppendFallback('the project has no stored tarball')
+    try:
+        old_raw_runs = json.loads(read_project_tar_member(project, RUN_JSON))['runs']
+    except Exception as e:
+        raise AppendFallback(f'could not read the stored run.json: {e}')
+
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        # The aggregator prefixes the consolidated_classification files with
+        # the project name; a fresh one keeps them clear of earlier appends'.
+        agg = Aggregator(
+            input_paths=[uploaded_file_path],
+            project_name=uuid.uuid4().hex,
+            work_dir=work_dir,
+        )
+        if not agg.completed:
+            return None
+        new_tar_path = agg.aggregated_filename
+        del agg
+
+        extract_dir = os.path.join(work_dir, 'extracted')
+        with tarfile.open(new_tar_path, 'r:gz') as tar:
+            safe_extractall(tar, extract_dir, description=f'samples appended to {project["_id"]}')
+        with open(os.path.join(extract_dir, RUN_JSON)) as run_json:
+            new_runs = samples_to_dict(run_json)
+
+        check_appendable(new_runs, project['runs'], old_raw_runs)
+        new_runs = renumber_runs(new_runs, project['runs'], old_raw_runs)
+
+        # The tarball goes first: it needs the new rows' file paths, which
+        # store_feature_files replaces with GridFS ids.
+        merged_tar_path = os.path.join(work_dir, 'appended.tar')
+        write_appended_tar(fs_handle.get(ObjectId(project['tarfile'])), new_tar_path,
+                           merged_tar_path, {**old_raw_runs, **new_runs})
+        tar_id, index_id = store_project_tarball(merged_tar_path)
+
+        store_feature_files(new_runs, extract_dir)
+        new_runs = replace_underscore_keys(new_runs)
+        runs = dict(project['runs'])
+        runs.update(new_runs)
+
+        views, downloads = project_counters.with_counts(project, cached=False)
+        now = get_date()
+        version = {k: v for k, v in project.items() if k not in _NOT_CARRIED}
+        version.update({
+            'tarfile': tar_id,
+            'date_created': now,
+            'date': now,
+            'update_date': now,
+            'delete': False,
+            'current': True,
+            'previous_versions': previous_versions,
+            'runs': runs,
+            'sample_index': build_sample_index(runs),
+            'sample_count': len(runs),
+            'sample_metadata_available': runs_have_sample_metadata(runs),
+            'Oncogenes': _union(project.get('Oncogenes'), get_project_oncogenes(new_runs)),
+            'Classification': _union(project.get('Classification'), get_project_classifications(new_runs)),
+            'ecDNA_context': {**(project.get('ecDNA_context') or {}),
+                              **ecDNA_context_from_directory(extract_dir)},
+            'views': views,
+            'downloads': downloads,
+            'FINISHED?': True,
+            'EMPTY?': False,
+        })
+        if index_id is not None:
+            version['tarfile_index'] = index_id
+        get_tool_versions(version, new_runs)
+
+        new_id = collection_handle.insert_one(version)
+        add_project_to_site_statistics(version, normalize_visibility_field(version['private']))
+        gridfs_refs.record_project_refs(new_id.inserted_id, version)
+        logger.info(f"Appended {len(new_runs)} samples to {project['_id']} as {new_id.inserted_id}")
+
+        if settings.USE_S3_DOWNLOADS:
+            _thread_executor.submit(
+                sync_project_tarball_to_s3,
+                new_id.inserted_id,
+                task_label=f'S3 Upload: {new_id.inserted_id}/{new_id.inserted_id}.tar.gz',
+            )
+        return new_id
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
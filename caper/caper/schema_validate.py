@@ -6,8 +6,12 @@ import os
 import sys
 import re
 import copy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from jsonschema import Draft7Validator
-from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Import the database utilities from utils module
 # Adjust the import based on your project structure
@@ -19,6 +23,11 @@ except ImportError:
     from utils import get_db_handle, mongo_client, mongo_client_primary
 
 
+# Documents per cursor batch, per unit of work sent to a validation process,
+# and per bulk_write of repairs.
+DEFAULT_BATCH_SIZE = 100
+
+
 def generate_schema(data: Any) -> Dict[str, Any]:
     """
     Generates a basic JSON schema from a Python object (dict, list, str, int, etc.).
@@ -119,6 +128,45 @@ def parse_arguments():
         default="schema/schema.json",
         help="Path to the JSON schema file (default: schema/schema.json)"
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Documents per batch (default: {DEFAULT_BATCH_SIZE})"
+    )
+    parser.add_argument(
+        "--workers", "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Validation processes; 1 validates in this process (default: CPU count)"
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="Only check documents whose update_date is at or after this date "
+             "(e.g. 2026-01-01 or 2026-01-01T12:00:00)"
+    )
+    parser.add_argument(
+        "--jsonl",
+        dest="jsonl_path",
+        default=None,
+        help="Also write one JSON result per document, then a summary line, to this file"
+    )
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="Report schema repairs instead of validating (a preview unless --apply is given)"
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="With --fix, write the repairs to the collection"
+    )
+    parser.add_argument(
+        "--quiet", "-q",
+        action="store_true",
+        help="Do not list valid documents"
+    )
     return parser.parse_args()
 
 
@@ -140,12 +188,118 @@ def load_schema(schema_path):
         sys.exit(1)
 
 
+# Set in each validation process by _init_worker (and in this process when
+# validating serially), so the schema is compiled once per process rather
+# than shipped with every batch.
+_worker_schema = None
+_worker_validator = None
+
+
+def _init_worker(schema: Dict[str, Any]) -> None:
+    global _worker_schema, _worker_validator
+    _worker_schema = schema
+    _worker_validator = Draft7Validator(schema)
+
+
+def _sorted_errors(validator, document):
+    return sorted(
+        validator.iter_errors({
+            key: value for key, value in document.items()
+            if key != "_id"
+        }),
+        key=lambda error: (
+            tuple(str(part) for part in error.absolute_path),
+            error.message,
+        ),
+    )
+
+
+def _document_query(since: Optional[str] = None, deleted: bool = False) -> Dict[str, Any]:
+    """Filter for the documents to check (or, with *deleted*, the ones skipped).
+
+    ``update_date`` is stored as an ISO-8601 string, so a date prefix such as
+    ``2026-01-01`` compares correctly as a string.
+    """
+    query: Dict[str, Any] = {"delete": True} if deleted else {"delete": {"$ne": True}}
+    if since:
+        query["update_date"] = {"$gte": since}
+    return query
+
+
+def iter_batches(collection, query: Dict[str, Any], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+    """Stream the documents matching *query* in lists of *batch_size*."""
+    batch = []
+    for doc in collection.find(query, batch_size=batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def map_batches(fn, batches: Iterable[List[dict]], schema: Dict[str, Any], workers: int = 1) -> Iterator[list]:
+    """
+    Apply *fn* to every batch, in a pool of *workers* processes, yielding
+    results in batch order.
+
+    At most two batches per worker are in flight, so memory stays bounded
+    however large the collection is.  With ``workers <= 1`` everything runs
+    in this process.
+    """
+    if workers <= 1:
+        _init_worker(schema)
+        for batch in batches:
+            yield fn(batch)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(schema,)) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(fn, batch))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def _validate_document(doc: dict) -> Dict[str, Any]:
+    result = {
+        "_id": str(doc.get("_id", "UNKNOWN_ID")),
+        "project_name": doc.get("project_name", doc.get("name")),
+        "creator": doc.get("creator", "Unknown User"),
+    }
+    try:
+        errors = _sorted_errors(_worker_validator, doc)
+    except Exception as e:  # Catch unexpected errors during validation for *this* doc
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__} - {e}"
+        return result
+    result["status"] = "invalid" if errors else "valid"
+    result["errors"] = [_validation_error_summary(error) for error in errors]
+    return result
+
+
+def _validate_batch(docs: List[dict]) -> List[Dict[str, Any]]:
+    return [_validate_document(doc) for doc in docs]
+
+
+def _write_jsonl(jsonl_out, record) -> None:
+    if jsonl_out is not None:
+        jsonl_out.write(json.dumps(record, default=str) + "\n")
+
+
 def validate_collection(
         schema: Dict[str, Any],
         collection_name: str = "projects",
         db_handle=None,
         client=None,
-        close_connection: bool = False
+        close_connection: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = 1,
+        since: Optional[str] = None,
+        jsonl_out=None,
+        verbose: bool = True,
 ) -> Tuple[int, int, int]:
     """
     Validates documents in a collection against a schema.
@@ -156,6 +310,12 @@ def validate_collection(
         db_handle: Optional database handle (if None, uses the one from utils)
         client: Optional MongoDB client (if None, uses the one from utils)
         close_connection: Whether to close the client connection when done
+        batch_size: Documents per cursor batch and per unit of parallel work
+        workers: Validation processes (1 validates in this process)
+        since: Only validate documents with ``update_date`` at or after this
+        jsonl_out: Optional text stream; one JSON result per document and a
+            final ``{"summary": ...}`` line are written to it
+        verbose: Whether to list valid documents as well as invalid ones
 
     Returns:
         A tuple of (total documents, invalid documents, error count)
@@ -169,65 +329,47 @@ def validate_collection(
     try:
         collection = db_handle[collection_name]
         Draft7Validator.check_schema(schema)
-        validator = Draft7Validator(schema)
         print(f"Using database: '{db_handle.name}', collection: '{collection_name}'")
 
         # Fetch and Validate Documents
         print(f"\n--- Validating documents in '{collection_name}' ---")
+        if since:
+            print(f"Only documents updated since {since}")
+
+        # Deleted projects are skipped, and counted without being transferred
+        skipped_deleted_count = collection.count_documents(_document_query(since, deleted=True))
+        doc_count = skipped_deleted_count
+
+        batches = iter_batches(collection, _document_query(since), batch_size)
+        for results in map_batches(_validate_batch, batches, schema, workers):
+            for result in results:
+                doc_count += 1
+                validated_count += 1
+                _write_jsonl(jsonl_out, result)
+
+                # Use 'project_name' or 'name' field if available, otherwise use _id
+                identifier = result["project_name"] or f"Document (ID: {result['_id']})"
+                creator = result["creator"]
+
+                if result["status"] == "error":
+                    error_count += 1
+                    print(f"- '{identifier}': ERROR during validation")
+                    print(f"  Unexpected validation error: {result['error']}")
+                    continue
 
-        cursor = collection.find()
-        for doc in cursor:
-            doc_count += 1
-
-            # Skip deleted projects
-            deleted = doc.get('delete', False)
-            if deleted:
-                skipped_deleted_count += 1
-                continue
-
-            validated_count += 1
-
-            # --- Identify the document ---
-            # Use 'project_name' or 'name' field if available, otherwise use _id
-            doc_id_str = str(doc.get('_id', 'UNKNOWN_ID'))
-            identifier = doc.get('project_name', doc.get('name', f"Document (ID: {doc_id_str})"))
-            creator = doc.get('creator', 'Unknown User')
-
-            # --- Prepare document for validation ---
-            # Create a copy and remove MongoDB's _id field
-            doc_to_validate = doc.copy()
-            if '_id' in doc_to_validate:
-                del doc_to_validate['_id']
-
-            # --- Perform Validation ---
-            try:
-                validation_errors = sorted(
-                    validator.iter_errors(doc_to_validate),
-                    key=lambda error: (
-                        tuple(str(part) for part in error.absolute_path),
-                        error.message,
-                    ),
-                )
-                if not validation_errors:
-                    print(f"- '{identifier}' ({creator}): VALID")
+                if result["status"] == "valid":
+                    if verbose:
+                        print(f"- '{identifier}' ({creator}): VALID")
                     continue
 
                 invalid_count += 1
                 print(f"- '{identifier}' ({creator}): NOT VALID")
-                for error_number, error in enumerate(validation_errors, start=1):
+                for error_number, error in enumerate(result["errors"], start=1):
                     print(f"  Error {error_number}:")
-                    print(f"    Reason: {error.message}")
-                    if error.absolute_path:
-                        path = "/".join(map(str, error.absolute_path))
-                        print(f"    Path: /{path}")
-                    else:
-                        print("    Path: /")
-                    if error.validator:
-                        print(f"    Schema Keyword: '{error.validator}'")
-            except Exception as e:  # Catch unexpected errors during validation for *this* doc
-                error_count += 1
-                print(f"- '{identifier}': ERROR during validation")
-                print(f"  Unexpected validation error: {type(e).__name__} - {e}")
+                    print(f"    Reason: {error['reason']}")
+                    print(f"    Path: {error['path']}")
+                    if error["validator"]:
+                        print(f"    Schema Keyword: '{error['validator']}'")
 
         # Check if any documents were processed
         if doc_count == 0:
@@ -242,6 +384,14 @@ def validate_collection(
         print(f"Invalid documents: {invalid_count}")
         if error_count > 0:
             print(f"Errors during processing: {error_count}")
+        _write_jsonl(jsonl_out, {"summary": {
+            "processed": doc_count,
+            "validated": validated_count,
+            "deleted_skipped": skipped_deleted_count,
+            "invalid": invalid_count,
+            "errors": error_count,
+            "since": since,
+        }})
 
         return doc_count, invalid_count, error_count
 
@@ -254,7 +404,10 @@ def run_validation(
         db_host: Optional[str] = None,
         db_name: Optional[str] = None,
         collection_name: str = "projects",
-        schema_path: str = "schema/schema.json"
+        schema_path: str = "schema/schema.json",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = 1,
+        since: Optional[str] = None,
 ) -> str:
     """
     Run the validation process and return the output as a string.
@@ -265,6 +418,7 @@ def run_validation(
         db_name: Name of the database to use (if None, uses environment variable or default)
         collection_name: Name of the MongoDB collection to validate
         schema_path: Path to the JSON schema file
+        batch_size, workers, since: See validate_collection
 
     Returns:
         A string containing the validation report
@@ -305,7 +459,10 @@ def run_validation(
             collection_name=collection_name,
             db_handle=db_handle,
             client=client,
-            close_connection=bool(db_host)  # Only close if we created a new connection
+            close_connection=bool(db_host),  # Only close if we created a new connection
+            batch_size=batch_size,
+            workers=workers,
+            since=since,
         )
 
         # Return the captured output
@@ -558,16 +715,50 @@ def _format_report_field(value, fallback="Unknown"):
     return str(value)
 
 
+def _repair_document(doc: dict, build_updates: bool) -> Dict[str, Any]:
+    """Plan the repairs of one document; the document itself is only modified in memory."""
+    changes_log = []
+    issues_log = []
+    made_changes = _normalize_legacy_visibility(doc, _worker_schema, changes_log, issues_log)
+    if _add_missing_fields_recursive(doc, _worker_schema, changes_log, []):
+        made_changes = True
+    remaining_errors = _sorted_errors(_worker_validator, doc)
+    return {
+        "_id": doc["_id"],
+        "project_name": _format_report_field(
+            doc.get("project_name", doc.get("name")),
+            fallback="Unknown project",
+        ),
+        "creator": _format_report_field(doc.get("creator")),
+        "date_created": _format_report_field(doc.get("date_created")),
+        "made_changes": made_changes,
+        "set_updates": _build_set_updates(doc, changes_log) if made_changes and build_updates else {},
+        "changes": changes_log,
+        "issues": issues_log,
+        "remaining_errors": [
+            _validation_error_summary(error)
+            for error in remaining_errors
+        ],
+    }
+
+
+def _repair_batch(docs: List[dict], build_updates: bool = False) -> List[Dict[str, Any]]:
+    return [_repair_document(doc, build_updates) for doc in docs]
+
+
 def run_fix_schema(
         db_host: Optional[str] = None,
         db_name: Optional[str] = None,
         collection_name: str = "projects",
         schema_path: str = "schema/schema.json",
         apply_changes: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = 1,
+        since: Optional[str] = None,
+        jsonl_out=None,
 ) -> str:
     schema = load_schema(schema_path)
     Draft7Validator.check_schema(schema)
-    validator = Draft7Validator(schema)
     if db_name is None:
         db_name = os.environ.get("DB_NAME", "caper")
 
@@ -585,72 +776,63 @@ def run_fix_schema(
     collection = db[collection_name]
 
     overall_report = {}
-    documents_processed = 0
-    documents_skipped = 0
+    documents_skipped = collection.count_documents(_document_query(since, deleted=True))
+    documents_processed = documents_skipped
     documents_with_repairs = 0
     documents_updated = 0
     documents_with_unresolved_errors = 0
-
-    for doc in collection.find():
-        documents_processed += 1
-        doc_id_str = str(doc["_id"])
-
-        # Skip deleted projects
-        deleted = doc.get('delete', False)
-        if deleted:
-            documents_skipped += 1
-            continue
-
-        current_doc_changes_log = []
-        current_doc_issues_log = []
-        made_changes_to_this_doc = _normalize_legacy_visibility(
-            doc,
-            schema,
-            current_doc_changes_log,
-            current_doc_issues_log,
-        )
-        if _add_missing_fields_recursive(doc, schema, current_doc_changes_log, []):
-            made_changes_to_this_doc = True
-
-        remaining_errors = sorted(
-            validator.iter_errors({
-                key: value for key, value in doc.items()
-                if key != "_id"
-            }),
-            key=lambda error: (
-                tuple(str(part) for part in error.absolute_path),
-                error.message,
-            ),
-        )
-        if remaining_errors or current_doc_issues_log:
-            documents_with_unresolved_errors += 1
-
-        if made_changes_to_this_doc:
-            documents_with_repairs += 1
-            if apply_changes:
-                set_updates = _build_set_updates(doc, current_doc_changes_log)
-                if set_updates:
-                    collection.update_one(
-                        {"_id": doc["_id"]},
+    pending_updates = []
+
+    def flush_updates():
+        nonlocal documents_updated
+        if pending_updates:
+            collection.bulk_write(pending_updates, ordered=False)
+            documents_updated += len(pending_updates)
+            pending_updates.clear()
+
+    batches = iter_batches(collection, _document_query(since), batch_size)
+    repair = partial(_repair_batch, build_updates=apply_changes)
+    for results in map_batches(repair, batches, schema, workers):
+        for result in results:
+            documents_processed += 1
+            doc_id_str = str(result["_id"])
+
+            if result["remaining_errors"] or result["issues"]:
+                documents_with_unresolved_errors += 1
+
+            set_updates = result.pop("set_updates")
+            if result["made_changes"]:
+                documents_with_repairs += 1
+                if apply_changes and set_updates:
+                    pending_updates.append(UpdateOne(
+                        {"_id": result["_id"]},
                         {"$set": set_updates},
-                    )
-                    documents_updated += 1
-
-        if made_changes_to_this_doc or current_doc_issues_log or remaining_errors:
-            overall_report[doc_id_str] = {
-                "project_name": _format_report_field(
-                    doc.get("project_name", doc.get("name")),
-                    fallback="Unknown project",
-                ),
-                "creator": _format_report_field(doc.get("creator")),
-                "date_created": _format_report_field(doc.get("date_created")),
-                "changes": current_doc_changes_log,
-                "issues": current_doc_issues_log,
-                "remaining_errors": [
-                    _validation_error_summary(error)
-                    for error in remaining_errors
-                ],
-            }
+                    ))
+
+            if result["made_changes"] or result["issues"] or result["remaining_errors"]:
+                overall_report[doc_id_str] = result
+                _write_jsonl(jsonl_out, {
+                    "_id": doc_id_str,
+                    "project_name": result["project_name"],
+                    "changes": [
+                        {"path": change["path"], "action": change["action"], "value_set": change["value_set"]}
+                        for change in result["changes"]
+                    ],
+                    "issues": result["issues"],
+                    "remaining_errors": result["remaining_errors"],
+                })
+        if len(pending_updates) >= batch_size:
+            flush_updates()
+    flush_updates()
+    _write_jsonl(jsonl_out, {"summary": {
+        "mode": "apply" if apply_changes else "dry_run",
+        "processed": documents_processed,
+        "deleted_skipped": documents_skipped,
+        "with_repairs": documents_with_repairs,
+        "updated": documents_updated,
+        "requiring_review": documents_with_unresolved_errors,
+        "since": since,
+    }})
 
     mode = "APPLY" if apply_changes else "DRY RUN"
     fix_schema_report = f"\n--- Schema Repair Report ({mode}) ---"
@@ -705,8 +887,26 @@ def run_fix_schema(
 def main():
     """Main function for command-line usage."""
     args = parse_arguments()
+    jsonl_out = None
 
     try:
+        if args.jsonl_path:
+            jsonl_out = open(args.jsonl_path, "w", encoding="utf-8")
+
+        if args.fix:
+            print(run_fix_schema(
+                db_host=args.db_host,
+                db_name=args.db_name,
+                collection_name=args.collection_name,
+                schema_path=args.schema_path,
+                apply_changes=args.apply,
+                batch_size=args.batch_size,
+                workers=args.workers,
+                since=args.since,
+                jsonl_out=jsonl_out,
+            ))
+            return
+
         # Load schema
         schema = load_schema(args.schema_path)
 
@@ -729,13 +929,22 @@ def main():
             collection_name=args.collection_name,
             db_handle=db_handle,
             client=client,
-            close_connection=bool(args.db_host)  # Only close if we created a new connection
+            close_connection=bool(args.db_host),  # Only close if we created a new connection
+            batch_size=args.batch_size,
+            workers=args.workers,
+            since=args.since,
+            jsonl_out=jsonl_out,
+            verbose=not args.quiet,
         )
 
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+    finally:
+        if jsonl_out is not None:
+            jsonl_out.close()
+
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from django.utils.translation import gettext_lazy as _
 import logging
 default_log_level_name = os.getenv("DEFAULT_LOG_LEVEL", "INFO").upper()
@@ -169,7 +170,10 @@ AUTH_PASSWORD_VALIDATORS = [
 ACCOUNT_EMAIL_VERIFICATION = 'none'
 ACCOUNT_EMAIL_REQUIRED = False
 
-EMAIL_BACKEND = 'caper.email_backend.SSLCompatEmailBackend'
+# Set EMAIL_BACKEND to django.core.mail.backends.locmem.EmailBackend or
+# .filebased.EmailBackend (writing to EMAIL_FILE_PATH) to run without an SMTP server.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', default='caper.email_backend.SSLCompatEmailBackend')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', default=os.path.join(tempfile.gettempdir(), 'caper_emails'))
 #ACCOUNT_AUTHENTICATED_LOGIN_REDIRECTS = os.environ['ACCOUNT_AUTHENTICATED_LOGIN_REDIRECTS']
 
 EMAIL_HOST = 'smtp.gmail.com' #new
@@ -230,6 +234,19 @@ CACHES = {
             'CULL_FREQUENCY': 4,
         }
     },
+    # Rendered sample pages (caper/page_cache.py). Kept apart from 'default'
+    # for the same reason as 'throttle': a crawler walking thousands of samples
+    # would otherwise evict every cached chart. Entries carry their own
+    # timeout (SAMPLE_PAGE_CACHE_SECONDS) and are invalidated on project edits.
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/django_cache_pages',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        }
+    },
 }
 
 # ── Django REST Framework ───────────────────────────────────────────────────
@@ -430,6 +447,17 @@ if USE_S3_DOWNLOADS:
     _raw_bucket_path = os.getenv('S3_DOWNLOADS_BUCKET_PATH', default="")
     S3_DOWNLOADS_BUCKET_PATH = (_raw_bucket_path.rstrip('/') + '/') if _raw_bucket_path else ""
 
+# Project aggregation off the web tier (caper/job_queue.py).  When TRUE, uploads
+# queue their aggregation in background_tasks and `manage.py run_workers` runs it
+# in AGGREGATION_WORKERS processes at nice AGGREGATION_NICENESS; otherwise it
+# runs on the in-process thread pool of whichever gunicorn worker took the upload.
+AGGREGATION_QUEUE = os.getenv('CAPER_AGGREGATION_QUEUE') == 'TRUE'
+# JOB_QUEUE puts every background job (downloads and maintenance as well) on
+# the durable queue: leased, retried with backoff, run by `manage.py run_workers`.
+JOB_QUEUE = os.getenv('CAPER_JOB_QUEUE') == 'TRUE'
+AGGREGATION_WORKERS = int(os.getenv('CAPER_AGGREGATION_WORKERS', '2'))
+AGGREGATION_NICENESS = int(os.getenv('CAPER_AGGREGATION_NICENESS', '10'))
+
 
 
 TEMPLATES = [
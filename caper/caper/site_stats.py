@@ -1,8 +1,27 @@
 import datetime
+import logging
+import os
+
+from django.core.cache import cache
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
 
 from .utils import get_collection_handle, collection_handle, db_handle_primary, replace_space_to_underscore, preprocess_sample_data, get_one_sample, sample_data_from_feature_list, is_project_private, is_project_public, normalize_visibility_field
 
 site_statistics_handle = get_collection_handle(db_handle_primary, 'site_statistics')
+# One document per counted project: {_id: project _id, bucket, sample_count, coral,
+# amplicon_classifications_count, tissue_of_origin_count}. Site totals are a $sum over these,
+# so no statistics update has to read a project's runs more than once.
+site_stats_contributions_handle = get_collection_handle(db_handle_primary, 'site_stats_contributions')
+# Written by _reconcile_contributions once the contributions cover every counted project. Until it
+# exists the ledger may hold only the projects changed since deploy, so nothing may sum it as is.
+site_stats_checkpoints_handle = get_collection_handle(db_handle_primary, 'site_stats_checkpoints')
+_LEDGER_CHECKPOINT = 'contributions_ledger'
+
+# Totals are cached (shared across workers) and re-summed on every change made through this
+# module; the TTL bounds how stale a worker can be after changes made any other way.
+SITE_STATS_CACHE_SECONDS = int(os.getenv('SITE_STATS_CACHE_SECONDS', '300'))
+_SITE_STATS_CACHE_KEY = 'site_statistics:latest'
+_RECONCILE_BATCH_SIZE = 100
 
 # Upload placeholders (runs={}, sample_count=0) and projects whose aggregation failed stay
 # current/undeleted so their owner can still reach them, but the incremental add/delete
@@ -65,12 +84,30 @@ def _bucket_stat_keys():
             yield f'{prefix}_{suffix}', default() if callable(default) else default
 
 
+def invalidate_site_statistics_cache():
+    """Make the next get_latest_site_statistics() read the newest snapshot from the database."""
+    try:
+        cache.delete(_SITE_STATS_CACHE_KEY)
+    except Exception as e:
+        logging.warning(f"Could not invalidate cached site statistics: {e}")
+
+
 def get_latest_site_statistics():
-    # check to auto create the stats if needed
-    if site_statistics_handle.count_documents({})==0:
-        regenerate_site_statistics()
+    try:
+        latest = cache.get(_SITE_STATS_CACHE_KEY)
+    except Exception as e:
+        logging.warning(f"Cached site statistics unavailable: {e}")
+        latest = None
+
+    if latest is None:
+        # check to auto create the stats if needed: no snapshot yet, or a ledger that has never
+        # been built from the projects collection
+        if site_statistics_handle.count_documents({}) == 0 or not _ledger_built():
+            regenerate_site_statistics()
+
+        latest = site_statistics_handle.find().sort('_id', -1).limit(1).next()
+        _cache_snapshot(latest)
 
-    latest = site_statistics_handle.find().sort('_id', -1).limit(1).next()
     # Documents written before a bucket existed lack its keys entirely, and a missing key reaches
     # templates as '' rather than as a number or dict. Fill the defaults in so every reader sees
     # the full set until the next regeneration writes them for real.
@@ -87,6 +124,13 @@ def get_latest_site_statistics():
     return latest
 
 
+def _cache_snapshot(snapshot):
+    try:
+        cache.set(_SITE_STATS_CACHE_KEY, snapshot, SITE_STATS_CACHE_SECONDS)
+    except Exception as e:
+        logging.warning(f"Could not cache site statistics: {e}")
+
+
 def sum_amplicon_counts_by_classification(class_keys, class_values, sum_holder, sum_sign=1):
     for class_name in class_keys:
         prev = 0
@@ -114,87 +158,131 @@ def subtract_amplicon_counts_by_classification(class_keys, class_values, sum_hol
     return sum_holder
 
 
-def _sum_projects_into_bucket(projects, prefix):
-    """Total up every project in one visibility bucket into that bucket's statistics keys."""
-    amplicon_counts = dict()
-    tissue_counts = dict()
-    proj_count = 0
-    sample_count = 0
-    coral_project_count = 0
-    coral_sample_count = 0
-
-    for proj in projects:
-        class_keys, proj_amplicon_counts = get_project_amplicon_counts(proj)
-        sum_amplicon_counts_by_classification(class_keys, proj_amplicon_counts, amplicon_counts)
-        sum_tissue_of_origin_counts(get_project_tissue_of_origin_counts(proj), tissue_counts)
-        proj_count += 1
-        sample_count += len(proj['runs'])
-        if is_coral_project(proj):
-            coral_project_count += 1
-            coral_sample_count += len(proj['runs'])
+def project_contribution(project):
+    """
+    One project's contribution to the statistics of whichever bucket it is in.
 
+    This is the only place the project's runs are walked; the result is stored in
+    site_stats_contributions and every total is a sum over those documents.
+    """
+    sample_count = len(project.get('runs', {}))
+    class_keys, amplicon_counts = get_project_amplicon_counts(project)
     return {
-        f'{prefix}_proj_count': proj_count,
-        f'{prefix}_sample_count': sample_count,
-        f'{prefix}_coral_project_count': coral_project_count,
-        f'{prefix}_coral_sample_count': coral_sample_count,
-        f'{prefix}_amplicon_classifications_count': amplicon_counts,
-        f'{prefix}_tissue_of_origin_count': tissue_counts,
+        'sample_count': sample_count,
+        'coral': is_coral_project(project),
+        'amplicon_classifications_count': {k: amplicon_counts[k] for k in class_keys},
+        'tissue_of_origin_count': get_project_tissue_of_origin_counts(project),
     }
 
 
-def regenerate_site_statistics():
-    repo_stats = {}
-    for visibility, prefix in BUCKET_PREFIXES.items():
-        projects = list(collection_handle.find({
-            'private': {'$in': BUCKET_QUERY_VALUES[visibility]},
-            **COMPLETED_PROJECT_FILTER
-        }))
-        repo_stats.update(_sum_projects_into_bucket(projects, prefix))
+def _sum_contributions():
+    """Total every contribution into the per-bucket statistics keys, on the server."""
+    def _dict_entries(field):
+        return {'$map': {
+            'input': {'$objectToArray': {'$ifNull': [f'${field}', {}]}},
+            'as': 'c',
+            'in': {'f': field, 'k': '$$c.k', 'v': '$$c.v'},
+        }}
+
+    pipeline = [
+        {'$project': {'bucket': 1, 'entries': {'$concatArrays': [
+            [
+                {'f': 'proj_count', 'v': 1},
+                {'f': 'sample_count', 'v': '$sample_count'},
+                {'f': 'coral_project_count', 'v': {'$cond': ['$coral', 1, 0]}},
+                {'f': 'coral_sample_count', 'v': {'$cond': ['$coral', '$sample_count', 0]}},
+            ],
+            _dict_entries('amplicon_classifications_count'),
+            _dict_entries('tissue_of_origin_count'),
+        ]}}},
+        {'$unwind': '$entries'},
+        {'$group': {
+            '_id': {'bucket': '$bucket', 'f': '$entries.f', 'k': '$entries.k'},
+            'v': {'$sum': '$entries.v'},
+        }},
+    ]
+
+    repo_stats = dict(_bucket_stat_keys())
+    for group in site_stats_contributions_handle.aggregate(pipeline):
+        prefix = BUCKET_PREFIXES.get(group['_id'].get('bucket'))
+        if prefix is None or not group['v']:
+            continue
+        key = f"{prefix}_{group['_id']['f']}"
+        if isinstance(repo_stats[key], dict):
+            repo_stats[key][group['_id']['k']] = group['v']
+        else:
+            repo_stats[key] = group['v']
+    return repo_stats
+
 
+def _write_snapshot():
+    """Store the current totals as the newest site_statistics document and cache it."""
+    repo_stats = _sum_contributions()
     repo_stats["date"] = get_date()
     site_statistics_handle.insert_one(repo_stats)
-    print(f"SITE STATS REGENERATED FROM SCRATCH    {repo_stats['public_amplicon_classifications_count']} ")
-
+    _cache_snapshot(dict(repo_stats))
     return repo_stats
 
 
-def _carry_forward_buckets(current_stats):
-    """Copy every bucket's keys onto a new statistics document.
-
-    Statistics are stored as full snapshots rather than deltas, so the buckets that aren't
-    changing still have to be written out or their totals would be lost.
+def _reconcile_contributions():
     """
-    return {key: current_stats.get(key, default) for key, default in _bucket_stat_keys()}
+    Bring site_stats_contributions in line with the projects collection.
 
+    Reads only ids and visibilities: contributions of projects that are gone or no longer
+    counted are dropped, moved buckets are corrected, and only projects that have no
+    contribution yet have their runs read.
+    """
+    bucket_of_value = {value: visibility
+                       for visibility, values in BUCKET_QUERY_VALUES.items() for value in values}
+    live = {}
+    for proj in collection_handle.find({
+            'private': {'$in': list(bucket_of_value)},
+            **COMPLETED_PROJECT_FILTER}, {'private': 1}):
+        live[proj['_id']] = bucket_of_value[proj['private']]
+
+    ops = []
+    recorded = set()
+    for contribution in site_stats_contributions_handle.find({}, {'bucket': 1}):
+        project_id = contribution['_id']
+        recorded.add(project_id)
+        if project_id not in live:
+            ops.append(DeleteOne({'_id': project_id}))
+        elif contribution.get('bucket') != live[project_id]:
+            ops.append(UpdateOne({'_id': project_id}, {'$set': {'bucket': live[project_id]}}))
+
+    missing = [project_id for project_id in live if project_id not in recorded]
+    for start in range(0, len(missing), _RECONCILE_BATCH_SIZE):
+        batch = missing[start:start + _RECONCILE_BATCH_SIZE]
+        for proj in collection_handle.find({'_id': {'$in': batch}},
+                                           {'runs': 1, 'Reconstruction_tools': 1}):
+            ops.append(ReplaceOne(
+                {'_id': proj['_id']},
+                {'bucket': live[proj['_id']], **project_contribution(proj)},
+                upsert=True))
+
+    if ops:
+        site_stats_contributions_handle.bulk_write(ops, ordered=False)
+    site_stats_checkpoints_handle.update_one(
+        {'_id': _LEDGER_CHECKPOINT}, {'$set': {'built_at': get_date()}}, upsert=True)
+    return len(ops)
+
+
+def _ledger_built():
+    return site_stats_checkpoints_handle.find_one({'_id': _LEDGER_CHECKPOINT}, {'_id': 1}) is not None
+
+
+def _ensure_ledger():
+    """Build the ledger before the first incremental change, so its snapshot covers every project."""
+    if not _ledger_built():
+        _reconcile_contributions()
 
-def _apply_project_to_site_statistics(project, visibility, sign):
-    """Add (sign=1) or remove (sign=-1) one project's contribution to its visibility bucket."""
-    prefix = BUCKET_PREFIXES[normalize_visibility_field(visibility)]
-    updated_stats = _carry_forward_buckets(get_latest_site_statistics())
-    sample_count = len(project.get('runs', {}))
-
-    updated_stats[f'{prefix}_proj_count'] += sign
-    updated_stats[f'{prefix}_sample_count'] += sign * sample_count
-    if is_coral_project(project):
-        updated_stats[f'{prefix}_coral_project_count'] = max(
-            0, updated_stats[f'{prefix}_coral_project_count'] + sign)
-        updated_stats[f'{prefix}_coral_sample_count'] = max(
-            0, updated_stats[f'{prefix}_coral_sample_count'] + sign * sample_count)
 
-    class_keys, amplicon_counts = get_project_amplicon_counts(project)
-    tissue_counts = get_project_tissue_of_origin_counts(project)
-    amplicon_holder = updated_stats[f'{prefix}_amplicon_classifications_count']
-    tissue_holder = updated_stats[f'{prefix}_tissue_of_origin_count']
-    if sign > 0:
-        sum_amplicon_counts_by_classification(class_keys, amplicon_counts, amplicon_holder)
-        sum_tissue_of_origin_counts(tissue_counts, tissue_holder)
-    else:
-        subtract_amplicon_counts_by_classification(class_keys, amplicon_counts, amplicon_holder)
-        subtract_tissue_of_origin_counts(tissue_counts, tissue_holder)
+def regenerate_site_statistics():
+    changed = _reconcile_contributions()
+    repo_stats = _write_snapshot()
+    print(f"SITE STATS REGENERATED ({changed} contributions updated)    {repo_stats['public_amplicon_classifications_count']} ")
 
-    updated_stats["date"] = get_date()
-    site_statistics_handle.insert_one(updated_stats)
+    return repo_stats
 
 
 def add_project_to_site_statistics(project, visibility='private'):
@@ -202,12 +290,18 @@ def add_project_to_site_statistics(project, visibility='private'):
     Adds a project's statistics to the site-wide statistics.
 
     Args:
-        project (dict): Project dictionary
+        project (dict): Project dictionary, with its runs
         visibility: 'public', 'private' or 'hidden_public'. Legacy booleans are accepted and
             normalized (True -> private, False -> public), so they can never select the
             hidden_public bucket.
     """
-    _apply_project_to_site_statistics(project, visibility, sign=1)
+    bucket = normalize_visibility_field(visibility)
+    _ensure_ledger()
+    site_stats_contributions_handle.replace_one(
+        {'_id': project['_id']},
+        {'bucket': bucket, **project_contribution(project)},
+        upsert=True)
+    _write_snapshot()
 
 
 def delete_project_from_site_statistics(project, visibility='private'):
@@ -215,12 +309,12 @@ def delete_project_from_site_statistics(project, visibility='private'):
     Removes a project's statistics from the site-wide statistics.
 
     Args:
-        project (dict): Project dictionary
-        visibility: 'public', 'private' or 'hidden_public'. Legacy booleans are accepted and
-            normalized (True -> private, False -> public), so they can never select the
-            hidden_public bucket.
+        project (dict): Project dictionary; only its _id is used
+        visibility: kept for callers; the stored contribution knows its own bucket.
     """
-    _apply_project_to_site_statistics(project, visibility, sign=-1)
+    _ensure_ledger()
+    site_stats_contributions_handle.delete_one({'_id': project['_id']})
+    _write_snapshot()
 
 
 def edit_proj_privacy(project, old_privacy, new_privacy):
@@ -236,8 +330,13 @@ def edit_proj_privacy(project, old_privacy, new_privacy):
     if old_visibility == new_visibility:
         return
 
-    delete_project_from_site_statistics(project, old_visibility)
-    add_project_to_site_statistics(project, new_visibility)
+    _ensure_ledger()
+    result = site_stats_contributions_handle.update_one(
+        {'_id': project['_id']}, {'$set': {'bucket': new_visibility}})
+    if result.matched_count == 0 and 'runs' in project:
+        add_project_to_site_statistics(project, new_visibility)
+        return
+    _write_snapshot()
 
 
 def get_project_amplicon_counts(project):
@@ -4,18 +4,186 @@ Utility functions for working with GridFS-stored tar files.
 These functions allow efficient extraction of specific files or directories
 from tar files stored in MongoDB GridFS without requiring the entire tar
 to be written to disk first.
+
+Tarballs stored since the member index was introduced (see ``tar_index``)
+carry a ``tarfile_index`` GridFS id on the project document; reads of single
+members or subdirectories then seek straight to the blocks holding them.
+Older projects without an index fall back to streaming the whole archive.
 """
 
+import gzip
 import os
 import tarfile
 import tempfile
 import logging
 from bson import ObjectId
-from .tar_safety import safe_extract_member
-from .utils import fs_handle, collection_handle
+from .tar_index import (
+    DIRECTORY_TYPE, REGULAR_TYPES, deserialize_index, iter_member,
+    member_names, normalize_member_name, read_member, serialize_index,
+    write_blocked_tar_gz,
+)
+from .tar_safety import UnsafeTarMember, _check_member, safe_extract_member
+from .utils import (
+    ECDNA_CONTEXT_SUFFIX, collection_handle, fs_handle, parse_ecDNA_context_calls,
+)
 
 logger = logging.getLogger(__name__)
 
+# Only the GridFS ids are needed to locate a project's tarball; never pull runs.
+_TARFILE_PROJECTION = {'tarfile': 1, 'tarfile_index': 1}
+
+
+def store_project_tarball(file_location):
+    """
+    Store an uploaded project tarball in GridFS together with its member index.
+
+    The file at *file_location* is replaced in place by its block-compressed
+    rewrite, so the extraction thread and the S3 upload that read it later see
+    exactly the bytes that went into GridFS.  If the archive cannot be indexed
+    it is stored unchanged and the project simply has no index.
+
+    Args:
+        file_location (str): path of the uploaded .tar.gz on local disk
+
+    Returns:
+        tuple: (tar_id, index_id) - GridFS ids; index_id is None when no index
+               could be built
+    """
+    blocked_location = f'{file_location}.blocked'
+    index = None
+    try:
+        index = write_blocked_tar_gz(file_location, blocked_location)
+        os.replace(blocked_location, file_location)
+    except Exception as e:
+        logger.warning(f"Could not build member index for {file_location}, storing it unindexed: {e}")
+        index = None
+        if os.path.exists(blocked_location):
+            os.remove(blocked_location)
+
+    with open(file_location, 'rb') as tar_file:
+        tar_id = fs_handle.put(tar_file)
+
+    index_id = None
+    if index is not None:
+        index_id = fs_handle.put(serialize_index(index), filename=f'{tar_id}.index.json.gz')
+    return tar_id, index_id
+
+
+def load_project_tar_index(project):
+    """
+    Load the member index of a project's stored tarball.
+
+    Args:
+        project (dict): project document; only 'tarfile_index' is used
+
+    Returns:
+        dict or None: the index, or None if the project predates indexing or
+                      the index cannot be read
+    """
+    index_id = project.get('tarfile_index')
+    if not index_id:
+        return None
+    try:
+        return deserialize_index(fs_handle.get(ObjectId(index_id)).read())
+    except Exception as e:
+        logger.warning(f"Could not load tar member index {index_id}: {e}")
+        return None
+
+
+def _get_project_tar_refs(project_id):
+    """Return (project_id, project) with only the tarball references loaded."""
+    try:
+        if isinstance(project_id, str):
+            project_id = ObjectId(project_id)
+        project = collection_handle.find_one({'_id': project_id}, _TARFILE_PROJECTION)
+        if not project:
+            raise ValueError(f"Project {project_id} not found")
+    except Exception as e:
+        raise ValueError(f"Invalid project_id: {e}")
+
+    if 'tarfile' not in project:
+        raise ValueError(f"Project {project_id} has no tarfile stored")
+    return project_id, project
+
+
+def read_project_tar_member(project, member_name):
+    """
+    Read a single file out of a project's stored tarball.
+
+    Uses the member index when the project has one (one seek plus the blocks
+    the member spans); otherwise streams the archive until the member is found.
+
+    Args:
+        project (dict): project document with 'tarfile' (and optionally
+                        'tarfile_index')
+        member_name (str): member path, e.g. 'results/run.json'
+
+    Returns:
+        bytes: the member's contents
+
+    Raises:
+        KeyError: if the tarball has no regular file named *member_name*
+        ValueError: if the project has no tarfile stored
+    """
+    tar_id = project.get('tarfile')
+    if not tar_id:
+        raise ValueError(f"Project {project.get('_id')} has no tarfile stored")
+
+    tar_gridfs_file = fs_handle.get(ObjectId(tar_id))
+    index = load_project_tar_index(project)
+    if index is not None:
+        return read_member(tar_gridfs_file, index, member_name)
+
+    # Stored tarballs are multi-member gzip; 'r|gz' would stop after the first block.
+    with gzip.GzipFile(fileobj=tar_gridfs_file, mode='rb') as stream, \
+            tarfile.open(fileobj=stream, mode='r|') as tar:
+        for member in tar:
+            if normalize_member_name(member.name) == normalize_member_name(member_name) and member.isfile():
+                return tar.extractfile(member).read()
+    raise KeyError(f"filename {member_name!r} not found")
+
+
+def ecDNA_context_from_project_tar(project):
+    """
+    Collect the ecDNA context of a project from its stored tarball.
+
+    Used to backfill projects ingested before ecDNA context was harvested at
+    extraction time.  With a member index only the ecDNA_context_calls.tsv
+    members are decompressed; otherwise the archive is streamed once.
+
+    Args:
+        project (dict): project document with 'tarfile' (and optionally
+                        'tarfile_index')
+
+    Returns:
+        dict: feature key -> context call
+
+    Raises:
+        ValueError: if the project has no tarfile stored
+    """
+    tar_id = project.get('tarfile')
+    if not tar_id:
+        raise ValueError(f"Project {project.get('_id')} has no tarfile stored")
+
+    ecDNA_context = {}
+    tar_gridfs_file = fs_handle.get(ObjectId(tar_id))
+    index = load_project_tar_index(project)
+    if index is not None:
+        for name in member_names(index):
+            if name.endswith(ECDNA_CONTEXT_SUFFIX):
+                try:
+                    parse_ecDNA_context_calls(read_member(tar_gridfs_file, index, name), ecDNA_context)
+                except KeyError:
+                    continue  # not a regular file (a link or directory of that name)
+        return ecDNA_context
+
+    with gzip.GzipFile(fileobj=tar_gridfs_file, mode='rb') as stream, \
+            tarfile.open(fileobj=stream, mode='r|') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(ECDNA_CONTEXT_SUFFIX):
+                parse_ecDNA_context_calls(tar.extractfile(member).read(), ecDNA_context)
+    return ecDNA_context
+
 
 def extract_from_project_tarfile(project_id, tar_path_filter, output_dir=None, use_temp=False):
     """
@@ -50,20 +218,8 @@ def extract_from_project_tarfile(project_id, tar_path_filter, output_dir=None, u
         >>> print(f"Extracted {count} files to {output_dir}")
     """
     
-    # Get project document
-    try:
-        if isinstance(project_id, str):
-            project_id = ObjectId(project_id)
-        project = collection_handle.find_one({'_id': project_id})
-        if not project:
-            raise ValueError(f"Project {project_id} not found")
-    except Exception as e:
-        raise ValueError(f"Invalid project_id: {e}")
-    
-    # Get tarfile ID
-    if 'tarfile' not in project:
-        raise ValueError(f"Project {project_id} has no tarfile stored")
-    
+    project_id, project = _get_project_tar_refs(project_id)
+
     tar_id = project['tarfile']
     logger.info(f"Found tarfile ID: {tar_id} for project {project_id}")
     
@@ -80,7 +236,14 @@ def extract_from_project_tarfile(project_id, tar_path_filter, output_dir=None, u
         logger.info(f"Retrieved tarfile from GridFS (size: {tar_gridfs_file.length:,} bytes)")
     except Exception as e:
         raise RuntimeError(f"Failed to retrieve tarfile from GridFS: {e}")
-    
+
+    index = load_project_tar_index(project)
+    if index is not None:
+        extracted_count = _extract_via_index(tar_gridfs_file, index, tar_path_filter, output_dir)
+        if extracted_count is not None:
+            logger.info(f"Successfully extracted {extracted_count} files to {output_dir} using the member index")
+            return output_dir, extracted_count
+
     if use_temp:
         # Method 1: Write to temp file first (safer but uses more disk)
         extracted_count = _extract_via_tempfile(tar_gridfs_file, tar_path_filter, output_dir)
@@ -130,6 +293,54 @@ def _extract_via_tempfile(gridfs_file, path_filter, output_dir):
         logger.info(f"Cleaned up temporary file: {temp_tar_path}")
 
 
+def _extract_via_index(gridfs_file, index, path_filter, output_dir):
+    """
+    Extract members matching *path_filter* by seeking to each one.
+
+    Links are not recorded in the index, so if any matching member is one this
+    returns None and the caller falls back to a full streaming extraction.
+
+    Returns:
+        int or None: number of files extracted, or None to request the fallback
+    """
+    path_filter = path_filter.rstrip('/')
+    matching = [entry for entry in index['members'] if entry[0].startswith(path_filter)]
+    logger.info(f"Index lists {len(matching)} members matching '{path_filter}' out of {len(index['members'])} total")
+    extractable = REGULAR_TYPES + (DIRECTORY_TYPE,)
+    if any(member_type not in extractable for _, _, _, member_type in matching):
+        logger.info("Matching members include links; falling back to a streaming extraction")
+        return None
+
+    extracted_count = 0
+    for name, _, size, member_type in matching:
+        # Names come from the uploaded archive, so they get the same containment
+        # check as a real tar member before anything is written.
+        info = tarfile.TarInfo(name)
+        info.size = size
+        is_dir = member_type == DIRECTORY_TYPE
+        info.type = tarfile.DIRTYPE if is_dir else tarfile.REGTYPE
+        info.mode = 0o755 if is_dir else 0o644
+        try:
+            _check_member(info, output_dir)
+        except UnsafeTarMember as err:
+            logger.warning(f"Refusing unsafe tar member: {err}")
+            continue
+
+        target = os.path.join(output_dir, name)
+        try:
+            if is_dir:
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as out:
+                for chunk in iter_member(gridfs_file, index, name):
+                    out.write(chunk)
+            extracted_count += 1
+        except Exception as e:
+            logger.warning(f"Failed to extract {name}: {e}")
+    return extracted_count
+
+
 def _extract_via_stream(gridfs_file, path_filter, output_dir):
     """Extract by streaming directly from GridFS."""
     logger.info("Streaming tar directly from GridFS...")
@@ -206,20 +417,14 @@ def list_project_tar_contents(project_id, path_filter=None):
         ... )
         >>> print(f"Found {len(files)} files in other_files/")
     """
-    # Get project document
-    try:
-        if isinstance(project_id, str):
-            project_id = ObjectId(project_id)
-        project = collection_handle.find_one({'_id': project_id})
-        if not project:
-            raise ValueError(f"Project {project_id} not found")
-    except Exception as e:
-        raise ValueError(f"Invalid project_id: {e}")
-    
-    # Get tarfile ID
-    if 'tarfile' not in project:
-        raise ValueError(f"Project {project_id} has no tarfile stored")
-    
+    project_id, project = _get_project_tar_refs(project_id)
+
+    index = load_project_tar_index(project)
+    if index is not None:
+        names = member_names(index, path_filter)
+        logger.info(f"Tar index lists {len(names)} files for '{path_filter or ''}'")
+        return names
+
     tar_id = project['tarfile']
     
     # Get tarfile from GridFS
@@ -0,0 +1,354 @@
+"""
+Resumable, checksummed multipart uploads for the project upload API.
+
+The original multipart protocol of ``FileUploadView`` encodes the upload in
+the project name (``MULTIPART__<api_id>__<final_file>__<name>``), orders the
+parts by globbing ``POST*`` files, and only reassembles them once the part
+named as final arrives.  Nothing is verified, and a part lost or corrupted on
+a flaky link means pushing the whole project again.  An upload session
+replaces that:
+
+  init      POST /upload_api/sessions/                   -> session id, part count
+  part      PUT  /upload_api/sessions/<id>/parts/<n>/    raw part bytes, with an
+                                                            X-Part-SHA256 header
+  status    GET  /upload_api/sessions/<id>/              -> received and missing parts
+  finalize  POST /upload_api/sessions/<id>/complete/     -> project creation starts
+
+Layout on disk::
+
+    MEDIA_ROOT/upload_sessions/<session id>/
+        session.json             manifest, written at init and at finalize
+        part-000001-<sha256>     a verified part
+        finalizing/              the finalize lock (mkdir is atomic)
+
+A part is written to a temporary file while it is hashed, and linked into
+place under a name carrying its digest only once size and digest both match.
+A part file is therefore always complete and verified, and part state is read
+from the directory listing rather than the manifest, so concurrent PUTs of
+different parts never contend on a shared file.  Re-sending a part the
+session already holds with the same digest is acknowledged without rewriting
+it; re-sending it with a different digest is refused.
+
+Finalize concatenates the parts into ``MEDIA_ROOT/<session id>/
+reconstructed.tar.gz`` in one streaming pass, checking the total size and,
+when the client supplied one at init, the SHA-256 of the whole file, then the
+view hands that file to ``FileUploadView.api_helper`` exactly as the legacy
+path does.  A repeated finalize (the client lost the first response) reports
+the session as already finalized instead of failing.
+
+Session ids are unguessable and only returned to the caller that created the
+session, so the id is the credential for the later calls, as with download
+job ids.  Sessions left unfinished are removed after
+``UPLOAD_SESSION_TTL_SECONDS``; the sweep runs whenever a session is created.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+
+OPEN = 'open'
+FINALIZING = 'finalizing'
+FINALIZED = 'finalized'
+
+# Default and bounds for the part size a client may choose.  Parts are
+# streamed to disk, never held in memory, so the ceiling only bounds how much
+# a single failed PUT has to resend.
+DEFAULT_PART_SIZE = int(os.getenv('UPLOAD_SESSION_PART_SIZE', 64 * 1024 * 1024))
+MIN_PART_SIZE = 1024 * 1024
+MAX_PART_SIZE = 512 * 1024 * 1024
+MAX_PARTS = 10000
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv('UPLOAD_SESSION_TTL_SECONDS', 48 * 60 * 60))
+
+RECONSTRUCTED_NAME = 'reconstructed.tar.gz'
+_MANIFEST = 'session.json'
+_LOCK = 'finalizing'
+_CHUNK = 1024 * 1024
+
+_SESSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+_PART_RE = re.compile(r'^part-(\d{6})-([0-9a-f]{64})$')
+
+
+class UploadSessionError(Exception):
+    """A request the session cannot satisfy; ``status_code`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+def sessions_root():
+    return os.path.join(settings.MEDIA_ROOT, 'upload_sessions')
+
+
+def _session_dir(session_id):
+    if not _SESSION_ID_RE.match(str(session_id)):
+        raise UploadSessionError('Upload session not found', 404)
+    return os.path.join(sessions_root(), session_id)
+
+
+def upload_dir(session_id):
+    """Directory the reassembled tarball is written to: MEDIA_ROOT/<api_id>, as for every API upload."""
+    return os.path.join(settings.MEDIA_ROOT, session_id)
+
+
+def _utcnow():
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, f'.{_MANIFEST}.{uuid.uuid4().hex}')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, _MANIFEST))
+
+
+def _normalize_sha256(value, field):
+    value = (value or '').strip().lower()
+    if not _SHA256_RE.match(value):
+        raise UploadSessionError(f'{field} must be a hex SHA-256 digest')
+    return value
+
+
+def create_session(file_name, total_size, form_data, current_user, part_size=None, sha256=None):
+    """
+    Open a session for a file of ``total_size`` bytes.
+
+    form_data: the RunForm fields of the project to create, kept until finalize.
+
+    Returns:
+        dict: the session manifest; ``session_id``, ``part_size`` and
+        ``part_count`` are what the client needs.
+    """
+    file_name = os.path.basename(str(file_name or ''))
+    if not file_name or file_name.startswith('.'):
+        raise UploadSessionError('file_name is required')
+    try:
+        total_size = int(total_size)
+        part_size = int(part_size) if part_size else DEFAULT_PART_SIZE
+    except (TypeError, ValueError):
+        raise UploadSessionError('total_size and part_size must be integers')
+    if total_size <= 0:
+        raise UploadSessionError('total_size must be positive')
+    if not MIN_PART_SIZE <= part_size <= MAX_PART_SIZE:
+        raise UploadSessionError(f'part_size must be between {MIN_PART_SIZE} and {MAX_PART_SIZE} bytes')
+    part_count = -(-total_size // part_size)
+    if part_count > MAX_PARTS:
+        raise UploadSessionError(f'An upload may have at most {MAX_PARTS} parts; use a larger part_size')
+
+    purge_expired_sessions()
+
+    now = _utcnow()
+    manifest = {
+        'session_id': uuid.uuid4().hex,
+        'state': OPEN,
+        'file_name': file_name,
+        'total_size': total_size,
+        'part_size': part_size,
+        'part_count': part_count,
+        'sha256': _normalize_sha256(sha256, 'sha256') if sha256 else None,
+        'user': current_user,
+        'form_data': form_data,
+        'created_at': now.isoformat(),
+        'expires_at': (now + datetime.timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)).isoformat(),
+    }
+    path = _session_dir(manifest['session_id'])
+    os.makedirs(path)
+    _write_manifest(path, manifest)
+    logging.info(f"Opened upload session {manifest['session_id']} for {file_name} "
+                 f"({total_size} bytes in {part_count} parts) for {current_user}")
+    return manifest
+
+
+def load_session(session_id):
+    """The manifest of a live session; raises UploadSessionError(404) otherwise."""
+    path = _session_dir(session_id)
+    try:
+        with open(os.path.join(path, _MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        raise UploadSessionError('Upload session not found', 404)
+    if manifest['state'] == OPEN and os.path.isdir(os.path.join(path, _LOCK)):
+        manifest['state'] = FINALIZING
+    return manifest
+
+
+def expected_part_size(manifest, part_number):
+    if part_number == manifest['part_count']:
+        return manifest['total_size'] - manifest['part_size'] * (manifest['part_count'] - 1)
+    return manifest['part_size']
+
+
+def received_parts(session_id):
+    """{part number: sha256} of the verified parts on disk."""
+    parts = {}
+    for name in os.listdir(_session_dir(session_id)):
+        match = _PART_RE.match(name)
+        if match:
+            parts[int(match.group(1))] = match.group(2)
+    return parts
+
+
+def session_status(session_id):
+    manifest = load_session(session_id)
+    received = received_parts(session_id) if manifest['state'] != FINALIZED else {}
+    if manifest['state'] == FINALIZED:
+        missing = []
+        received_numbers = list(range(1, manifest['part_count'] + 1))
+    else:
+        received_numbers = sorted(received)
+        missing = [n for n in range(1, manifest['part_count'] + 1) if n not in received]
+    return {
+        'session_id': manifest['session_id'],
+        'state': manifest['state'],
+        'file_name': manifest['file_name'],
+        'total_size': manifest['total_size'],
+        'part_size': manifest['part_size'],
+        'part_count': manifest['part_count'],
+        'received_parts': received_numbers,
+        'missing_parts': missing,
+        'expires_at': manifest['expires_at'],
+    }
+
+
+def put_part(session_id, part_number, stream, sha256):
+    """
+    Store part ``part_number`` read from ``stream``, verifying its size and SHA-256.
+
+    Returns:
+        bool: True if the part was written, False if the session already held
+        it with the same digest (the body is not read in that case).
+    """
+    manifest = load_session(session_id)
+    if manifest['state'] != OPEN:
+        raise UploadSessionError(f"Upload session is {manifest['state']}", 409)
+    if not 1 <= part_number <= manifest['part_count']:
+        raise UploadSessionError(f"part number must be between 1 and {manifest['part_count']}", 404)
+    sha256 = _normalize_sha256(sha256, 'X-Part-SHA256')
+
+    held = received_parts(session_id).get(part_number)
+    if held == sha256:
+        return False
+    if held is not None:
+        raise UploadSessionError(f'Part {part_number} was already received with a different SHA-256', 409)
+
+    path = _session_dir(session_id)
+    expected = expected_part_size(manifest, part_number)
+    tmp = os.path.join(path, f'.part-{part_number:06d}.{uuid.uuid4().hex}')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, 'wb') as out:
+            while True:
+                # Never read past one byte over the expected size: an
+                # oversized body is refused without being spooled to disk.
+                chunk = stream.read(min(_CHUNK, expected + 1 - size))
+                if not chunk:
+                    break
+                size += len(chunk)
+                digest.update(chunk)
+                out.write(chunk)
+                if size > expected:
+                    break
+        if size != expected:
+            raise UploadSessionError(f'Part {part_number} must be {expected} bytes')
+        if digest.hexdigest() != sha256:
+            raise UploadSessionError(f'Part {part_number} does not match its SHA-256', 422)
+
+        final = os.path.join(path, f'part-{part_number:06d}-{sha256}')
+        try:
+            os.link(tmp, final)
+        except FileExistsError:
+            return False
+        # Two different bodies for the same part racing each other can both
+        # get here; the one that finds the other's file backs out.
+        if received_parts(session_id).get(part_number, sha256) != sha256:
+            os.remove(final)
+            raise UploadSessionError(f'Part {part_number} was already received with a different SHA-256', 409)
+        return True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def finalize_session(session_id):
+    """
+    Reassemble a complete session into ``upload_dir(session_id)/reconstructed.tar.gz``.
+
+    Returns:
+        (manifest, path): path is None if the session had already been finalized.
+    """
+    manifest = load_session(session_id)
+    if manifest['state'] == FINALIZED:
+        return manifest, None
+    path = _session_dir(session_id)
+    try:
+        os.mkdir(os.path.join(path, _LOCK))
+    except FileExistsError:
+        raise UploadSessionError('Upload session is already being finalized', 409)
+
+    try:
+        parts = received_parts(session_id)
+        missing = [n for n in range(1, manifest['part_count'] + 1) if n not in parts]
+        if missing:
+            raise UploadSessionError('Upload is missing parts', 409, missing_parts=missing)
+
+        out_dir = upload_dir(session_id)
+        os.makedirs(out_dir, exist_ok=True)
+        reconstructed = os.path.join(out_dir, RECONSTRUCTED_NAME)
+        digest = hashlib.sha256()
+        size = 0
+        with open(reconstructed, 'wb') as out:
+            for n in range(1, manifest['part_count'] + 1):
+                with open(os.path.join(path, f'part-{n:06d}-{parts[n]}'), 'rb') as part:
+                    for chunk in iter(lambda: part.read(_CHUNK), b''):
+                        digest.update(chunk)
+                        out.write(chunk)
+                        size += len(chunk)
+        if size != manifest['total_size'] or (manifest['sha256'] and digest.hexdigest() != manifest['sha256']):
+            os.remove(reconstructed)
+            raise UploadSessionError('Reassembled upload does not match the size and SHA-256 given at init', 422)
+    except Exception:
+        os.rmdir(os.path.join(path, _LOCK))
+        raise
+
+    for n, sha256 in parts.items():
+        os.remove(os.path.join(path, f'part-{n:06d}-{sha256}'))
+    manifest['state'] = FINALIZED
+    manifest['finalized_at'] = _utcnow().isoformat()
+    _write_manifest(path, manifest)
+    os.rmdir(os.path.join(path, _LOCK))
+    logging.info(f"Reassembled upload session {session_id} into {reconstructed}")
+    return manifest, reconstructed
+
+
+def purge_expired_sessions(now=None):
+    """Remove sessions whose manifest is older than the TTL, finished or not.  Returns the count."""
+    root = sessions_root()
+    if not os.path.isdir(root):
+        return 0
+    cutoff = (now or time.time()) - UPLOAD_SESSION_TTL_SECONDS
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(os.path.join(path, _MANIFEST)) >= cutoff:
+                continue
+        except OSError:
+            # No manifest: a create that died between mkdir and the write.
+            if os.path.getmtime(path) >= cutoff:
+                continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logging.info(f'Removed {removed} expired upload session(s)')
+    return removed
@@ -97,6 +97,7 @@ urlpatterns += [
     path('admin-delete-user/', views.admin_delete_user, name='admin_delete_user'),
     path('admin-prepare-shutdown/', views.admin_prepare_shutdown, name='admin_prepare_shutdown'),
     path('admin-project-files-report/', views.admin_project_files_report, name='admin_project_files_report'),
+    path('admin-project-files-report/<str:report_id>/status/', views.admin_project_files_report_status, name='admin_project_files_report_status'),
     path('admin-audit-log/', views.admin_audit_log, name='admin_audit_log'),
     path('admin-audit-log/validate/', views.admin_audit_log_validate, name='admin_audit_log_validate'),
 
@@ -106,6 +107,10 @@ urlpatterns += [
     path('data-qc/fix-schema', views.fix_schema, name='fix_schema'),
     path('data-qc/make-project-current/<str:project_id>/', views.make_project_current, name='make_project_current'),
     path('upload_api/', views.FileUploadView.as_view(), name = 'Document'),
+    path('upload_api/sessions/', views.UploadSessionCreateView.as_view(), name='upload_session_create'),
+    path('upload_api/sessions/<str:session_id>/', views.UploadSessionStatusView.as_view(), name='upload_session_status'),
+    path('upload_api/sessions/<str:session_id>/parts/<int:part_number>/', views.UploadSessionPartView.as_view(), name='upload_session_part'),
+    path('upload_api/sessions/<str:session_id>/complete/', views.UploadSessionCompleteView.as_view(), name='upload_session_complete'),
     path('add_samples_to_project_api/', views.ProjectFileAddView.as_view(), name='addSamplesToProject'),
     path('api/background-task-status/', views.BackgroundTaskStatusView.as_view(), name='background_task_status'),
 
@@ -115,6 +120,8 @@ urlpatterns += [
     path('api/v1/projects/<str:project_id>/', views.ProjectDetailView.as_view(), name='api_project_detail'),
     path('api/v1/projects/<str:project_id>/download/', views.ProjectDownloadView.as_view(), name='api_project_download'),
     path('api/v1/projects/<str:project_id>/samples/', views.ProjectSamplesView.as_view(), name='api_project_samples'),
+    path('api/v1/jobs/<str:job_id>/', views.JobStatusView.as_view(), name='api_job_status'),
+    path('api/v1/jobs/<str:job_id>/download/', views.JobDownloadView.as_view(), name='api_job_download'),
     path('api/v1/token/', views.ApiTokenView.as_view(), name='api_token'),
 
     path('robots.txt', views.robots, name = "robots.txt"),
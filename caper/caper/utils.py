@@ -16,7 +16,7 @@ import re
 import os
 from django.forms.models import model_to_dict
 import datetime
-import tarfile
+import threading
 
 # def get_db_handle(db_name, host, read_preference=ReadPreference.SECONDARY_PREFERRED
 #                   ):
@@ -66,6 +66,32 @@ def get_collection_handle(db_handle,collection_name):
     return db_handle[collection_name]
 
 
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client(profile_name=None):
+    """Return the process-wide S3 client for *profile_name*.
+
+    Defaults to ``settings.AWS_PROFILE_NAME`` (or 'default').  Building a
+    session and client resolves credentials and endpoints, which was being
+    paid on every download click.  boto3 sessions are not thread-safe but
+    clients are, so one client per profile is shared by every thread.
+    """
+    import boto3
+    from django.conf import settings
+
+    profile_name = profile_name or getattr(settings, 'AWS_PROFILE_NAME', None) or 'default'
+    client = _s3_clients.get(profile_name)
+    if client is None:
+        with _s3_clients_lock:
+            client = _s3_clients.get(profile_name)
+            if client is None:
+                client = boto3.Session(profile_name=profile_name).client('s3')
+                _s3_clients[profile_name] = client
+    return client
+
+
 def create_run_display(project):
     """
     Creates a flattened list of samples with underscores replacing spaces in keys.
@@ -316,12 +342,98 @@ def page_query_timeout():
     return float(os.getenv('MONGO_PAGE_TIMEOUT_SECONDS', '20'))
 
 
+def build_sample_index(runs):
+    """Return the sample navigation index stored on a project as ``sample_index``.
+
+    A list of ``{'k': run key, 's': first Sample_name}`` sorted by run key, the
+    order the prev/next links on sample pages follow.  It is stored alongside
+    ``runs`` whenever ``runs`` is written, so a sample page can find its
+    neighbours without reading or sorting every run.
+    """
+    index = []
+    for key in sorted(runs or {}):
+        rows = runs[key]
+        try:
+            name = rows[0]['Sample_name']
+        except (IndexError, KeyError, TypeError):
+            name = None
+        index.append({'k': key, 's': name})
+    return index
+
+
+def _fetch_run_rows(project_id, run_key):
+    """Fetch the feature rows of one run of a project, by run key."""
+    if '.' not in run_key and not run_key.startswith('$'):
+        doc = collection_handle.find_one({'_id': project_id}, {f'runs.{run_key}': 1})
+        return ((doc or {}).get('runs') or {}).get(run_key)
+
+    # A key that cannot be written as a projection path.
+    pipeline = [
+        {'$match': {'_id': project_id}},
+        {'$project': {'_matched': {'$filter': {
+            'input': {'$objectToArray': '$runs'},
+            'as': 'r',
+            'cond': {'$eq': ['$$r.k', run_key]},
+        }}}},
+    ]
+    doc = next(iter(collection_handle.aggregate(pipeline)), None)
+    return next((entry.get('v') for entry in (doc or {}).get('_matched') or []), None)
+
+
 def _fetch_sample_slice(match, sample_name):
-    """Fetch one sample's feature rows plus a compact index of every sample name.
+    """Fetch one sample's feature rows and the names of its neighbours.
+
+    Looks the sample up in the project's stored ``sample_index`` on the server
+    and transfers only the (at most three) index entries around it, then reads
+    just that run.  Returns ``(rows, prev_name, next_name)``.
+
+    Projects written before ``sample_index`` existed take the slower path in
+    :func:`_fetch_sample_slice_unindexed`, which also stores the index.
+    """
+    pipeline = [
+        {'$match': match},
+        {'$limit': 1},
+        {'$project': {
+            'sample_index': 1,
+            '_indexed': {'$isArray': '$sample_index'},
+            '_pos': {'$indexOfArray': ['$sample_index.s', sample_name]},
+        }},
+        # The entry before the sample (if any), the sample, and the one after.
+        {'$project': {
+            '_indexed': 1,
+            '_pos': 1,
+            '_nav': {'$cond': [
+                {'$gt': ['$_pos', 0]},
+                {'$slice': ['$sample_index', {'$subtract': ['$_pos', 1]}, 3]},
+                {'$slice': ['$sample_index', 0, 2]},
+            ]},
+        }},
+    ]
+    doc = next(iter(collection_handle.aggregate(pipeline)), None)
+    if doc is None:
+        return None, None, None
+    if not doc.get('_indexed'):
+        return _fetch_sample_slice_unindexed(match, sample_name)
+
+    position = doc.get('_pos')
+    if position is None or position < 0:
+        return None, None, None
+
+    nav = doc.get('_nav') or []
+    offset = 1 if position > 0 else 0
+    rows = _fetch_run_rows(doc['_id'], nav[offset]['k'])
+    prev_name = nav[offset - 1].get('s') if offset else None
+    next_name = nav[offset + 1].get('s') if len(nav) > offset + 1 else None
+    return rows, prev_name, next_name
+
+
+def _fetch_sample_slice_unindexed(match, sample_name):
+    """:func:`_fetch_sample_slice` for a project without a ``sample_index``.
 
     Asks the server for just the matching run and a ``{run key -> first
     Sample_name}`` index (a few bytes per sample), instead of transferring the
-    whole ``runs`` dict.  Returns ``(rows, prev_name, next_name)``.
+    whole ``runs`` dict, then stores the sorted index so later views of this
+    project take the indexed path.
     """
     pipeline = [
         {'$match': match},
@@ -350,6 +462,14 @@ def _fetch_sample_slice(match, sample_name):
         ((entry.get('k'), entry.get('s')) for entry in doc.get('_sample_index') or []),
         key=lambda kv: kv[0],
     )
+    try:
+        # Guarded so a concurrent runs update (which writes its own index) wins.
+        collection_handle.update_one(
+            {'_id': doc['_id'], 'sample_index': {'$exists': False}},
+            {'$set': {'sample_index': [{'k': k, 's': name} for k, name in index]}})
+    except PyMongoError as e:
+        logging.warning(f"Could not store sample_index for project {doc['_id']}: {e}")
+
     position = next(
         (i for i, (_, name) in enumerate(index) if name == sample_name), None)
     if position is None:
@@ -457,90 +577,119 @@ def get_one_sample(project_name, sample_name):
     return project, rows, prev_sample, next_sample
 
 
+def get_samples_of_project(project_id, sample_names):
+    """Return ``{sample_name: rows}`` for several samples of one project.
+
+    The batch-download counterpart of ``get_one_sample()``: one ``$filter``
+    aggregation pulls every requested sample's rows, instead of one pipeline
+    per sample.  The caller has already resolved and authorized the project,
+    so *project_id* is its ``_id``.  Names with no matching sample are simply
+    absent from the result.
+    """
+    wanted = list(dict.fromkeys(sample_names))
+    if not wanted:
+        return {}
+    pipeline = [
+        {'$match': {'_id': ObjectId(project_id)}},
+        {'$limit': 1},
+        {'$project': {
+            '_id': 0,
+            '_matched': {'$filter': {
+                'input': {'$objectToArray': '$runs'},
+                'as': 'r',
+                'cond': {'$in': [{'$arrayElemAt': ['$$r.v.Sample_name', 0]},
+                                 wanted]},
+            }},
+        }},
+    ]
+    try:
+        with pymongo.timeout(page_query_timeout()):
+            doc = next(iter(collection_handle.aggregate(pipeline)), None)
+        matched = [entry.get('v') for entry in (doc or {}).get('_matched') or []]
+    except PyMongoError as exc:
+        # Same policy as get_one_sample(): deadlines propagate, anything else
+        # degrades to reading the runs dict once.
+        if getattr(exc, 'timeout', False):
+            raise
+        logging.warning(
+            "get_samples_of_project: server-side lookup failed for %s (%s); "
+            "falling back to reading runs", project_id, exc)
+        doc = collection_handle.find_one({'_id': ObjectId(project_id)}, {'runs': 1})
+        wanted_set = set(wanted)
+        matched = [rows for rows in ((doc or {}).get('runs') or {}).values()
+                   if rows and rows[0].get('Sample_name') in wanted_set]
+
+    samples = {}
+    for rows in matched:
+        if not rows:
+            continue
+        name = rows[0].get('Sample_name')
+        if name not in samples:
+            samples[name] = replace_space_to_underscore(rows)
+    return samples
+
+
+ECDNA_CONTEXT_SUFFIX = 'ecDNA_context_calls.tsv'
+
+
+def parse_ecDNA_context_calls(content, ecDNA_context=None):
+    """
+    Add the calls in one ecDNA_context_calls.tsv to *ecDNA_context*.
+
+    Each non-empty line is a key, whitespace, then the context (which may be
+    empty).  Later files overwrite earlier keys.
+
+    Returns:
+        dict: *ecDNA_context* (a new dict if None was given)
+    """
+    if ecDNA_context is None:
+        ecDNA_context = {}
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    for line in content.strip().split('\n'):
+        parts = line.strip().split(None, 1)  # Split on first whitespace
+        if parts:
+            ecDNA_context[parts[0]] = parts[1].strip() if len(parts) > 1 else ""
+    return ecDNA_context
+
+
+def ecDNA_context_from_directory(root):
+    """Collect ecDNA context from every ecDNA_context_calls.tsv under an extracted project."""
+    ecDNA_context = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(ECDNA_CONTEXT_SUFFIX):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                with open(path, 'rb') as context_file:
+                    parse_ecDNA_context_calls(context_file.read(), ecDNA_context)
+            except Exception as e:
+                logging.error(f"Error processing {path}: {e}")
+    return ecDNA_context
+
+
 def initialize_ecDNA_context(project):
     """
-    Check for and initialize the ecDNA_context dictionary in a project.
+    Make sure *project* has an ecDNA_context dictionary to render with.
 
-    If the ecDNA_context dictionary already exists in the project, return immediately.
-    If it doesn't exist, create a dictionary populated from ecDNA_context_calls.tsv files
-    in the project's tar file and save it to the project in the database.
+    ecDNA context is harvested when a project's files are extracted and
+    stored with its runs; projects that predate that are filled in by the
+    backfill_ecdna_context management command.  A page request never scans
+    the project tarball, so a project still missing the field renders with an
+    empty context until the backfill reaches it.  Nothing is written here.
 
     Args:
         project: The project dictionary from the database
 
     Returns:
-        None - modifies the project in the database if needed
+        None - sets project['ecDNA_context'] in memory if it was missing
     """
-    # Check if ecDNA_context already exists
-    if 'ecDNA_context' in project:
-        logging.debug(f"Project {project.get('project_name', project['_id'])} already has ecDNA_context")
-        return
-
-    # Create ecDNA_context dictionary
-    logging.info(f"Initializing ecDNA_context for project {project.get('project_name', project['_id'])}")
-    ecDNA_context = {}
-
-    # Check if project has a tarfile
-    if 'tarfile' not in project:
-        logging.warning(
-            f"Project {project.get('project_name', project['_id'])} has no tarfile, storing empty ecDNA_context")
-    else:
-        # Get the tar file from GridFS and extract ecDNA_context_calls.tsv files
-        try:
-            tar_id = project['tarfile']
-            tar_gridfs_file = fs_handle.get(ObjectId(tar_id))
-            logging.debug(f"Retrieved tarfile from GridFS for project {project.get('project_name', project['_id'])}")
-
-            # Open tar file and look for ecDNA_context_calls.tsv files
-            with tarfile.open(fileobj=tar_gridfs_file, mode='r:gz') as tar:
-                # Find all members ending with ecDNA_context_calls.tsv
-                context_files = [m for m in tar.getmembers() if m.name.endswith('ecDNA_context_calls.tsv')]
-
-                logging.info(f"Found {len(context_files)} ecDNA_context_calls.tsv file(s) in project tar")
-
-                # Process each file
-                for member in context_files:
-                    try:
-                        # Extract and read the file
-                        file_obj = tar.extractfile(member)
-                        if file_obj:
-                            content = file_obj.read().decode('utf-8')
-                            lines = content.strip().split('\n')
-
-                            logging.debug(f"Processing {member.name} with {len(lines)} line(s)")
-
-                            # Parse each line
-                            for line in lines:
-                                line = line.strip()
-                                if line:  # Skip empty lines
-                                    parts = line.split(None, 1)  # Split on first whitespace
-                                    if len(parts) >= 2:
-                                        key = parts[0]
-                                        value = parts[1].strip()
-                                        ecDNA_context[key] = value
-                                        logging.debug(f"Added ecDNA_context: {key} -> {value}")
-                                    elif len(parts) == 1:
-                                        # Handle case where there's only a key with no value
-                                        key = parts[0]
-                                        ecDNA_context[key] = ""
-                                        logging.debug(f"Added ecDNA_context: {key} -> (empty)")
-                    except Exception as e:
-                        logging.error(f"Error processing {member.name}: {e}")
-
-            logging.info(f"Populated ecDNA_context with {len(ecDNA_context)} entries")
-
-        except Exception as e:
-            logging.error(f"Error reading tarfile for ecDNA_context: {e}")
-            logging.exception("Full traceback:")
-
-    # Update the project in the database
-    query = {'_id': project['_id'], 'delete': False}
-    new_values = {"$set": {'ecDNA_context': ecDNA_context}}
-    collection_handle.update_one(query, new_values)
-
-    # Update the local project object as well
-    project['ecDNA_context'] = ecDNA_context
-    logging.debug(f"ecDNA_context initialized and saved for project {project.get('project_name', project['_id'])}")
+    if 'ecDNA_context' not in project:
+        logging.info(f"Project {project.get('project_name', project['_id'])} has no ecDNA_context yet; "
+                     f"run manage.py backfill_ecdna_context")
+        project['ecDNA_context'] = {}
 
 
 def sample_data_from_feature_list(features_list):
@@ -1170,7 +1319,8 @@ def validate_project(project, project_name):
             break
     if update and runs is not None:
         new_values = {"$set": {
-            'runs': runs
+            'runs': runs,
+            'sample_index': build_sample_index(runs),
         }}
         query = {'_id': project['_id'],
                     'delete': False}
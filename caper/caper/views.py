@@ -4,6 +4,7 @@ import os
 import re
 import sys
 import gc
+import tarfile
 import traceback
 import json
 from collections import defaultdict
@@ -16,6 +17,7 @@ logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
 logging.getLogger("pymongo").setLevel(logging.WARNING)
 
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
 
 from django.http import HttpResponse, StreamingHttpResponse, HttpResponseRedirect, HttpResponseNotFound, Http404, JsonResponse
 from django.shortcuts import render, redirect
@@ -44,6 +46,7 @@ from .views_admin import (
     fix_schema, data_qc, admin_prepare_shutdown, admin_project_files_report, make_project_current,
     admin_audit_log,
     admin_audit_log_validate,
+    admin_project_files_report_status,
 )
 
 # Import API views from separate module
@@ -51,6 +54,9 @@ from .views_apis import (
     FileUploadView, ProjectFileAddView, BackgroundTaskStatusView,
     ProjectListView, ProjectDetailView, ProjectSamplesView,
     ProjectDownloadView, ProjectBatchDownloadView, ApiTokenView,
+    JobStatusView, JobDownloadView, _PROJECT_METADATA_PROJECTION,
+    UploadSessionCreateView, UploadSessionStatusView, UploadSessionPartView,
+    UploadSessionCompleteView,
 )
 
 # from django.views.generic import TemplateView
@@ -65,8 +71,10 @@ from .forms import RunForm, UpdateForm, UserPreferencesForm
 from .utils import (
     collection_handle, collection_handle_primary, fs_handle, audit_log_handle,
     get_one_project, get_one_sample, get_one_deleted_project,
-    prepare_project_linkid, check_if_db_field_exists,
-    get_date, get_date_short, previous_versions, form_to_dict,
+    get_one_project_sans_runs, get_samples_of_project, get_s3_client,
+    build_sample_index, ecDNA_context_from_directory, initialize_ecDNA_context,
+    prepare_project_linkid,
+    get_date, previous_versions, form_to_dict,
     replace_space_to_underscore, sample_data_from_feature_list,
     get_all_alias, get_projects_close_cursor, create_user_list,
     preprocess_sample_data, validate_project, replace_underscore_keys,
@@ -74,6 +82,9 @@ from .utils import (
     AC_VERSION_OUTDATED, AC_VERSION_UNIDENTIFIED
 )
 from .tar_safety import safe_extract_member, safe_extractall
+from .tar_utils import read_project_tar_member, store_project_tarball
+from .zip_stream import ZipMember, gridfs_source, iter_zip_stream
+from . import download_jobs, gridfs_refs, job_queue, page_cache, project_counters, sample_append
 from .project_version_cleanup import (
     build_deleted_version_tombstone,
     delete_gridfs_payload_for_project,
@@ -99,7 +110,7 @@ from django.core.files.uploadedfile import TemporaryUploadedFile
 
 from wsgiref.util import FileWrapper
 import requests
-import boto3, botocore, fnmatch, uuid, datetime, time
+import botocore, fnmatch, uuid, datetime, time
 import dateutil.parser
 
 ## Message framework
@@ -296,7 +307,8 @@ def index(request):
         'sample_data': 0,
         'aggregate_df': 0,
         'previous_versions': 0,
-        'tarfile': 0
+        'tarfile': 0,
+        'tarfile_index': 0
     }
 
     # Get public projects (including featured) in one query
@@ -354,6 +366,54 @@ def index(request):
     })
 
 
+# Fields of the profile page's project table.  runs is never read: sample_count
+# and sample_metadata_available are stored whenever runs is written.
+_PROFILE_PROJECT_FIELDS = {
+    'project_name': 1, 'description': 1, 'date': 1, 'private': 1,
+    'project_members': 1, 'Reconstruction_tools': 1,
+    'sample_count': 1, 'sample_metadata_available': 1,
+}
+
+
+def fill_project_summaries(projects):
+    """
+    Fill in sample_count and sample_metadata_available on projects stored without them.
+
+    Both are computed inside MongoDB for just the projects missing one, in a
+    single aggregation, and written back so the next listing finds them.
+    """
+    missing = [p['_id'] for p in projects
+               if 'sample_count' not in p or 'sample_metadata_available' not in p]
+    if not missing:
+        return projects
+
+    pipeline = [
+        {'$match': {'_id': {'$in': missing}}},
+        {'$project': {
+            'sample_count': {'$size': {'$objectToArray': {'$ifNull': ['$runs', {}]}}},
+            'sample_metadata_available': SAMPLE_METADATA_AVAILABLE_EXPR,
+        }},
+    ]
+    summaries = {doc.pop('_id'): doc for doc in collection_handle.aggregate(pipeline)}
+    updates = []
+    for proj in projects:
+        summary = summaries.get(proj['_id'])
+        if summary is None:
+            continue
+        for field, value in summary.items():
+            if field not in proj:
+                proj[field] = value
+                # Guarded so a concurrent runs update, which writes its own value, wins.
+                updates.append(UpdateOne({'_id': proj['_id'], field: {'$exists': False}},
+                                         {'$set': {field: value}}))
+    if updates:
+        try:
+            collection_handle.bulk_write(updates, ordered=False)
+        except Exception as e:
+            logging.warning(f"Could not store project summaries: {e}")
+    return projects
+
+
 def profile(request, message_to_user=None):
 
     username = request.user.username
@@ -371,14 +431,13 @@ def profile(request, message_to_user=None):
     # prevent an absent/null email from matching on anything
     if not useremail:
         useremail = username
-    projects = list(collection_handle.find({"$or": [{"project_members": username}, {"project_members": useremail}] , 'delete': False, 'current': True}))
+    projects = list(collection_handle.find({"$or": [{"project_members": username}, {"project_members": useremail}] , 'delete': False, 'current': True},
+                                           _PROFILE_PROJECT_FIELDS))
     # projects = get_projects_close_cursor({"$or": [{"project_members": username}, {"project_members": useremail}] , 'delete': False})
+    fill_project_summaries(projects)
 
     for proj in projects:
         prepare_project_linkid(proj)
-        test = get_extra_metadata_from_project(proj)
-        proj['sample_metadata_available'] = has_sample_metadata(proj)
-        proj['sample_count'] = len(proj.get('runs', {}))
         # Format visibility for display
         proj['visibility_display'] = format_visibility_for_display(proj.get('private', True))
 
@@ -756,7 +815,6 @@ def project_page(request, project_name, message=''):
     needs_metadata = (
             'metadata_stored' not in project or
             'sample_data' not in project or
-            'ecDNA_context' not in project or
             any('Classifications_counted' not in item for item in project.get('sample_data', []))
     )
     logging.info(f'project needs metadata generation: {needs_metadata}')
@@ -771,7 +829,7 @@ def project_page(request, project_name, message=''):
         pc_fig = None
     # For regular projects missing one or more keys
     elif needs_metadata:
-        # Initialize ecDNA_context for this project
+        # ecDNA_context is stored at ingest (or by the backfill); never scan the tar here
         initialize_ecDNA_context(project)
         
         samples = project['runs'].copy()
@@ -882,63 +940,97 @@ def project_page(request, project_name, message=''):
 
 
 
-def upload_file_to_s3(file_path_and_location_local, file_path_and_name_in_bucket,
-                      on_upload_complete=None):
+# A worker holding the S3 sync lease for longer than this is presumed dead.
+_S3_SYNC_LEASE_SECONDS = 15 * 60
+# How long a download waits for another worker's upload before streaming the
+# tarball from GridFS itself.
+_S3_SYNC_WAIT_SECONDS = 30
+
+
+def project_s3_key(project_linkid):
+    """Key of a project's tarball in the downloads bucket."""
+    return f'{settings.S3_DOWNLOADS_BUCKET_PATH}{project_linkid}/{project_linkid}.tar.gz'
+
+
+def sync_project_tarball_to_s3(project_id, on_upload_complete=None, wait=False):
     """
-    Upload a local file to S3.
+    Copy a project's stored tarball from GridFS to S3 once, and mark the
+    project document ``s3_synced``.
+
+    Runs at project finalization; project_download falls back to it for
+    projects created before the marker existed.  Concurrent callers coalesce
+    on an ``s3_sync_lock`` lease on the project document, so only one of them
+    checks and uploads while the others wait for (``wait=True``) or skip the
+    result.
 
     Args:
-        file_path_and_location_local:  Local path of the file to upload.
-        file_path_and_name_in_bucket:  Key suffix within the bucket (bucket_path is prepended).
-        on_upload_complete:            Optional callable invoked as
-                                       on_upload_complete(s3_uri, file_size_bytes) after a
-                                       successful upload.  Errors in the callback are logged
-                                       but do not propagate.
-    """
-    import os
-    import threading
-
-    session = boto3.Session(profile_name=settings.AWS_PROFILE_NAME)
-    s3client = session.client('s3')
-
-    file_size = os.path.getsize(file_path_and_location_local)
-    full_s3_key = f'{settings.S3_DOWNLOADS_BUCKET_PATH}{file_path_and_name_in_bucket}'
-    s3_uri = f's3://{settings.S3_DOWNLOADS_BUCKET}/{full_s3_key}'
-    logging.info(f'==== XXX STARTING upload of {file_path_and_location_local} to '
-                 f'{s3_uri} (size: {file_size} bytes)')
-
-    transferred = {'bytes': 0}
-    last_log = {'time': 0.0}
-    lock = threading.Lock()
-
-    def progress_callback(bytes_transferred):
-        import time
-        with lock:
-            transferred['bytes'] += bytes_transferred
-            now = time.monotonic()
-            if now - last_log['time'] >= 30:
-                last_log['time'] = now
-                pct = (transferred['bytes'] / file_size * 100) if file_size else 0
-                logging.info(
-                    f'[S3 UPLOAD] {file_path_and_name_in_bucket}: '
-                    f'{transferred["bytes"]}/{file_size} bytes ({pct:.1f}%)'
-                )
+        project_id: _id of the project
+        on_upload_complete: Optional callable invoked as
+                            on_upload_complete(s3_uri, file_size_bytes) after a
+                            successful upload
+        wait: if another caller holds the lease, poll for up to
+              _S3_SYNC_WAIT_SECONDS for it to finish
 
-    s3client.upload_file(
-        f'{file_path_and_location_local}',
-        settings.S3_DOWNLOADS_BUCKET,
-        full_s3_key,
-        Callback=progress_callback
+    Returns:
+        bool: True if the tarball is in S3
+    """
+    pid = ObjectId(str(project_id))
+    now = datetime.datetime.utcnow()
+    stale = now - datetime.timedelta(seconds=_S3_SYNC_LEASE_SECONDS)
+    leased = collection_handle_primary.find_one_and_update(
+        {'_id': pid, 's3_synced': {'$ne': True},
+         '$or': [{'s3_sync_lock': {'$exists': False}}, {'s3_sync_lock': {'$lt': stale}}]},
+        {'$set': {'s3_sync_lock': now}},
+        projection={'tarfile': 1},
     )
-    logging.info('==== XXX uploaded to bucket')
+    if leased is None:
+        deadline = time.monotonic() + (_S3_SYNC_WAIT_SECONDS if wait else 0)
+        while True:
+            doc = collection_handle_primary.find_one({'_id': pid}, {'s3_synced': 1, 's3_sync_lock': 1})
+            if doc is None:
+                return False
+            if doc.get('s3_synced'):
+                return True
+            if 's3_sync_lock' not in doc or time.monotonic() >= deadline:
+                return False
+            time.sleep(1)
+
+    tar_id = leased.get('tarfile')
+    if not tar_id:
+        # Project has no samples yet (empty project) – nothing to upload
+        collection_handle_primary.update_one({'_id': pid}, {'$unset': {'s3_sync_lock': ''}})
+        return False
+
+    s3_key = project_s3_key(pid)
+    s3_uri = f's3://{settings.S3_DOWNLOADS_BUCKET}/{s3_key}'
+    try:
+        s3client = get_s3_client()
+        try:
+            head = s3client.head_object(Bucket=settings.S3_DOWNLOADS_BUCKET, Key=s3_key)
+            file_size = head.get('ContentLength')
+            logging.info(f'==== XXX {s3_uri} already in bucket, marking project synced')
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            grid_out = fs_handle.get(ObjectId(str(tar_id)))
+            file_size = grid_out.length
+            logging.info(f'==== XXX STARTING upload of project {pid} tarball to {s3_uri} '
+                         f'(size: {file_size} bytes)')
+            s3client.upload_fileobj(grid_out, settings.S3_DOWNLOADS_BUCKET, s3_key)
+            logging.info('==== XXX uploaded to bucket')
+        collection_handle_primary.update_one(
+            {'_id': pid},
+            {'$set': {'s3_synced': True}, '$unset': {'s3_sync_lock': ''}})
+    except Exception:
+        collection_handle_primary.update_one({'_id': pid}, {'$unset': {'s3_sync_lock': ''}})
+        raise
 
     if on_upload_complete is not None:
         try:
             on_upload_complete(s3_uri, file_size)
         except Exception as cb_exc:
             logging.error(f'on_upload_complete callback failed for {s3_uri}: {cb_exc}')
-
-
+    return True
 
 
 def find_one(pattern, path):
@@ -951,7 +1043,8 @@ def find_one(pattern, path):
 
 
 def project_download(request, project_name):
-    project = get_one_project(project_name)
+    # Metadata only: the tarball id and download counters are all this reads.
+    project = get_one_project_sans_runs(project_name, _PROJECT_METADATA_PROJECTION)
     if project is None:
         raise Http404(f"Project {project_name!r} not found")
     update_project_download_count(project, project_name)
@@ -975,59 +1068,30 @@ def project_download(request, project_name):
             messages.error(request, message)
             return redirect(request.META['HTTP_REFERER'])
 
-        s3_file_location = f'{settings.S3_DOWNLOADS_BUCKET_PATH}{project_linkid}/{project_linkid}.tar.gz'
-        logging.info(f'==== XXX STARTING download for {s3_file_location} for project {real_project_name}')
-
-        if not settings.AWS_PROFILE_NAME:
-            settings.AWS_PROFILE_NAME = 'default'
-
-        session = boto3.Session(profile_name=settings.AWS_PROFILE_NAME)
-        s3client = session.client('s3')
-
-        logging.info("BUCKET "+ settings.S3_DOWNLOADS_BUCKET)
-        logging.info("FILELOC " + s3_file_location)
-        logging.info("PROFILE " + settings.AWS_PROFILE_NAME)
+        tar_id = project.get('tarfile')
+        if not tar_id:
+            # Project has no samples yet (empty project) – nothing to download
+            logging.info(f"==== XXX project {project_name} has no tarfile yet (empty project), returning 404")
+            return HttpResponseNotFound('Project has no samples yet.')
 
-        try:
-            s3client.head_object(Bucket=settings.S3_DOWNLOADS_BUCKET, Key=s3_file_location)
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                # The object does not exist.
-                # so we need to get a local file from mongo and push that to S3
-                logging.debug("===== XXX PROJECT FILE NOT IN S3 --  GET IT IN THERE")
-                tar_id = project.get('tarfile')
-                if not tar_id:
-                    # Project has no samples yet (empty project) – nothing to download
-                    logging.info(f"==== XXX project {project_name} has no tarfile yet (empty project), returning 404")
-                    return HttpResponseNotFound('Project has no samples yet.')
-                tar_file_wrapper = FileWrapper(fs_handle.get(ObjectId(tar_id)), blksize=32728)
-
-                isExist = os.path.exists(f'{project_data_path}')
-                if not isExist:
-                    # Create a new directory because it does not exist
-                    os.makedirs(f'{project_data_path}')
-
-                output = open(f'{project_data_path}/{project_linkid}.tar.gz', "wb")
-                for chunk in tar_file_wrapper:
-                    output.write(chunk)
-                output.close()
-                # recreate the path without the {settings.S3_DOWNLOADS_BUCKET} which the upload_file_to_s3 adds as well
-                s3_file_location_bucketless = f'{project_linkid}/{project_linkid}.tar.gz'
-                upload_file_to_s3(f'{project_data_path}/{project_linkid}.tar.gz', s3_file_location_bucketless)
-                logging.info('==== XXX upload to bucket complete, move on to get one time url')
+        s3_file_location = project_s3_key(project_linkid)
+        logging.info(f'==== XXX STARTING download for {s3_file_location} for project {real_project_name}')
 
-            else:
-                # Something else has gone wrong.
-                raise
-        else:
-            # The object does exist.
-            logging.debug('==== XXX found it in bucket, move on to get one time url')
+        # Projects are uploaded at finalization and marked s3_synced, so the
+        # usual click costs no S3 round-trip at all: presigning is local.
+        if not project.get('s3_synced') and not sync_project_tarball_to_s3(project_linkid, wait=True):
+            # Another worker is still uploading it; don't hold this one up.
+            logging.info(f'==== XXX {s3_file_location} not in bucket yet, streaming from GridFS')
+            response = StreamingHttpResponse(
+                FileWrapper(fs_handle.get(ObjectId(tar_id)), blksize=32768))
+            response['Content-Type'] = 'application/tar+gzip'
+            response['Content-Disposition'] = f'attachment; filename={project_linkid}.tar.gz'
+            return response
 
-        # we should have uploaded the file if it was not already there
         # get a one-time-use url and redirect the response
         expiration=600
         # good for seconds, can move this to settings later
-        presigned_url = s3client.generate_presigned_url('get_object', Params = {'Bucket': settings.S3_DOWNLOADS_BUCKET, 'Key': s3_file_location}, ExpiresIn = expiration)
+        presigned_url = get_s3_client().generate_presigned_url('get_object', Params = {'Bucket': settings.S3_DOWNLOADS_BUCKET, 'Key': s3_file_location}, ExpiresIn = expiration)
         return HttpResponseRedirect(presigned_url)
 
     ###### the following is used when S3 is not used for download
@@ -1109,17 +1173,28 @@ def project_summary_download(request, project_name):
             # Ensure the directory exists
             os.makedirs(f'tmp/{project_id}/results', exist_ok=True)
             
-            # First, try to get it from GridFS
-            if 'tarfile' in project and project['tarfile']:
+            # First, try the member index: one seek into the GridFS tarball
+            # instead of decompressing everything in front of run.json.
+            if project.get('tarfile_index'):
+                try:
+                    run_json_bytes = read_project_tar_member(project, 'results/run.json')
+                    with open(run_json_path, 'wb') as run_json_out:
+                        run_json_out.write(run_json_bytes)
+                    logging.info(f"Read run.json from GridFS tarfile via member index")
+                except Exception as e:
+                    logging.warning(f"Member index lookup of run.json failed, scanning tarfile instead: {e}")
+
+            # Otherwise stream the GridFS tarball to disk and look for it
+            if not os.path.exists(run_json_path) and 'tarfile' in project and project['tarfile']:
                 try:
                     logging.info(f"Attempting to extract run.json from GridFS tarfile")
                     tar_id = project['tarfile']
                     
-                    # Create a temporary file to write the tar data
+                    # Create a temporary file to write the tar data, in chunks
+                    # rather than holding the whole tarball in memory
                     with tempfile.NamedTemporaryFile(delete=False, suffix='.tar.gz') as temp_tar:
                         temp_tar_path = temp_tar.name
-                        tar_file_data = fs_handle.get(ObjectId(tar_id)).read()
-                        temp_tar.write(tar_file_data)
+                        shutil.copyfileobj(fs_handle.get(ObjectId(tar_id)), temp_tar, 1024 * 1024)
                     
                     # Extract run.json from the tar file
                     with tarfile.open(temp_tar_path, 'r:gz') as tar:
@@ -1167,11 +1242,7 @@ def project_summary_download(request, project_name):
                     project_linkid = project.get('linkid', str(project['_id']))
                     s3_file_location = f'{settings.S3_DOWNLOADS_BUCKET_PATH}{project_linkid}/{project_linkid}.tar.gz'
                     
-                    if not settings.AWS_PROFILE_NAME:
-                        settings.AWS_PROFILE_NAME = 'default'
-                    
-                    session = boto3.Session(profile_name=settings.AWS_PROFILE_NAME)
-                    s3client = session.client('s3')
+                    s3client = get_s3_client()
                     
                     # Check if file exists in S3
                     s3client.head_object(Bucket=settings.S3_DOWNLOADS_BUCKET, Key=s3_file_location)
@@ -1391,23 +1462,9 @@ def project_metadata_download(request, project_name):
 
 
 def update_project_download_count(project, project_name):
-    if check_if_db_field_exists(project, 'project_downloads'):
-        project_download_data = project['project_downloads']
-        if isinstance(project_download_data, int):
-            temp_data = project_download_data
-            project_download_data = dict()
-            project_download_data[get_date_short()] = temp_data
-        elif get_date_short() in project_download_data:
-            project_download_data[get_date_short()] += 1
-        else:
-            project_download_data[get_date_short()] = 1
-    else:
-        project_download_data = dict()
-        project_download_data[get_date_short()] = 1
-    query = {'_id': ObjectId(project_name)}
-    new_val = {"$set": {'project_downloads': project_download_data}}
-    collection_handle.update_one(query, new_val)
-    collection_handle.update_one(query, {'$inc': {'downloads': 1}})
+    """Count one download of the whole project (see project_counters)."""
+    project_counters.increment(project['_id'], 'project_downloads')
+    project_counters.increment(project['_id'], 'downloads')
 
 
 def convert_runs_to_csv(runs):
@@ -1559,8 +1616,31 @@ def add_metadata(request, project_id):
     return render(request, 'pages/add_metadata.html', {'project_id': project_id})
 
 
-# @cache_page(600) # 10 minutes
 def sample_page(request, project_name, sample_name):
+    """
+    Render one sample's page, served from the page cache when possible.
+
+    Repeat hits (overwhelmingly crawlers) are answered from page_cache,
+    including a 304 for a matching If-None-Match, without touching MongoDB.
+    """
+    filter_plots = not request.GET.get('display_all_chr')
+    # A pending flash message is rendered into the page, so such a response
+    # is neither served from nor stored in the cache.
+    if len(messages.get_messages(request)):
+        return _render_sample_page(request, project_name, sample_name, filter_plots)[0]
+
+    key = page_cache.sample_page_key(request, project_name, sample_name, filter_plots)
+    cached = page_cache.get_cached_page(request, key)
+    if cached is not None:
+        return cached
+    response, project_id = _render_sample_page(request, project_name, sample_name, filter_plots)
+    if project_id is None:
+        return response
+    return page_cache.store_page(request, key, project_id, response)
+
+
+def _render_sample_page(request, project_name, sample_name, filter_plots):
+    """Build the sample page; returns (response, project _id or None if not cacheable)."""
     import time
     t_total_start = time.time()
     
@@ -1577,7 +1657,7 @@ def sample_page(request, project_name, sample_name):
         # For private and hidden_public projects, members can view
         # For private, non-members must login
         if not is_project_hidden_public(visibility):
-            return redirect('/accounts/login')
+            return redirect('/accounts/login'), None
     
     # Extract sample names from prev_sample and next_sample
     prev_sample_name = None
@@ -1594,7 +1674,6 @@ def sample_page(request, project_name, sample_name):
     sample_metadata = get_sample_metadata(sample_data)
     reference_genome = reference_genome_from_sample(sample_data)
     sample_data_processed = preprocess_sample_data(replace_space_to_underscore(sample_data))
-    filter_plots = not request.GET.get('display_all_chr')
     all_locuses = []
     igv_tracks = []
     download_png = []
@@ -1644,25 +1723,26 @@ def sample_page(request, project_name, sample_name):
     total_time = time.time() - t_total_start
     logging.info(f"[PERF] Total sample_page processing for {sample_name}: {total_time:.3f}s")
 
-    return render(request, "pages/sample.html",
-                  {'project': project,
-                   'project_name': project_name,
-                   'project_linkid': project_linkid,
-                   'sample_data': sample_data_for_table,
-                   'sample_metadata': dict(sample_metadata),
-                   'reference_genome': reference_genome,
-                   'sample_name': sample_name,
-                   'prev_sample': prev_sample_name,
-                   'next_sample': next_sample_name,
-                   'graph': plot,
-                   'igv_tracks': json.dumps(igv_tracks),
-                   'locuses': json.dumps(all_locuses),
-                   'download_links': json.dumps(download_png),
-                   'reference_versions': json.dumps(reference_version),
-                   'ec3d_available': ec3d_available,  # New context variable
-                   'ecDNA_context': ecDNA_context,  # Add ecDNA_context dictionary
+    response = render(request, "pages/sample.html",
+                     {'project': project,
+                      'project_name': project_name,
+                      'project_linkid': project_linkid,
+                      'sample_data': sample_data_for_table,
+                      'sample_metadata': dict(sample_metadata),
+                      'reference_genome': reference_genome,
+                      'sample_name': sample_name,
+                      'prev_sample': prev_sample_name,
+                      'next_sample': next_sample_name,
+                      'graph': plot,
+                      'igv_tracks': json.dumps(igv_tracks),
+                      'locuses': json.dumps(all_locuses),
+                      'download_links': json.dumps(download_png),
+                      'reference_versions': json.dumps(reference_version),
+                      'ec3d_available': ec3d_available,  # New context variable
+                      'ecDNA_context': ecDNA_context,  # Add ecDNA_context dictionary
         }
     )
+    return response, project_linkid
 
 # Custom JSON encoder to handle any remaining ObjectId
 class JSONEncoder(json.JSONEncoder):
@@ -1672,114 +1752,112 @@ class JSONEncoder(json.JSONEncoder):
         return super().default(o)
 
 
-def create_zip_response(zip_source_dir, filename):
+def create_zip_response(members, filename):
     """
-    Create a zip file from a directory and return it as an HTTP response.
-    Cleans up both the zip file and the source directory.
+    Stream a zip of *members* as an HTTP response.
 
     Args:
-        zip_source_dir: Directory to zip
+        members: list of ZipMember describing the archive (see zip_stream)
         filename: Name of the zip file (without .zip extension)
 
     Returns:
-        HttpResponse with the zip file
+        StreamingHttpResponse producing the archive as it is built
     """
-    logging.debug("Creating sample download zip file from directory " + zip_source_dir)
-    zip_path = f"{filename}.zip"
+    logging.debug(f"Streaming sample download zip {filename}.zip with {len(members)} members")
+    response = StreamingHttpResponse(iter_zip_stream(members))
+    response['Content-Type'] = 'application/x-zip-compressed'
+    response['Content-Disposition'] = f'attachment; filename={filename}.zip'
+    return response
 
-    try:
-        # Create the zip archive
-        shutil.make_archive(filename, 'zip', zip_source_dir)
 
-        # Create the response
-        with open(zip_path, 'rb') as zip_file:
-            response = HttpResponse(zip_file)
-            response['Content-Type'] = 'application/x-zip-compressed'
-            response['Content-Disposition'] = f'attachment; filename={filename}.zip'
+def record_sample_download(project, count=1):
+    """
+    Count *count* sample downloads against *project* for today.
 
-        return response
+    Goes through project_counters, so a batch download of many samples from
+    one project is one counter increment and the project document is not
+    written at all.
+    """
+    project_counters.increment(project['_id'], 'sample_downloads', count)
 
-    finally:
-        # Clean up both the zip file and the source directory
-        if os.path.exists(zip_path):
-            os.remove(zip_path)
 
-        # Clean up the source directory
-        if os.path.exists(zip_source_dir):
-            try:
-                shutil.rmtree(zip_source_dir)
-                logging.debug(f"Cleaned up temporary directory: {zip_source_dir}")
-            except Exception as e:
-                logging.error(f"Failed to clean up directory {zip_source_dir}: {e}")
+def _sample_result_tsv(updated_data):
+    """Render the per-sample result table written alongside the sample files."""
+    # Define the column order for the first four columns
+    ordered_columns = ['Sample_name', 'AA_amplicon_number', 'Feature_ID', 'Classification']
+
+    # Get all column names from the data
+    all_columns = set()
+    for feature in updated_data:
+        all_columns.update(feature.keys())
+
+    # Sort remaining columns alphabetically
+    remaining_columns = sorted(list(all_columns - set(ordered_columns)))
 
+    # Final column order
+    columns = ordered_columns + remaining_columns
+
+    lines = ['\t'.join(columns)]
+    for feature in updated_data:
+        row = []
+        for col in columns:
+            val = feature.get(col, '')
+            # Convert ObjectId to string if needed
+            if isinstance(val, ObjectId):
+                val = str(val)
+            row.append(str(val))
+        lines.append('\t'.join(row))
+    return '\n'.join(lines) + '\n'
 
-def process_sample_data(project, sample_name, sample_data, output_dir=None):
+
+def sample_zip_members(project, sample_name, sample_data, prefix=''):
     """
-    Process sample data and save it to the specified directory or a temporary directory.
+    Describe one sample's download as zip members, without reading any blobs.
+
+    GridFS files are attached as lazy sources and only fetched while the zip
+    is streamed (see zip_stream.iter_zip_stream).
 
     Args:
         project: The project containing the sample
         sample_name: Name of the sample
         sample_data: Sample data to process
-        output_dir: Directory to save processed data (or None for a temp directory)
+        prefix: Path inside the zip to place the sample's files under
+                ('' for a single-sample download)
 
     Returns:
-        tuple: (sample_data_path, updated_data) where
-            sample_data_path is the directory containing the processed sample data
-            updated_data is the processed feature data
-    """
-    # Track downloads
-    if check_if_db_field_exists(project, 'sample_downloads'):
-        sample_download_data = project['sample_downloads']
-        if isinstance(sample_download_data, int):
-            temp_data = sample_download_data
-            sample_download_data = dict()
-            sample_download_data[get_date_short()] = temp_data
-        elif get_date_short() in sample_download_data:
-            sample_download_data[get_date_short()] += 1
-        else:
-            sample_download_data[get_date_short()] = 1
-    else:
-        sample_download_data = dict()
-        sample_download_data[get_date_short()] = 1
-
-    query = {'_id': ObjectId(project['_id'])}
-    new_val = {"$set": {'sample_downloads': sample_download_data}}
-    collection_handle.update_one(query, new_val)
-
-    # Create directory for files
-    if output_dir is None:
-        # For single sample download, use default path
-        sample_data_path = f"tmp/{project['_id']}/{sample_name}"
-    else:
-        # For batch download, use provided path
-        sample_data_path = output_dir
+        tuple: (members, updated_data) where
+            members is the list of ZipMember for this sample
+            updated_data is the processed feature data, with file ids replaced
+            by their paths inside the zip
 
-    os.makedirs(sample_data_path, exist_ok=True)
-
-    # Create new specialized directories
-    bed_files_dir = f"{sample_data_path}/{sample_name}_classification_bed_files"
-    sashimi_plots_dir = f"{sample_data_path}/{sample_name}_sashimi_plots"
+    Downloads are not counted here; callers do that with
+    record_sample_download() once the samples are resolved.
+    """
+    bed_files_dir = f"{sample_name}_classification_bed_files"
+    sashimi_plots_dir = f"{sample_name}_sashimi_plots"
+    members = []
+    seen = set()
+
+    def _add(path, source):
+        arcname = f"{prefix}{path}"
+        if arcname in seen:
+            return
+        seen.add(arcname)
+        members.append(ZipMember(arcname, source))
 
-    os.makedirs(bed_files_dir, exist_ok=True)
-    os.makedirs(sashimi_plots_dir, exist_ok=True)
+    if prefix:
+        _add('', None)
+    _add(f"{bed_files_dir}/", None)
+    _add(f"{sashimi_plots_dir}/", None)
 
-    # Get and save sample metadata
-    try:
-        sample_metadata = get_sample_metadata(sample_data)
-        with open(f'{sample_data_path}/{sample_name}_sample_metadata.json', 'w') as metadata_file:
-            json.dump(sample_metadata, metadata_file, indent=2)
-        metadata_file_path = f"{sample_name}_sample_metadata.json"
-    except Exception as e:
-        logging.exception(e)
-        metadata_file_path = "Not Provided"
+    # Sample metadata
+    metadata_file_path = f"{sample_name}_sample_metadata.json"
+    _add(metadata_file_path, lambda: json.dumps(get_sample_metadata(sample_data), indent=2))
 
     # Process sample data
     sample_data_processed = preprocess_sample_data(replace_space_to_underscore(sample_data))
     updated_data = []
-    cnv_file_processed = False
 
-    # Process feature files (existing logic from sample_download)
     for feature in sample_data_processed:
         # Create a copy of the feature to update paths
         updated_feature = feature.copy()
@@ -1788,42 +1866,37 @@ def process_sample_data(project, sample_name, sample_data, output_dir=None):
         if 'Sample_metadata_JSON' in updated_feature:
             updated_feature['Sample_metadata_JSON'] = metadata_file_path
 
-        # Set up file system
         feature_id = feature['Feature_ID']
         amplicon_number = feature['AA_amplicon_number']
 
         # Updates paths to use the new directory structure
-        bed_file_path = f"{sample_name}_classification_bed_files/{feature_id}.bed"
-        pdf_file_path = f"{sample_name}_sashimi_plots/{sample_name}_amplicon{amplicon_number}.pdf"
-        png_file_path = f"{sample_name}_sashimi_plots/{sample_name}_amplicon{amplicon_number}.png"
+        bed_file_path = f"{bed_files_dir}/{feature_id}.bed"
+        pdf_file_path = f"{sashimi_plots_dir}/{sample_name}_amplicon{amplicon_number}.pdf"
+        png_file_path = f"{sashimi_plots_dir}/{sample_name}_amplicon{amplicon_number}.png"
         cnv_file_path = f"{sample_name}_CNV_CALLS.bed"
 
         # Get object ids
         if feature['Feature_BED_file'] != 'Not Provided':
             bed_id = feature['Feature_BED_file']
-            # Update the path in the feature copy
             updated_feature['Feature_BED_file'] = bed_file_path
         else:
             bed_id = False
 
-        # CNV file is at the sample level
+        # CNV file is at the sample level; all features reference the same one
         if feature.get('CNV_BED_file', 'Not Provided') != 'Not Provided':
             cnv_id = feature['CNV_BED_file']
-            # All features reference the same CNV file at the sample level
             updated_feature['CNV_BED_file'] = cnv_file_path
         else:
             cnv_id = False
 
         if feature.get('AA_PDF_file', 'Not Provided') != 'Not Provided':
             pdf_id = feature['AA_PDF_file']
-            # Update the path to use amplicon number in the filename
             updated_feature['AA_PDF_file'] = pdf_file_path
         else:
             pdf_id = False
 
         if feature.get('AA_PNG_file', 'Not Provided') != 'Not Provided':
             png_id = feature['AA_PNG_file']
-            # Update the path to use amplicon number in the filename
             updated_feature['AA_PNG_file'] = png_file_path
         else:
             png_id = False
@@ -1848,11 +1921,11 @@ def process_sample_data(project, sample_name, sample_data, output_dir=None):
             'Graph_PNG_file': png_file_path,
             'Graph_PDF_file': pdf_file_path,
             'Cycles_PNG_file': (
-                f"{sample_name}_sashimi_plots/"
+                f"{sashimi_plots_dir}/"
                 f"{sample_name}_amplicon{amplicon_number}_cycles.png"
             ),
             'Cycles_PDF_file': (
-                f"{sample_name}_sashimi_plots/"
+                f"{sashimi_plots_dir}/"
                 f"{sample_name}_amplicon{amplicon_number}_cycles.pdf"
             ),
             'Graph_file': f"{sample_name}_amplicon{amplicon_number}_graph.txt",
@@ -1871,86 +1944,38 @@ def process_sample_data(project, sample_name, sample_data, output_dir=None):
         # Add the updated feature to our list
         updated_data.append(updated_feature)
 
-        # Get files from gridfs
-        if bed_id is not None and bed_id:
+        # Attach files from gridfs
+        if bed_id:
             if not ObjectId.is_valid(bed_id):
                 logging.debug(
                     "Sample: " + sample_name + ", Feature: " + feature_id + ", BED_ID is ->" + str(bed_id) + " <-")
                 break
+            _add(bed_file_path, gridfs_source(fs_handle, bed_id))
 
-            bed_file = fs_handle.get(ObjectId(bed_id)).read()
-            with open(f'{bed_files_dir}/{feature_id}.bed', "wb+") as bed_file_tmp:
-                bed_file_tmp.write(bed_file)
-
-        # Only process the CNV file once for the whole sample
-        if cnv_id and not cnv_file_processed:
-            cnv_file = fs_handle.get(ObjectId(cnv_id)).read()
-            with open(f'{sample_data_path}/{sample_name}_CNV_CALLS.bed', "wb+") as cnv_file_tmp:
-                cnv_file_tmp.write(cnv_file)
-            cnv_file_processed = True
+        # Only the first CNV file is kept for the whole sample
+        if cnv_id:
+            _add(cnv_file_path, gridfs_source(fs_handle, cnv_id))
 
         if pdf_id:
-            pdf_file = fs_handle.get(ObjectId(pdf_id)).read()
-            # Save the PDF in the sashimi plots directory
-            with open(f'{sashimi_plots_dir}/{sample_name}_amplicon{amplicon_number}.pdf', "wb+") as pdf_file_tmp:
-                pdf_file_tmp.write(pdf_file)
+            _add(pdf_file_path, gridfs_source(fs_handle, pdf_id))
 
         if png_id:
-            png_file = fs_handle.get(ObjectId(png_id)).read()
-            # Save the PNG in the sashimi plots directory
-            with open(f'{sashimi_plots_dir}/{sample_name}_amplicon{amplicon_number}.png', "wb+") as png_file_tmp:
-                png_file_tmp.write(png_file)
+            _add(png_file_path, gridfs_source(fs_handle, png_id))
 
         if aa_directory_id:
-            if not os.path.exists(f'{sample_data_path}/{aa_archive_name}'):
-                aa_directory_file = fs_handle.get(ObjectId(aa_directory_id)).read()
-                with open(f'{sample_data_path}/{aa_archive_name}', "wb+") as aa_directory_tmp:
-                    aa_directory_tmp.write(aa_directory_file)
+            _add(aa_archive_name, gridfs_source(fs_handle, aa_directory_id))
 
-        # Graph PNG/PDF were already written through their AA compatibility
+        # Graph PNG/PDF were already attached through their AA compatibility
         # aliases. Export the remaining Aggregator 7 artifacts directly.
         for field in ('Cycles_PNG_file', 'Cycles_PDF_file', 'Graph_file', 'Cycles_file'):
             file_id = new_artifact_ids.get(field)
-            if not file_id:
-                continue
-            export_path = new_artifact_paths[field]
-            full_export_path = os.path.join(sample_data_path, export_path)
-            os.makedirs(os.path.dirname(full_export_path), exist_ok=True)
-            file_data = fs_handle.get(ObjectId(file_id)).read()
-            with open(full_export_path, 'wb+') as exported_file:
-                exported_file.write(file_data)
-
-    # Generate TSV file using the updated data
-    with open(f'{sample_data_path}/{sample_name}_result_data.tsv', 'w') as tsv_file:
-        # Define the column order for the first four columns
-        ordered_columns = ['Sample_name', 'AA_amplicon_number', 'Feature_ID', 'Classification']
-
-        # Get all column names from the data
-        all_columns = set()
-        for feature in updated_data:
-            all_columns.update(feature.keys())
-
-        # Sort remaining columns alphabetically
-        remaining_columns = sorted(list(all_columns - set(ordered_columns)))
-
-        # Final column order
-        columns = ordered_columns + remaining_columns
-
-        # Write header
-        tsv_file.write('\t'.join(columns) + '\n')
+            if file_id:
+                _add(new_artifact_paths[field], gridfs_source(fs_handle, file_id))
 
-        # Write data rows
-        for feature in updated_data:
-            row = []
-            for col in columns:
-                val = feature.get(col, '')
-                # Convert ObjectId to string if needed
-                if isinstance(val, ObjectId):
-                    val = str(val)
-                row.append(str(val))
-            tsv_file.write('\t'.join(row) + '\n')
+    # Result table using the updated data
+    _add(f"{sample_name}_result_data.tsv", _sample_result_tsv(updated_data))
 
-    return sample_data_path, updated_data
+    return members, updated_data
 
 
 def sample_download(request, project_name, sample_name):
@@ -1959,177 +1984,120 @@ def sample_download(request, project_name, sample_name):
     """
     project, sample_data, _, _ = get_one_sample(project_name, sample_name)
 
-    # Process the sample data
-    sample_data_path, _ = process_sample_data(project, sample_name, sample_data)
+    members, _ = sample_zip_members(project, sample_name, sample_data)
+    record_sample_download(project)
 
     # Create and return the response
-    return create_zip_response(sample_data_path, sample_name)
+    return create_zip_response(members, sample_name)
 
 
-def handle_email_results(request, batch_dir, zip_filename):
+def handle_email_results(request, selection, zip_filename):
     """
-    Upload the zip file to S3, generate a presigned URL, and email it to the user.
-    
+    Queue the archive build and email the user a presigned S3 link when done.
+
+    The archive is built by a download job (see download_jobs), so this
+    returns as soon as the job is queued rather than after the upload.
+
     Args:
         request: The HTTP request object
-        batch_dir: Directory containing the files to zip
+        selection: list of download_jobs.selection_entry dicts
         zip_filename: Name of the zip file (without .zip extension)
-    
+
     Returns:
         HttpResponse with a message about the email
     """
-    from django.core.mail import EmailMessage
-    from django.template.loader import render_to_string
-    from django.utils.html import strip_tags
-    logging.error("handle email results called")
-    zip_path = None
-    s3_key = None
-    
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+    def _error(message, status_code=400):
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': message}, status=status_code)
+        messages.error(request, message)
+        return redirect('gene_search_page')
+
+    # Check if S3 downloads are configured first
+    if not settings.USE_S3_DOWNLOADS:
+        return _error("Email results feature requires S3 to be configured.")
+    user_email = request.user.email
+    if not user_email:
+        return _error("Your account does not have an email address. Please update your profile.")
+
     try:
-        # Check if S3 downloads are configured first
-        if not settings.USE_S3_DOWNLOADS:
-            messages.error(request, "Email results feature requires S3 to be configured.")
-            return redirect('gene_search_page')
-        
-        # Set up AWS profile and create S3 client
-        if not settings.AWS_PROFILE_NAME:
-            settings.AWS_PROFILE_NAME = 'default'
-        
-        session = boto3.Session(profile_name=settings.AWS_PROFILE_NAME)
-        s3_client = session.client('s3')
-        bucket_name = settings.S3_DOWNLOADS_BUCKET
-        
-        # Create a unique key for the file in S3
-        s3_key = f"batch_downloads/{request.user.username}/{uuid.uuid4()}/{zip_filename}.zip"
-        
-        # Create the zip archive with full path
-        # shutil.make_archive base_name should NOT include .zip extension
-        # It will create the file at: <parent_of_batch_dir>/<zip_filename>.zip
-        parent_dir = os.path.dirname(batch_dir)
-        zip_base_path = os.path.join(parent_dir, zip_filename)
-        zip_path = f"{zip_base_path}.zip"
-        
-        logging.info(f"Creating zip file at: {zip_path}")
-        shutil.make_archive(zip_base_path, 'zip', batch_dir)
-        
-        if not os.path.exists(zip_path):
-            raise FileNotFoundError(f"Zip file was not created at expected location: {zip_path}")
-        
-        logging.info(f"Uploading {zip_path} to S3: s3://{bucket_name}/{s3_key}")
-        
-        with open(zip_path, 'rb') as zip_file:
-            s3_client.upload_fileobj(zip_file, bucket_name, s3_key)
-        
-        logging.info(f"Successfully uploaded to S3: {s3_key}")
-        
-        # Generate presigned URL (valid for 7 days)
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': s3_key},
-            ExpiresIn=604800  # 7 days in seconds
-        )
-        
-        # Get user email
-        user_email = request.user.email
-        if not user_email:
-            messages.error(request, "Your account does not have an email address. Please update your profile.")
-            # Clean up S3 file
-            s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
-            return redirect('gene_search_page')
-        
-        # Send email
-        subject = f"Your batch sample download is ready - {zip_filename}"
-        
-        # Prepare email context
-        email_context = {
-            'username': request.user.username,
-            'download_url': presigned_url,
-            'filename': f"{zip_filename}.zip",
-            'expiration_days': 7,
-            'SITE_TITLE': settings.SITE_TITLE,
-            'SITE_URL': settings.SITE_URL,
-        }
-        
-        # Render email body from template or create simple text
-        email_body = f"""
-Dear {request.user.username},
+        job_id = download_jobs.submit_batch_download(
+            selection, zip_filename,
+            recipient={'username': request.user.username, 'email': user_email})
+    except Exception as e:
+        logging.exception(f"Error handling email results: {e}")
+        return _error(f"Error processing your request: {str(e)}", status_code=500)
 
-Your batch sample download is ready!
+    message = (f"Your download is being prepared. A link will be sent to {user_email} "
+               f"when it is ready and will be valid for 7 days.")
+    if is_ajax:
+        return JsonResponse({'success': True, 'message': message, 'job_id': job_id})
+    messages.success(request, message)
+    return redirect('gene_search_page')
 
-Download URL: {presigned_url}
 
-Filename: {zip_filename}.zip
+def batch_zip_members(selection, progress=None):
+    """
+    Describe a batch download of *selection* as zip members.
 
-This link will expire in 7 days.
+    One aggregation per project fetches every selected sample's rows; blobs
+    are only read from GridFS while the zip streams out.
 
-Best regards,
-{settings.SITE_TITLE} Team
-{settings.SITE_URL}
-"""
-        
-        # Send the email
-        email = EmailMessage(
-            subject,
-            email_body,
-            settings.EMAIL_HOST_USER,
-            [user_email],
-            reply_to=[settings.EMAIL_HOST_USER]
-        )
-        email.send(fail_silently=False)
-        
-        logging.info(f"Download link emailed to {user_email}")
-        
-        # Check if this is an AJAX request
-        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
-        
-        if is_ajax:
-            return JsonResponse({
-                'success': True,
-                'message': f"A download link has been sent to {user_email}. The link will be valid for 7 days."
-            })
-        else:
-            messages.success(request, f"A download link has been sent to {user_email}. The link will be valid for 7 days.")
-            return redirect('gene_search_page')
-        
-    except Exception as e:
-        logging.exception(f"Error handling email results: {e}")
-        
-        # Try to clean up S3 file if it was uploaded
-        if s3_key:
-            try:
-                session = boto3.Session(profile_name=settings.AWS_PROFILE_NAME)
-                s3_client = session.client('s3')
-                s3_client.delete_object(Bucket=settings.S3_DOWNLOADS_BUCKET, Key=s3_key)
-            except Exception as cleanup_error:
-                logging.exception(f"Error cleaning up S3 file: {cleanup_error}")
-        
-        # Check if this is an AJAX request
-        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
-        
-        if is_ajax:
-            return JsonResponse({
-                'success': False,
-                'error': f"Error processing your request: {str(e)}"
-            }, status=500)
-        else:
-            messages.error(request, f"Error processing your request: {str(e)}")
-            return redirect('gene_search_page')
-        
-    finally:
-        # Clean up local zip file
-        if zip_path and os.path.exists(zip_path):
+    Args:
+        selection: list of download_jobs.selection_entry dicts, already
+                   authorized
+        progress: optional callable, given the number of samples resolved so
+                  far after each project
+
+    Returns:
+        tuple: (members, counts) where counts maps project id to the number of
+        samples included from it
+    """
+    members = []
+    counts = {}
+    for entry in selection:
+        try:
+            sample_rows = get_samples_of_project(entry['project_id'], entry['samples'])
+        except Exception as e:
+            logging.exception(f"Error resolving samples of project {entry['project_id']}: {e}")
+            continue
+
+        project = {'_id': entry['project_id']}
+        project_dir = f"{entry['project_name']}/"
+        members.append(ZipMember(project_dir))
+
+        project_count = 0
+        for sample_name in entry['samples']:
+            sample_data = sample_rows.get(sample_name)
+            if not sample_data:
+                continue
             try:
-                os.remove(zip_path)
-                logging.debug(f"Cleaned up local zip file: {zip_path}")
+                sample_members, _ = sample_zip_members(
+                    project, sample_name, sample_data, prefix=f"{project_dir}{sample_name}/")
             except Exception as e:
-                logging.error(f"Failed to clean up zip file {zip_path}: {e}")
+                logging.exception(f"Error processing sample {sample_name}: {e}")
+                continue
+            members.extend(sample_members)
+            project_count += 1
+
+        counts[entry['project_id']] = project_count
+        if progress is not None:
+            progress(sum(counts.values()))
+    logging.info(f"Completed processing {sum(counts.values())} samples total")
+    return members, counts
 
 
 @login_required(login_url='/accounts/login/')
 def batch_sample_download(request):
     """
     Download multiple samples organized by project.
-    If emailResults is set to 'true', uploads the zip to S3 and emails a presigned URL.
+    If emailResults is set to 'true', builds the zip in the background and
+    emails a presigned URL.  If async is set to 'true', or more than
+    download_jobs.SYNC_MAX_SAMPLES samples are selected, builds the zip in the
+    background and returns the job id (202); poll /api/v1/jobs/<id>/ and fetch
+    /api/v1/jobs/<id>/download/ when it has completed.  Smaller selections
+    stream the zip directly.
     """
     if request.method != 'POST':
         alert_message = "Invalid request method. Please use the selection checkboxes to choose samples."
@@ -2137,6 +2105,7 @@ def batch_sample_download(request):
     logging.error("begin batch download")
     samples = request.POST.getlist('samples')
     email_results = request.POST.get('emailResults', 'false').lower() == 'true'
+    run_async = request.POST.get('async', 'false').lower() == 'true'
 
     if not samples:
         alert_message = "No samples were selected. Please select at least one sample to download."
@@ -2146,83 +2115,56 @@ def batch_sample_download(request):
     #    alert_message = "Too many samples selected. Please download relevant projects directly."
     #    return redirect('gene_search_page', alert_message=alert_message)
 
-    # Create a temporary directory for the batch
-    batch_id = uuid.uuid4()
-    batch_dir = f"tmp/batch_{batch_id}"
-    os.makedirs(batch_dir, exist_ok=True)
-
-    # Group samples by project
-    projects_and_samples = {}
-
+    # Group sample names by project, keeping the order they were selected in.
+    requested = {}
     for sample_str in samples:
         try:
             project_id, sample_name = sample_str.split(':')
-
-            # Skip if no access
-            project = get_one_project(project_id)
-            visibility = normalize_visibility_field(project.get('private', 'private'))
-            # Allow access for members, or for hidden_public/public projects
-            if is_project_private(visibility) and not is_project_hidden_public(visibility) and not is_user_a_project_member(project, request):
-                continue
-
-            # Add to our grouping
-            if project_id not in projects_and_samples:
-                projects_and_samples[project_id] = {
-                    'project': project,
-                    'samples': []
-                }
-
-            projects_and_samples[project_id]['samples'].append(sample_name)
-
-        except (ValueError, Exception) as e:
-            logging.exception(f"Error processing sample string {sample_str}: {e}")
+        except ValueError:
+            logging.error(f"Skipping malformed sample string {sample_str!r}")
             continue
+        requested.setdefault(project_id, []).append(sample_name)
     logging.error("batch download - processing samples ")
-    try:
-        # Process each project's samples
-        processed_count = 0
-        for project_id, project_info in projects_and_samples.items():
-            project = project_info['project']
-            project_dir = f"{batch_dir}/{project['project_name']}"
-            os.makedirs(project_dir, exist_ok=True)
-
-            # Process each sample in the project
-            for sample_name in project_info['samples']:
-                try:
-                    # Get sample data
-                    _, sample_data, _, _ = get_one_sample(project_id, sample_name)
-                    if not sample_data:
-                        continue
 
-                    # Process the sample
-                    sample_dir = f"{project_dir}/{sample_name}"
-                    process_sample_data(project, sample_name, sample_data, sample_dir)
-                    
-                    processed_count += 1
-                    if processed_count % 20 == 0:
-                        logging.info(f"Processed {processed_count} samples so far...")
-
-                except Exception as e:
-                    logging.exception(f"Error processing sample {sample_name}: {e}")
-                    continue
-        
-        logging.info(f"Completed processing {processed_count} samples total")
-
-        # Create the zip file with timestamp
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        zip_filename = f"batch_samples_{timestamp}"
-
-        # If emailResults is true, upload to S3 and send email
-        if email_results:
-            return handle_email_results(request, batch_dir, zip_filename)
-        else:
-            # Return the response directly
-            return create_zip_response(batch_dir, zip_filename)
+    # Authorize each project once, from a runs-free read.  The sample rows
+    # are fetched when the archive is built.
+    selection = []
+    projects = {}
+    for project_id, sample_names in requested.items():
+        try:
+            project = get_one_project_sans_runs(project_id, _PROJECT_METADATA_PROJECTION)
+        except Exception as e:
+            logging.exception(f"Error resolving project {project_id}: {e}")
+            continue
+        if project is None:
+            continue
+        visibility = normalize_visibility_field(project.get('private', 'private'))
+        # Allow access for members, or for hidden_public/public projects
+        if is_project_private(visibility) and not is_project_hidden_public(visibility) and not is_user_a_project_member(project, request):
+            continue
+        selection.append(download_jobs.selection_entry(project, sample_names))
+        projects[str(project['_id'])] = project
+
+    # Create the zip file with timestamp
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    zip_filename = f"batch_samples_{timestamp}"
+
+    # If emailResults is true, build in the background and send email
+    if email_results:
+        return handle_email_results(request, selection, zip_filename)
+    if run_async or sum(len(entry['samples']) for entry in selection) > download_jobs.SYNC_MAX_SAMPLES:
+        job_id = download_jobs.submit_batch_download(selection, zip_filename)
+        return JsonResponse({
+            'job_id': job_id,
+            'status_url': f'/api/v1/jobs/{job_id}/',
+            'download_url': f'/api/v1/jobs/{job_id}/download/',
+        }, status=202)
 
-    finally:
-        # Clean up the temporary directory
-        if os.path.exists(batch_dir):
-            shutil.rmtree(batch_dir)
+    # Return the response directly
+    members, counts = batch_zip_members(selection)
+    for project_id, count in counts.items():
+        record_sample_download(projects[project_id], count)
+    return create_zip_response(members, zip_filename)
 
 
 def feature_page(request, project_name, sample_name, feature_name):
@@ -2504,10 +2446,7 @@ def _get_s3_file_size_bytes(s3_uri):
         bucket, _, key = without_prefix.partition('/')
         if not bucket or not key:
             return None
-        profile = getattr(settings, 'AWS_PROFILE_NAME', None) or 'default'
-        session = boto3.Session(profile_name=profile)
-        s3client = session.client('s3')
-        resp = s3client.head_object(Bucket=bucket, Key=key)
+        resp = get_s3_client().head_object(Bucket=bucket, Key=key)
         return resp.get('ContentLength')
     except Exception as e:
         logging.debug(f"Could not get S3 file size for {s3_uri}: {e}")
@@ -2585,6 +2524,7 @@ def project_delete(request, project_name):
         #query = {'project_name': project_name}
         new_val = { "$set": {'delete' : True, 'delete_user': deleter, 'delete_date': get_date()} }
         collection_handle.update_one(query, new_val)
+        page_cache.invalidate_project_pages(project['_id'])
         delete_project_from_site_statistics(project, visibility)
 
         # No Neo4j graph invalidation here on purpose. This is a reversible soft
@@ -2660,10 +2600,13 @@ def delete_project_version(request, project_name, version_id):
 
             # Copy forward important metadata from the current version
             metadata_to_copy = {}
-            for field in ['project_members', 'subscribers', 'views', 'downloads',
+            for field in ['project_members', 'subscribers',
                           'alias_name', 'publication_link', 'private', 'privateKey', 'featured']:
                 if field in latest_project:
                     metadata_to_copy[field] = latest_project[field]
+            metadata_to_copy['views'], metadata_to_copy['downloads'] = \
+                project_counters.with_counts(latest_project, cached=False)
+            project_counters.clear_totals(prev_linkid)
 
             # Un-delete and make the previous version current
             update_fields = {
@@ -2677,12 +2620,17 @@ def delete_project_version(request, project_name, version_id):
                 {'_id': ObjectId(prev_linkid)},
                 {'$set': update_fields}
             )
+            page_cache.invalidate_project_pages(current_linkid)
+            page_cache.invalidate_project_pages(prev_linkid)
 
             promoted_project = collection_handle.find_one({'_id': ObjectId(prev_linkid)}) or {
                 '_id': ObjectId(prev_linkid),
                 **update_fields,
             }
             promoted_file_ids = set(iter_gridfs_file_ids(promoted_project))
+            # Versions made by appending samples share files with other versions.
+            promoted_file_ids |= gridfs_refs.referenced_elsewhere(
+                current_linkid, iter_gridfs_file_ids(latest_project))
             deleted_gridfs_count = delete_gridfs_payload_for_project(
                 fs_handle,
                 latest_project,
@@ -2699,6 +2647,7 @@ def delete_project_version(request, project_name, version_id):
                 tombstone,
                 upsert=True,
             )
+            gridfs_refs.drop_project_refs(current_linkid)
             retarget_count = retarget_deleted_version_tombstones(
                 collection_handle,
                 current_linkid,
@@ -2731,6 +2680,7 @@ def delete_project_version(request, project_name, version_id):
                     'version_deleted_from_history': True,
                 }}
             )
+            page_cache.invalidate_project_pages(current_linkid)
 
             vis = normalize_visibility_field(latest_project.get('private', 'private'))
             delete_project_from_site_statistics(latest_project, vis)
@@ -2759,6 +2709,8 @@ def delete_project_version(request, project_name, version_id):
         )
 
         latest_file_ids = set(iter_gridfs_file_ids(latest_project))
+        latest_file_ids |= gridfs_refs.referenced_elsewhere(
+            version_id, iter_gridfs_file_ids(old_version))
         deleted_gridfs_count = delete_gridfs_payload_for_project(
             fs_handle,
             old_version,
@@ -2775,6 +2727,9 @@ def delete_project_version(request, project_name, version_id):
             tombstone,
             upsert=True,
         )
+        gridfs_refs.drop_project_refs(version_id)
+        page_cache.invalidate_project_pages(current_linkid)
+        page_cache.invalidate_project_pages(version_id)
 
         logging.info(
             f"Deleted old version {version_id} from history of project "
@@ -2802,6 +2757,7 @@ def project_update(request, project_name):
         ## 2 new fields: current, and update_date, $set will add a new field with the specified value.
         new_val = { "$set": {'current' : False, 'update_date': get_date()} }
         collection_handle.update_one(query, new_val)
+        page_cache.invalidate_project_pages(project['_id'])
 
         return redirect('profile')
     else:
@@ -3054,7 +3010,9 @@ def edit_project_without_reversioning(request, project_name, project, form_dict,
             alias_name = None
 
         old_extra_metadata = get_extra_metadata_from_project(project)
-        current_runs = process_metadata_no_request(current_runs, metadata_file=metadata_file, old_extra_metadata=old_extra_metadata)
+        metadata_changed = []
+        current_runs = process_metadata_no_request(current_runs, metadata_file=metadata_file, old_extra_metadata=old_extra_metadata,
+                                                   changed=metadata_changed)
 
         # Initialize sample_data from existing project
         sample_data = project.get('sample_data', None)
@@ -3073,10 +3031,12 @@ def edit_project_without_reversioning(request, project_name, project, form_dict,
         updated_subscribers = [email for email in current_subscribers if email not in form_dict['project_members']]
 
         new_val = {"$set": {'project_name': new_project_name, 'runs': current_runs,
+                            'sample_index': build_sample_index(current_runs),
                             'description': form_dict['description'], 'date': get_date(),
                             'private': normalize_visibility_field(form_dict['private']),
                             'sample_data': sample_data,
                             'sample_count': len(current_runs),
+                            'sample_metadata_available': runs_have_sample_metadata(current_runs),
                             'project_members': form_dict['project_members'],
                             'subscribers': updated_subscribers,
                             'publication_link': form_dict['publication_link'],
@@ -3085,6 +3045,14 @@ def edit_project_without_reversioning(request, project_name, project, form_dict,
 
         if project.get('sample_data', False) and samples_to_remove and len(samples_to_remove) > 0:
             new_val["$unset"] = {'metadata_stored': ""}
+        elif runs == 0:
+            # Only metadata can have touched the samples: $set just the
+            # changed ones rather than rewriting every run.
+            sample_sets = changed_sample_updates(current_runs, metadata_changed)
+            if sample_sets is not None:
+                del new_val["$set"]['runs']
+                for paths in sample_sets:
+                    new_val["$set"].update(paths)
 
         # After form_dict is created and before new_val is defined
         for version_field in ['ASP_version', 'AA_version', 'AC_version', 'CoRAL_version']:
@@ -3095,6 +3063,7 @@ def edit_project_without_reversioning(request, project_name, project, form_dict,
 
         if form.is_valid():
             collection_handle.update_one(query, new_val)
+            page_cache.invalidate_project_pages(project['_id'])
 
             # Update site statistics -------------------------------------------
             # Determine whether any samples were actually removed.
@@ -3264,7 +3233,7 @@ def _process_edit_and_notify(file_fps, placeholder_project_id, project_data_path
         
         # Call _process_and_aggregate_files to do the actual aggregation and project creation.
         # Passing audit_event_type causes the audit log to be written inside
-        # upload_file_to_s3 once the S3 upload finishes, so the real file size is captured.
+        # sync_project_tarball_to_s3 once the S3 upload finishes, so the real file size is captured.
         _process_and_aggregate_files(
             file_fps,
             placeholder_project_id,
@@ -3429,8 +3398,7 @@ def edit_project_into_new_version(request, project_name, project, form_dict, for
             }
         )
 
-        views = project['views']
-        downloads = project['downloads']
+        views, downloads = project_counters.with_counts(project, cached=False)
         # Preserve subscribers from the old project version
         old_subscribers = project.get('subscribers', [])
         # Remove any new project members from the subscribers list
@@ -3494,7 +3462,7 @@ def edit_project_into_new_version(request, project_name, project, form_dict, for
             form_data['alias'] = form_dict.get('alias', '')
 
             logging.info(f"EditProject - start background thread to _process_edit_and_notify")
-            _thread_executor.submit(
+            job_queue.submit_aggregation(
                 _process_edit_and_notify,
                 file_fps, temp_proj_id, project_data_path, temp_directory,
                 form_data, request.user, extra_metadata_file_fp,
@@ -3504,6 +3472,7 @@ def edit_project_into_new_version(request, project_name, project, form_dict, for
                 oldFeatured=oldFeatured,
                 rollback_project_id=str(project['linkid']),
                 task_label=f'Project Edit: {temp_proj_id}',
+                keep_dirs=[project_data_path, temp_directory],
                 old_extra_metadata=old_extra_metadata,
             )
             logging.info(f"EditProject - finished launch of background thread")
@@ -3589,6 +3558,7 @@ def edit_project_page(request, project_name):
                 query = {'_id': ObjectId(project_name)}
                 new_val = { "$set": {'alias_name' : None}}
                 collection_handle.update_one(query, new_val)
+                page_cache.invalidate_project_pages(project_name)
         
         ## new project information is stored in form_dict
         form_dict = form_to_dict(form)
@@ -3712,54 +3682,40 @@ def edit_project_page(request, project_name):
                    })
 
 
-def  remove_samples_from_tar(project, samples_to_remove, download_path, url):
-    # remove the sample data for the samples removed
-    # from the project zip file. They will be in a directory in the tar file called
-    # results/other_files/<SAMPLE_NAME>_classification/
+def remove_samples_from_tar(project, samples_to_remove, download_path, url):
+    """
+    Write a copy of the project tarball without the files of the removed samples.
+
+    Their data sits in results/other_files/<SAMPLE_NAME>_classification/ and
+    results/AA_outputs/[extracted_from_zips/]<SAMPLE_NAME>_AA_results/.  The
+    stored tarball is streamed from GridFS (or from *url* for a project that
+    has none) straight into the filtered copy, so nothing is extracted.
+
+    Returns:
+        str: path of the stripped .tar.gz, next to *download_path*; None on failure
+    """
     project_name = project['project_name']
+    parent_dir = os.path.abspath(os.path.dirname(download_path))
+    new_project_tar_fp = f'{parent_dir}/{project_name}_stripped.tar.gz'
+    os.makedirs(parent_dir, exist_ok=True)
 
     try:
-        download_file(url, download_path)
+        if project.get('tarfile'):
+            source = fs_handle.get(ObjectId(project['tarfile']))
+        else:
+            response = requests.get(url, stream=True)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            source = response.raw
+        dropped = sample_append.write_tar_without_samples(source, new_project_tar_fp, samples_to_remove)
     except Exception as e:
-        logging.error(f'Failed to download the file: {e}')
+        logging.error(f'Failed to strip samples from the project tarball: {e}')
+        if os.path.exists(new_project_tar_fp):
+            os.remove(new_project_tar_fp)
         return None
 
-    if os.path.exists(download_path):
-        parent_dir = os.path.abspath(os.path.dirname(download_path))
-        # Create a temporary directory to extract the tar file
-        temp_extract_dir = f'{parent_dir}/extracted'
-        os.makedirs(temp_extract_dir, exist_ok=True)
-
-        # Extract the tar file
-        with tarfile.open(download_path, 'r:gz') as tar:
-            safe_extractall(tar, temp_extract_dir,
-                            description=f"project {project.get('_id')}")
-
-        # Remove the sample directories
-        for sample in samples_to_remove:
-            sample_dir = os.path.join(temp_extract_dir, 'results', 'other_files', f'{sample}_classification')
-            if os.path.exists(sample_dir):
-                shutil.rmtree(sample_dir)
-
-            # Also remove other directories left behind in other_files
-            sample_dir2 = os.path.join(temp_extract_dir, 'results', 'AA_outputs', f'{sample}_AA_results')
-            if os.path.exists(sample_dir2):
-                shutil.rmtree(sample_dir2)
-
-            sample_dir3 = os.path.join(temp_extract_dir, 'results', 'AA_outputs','extracted_from_zips', f'{sample}_AA_results')
-            if os.path.exists(sample_dir3):
-                shutil.rmtree(sample_dir3)
-
-        # Create a new tar file without the removed samples
-
-        new_project_tar_fp = f'{parent_dir}/{project_name}_stripped.tar.gz'
-        with tarfile.open(new_project_tar_fp, 'w:gz') as tar:
-            tar.add(os.path.join(temp_extract_dir, 'results'), arcname='results')
-
-        # Clean up the temporary extraction directory
-        shutil.rmtree(temp_extract_dir)
-        os.remove(download_path)
-        return new_project_tar_fp
+    logging.info(f"Dropped {dropped} tar members of {len(samples_to_remove)} removed samples")
+    return new_project_tar_fp
 
 
 def clear_tmp(folder = 'tmp/'):
@@ -3786,24 +3742,139 @@ def update_notification_preferences(request):
 # extract_project_files is meant to be called in a seperate thread to reduce the wait
 # for users as they create the project
 
+def store_feature_files(runs, project_data_path):
+    """
+    Upload the files referenced by the feature rows of *runs* to GridFS.
+
+    Paths in the rows are relative to ``<project_data_path>/results``, as the
+    aggregator writes them; each is replaced in place by the GridFS id of the
+    stored file, or 'Not Provided' if the file is missing.  Used for a whole
+    project at extraction time and for just the new samples when samples are
+    appended to an existing project.
+    """
+    feature_count = 0
+    total_features = sum(len(features) for features in runs.values())
+
+    gfs_start_time = time.time()
+    # get cnv, image, bed files
+    for sample, features in runs.items():
+        for feature in features:
+            feature_count += 1
+            if feature_count % 100 == 0:
+                logging.info(f"Processing feature {feature_count}/{total_features}...")
+
+
+            if len(feature) > 0:
+                # get paths
+                # 'AA graph file' and 'AA cycles file' are new keys (new-format archives only)
+                # stored individually in GridFS for direct access.
+                # 'AA directory' is handled separately below: old-format archives supply a
+                # .tar.gz file; new-format archives supply a plain directory that we tar
+                # in-memory before storing in GridFS.
+                # Aggregator <=6 used the AA-prefixed image/text keys. 7.0
+                # emits distinct graph/cycles artifacts. Upload whichever
+                # schema is present and retain its original field names.
+                key_names = [
+                    'Feature BED file', 'CNV BED file',
+                    'AA PDF file', 'AA PNG file',
+                    'Graph PNG file', 'Graph PDF file',
+                    'Cycles PNG file', 'Cycles PDF file',
+                    'AA graph file', 'AA cycles file',
+                    'Graph file', 'Cycles file',
+                    'Run metadata JSON', 'Sample metadata JSON',
+                ]
+                for k in key_names:
+                    if k not in feature:
+                        continue
+                    try:
+                        path_var = feature[k]
+                        with open(f'{project_data_path}/results/{path_var}', "rb") as file_var:
+                            id_var = fs_handle.put(file_var)
+                        # Explicitly delete the file data reference
+                        del path_var
+                    except:
+                        id_var = "Not Provided"
+                    feature[k] = id_var
+
+                # Existing pages and API clients use AA_PNG/PDF. For 7.0
+                # archives, expose the graph render through those legacy
+                # aliases while preserving every new-format field above.
+                if 'AA PNG file' not in feature and 'Graph PNG file' in feature:
+                    feature['AA PNG file'] = feature['Graph PNG file']
+                if 'AA PDF file' not in feature and 'Graph PDF file' in feature:
+                    feature['AA PDF file'] = feature['Graph PDF file']
+
+                # Handle AA directory: new-format archives supply a plain directory;
+                # old-format archives supply a .tar.gz file.  Either way we end up with
+                # a named tar.gz blob in GridFS.
+                try:
+                    import io
+                    directory_key = (
+                        'Reconstruction directory'
+                        if 'Reconstruction directory' in feature
+                        else 'AA directory'
+                    )
+                    path_var = feature[directory_key]
+                    full_path = f'{project_data_path}/results/{path_var}'
+                    # Aggregator 7 identifies CoRAL as the reconstruction
+                    # tool but does not yet emit its version. Recover the
+                    # stable `CoRAL vX.Y.Z` summary banner as a fallback.
+                    if (
+                        feature.get('Reconstruction tool') == 'CoRAL'
+                        and not feature.get('Reconstruction version')
+                        and os.path.isdir(full_path)
+                    ):
+                        for filename in os.listdir(full_path):
+                            if not filename.endswith(('_summary.txt', '_amplicon_summary.txt')):
+                                continue
+                            try:
+                                with open(os.path.join(full_path, filename)) as summary_file:
+                                    banner = summary_file.readline().strip()
+                                match = re.match(r'^CoRAL\s+v?([^\s]+)', banner, re.IGNORECASE)
+                                if match:
+                                    feature['Reconstruction version'] = match.group(1)
+                                    break
+                            except OSError:
+                                continue
+                    if os.path.isdir(full_path):
+                        dir_name = os.path.basename(path_var.rstrip('/'))
+                        archive_name = f'{dir_name}.tar.gz'
+                        buf = io.BytesIO()
+                        with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+                            tar.add(full_path, arcname=dir_name)
+                        buf.seek(0)
+                        id_var = fs_handle.put(buf, filename=archive_name)
+                    else:
+                        with open(full_path, 'rb') as file_var:
+                            id_var = fs_handle.put(file_var)
+                except:
+                    id_var = 'Not Provided'
+                feature[directory_key] = id_var
+                if directory_key == 'Reconstruction directory':
+                    feature['AA directory'] = id_var
+
+    gfs_end_time = time.time()
+    logging.info(f"Putting files in GridFS took {gfs_end_time - gfs_start_time:.4f}s")
+    return runs
+
+
 def extract_project_files(tarfile, file_location, project_data_path, project_id, extra_metadata_filepath, old_extra_metadata, samples_to_remove, remap_names_to_alias=False):
     logging.info("Extracting files from tar...")
     try:
-        # Check tar file structure before extraction
+        # One decompression pass: the member list is read back from the
+        # headers extractall already parsed.
         with tarfile.open(file_location, "r:gz") as tar_file:
+            # Uploaded tarballs are untrusted: /upload_api/ takes them without
+            # authentication.  safe_extractall keeps every member inside
+            # project_data_path.
+            safe_extractall(tar_file, project_data_path,
+                            description=f'project {project_id}')
             member_names = tar_file.getnames()
             logging.info(f"Tar file contains {len(member_names)} members")
             logging.info(f"First 10 members: {member_names[:10]}")
             # Check if run.json exists and where
             run_json_members = [m for m in member_names if 'run.json' in m]
             logging.info(f"run.json locations in tar: {run_json_members}")
-        
-        with tarfile.open(file_location, "r:gz") as tar_file:
-            # Uploaded tarballs are untrusted: /upload_api/ takes them without
-            # authentication.  safe_extractall keeps every member inside
-            # project_data_path.
-            safe_extractall(tar_file, project_data_path,
-                            description=f'project {project_id}')
 
         # Verify extraction completed by checking if the path exists
         if not os.path.exists(project_data_path):
@@ -3842,109 +3913,7 @@ def extract_project_files(tarfile, file_location, project_data_path, project_id,
             runs = remove_samples_from_runs(runs, samples_to_remove)
 
         logging.info("Processing and uploading individual files to GridFS...")
-        feature_count = 0
-        total_features = sum(len(features) for features in runs.values())
-
-        gfs_start_time = time.time()
-        # get cnv, image, bed files
-        for sample, features in runs.items():
-            for feature in features:
-                feature_count += 1
-                if feature_count % 100 == 0:
-                    logging.info(f"Processing feature {feature_count}/{total_features}...")
-
-
-                if len(feature) > 0:
-                    # get paths
-                    # 'AA graph file' and 'AA cycles file' are new keys (new-format archives only)
-                    # stored individually in GridFS for direct access.
-                    # 'AA directory' is handled separately below: old-format archives supply a
-                    # .tar.gz file; new-format archives supply a plain directory that we tar
-                    # in-memory before storing in GridFS.
-                    # Aggregator <=6 used the AA-prefixed image/text keys. 7.0
-                    # emits distinct graph/cycles artifacts. Upload whichever
-                    # schema is present and retain its original field names.
-                    key_names = [
-                        'Feature BED file', 'CNV BED file',
-                        'AA PDF file', 'AA PNG file',
-                        'Graph PNG file', 'Graph PDF file',
-                        'Cycles PNG file', 'Cycles PDF file',
-                        'AA graph file', 'AA cycles file',
-                        'Graph file', 'Cycles file',
-                        'Run metadata JSON', 'Sample metadata JSON',
-                    ]
-                    for k in key_names:
-                        if k not in feature:
-                            continue
-                        try:
-                            path_var = feature[k]
-                            with open(f'{project_data_path}/results/{path_var}', "rb") as file_var:
-                                id_var = fs_handle.put(file_var)
-                            # Explicitly delete the file data reference
-                            del path_var
-                        except:
-                            id_var = "Not Provided"
-                        feature[k] = id_var
-
-                    # Existing pages and API clients use AA_PNG/PDF. For 7.0
-                    # archives, expose the graph render through those legacy
-                    # aliases while preserving every new-format field above.
-                    if 'AA PNG file' not in feature and 'Graph PNG file' in feature:
-                        feature['AA PNG file'] = feature['Graph PNG file']
-                    if 'AA PDF file' not in feature and 'Graph PDF file' in feature:
-                        feature['AA PDF file'] = feature['Graph PDF file']
-
-                    # Handle AA directory: new-format archives supply a plain directory;
-                    # old-format archives supply a .tar.gz file.  Either way we end up with
-                    # a named tar.gz blob in GridFS.
-                    try:
-                        import io
-                        directory_key = (
-                            'Reconstruction directory'
-                            if 'Reconstruction directory' in feature
-                            else 'AA directory'
-                        )
-                        path_var = feature[directory_key]
-                        full_path = f'{project_data_path}/results/{path_var}'
-                        # Aggregator 7 identifies CoRAL as the reconstruction
-                        # tool but does not yet emit its version. Recover the
-                        # stable `CoRAL vX.Y.Z` summary banner as a fallback.
-                        if (
-                            feature.get('Reconstruction tool') == 'CoRAL'
-                            and not feature.get('Reconstruction version')
-                            and os.path.isdir(full_path)
-                        ):
-                            for filename in os.listdir(full_path):
-                                if not filename.endswith(('_summary.txt', '_amplicon_summary.txt')):
-                                    continue
-                                try:
-                                    with open(os.path.join(full_path, filename)) as summary_file:
-                                        banner = summary_file.readline().strip()
-                                    match = re.match(r'^CoRAL\s+v?([^\s]+)', banner, re.IGNORECASE)
-                                    if match:
-                                        feature['Reconstruction version'] = match.group(1)
-                                        break
-                                except OSError:
-                                    continue
-                        if os.path.isdir(full_path):
-                            dir_name = os.path.basename(path_var.rstrip('/'))
-                            archive_name = f'{dir_name}.tar.gz'
-                            buf = io.BytesIO()
-                            with tarfile.open(fileobj=buf, mode='w:gz') as tar:
-                                tar.add(full_path, arcname=dir_name)
-                            buf.seek(0)
-                            id_var = fs_handle.put(buf, filename=archive_name)
-                        else:
-                            with open(full_path, 'rb') as file_var:
-                                id_var = fs_handle.put(file_var)
-                    except:
-                        id_var = 'Not Provided'
-                    feature[directory_key] = id_var
-                    if directory_key == 'Reconstruction directory':
-                        feature['AA directory'] = id_var
-
-        gfs_end_time = time.time()
-        logging.info(f"Putting files in GridFS took {gfs_end_time - gfs_start_time:.4f}s")
+        store_feature_files(runs, project_data_path)
         logging.info("All features processed. Updating project in database...")
 
         # Now update the project with the updated runs
@@ -3960,7 +3929,12 @@ def extract_project_files(tarfile, file_location, project_data_path, project_id,
             runs = process_metadata_no_request(replace_underscore_keys(runs), old_extra_metadata = old_extra_metadata, remap_name_to_alias=remap_names_to_alias )
 
         new_val = {"$set": {'runs': runs,
-                            'Oncogenes': get_project_oncogenes(runs)}}
+                            'sample_index': build_sample_index(runs),
+                            'sample_count': len(runs),
+                            'sample_metadata_available': runs_have_sample_metadata(runs),
+                            'Oncogenes': get_project_oncogenes(runs),
+                            # Harvested from the extracted tree so page views never scan the tarball
+                            'ecDNA_context': ecDNA_context_from_directory(project_data_path)}}
 
         get_tool_versions(project, runs)
         version_keys = [
@@ -3972,6 +3946,7 @@ def extract_project_files(tarfile, file_location, project_data_path, project_id,
         new_val["$set"].update(tool_versions)
 
         collection_handle.update_one(query, new_val)
+        gridfs_refs.record_project_refs(project_id, {'runs': runs})
 
         finish_flag = {
             "$set" : {
@@ -3979,6 +3954,7 @@ def extract_project_files(tarfile, file_location, project_data_path, project_id,
             }
         }
         collection_handle.update_one(query, finish_flag)
+        page_cache.invalidate_project_pages(project_id)
         logging.info("Finished extracting from tar and updating database")
         
        
@@ -4159,6 +4135,7 @@ def create_empty_project(request):
             'FINISHED?': True,  # Mark as finished since there's no extraction needed
             'EMPTY?': True, # Mark as empty
             'sample_count': 0,
+            'sample_metadata_available': False,
             'metadata_stored': True  # Prevent reprocessing attempts
         }
         if publication_link:
@@ -4459,7 +4436,7 @@ def _process_and_aggregate_files(file_fps, temp_proj_id, project_data_path, temp
                 {'$set': {'aggregator_version': agg_version}}
             )
             logging.info(f"Project {temp_proj_id} aggregation complete (aggregator version: {agg_version})")
-            # Audit log is handled inside _create_project / upload_file_to_s3 callback
+            # Audit log is handled inside _create_project / sync_project_tarball_to_s3 callback
 
 
     except BaseException as e:
@@ -4628,12 +4605,13 @@ def create_project(request):
         #)
         #agg_thread.start()
         logging.info(f"CreateProject - start background thread to _process_and_aggregate_files")
-        _thread_executor.submit(
+        job_queue.submit_aggregation(
             _process_and_aggregate_files,
             file_fps, temp_proj_id, project_data_path, temp_directory,
             form_data, request.user, extra_metadata_file_fp, name_map_file_path,
             None, None, None, AUDIT_EVENT_CREATE,
             task_label=f'Project Create: {temp_proj_id}',
+            keep_dirs=[project_data_path, temp_directory],
         )
         # Immediately redirect to the processing project page
         logging.info(f"CreateProject - finished launch of background thread to _process_and_aggregate_files")
@@ -4688,6 +4666,7 @@ def _create_project(form, request, extra_metadata_file_fp = None, old_extra_meta
         new_id = collection_handle.insert_one(project)
         add_project_to_site_statistics(project, normalize_visibility_field(project['private']))
         project_id = new_id.inserted_id
+        gridfs_refs.record_project_refs(project_id, project)
 
         # move the project location to a new name using the UUID to prevent name collisions
         new_project_data_path = f"tmp/{project_id}"
@@ -4722,6 +4701,7 @@ def _create_project(form, request, extra_metadata_file_fp = None, old_extra_meta
                  'owner': ''
              }}
         )
+        gridfs_refs.record_project_refs(project_id, project)
         if oldFeatured:
             project['featured'] = True
             collection_handle.update_one({'_id': project_id}, {"$set": {'featured': True}})
@@ -4771,11 +4751,10 @@ def _create_project(form, request, extra_metadata_file_fp = None, old_extra_meta
                     event_type=_ap.get('event_type'),
                     sample_count=_sample_count,
                 )
-        # load the zip asynch to S3 for later use
+        # copy the stored tarball to S3 once, for later downloads
         _thread_executor.submit(
-            upload_file_to_s3,
-            f'{project_data_path}/{request_file.name}',
-            s3_key_suffix,
+            sync_project_tarball_to_s3,
+            project_id,
             on_complete,
             task_label=f'S3 Upload: {s3_key_suffix}',
         )
@@ -4897,8 +4876,9 @@ def create_project_helper(form, user, request_file, save = True, tmp_id = uuid.u
         return None, None
 
 
-    with open(file_location, "rb") as tar_file:
-        project_tar_id = fs_handle.put(tar_file)
+    # Stored block-compressed with a member index so single files (run.json,
+    # other_files/) can later be read without decompressing the whole archive.
+    project_tar_id, project_tar_index_id = store_project_tarball(file_location)
 
 
     #get run.json
@@ -4922,6 +4902,8 @@ def create_project_helper(form, user, request_file, save = True, tmp_id = uuid.u
     project['publication_link'] = form_dict['publication_link']
     project['description'] = form_dict['description']
     project['tarfile'] = project_tar_id
+    if project_tar_index_id is not None:
+        project['tarfile_index'] = project_tar_index_id
     project['date_created'] = get_date()
     project['date'] = get_date()
     project['private'] = normalize_visibility_field(form_dict['private'])
@@ -4940,6 +4922,7 @@ def create_project_helper(form, user, request_file, save = True, tmp_id = uuid.u
     project['downloads'] = previous_views[1]
     project['alias_name'] = form_dict['alias']
     project['sample_count'] = len(runs)
+    project['sample_metadata_available'] = runs_have_sample_metadata(project['runs'])
 
     # Preserve subscribers from previous version if provided
     if old_subscribers is not None:
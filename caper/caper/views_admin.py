@@ -11,14 +11,13 @@ import shutil
 import datetime
 from pathlib import Path
 
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.conf import settings
 
-from django.utils import timezone
 from django.contrib import messages
 
 from django.core.mail import EmailMessage
@@ -33,7 +32,7 @@ from .forms import FeaturedProjectForm, DeletedProjectForm, SendEmailForm
 from .utils import (
     collection_handle, collection_handle_primary, fs_handle, audit_log_handle,
     get_one_project, get_one_deleted_project, prepare_project_linkid,
-    check_if_db_field_exists, get_date_short, previous_versions,
+    get_date_short, previous_versions,
     form_to_dict, get_date, db_handle_primary, format_visibility_for_display,
     get_project_version_chain, normalize_visibility_field, is_project_private,
 )
@@ -42,7 +41,10 @@ from .background_tasks import get_background_task_status
 from .extra_metadata import *
 
 from .site_stats import get_latest_site_statistics, regenerate_site_statistics
-from .tar_utils import list_project_tar_contents
+from .gridfs_refs import drop_project_refs
+from .page_cache import invalidate_project_pages
+from .project_counters import merge_counts
+from .project_files_report import get_report_progress, start_report
 
 
 def _partition_admin_stats_projects(projects):
@@ -58,6 +60,42 @@ def _partition_admin_stats_projects(projects):
     return public_projects, private_projects
 
 
+# Fields of the admin_stats project tables.  runs is never transferred:
+# sample_metadata_available is evaluated on the server instead of calling
+# has_sample_metadata() on every project's full runs.
+_ADMIN_STATS_PROJECT_FIELDS = {
+    'project_name': 1, 'description': 1, 'date': 1, 'private': 1,
+    'project_members': 1, 'downloads': 1, 'project_downloads': 1,
+    'sample_downloads': 1, 'Reconstruction_tools': 1,
+    'sample_metadata_available': SAMPLE_METADATA_AVAILABLE_EXPR,
+}
+
+
+def _solo_member_project_counts():
+    """
+    Count current projects that have exactly one member, per member.
+
+    Returns ``{member: {'private': n, 'public': n}}``, where member is whatever
+    the project stores (a username or an email).  One aggregation groups by
+    (sole member, stored visibility); the few distinct visibility values are
+    normalized here, so legacy boolean values count the same as strings.
+    """
+    pipeline = [
+        {'$match': {'current': True, 'delete': False, 'project_members': {'$size': 1}}},
+        {'$group': {
+            '_id': {'member': {'$arrayElemAt': ['$project_members', 0]}, 'private': '$private'},
+            'count': {'$sum': 1},
+        }},
+    ]
+    counts = {}
+    for group in collection_handle.aggregate(pipeline):
+        visibility = normalize_visibility_field(group['_id'].get('private', 'private'))
+        kind = 'private' if is_project_private(visibility) else 'public'
+        member_counts = counts.setdefault(group['_id'].get('member'), {'private': 0, 'public': 0})
+        member_counts[kind] += group['count']
+    return counts
+
+
 def _get_s3_file_size_bytes_admin(s3_uri):
     """
     Returns the size in bytes of the S3 object at *s3_uri*, or None on any error.
@@ -408,81 +446,29 @@ def admin_stats(request):
     User = get_user_model()
     users = User.objects.all()
 
-    # Get all projects
-    all_projects = list(collection_handle.find({'current': True, 'delete': False}))
-
-    # Create a dictionary to store user stats
+    # Solo-member project counts, keyed by the sole member (username or email)
+    solo_counts = _solo_member_project_counts()
     user_stats = {}
-
-    # For each user, count their private and public projects where they are the only member
     for user in users:
-        username = user.username
-        email = user.email
-        user_id = user.id
-
-        # Initialize counts for this user
-        solo_private_projects = 0
-        solo_public_projects = 0
-
-        # Check each project
-        for project in all_projects:
-            project_members = project.get('project_members', [])
-
-            # Check if user is a member (by username or email) and they're the only one
-            is_only_member = (len(project_members) == 1 and
-                              (username in project_members or email in project_members))
-
-            if is_only_member:
-                if is_project_private(normalize_visibility_field(
-                        project.get('private', 'private'))):
-                    solo_private_projects += 1
-                else:
-                    solo_public_projects += 1
-
-        # Store the stats for this user
-        user_stats[user_id] = {
-            'solo_private_projects': solo_private_projects,
-            'solo_public_projects': solo_public_projects
+        identities = {user.username, user.email} - {'', None}
+        user_stats[user.id] = {
+            'solo_private_projects': sum(solo_counts.get(i, {}).get('private', 0) for i in identities),
+            'solo_public_projects': sum(solo_counts.get(i, {}).get('public', 0) for i in identities),
         }
 
-    # Get public project data for display
+    # Project tables. Legacy integer download counts are converted by the
+    # migrate_download_counts management command, not here; both formats are
+    # still displayed correctly.
+    all_projects = list(collection_handle.aggregate([
+        {'$match': {'current': True, 'delete': False}},
+        {'$project': _ADMIN_STATS_PROJECT_FIELDS},
+    ]))
+    merge_counts(all_projects)
     public_projects, private_projects = _partition_admin_stats_projects(all_projects)
 
-    for project in private_projects:
-        project['sample_metadata_available'] = has_sample_metadata(project)
-
-    for proj in public_projects:
-        prepare_project_linkid(proj)
-        if check_if_db_field_exists(proj, 'project_downloads'):
-            project_download_data = proj['project_downloads']
-            if isinstance(project_download_data, int):
-                temp_data = project_download_data
-                project_download_data = dict()
-                project_download_data[get_date_short()] = temp_data
-                proj_id = proj['_id']
-                query = {'_id': ObjectId(proj_id)}
-                new_val = {"$set": {'project_downloads': project_download_data}}
-                collection_handle.update_one(query, new_val)
-        if check_if_db_field_exists(proj, 'sample_downloads'):
-            sample_download_data = proj['sample_downloads']
-            if isinstance(sample_download_data, int):
-                if sample_download_data > 0:
-                    # Migration for sample downloads format
-                    temp_data = sample_download_data
-                    sample_download_data = dict()
-                    sample_download_data[get_date_short()] = temp_data
-                    proj_id = proj['_id']
-                    query = {'_id': ObjectId(proj_id)}
-                    new_val = {"$set": {'sample_downloads': sample_download_data}}
-                    collection_handle.update_one(query, new_val)
-
-    # Calculate stats
     for project in public_projects:
-        project['sample_metadata_available'] = has_sample_metadata(project)
-        if 'project_downloads' in project:
-            # Process download stats
-            pass
-        else:
+        prepare_project_linkid(project)
+        if 'project_downloads' not in project:
             project['project_downloads'] = {}
 
         if 'sample_downloads' in project:
@@ -544,7 +530,8 @@ def site_stats_regenerate(request):
 
 def project_stats_download(request):
     # Get public and private project data
-    public_projects = list(collection_handle.find({'private': {'$in': [False, 'public']}, 'delete': False, 'current': True}))
+    public_projects = merge_counts(list(collection_handle.find(
+        {'private': {'$in': [False, 'public']}, 'delete': False, 'current': True}, {'runs': 0})))
     for project in public_projects:
         if not 'project_downloads' in project:
             project['project_downloads_sum'] = 0
@@ -646,6 +633,7 @@ def admin_permanent_delete_project(project_id, project, project_name):
     # Final step, delete the project
     try:
         collection_handle.delete_one(query)
+        drop_project_refs(project_id)
     except:
         logging.exception('Problem deleting Project document from Mongo.')
         error_message = error_message + " Problem deleting Project document from Mongo. "
@@ -772,6 +760,7 @@ def admin_delete_project(request):
             query = {'_id': ObjectId(project_id)}
             new_val = {"$set": {'delete': False}}
             collection_handle.update_one(query, new_val)
+            invalidate_project_pages(project_id)
             error_message = f"Project {project_name} restored."
 
         elif deleteit and (action == 'delete'):
@@ -946,6 +935,7 @@ def make_project_current(request, project_id):
                 {'_id': ObjectId(project_id)},
                 {'$set': {'current': True}}
             )
+            invalidate_project_pages(project_id)
             
             if result.modified_count > 0:
                 add_project_to_site_statistics(
@@ -1026,47 +1016,45 @@ def admin_project_files_report(request):
                 logger.info(f"Deleted saved report {report_id}")
             return redirect('/admin-project-files-report/')
     
+    # Saved reports are listed without their rows, which can be large.
+    all_saved_reports = list(saved_reports_collection.find({}, {'project_reports': 0}).sort('created_at', -1))
+
+    # Convert _id to string for Django templates (can't access underscore-prefixed attributes)
+    for report in all_saved_reports:
+        report['id_str'] = str(report['_id'])
+
     # Check if we're loading a saved report
     load_report_id = request.GET.get('load_report')
     if load_report_id:
         saved_report = saved_reports_collection.find_one({'_id': ObjectId(load_report_id)})
         if saved_report:
-            # Get list of all saved reports
-            all_saved_reports = list(saved_reports_collection.find().sort('created_at', -1))
-            
-            # Convert _id to string for Django templates (can't access underscore-prefixed attributes)
-            for report in all_saved_reports:
-                report['id_str'] = str(report['_id'])
-            
+            progress = get_report_progress(load_report_id)
+
             # Convert project_reports to JSON for JavaScript
             import json
             project_reports_json = json.dumps(saved_report['project_reports'])
-            
+
             return render(request, 'pages/admin_project_files_report.html', {
                 'project_reports': saved_report['project_reports'],
                 'project_reports_json': project_reports_json,
                 's3_enabled': saved_report['s3_enabled'],
                 'projects_with_local_tar': saved_report['projects_with_local_tar'],
                 'projects_with_s3_tar': saved_report['projects_with_s3_tar'],
+                'projects_with_gridfs_tar': saved_report.get('projects_with_gridfs_tar'),
                 'file_pattern': saved_report['file_pattern'],
                 'user': request.user,
                 'SITE_TITLE': settings.SITE_TITLE,
                 'saved_reports': all_saved_reports,
                 'is_loaded_report': True,
+                'loaded_report_id': load_report_id,
                 'loaded_report_date': saved_report['created_at'],
+                'report_progress': progress,
                 **audit_ctx,
             })
-    
+
     # Check if file_pattern parameter is provided
     file_pattern = request.GET.get('file_pattern', '').strip()
-    
-    # Get list of all saved reports
-    all_saved_reports = list(saved_reports_collection.find().sort('created_at', -1))
-    
-    # Convert _id to string for Django templates (can't access underscore-prefixed attributes)
-    for report in all_saved_reports:
-        report['id_str'] = str(report['_id'])
-    
+
     # If no file_pattern provided, just show the empty form
     if not file_pattern:
         s3_enabled = hasattr(settings, 'USE_S3_DOWNLOADS') and settings.USE_S3_DOWNLOADS
@@ -1082,149 +1070,23 @@ def admin_project_files_report(request):
             'saved_reports': all_saved_reports,
             **audit_ctx,
         })
-    
-    logger.info("Generating project files report...")
-    logger.info(f"Searching for files matching pattern: {file_pattern}")
-    
-    # Get all projects (public and private)
-    all_projects = list(collection_handle.find({'current': True, 'delete': False}))
-    
-    # Initialize S3 client if S3 downloads are enabled
-    s3_client = None
-    s3_enabled = hasattr(settings, 'USE_S3_DOWNLOADS') and settings.USE_S3_DOWNLOADS
-    
-    if s3_enabled:
-        try:
-            session = boto3.Session(profile_name=settings.AWS_PROFILE_NAME)
-            s3_client = session.client('s3')
-        except Exception as e:
-            logger.error(f"Failed to initialize S3 client: {e}")
-            s3_enabled = False
-    
-    project_reports = []
-    
-    for project in all_projects:
-        project_id = str(project['_id'])
-        project_name = project.get('project_name', 'Unknown')
-        is_private = project.get('private', True)
-        
-        # Initialize report data for this project
-        report = {
-            'project_id': project_id,
-            'project_name': project_name,
-            'is_private': is_private,
-            'has_local_tar': False,
-            'has_s3_tar': False,
-            'local_ecDNA_files': [],
-            's3_ecDNA_files': [],
-            'gridfs_ecDNA_files': []
-        }
-        
-        # Check for local tar file
-        local_tar_path = None
-        if os.path.exists(f"../tmp/{project_id}/"):
-            local_tar_path = f"../tmp/{project_id}/{project_id}.tar.gz"
-        else:
-            local_tar_path = f"tmp/{project_id}/{project_id}.tar.gz"
-        
-        if os.path.exists(local_tar_path):
-            report['has_local_tar'] = True
-        
-        # Check for S3 tar file
-        if s3_enabled:
-            s3_tar_key = f'{settings.S3_DOWNLOADS_BUCKET_PATH}{project_id}/{project_id}.tar.gz'
-            try:
-                s3_client.head_object(Bucket=settings.S3_DOWNLOADS_BUCKET, Key=s3_tar_key)
-                report['has_s3_tar'] = True
-            except:
-                report['has_s3_tar'] = False
-        
-        # Check for local ecDNA context files
-        local_project_path = None
-        if os.path.exists(f"../tmp/{project_id}/"):
-            local_project_path = f"../tmp/{project_id}/"
-        else:
-            local_project_path = f"tmp/{project_id}/"
-        
-        if os.path.exists(local_project_path):
-            for root, dirs, files in os.walk(local_project_path):
-                for file in files:
-                    if file_pattern in file:
-                        abs_path = os.path.abspath(os.path.join(root, file))
-                        report['local_ecDNA_files'].append(abs_path)
-        
-        # Check for S3 ecDNA context files
-        if s3_enabled:
-            s3_project_prefix = f'{settings.S3_DOWNLOADS_BUCKET_PATH}{project_id}/'
-            try:
-                paginator = s3_client.get_paginator('list_objects_v2')
-                for page in paginator.paginate(Bucket=settings.S3_DOWNLOADS_BUCKET, Prefix=s3_project_prefix):
-                    if 'Contents' in page:
-                        for obj in page['Contents']:
-                            key = obj['Key']
-                            if file_pattern in key:
-                                # Get relative path (remove project prefix)
-                                relative_key = key[len(s3_project_prefix):]
-                                report['s3_ecDNA_files'].append(relative_key)
-            except Exception as e:
-                logger.error(f"Failed to list S3 objects for project {project_id}: {e}")
-        
-        # Check for ecDNA context files in GridFS tar
-        if 'tarfile' in project:
-            try:
-                tar_contents = list_project_tar_contents(project_id)
-                # Filter for files containing the pattern
-                ecDNA_files = [f for f in tar_contents if file_pattern in f]
-                report['gridfs_ecDNA_files'] = ecDNA_files
-            except Exception as e:
-                logger.error(f"Failed to list GridFS tar contents for project {project_id}: {e}")
-        
-        project_reports.append(report)
-    
-    # Calculate summary statistics
-    projects_with_local_tar = sum(1 for r in project_reports if r['has_local_tar'])
-    projects_with_s3_tar = sum(1 for r in project_reports if r['has_s3_tar']) if s3_enabled else 0
-    
-    logger.info(f"Generated report for {len(project_reports)} projects")
-    
-    # Automatically save the report
-    import json
-    saved_report = {
-        'file_pattern': file_pattern,
-        'created_at': timezone.now(),
-        'created_by': request.user.username,
-        'project_reports': project_reports,
-        's3_enabled': s3_enabled,
-        'projects_with_local_tar': projects_with_local_tar,
-        'projects_with_s3_tar': projects_with_s3_tar,
-        'total_projects': len(project_reports)
-    }
-    
-    saved_reports_collection.insert_one(saved_report)
-    logger.info(f"Auto-saved report for pattern '{file_pattern}' by {request.user.username}")
-    
-    # Refresh the saved reports list to include the newly saved report
-    all_saved_reports = list(saved_reports_collection.find().sort('created_at', -1))
-    for report in all_saved_reports:
-        report['id_str'] = str(report['_id'])
-    
-    # Convert project_reports to JSON for JavaScript
-    project_reports_json = json.dumps(project_reports)
-    
-    return render(request, 'pages/admin_project_files_report.html', {
-        'project_reports': project_reports,
-        'project_reports_json': project_reports_json,
-        's3_enabled': s3_enabled,
-        'projects_with_local_tar': projects_with_local_tar,
-        'projects_with_s3_tar': projects_with_s3_tar,
-        'file_pattern': file_pattern,
-        'user': request.user,
-        'SITE_TITLE': settings.SITE_TITLE,
-        'saved_reports': all_saved_reports,
-        'is_loaded_report': False,
-        'report_auto_saved': True,
-        **audit_ctx,
-    })
+
+    # The report is built in the background and saved as it goes; the loaded
+    # report page polls admin_project_files_report_status until it completes.
+    report_id = start_report(file_pattern, request.user.username)
+    return redirect(f'/admin-project-files-report/?load_report={report_id}')
+
+
+@user_passes_test(lambda u: u.is_staff, login_url="/notfound/")
+def admin_project_files_report_status(request, report_id):
+    """Progress of a project files report, for the report page to poll."""
+    try:
+        progress = get_report_progress(report_id)
+    except Exception:
+        progress = None
+    if progress is None:
+        return JsonResponse({'error': 'Report not found'}, status=404)
+    return JsonResponse(progress)
 
 
 def _get_audit_log_context(request):
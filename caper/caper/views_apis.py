@@ -4,6 +4,7 @@ This module contains all API endpoints for file uploads and project management.
 """
 
 import glob
+import io
 import logging
 import math
 import os
@@ -33,11 +34,12 @@ from .forms import RunForm
 from .utils import (
     collection_handle, get_one_project, get_one_project_sans_runs, form_to_dict,
     get_latest_project_version, normalize_visibility_field, is_project_private,
-    fs_handle,
+    fs_handle, get_s3_client,
 )
 from .project_version_cleanup import retarget_deleted_version_tombstones
 from .extra_metadata import *
 from .background_tasks import get_background_task_status
+from . import download_jobs, gridfs_refs, project_counters, sample_append, upload_sessions
 
 
 def parse_project_members(request):
@@ -110,13 +112,13 @@ class FileUploadView(APIView):
                     for _pf in post_files:
                         os.remove(_pf)
 
-                    helper_thread = Thread(target=self.api_helper, args=(form, current_user, file , api_id, actual_proj_name, True))
+                    helper_thread = Thread(target=FileUploadView().api_helper, args=(form, current_user, file , api_id, actual_proj_name, True))
                     helper_thread.start()
             else:
                 ## no multipart, just run the api helper:
                 file = open(os.path.join(api_dir, request_file.name), 'rb')
                 actual_proj_name = request_file.name.split('.')[0]
-                helper_thread = Thread(target=self.api_helper, args=(form, current_user,file, api_id, actual_proj_name))
+                helper_thread = Thread(target=FileUploadView().api_helper, args=(form, current_user,file, api_id, actual_proj_name))
                 helper_thread.start()
 
             print('hanging up now')
@@ -133,7 +135,7 @@ class FileUploadView(APIView):
         """
         from .views import (
             create_project_helper, extract_project_files,
-            upload_file_to_s3
+            sync_project_tarball_to_s3
         )
         
         logging.info('starting api helper')
@@ -142,6 +144,7 @@ class FileUploadView(APIView):
             project['project_name'] = actual_proj_name
         logging.info('the project is here: ')
         new_id = collection_handle.insert_one(project)
+        gridfs_refs.record_project_refs(new_id.inserted_id, project)
         logging.info(str(new_id))
         project_data_path = os.path.join(settings.MEDIA_ROOT, api_id)
         # move the project location to a new name using the UUID to prevent name collisions
@@ -159,13 +162,126 @@ class FileUploadView(APIView):
         extract_thread.start()
 
         if settings.USE_S3_DOWNLOADS:
-            # load the zip asynch to S3 for later use
-            file_location = f'{project_data_path}/{request_file.name}'
-
-            s3_thread = Thread(target=upload_file_to_s3, args=(f'{request_file.name}', f'{new_id.inserted_id}/{new_id.inserted_id}.tar.gz'))
+            # copy the stored tarball asynch to S3 for later use
+            s3_thread = Thread(target=sync_project_tarball_to_s3, args=(new_id.inserted_id,))
             s3_thread.start()
 
 
+def _upload_session_error(exc):
+    return Response({'error': str(exc), **exc.details}, status=exc.status_code)
+
+
+class UploadSessionCreateView(APIView):
+    """
+    POST /upload_api/sessions/ — open a resumable upload (see caper/upload_sessions.py).
+
+    Takes the same project form fields as POST /upload_api/ (project_name,
+    description, publication_link, private, project_members, alias,
+    accept_license) plus:
+
+      file_name   name of the tarball being uploaded (required)
+      total_size  its size in bytes (required)
+      part_size   bytes per part (optional; every part but the last is this size)
+      sha256      SHA-256 of the whole file (optional; checked at finalize)
+
+    The form is validated here, before any data is sent, rather than after
+    the last part has arrived.
+    """
+    parser_class = (MultiPartParser,)
+    permission_classes = []
+
+    def post(self, request, format=None):
+        project_members = parse_project_members(request)
+        if not project_members:
+            return Response({'error': 'project_members is required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        form_data = {field: request.POST.get(field) for field in RunForm.Meta.fields
+                     if field in request.POST}
+        form_data['project_members'] = ','.join(project_members)
+        form = RunForm(form_data)
+        if not form.is_valid():
+            return Response(form.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            manifest = upload_sessions.create_session(
+                request.POST.get('file_name'), request.POST.get('total_size'),
+                form_data, project_members[0],
+                part_size=request.POST.get('part_size'), sha256=request.POST.get('sha256'),
+            )
+        except upload_sessions.UploadSessionError as e:
+            return _upload_session_error(e)
+        return Response({
+            'session_id': manifest['session_id'],
+            'part_size': manifest['part_size'],
+            'part_count': manifest['part_count'],
+            'expires_at': manifest['expires_at'],
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionStatusView(APIView):
+    """GET /upload_api/sessions/<session_id>/ — received and missing parts."""
+    permission_classes = []
+
+    def get(self, request, session_id):
+        try:
+            return Response(upload_sessions.session_status(session_id))
+        except upload_sessions.UploadSessionError as e:
+            return _upload_session_error(e)
+
+
+class UploadSessionPartView(APIView):
+    """
+    PUT /upload_api/sessions/<session_id>/parts/<part_number>/ — the raw bytes
+    of one part, with its hex SHA-256 in the X-Part-SHA256 header.
+
+    201 when the part was stored, 200 when the session already held it with
+    that digest (so a client unsure whether a PUT landed can simply resend it),
+    409 when it holds that part with a different digest, 422 when the body
+    does not match the digest.  The body is streamed to disk, never parsed.
+    """
+    permission_classes = []
+
+    def put(self, request, session_id, part_number):
+        try:
+            written = upload_sessions.put_part(
+                session_id, part_number, request.stream or io.BytesIO(),
+                request.META.get('HTTP_X_PART_SHA256'),
+            )
+        except upload_sessions.UploadSessionError as e:
+            return _upload_session_error(e)
+        return Response({'part_number': part_number, 'stored': written},
+                        status=status.HTTP_201_CREATED if written else status.HTTP_200_OK)
+
+
+class UploadSessionCompleteView(APIView):
+    """
+    POST /upload_api/sessions/<session_id>/complete/ — reassemble the parts and
+    create the project, through the same api_helper as POST /upload_api/.
+
+    409 with ``missing_parts`` if any part has not arrived.  Repeating the
+    call after success returns 200 without creating the project twice.
+    """
+
+    permission_classes = []
+
+    def post(self, request, session_id, format=None):
+        try:
+            manifest, reconstructed = upload_sessions.finalize_session(session_id)
+        except upload_sessions.UploadSessionError as e:
+            return _upload_session_error(e)
+        if reconstructed is None:
+            return Response({'Message': 'Upload already finalized; project creation is under way.'},
+                            status=status.HTTP_200_OK)
+
+        form = RunForm(manifest['form_data'])
+        form.is_valid()
+        file = open(reconstructed, 'rb')
+        helper_thread = Thread(target=FileUploadView().api_helper, args=(
+            form, manifest['user'], file, session_id, manifest['form_data']['project_name'], True))
+        helper_thread.start()
+        return Response({'Message': 'Successfully uploaded. Project creation will take more than 2 mins.'},
+                        status=status.HTTP_201_CREATED)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ProjectFileAddView(APIView):
     parser_class = (MultiPartParser,)
@@ -232,20 +348,116 @@ class ProjectFileAddView(APIView):
 
 
     def process_file_in_background(self, request, project, username, uploaded_file, api_id):
+        from .views import project_update, project_delete
+
+        project_uuid = project['linkid']
+        tmp_project_data_path = os.path.join(settings.MEDIA_ROOT, api_id)
+        user_identifier = request.data.get('username')
+        user = User.objects.get(Q(username=user_identifier) | Q(email=user_identifier))
+        uploaded_file_path = os.path.join(tmp_project_data_path, uploaded_file.name)
+
+        try:
+            # Only the new samples are aggregated and stored; the existing
+            # samples' rows and GridFS files are shared with the new version.
+            new_id = sample_append.append_samples(
+                project, uploaded_file_path, os.path.join(tmp_project_data_path, 'append'),
+                self.previous_versions(project))
+            if new_id is None:
+                alert_message = "Edit project failed. Please ensure all uploaded samples have the same reference genome and are valid AmpliconSuite results."
+            else:
+                self.request.user = user
+                project_update(self.request, project_uuid)
+                project_delete(self.request, project_uuid)
+                alert_message = self.finish_new_version(project, new_id)
+        except sample_append.AppendFallback as reason:
+            logging.info(f"Re-aggregating project {project_uuid} to add samples: {reason}")
+            alert_message = self.reaggregate_project(request, project, user, uploaded_file, api_id)
+        except Exception as e:
+            logging.error(e)
+            alert_message = "Edit project failed. Error performing aggregation. Please ensure all uploaded samples are valid AmpliconSuite results."
+
+        logging.error("Preparing to send  email with status: "+ alert_message)
+        form_dict = {}
+        # add details for the template
+        form_dict['SITE_TITLE'] = settings.SITE_TITLE
+        form_dict['SITE_URL'] = settings.SITE_URL
+        form_dict['sharing_user_email'] = user.email
+        form_dict['project_name'] = project.get('project_name', project_uuid)
+        form_dict['project_id'] = project_uuid
+        form_dict['alert_message'] = alert_message
+
+        html_message = render_to_string('contacts/project_api_file_added.html', form_dict)
+        plain_message = strip_tags(html_message)
+
+        # send_mail(subject = subject, message = body, from_email = settings.EMAIL_HOST_USER_SECRET, recipient_list = [settings.RECIPIENT_ADDRESS])
+        email = EmailMessage(
+            f"Project update on {form_dict['project_name']}",
+            html_message,
+            settings.EMAIL_HOST_USER,
+            [user.email],
+            reply_to=[settings.EMAIL_HOST_USER]
+        )
+        email.content_subtype = "html"
+        email.send(fail_silently=False)
+        logging.error("Finished email sent")
+
+    @staticmethod
+    def previous_versions(project):
+        """Return the new version's ``previous_versions``: the current one's plus itself."""
+        return list(project.get('previous_versions', [])) + [{
+            'date': str(project['date']),
+            'linkid': str(project['linkid']),
+            'ASP_version': project.get('ASP_version', 'NA'),
+            'AA_version': project.get('AA_version', 'NA'),
+            'AC_version': project.get('AC_version', 'NA'),
+            'aggregator_version': project.get('aggregator_version', 'NA'),
+        }]
+
+    def finish_new_version(self, project, new_id):
+        """Point the old version's followers at the new one; returns the status message."""
+        from .views import invalidate_project_coamp_graphs
+
+        new_project_uuid = str(new_id.inserted_id)
+        retarget_count = retarget_deleted_version_tombstones(
+            collection_handle,
+            str(project['linkid']),
+            new_project_uuid,
+        )
+        if retarget_count:
+            logging.info(
+                f"Retargeted {retarget_count} deleted-version tombstones "
+                f"from {project['linkid']} to {new_project_uuid}"
+            )
+
+        # Drop the superseded version's cached co-amplification graph(s)
+        invalidate_project_coamp_graphs(str(project['linkid']))
+
+        # Notify subscribers about the project update
+        try:
+            from .user_preferences import notify_subscribers_of_project_update
+            new_project = get_one_project_sans_runs(new_project_uuid)
+            new_sample_count = new_project.get('sample_count', 0)
+            notify_subscribers_of_project_update(project, new_id.inserted_id, new_sample_count)
+        except Exception as notify_error:
+            logging.error(f"Failed to notify subscribers of project update: {str(notify_error)}")
+        return f"Aggregation successful. New samples added to project version: {new_project_uuid}"
+
+    def reaggregate_project(self, request, project, user, uploaded_file, api_id):
+        """
+        Add the uploaded samples by aggregating them together with the whole
+        current project and creating the new version from scratch.
+
+        Returns the status message for the email to the user.
+        """
         from django.core.files.uploadedfile import TemporaryUploadedFile
         # sys.path is already primed for AGGREGATOR_DEV_PATH in settings.py
         from AmpliconSuiteAggregator import Aggregator
         from .views import (
-            project_update, project_delete, download_file,
-            _create_project, invalidate_project_coamp_graphs
+            project_update, project_delete, download_file, _create_project
         )
 
         project_uuid = project['linkid']
         tmp_project_data_path = os.path.join(settings.MEDIA_ROOT, api_id)
-        user_identifier = request.data.get('username')
-        user = User.objects.get(Q(username=user_identifier) | Q(email=user_identifier))
-
-
 
         alert_message = None
         project_data_path = tmp_project_data_path
@@ -299,21 +511,9 @@ class ProjectFileAddView(APIView):
                 update_project = project_update(self.request, project_uuid)
                 delete_project = project_delete(self.request, project_uuid)
 
-                new_prev_versions = []
-                if 'previous_versions' in project:
-                    new_prev_versions = project['previous_versions']
-
-                new_prev_versions.append({
-                    'date': str(project['date']),
-                    'linkid': str(project['linkid']),
-                    'ASP_version': project.get('ASP_version', 'NA'),
-                    'AA_version': project.get('AA_version', 'NA'),
-                    'AC_version': project.get('AC_version', 'NA'),
-                    'aggregator_version': project.get('aggregator_version', 'NA'),
-                })
+                new_prev_versions = self.previous_versions(project)
                 # transfer the view and downloads counts to the new project version
-                views = project['views']
-                downloads = project['downloads']
+                views, downloads = project_counters.with_counts(project, cached=False)
                 old_subscribers = project.get('subscribers', [])
                 form_data = {
                     'project_name': project.get('project_name', ''),
@@ -356,58 +556,13 @@ class ProjectFileAddView(APIView):
                         logging.error(f"Failed to restore stats after _create_project failure: {stats_err}")
                     alert_message = "Edit project failed. Could not create new project version."
                 elif new_id is not None:
-                    new_project_uuid = str(new_id.inserted_id)
-                    retarget_count = retarget_deleted_version_tombstones(
-                        collection_handle,
-                        str(project['linkid']),
-                        new_project_uuid,
-                    )
-                    if retarget_count:
-                        logging.info(
-                            f"Retargeted {retarget_count} deleted-version tombstones "
-                            f"from {project['linkid']} to {new_project_uuid}"
-                        )
-                    alert_message = f"Aggregation successful. New samples added to project version: {new_project_uuid}"
-
-                    # Drop the superseded version's cached co-amplification graph(s)
-                    invalidate_project_coamp_graphs(str(project['linkid']))
-
-                    # Notify subscribers about the project update
-                    try:
-                        from .user_preferences import notify_subscribers_of_project_update
-                        new_project = get_one_project(new_project_uuid)
-                        new_sample_count = new_project.get('sample_count', len(new_project.get('runs', {})))
-                        notify_subscribers_of_project_update(project, new_id.inserted_id, new_sample_count)
-                    except Exception as notify_error:
-                        logging.error(f"Failed to notify subscribers of project update: {str(notify_error)}")
+                    alert_message = self.finish_new_version(project, new_id)
         except Exception as e:
             logging.error(e)
             alert_message = "Edit project failed. Error performing aggregation. Please ensure all uploaded samples are valid AmpliconSuite results."
 
-        logging.error("Preparing to send  email with status: "+ alert_message)
-        form_dict = {}
-        # add details for the template
-        form_dict['SITE_TITLE'] = settings.SITE_TITLE
-        form_dict['SITE_URL'] = settings.SITE_URL
-        form_dict['sharing_user_email'] = user.email
-        form_dict['project_name'] = project.get('project_name', project_uuid)
-        form_dict['project_id'] = project_uuid
-        form_dict['alert_message'] = alert_message
+        return alert_message
 
-        html_message = render_to_string('contacts/project_api_file_added.html', form_dict)
-        plain_message = strip_tags(html_message)
-
-        # send_mail(subject = subject, message = body, from_email = settings.EMAIL_HOST_USER_SECRET, recipient_list = [settings.RECIPIENT_ADDRESS])
-        email = EmailMessage(
-            f"Project update on {form_dict['project_name']}",
-            html_message,
-            settings.EMAIL_HOST_USER,
-            [user.email],
-            reply_to=[settings.EMAIL_HOST_USER]
-        )
-        email.content_subtype = "html"
-        email.send(fail_silently=False)
-        logging.error("Finished email sent")
 
 
 # ===========================================================================
@@ -468,6 +623,22 @@ _PROJECT_METADATA_PROJECTION = {
 }
 
 
+def _request_base_url(request):
+    """Return 'scheme://host' for absolute URLs in API responses ('' if no host).
+
+    build_absolute_uri raises DisallowedHost in test environments; construct
+    the base URL directly from META to avoid that.  Behind the TLS-terminating
+    load balancer the WSGI scheme is 'http'; trust X-Forwarded-Proto (set by
+    the ELB) so URLs handed out are https.
+    """
+    forwarded_proto = request.META.get('HTTP_X_FORWARDED_PROTO', '')
+    scheme = (forwarded_proto.split(',')[0].strip()
+              or request.META.get('wsgi.url_scheme')
+              or ('https' if request.META.get('HTTPS') == 'on' else 'http'))
+    host = request.META.get('HTTP_HOST', '')
+    return f'{scheme}://{host}' if host else ''
+
+
 def _project_to_dict(project):
     """Serialize a MongoDB project document to a JSON-safe dict, omitting internal fields."""
     linkid = str(project.get('linkid') or project.get('_id', ''))
@@ -707,12 +878,9 @@ class ProjectDownloadView(APIView):
         # S3 path — redirect to a presigned URL
         if getattr(django_settings, 'USE_S3_DOWNLOADS', False):
             try:
-                import boto3
                 bucket_path = getattr(django_settings, 'S3_DOWNLOADS_BUCKET_PATH', '')
                 s3_key = f'{bucket_path}{linkid}/{linkid}.tar.gz'
-                session = boto3.Session(
-                    profile_name=getattr(django_settings, 'AWS_PROFILE_NAME', None) or 'default')
-                s3client = session.client('s3')
+                s3client = get_s3_client()
                 presigned_url = s3client.generate_presigned_url(
                     'get_object',
                     Params={'Bucket': django_settings.S3_DOWNLOADS_BUCKET, 'Key': s3_key},
@@ -785,16 +953,7 @@ class ProjectBatchDownloadView(APIView):
             return Response({'error': "'ids' must be a JSON array"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # build_absolute_uri raises DisallowedHost in test environments;
-        # construct the base URL directly from META to avoid that.
-        # Behind the TLS-terminating load balancer the WSGI scheme is 'http';
-        # trust X-Forwarded-Proto (set by the ELB) so download_url is https.
-        forwarded_proto = request.META.get('HTTP_X_FORWARDED_PROTO', '')
-        scheme = (forwarded_proto.split(',')[0].strip()
-                  or request.META.get('wsgi.url_scheme')
-                  or ('https' if request.META.get('HTTPS') == 'on' else 'http'))
-        host = request.META.get('HTTP_HOST', '')
-        base = f'{scheme}://{host}' if host else ''
+        base = _request_base_url(request)
         downloads, skipped = [], []
 
         for pid in ids:
@@ -815,6 +974,83 @@ class ProjectBatchDownloadView(APIView):
         return Response({'downloads': downloads, 'skipped': skipped})
 
 
+# ── GET /api/v1/jobs/<job_id>/ ──────────────────────────────────────────────
+
+class JobStatusView(APIView):
+    """
+    Report the progress of a background download job.
+
+    Jobs are submitted by POSTing to /batch-sample-download/ with async=true
+    (or emailResults=true, or more than download_jobs.SYNC_MAX_SAMPLES
+    samples), which returns the job id immediately.  The id is
+    only handed to a caller that passed the access check for every sample in
+    the job, so it is the credential here.
+
+    Response:
+      {
+        "id": "...",
+        "state": "running" | "completed" | "failed" | "stale",
+        "progress": {"stage": "resolving" | "archiving" | "done",
+                     "samples": 120, "bytes": 33554432},
+        "filename": "batch_samples_20260101_120000.zip",
+        "size": 123456789,                    # completed only
+        "expires_at": "2026-01-02T12:00:00",  # completed only
+        "download_url": "https://.../api/v1/jobs/<id>/download/"  # completed only
+      }
+
+    curl example:
+        curl https://ampliconrepository.org/api/v1/jobs/<job_id>/
+    """
+    permission_classes = []
+    throttle_classes = [ApiScopedRateThrottle]
+    throttle_scope = 'api_read'
+
+    def get(self, request, job_id):
+        job = download_jobs.get_job(job_id)
+        if job is None:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        if job['state'] == 'completed':
+            job['download_url'] = f'{_request_base_url(request)}/api/v1/jobs/{job_id}/download/'
+        return Response(job)
+
+
+# ── GET /api/v1/jobs/<job_id>/download/ ─────────────────────────────────────
+
+class JobDownloadView(APIView):
+    """
+    Stream the archive built by a completed download job.
+
+    curl example:
+        curl -L -O -J https://ampliconrepository.org/api/v1/jobs/<job_id>/download/
+    """
+    permission_classes = []
+    throttle_classes = [ApiScopedRateThrottle]
+    throttle_scope = 'api_download'
+
+    def get(self, request, job_id):
+        artifact = download_jobs.open_artifact(job_id)
+        if artifact is None:
+            job = download_jobs.get_job(job_id)
+            if job is not None and job['state'] == 'running':
+                return Response({'error': 'Job has not finished yet'},
+                                status=status.HTTP_409_CONFLICT)
+            return Response({'error': 'Download not found or expired'},
+                            status=status.HTTP_404_NOT_FOUND)
+        grid_out, filename = artifact
+
+        def _stream():
+            while True:
+                chunk = grid_out.read(32768)
+                if not chunk:
+                    break
+                yield chunk
+
+        response = StreamingHttpResponse(_stream(), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Content-Length'] = str(grid_out.length)
+        return response
+
+
 # ── /api/v1/token/ — token management (browser session) ─────────────────────
 
 class ApiTokenView(APIView):
@@ -890,6 +1126,7 @@ class BackgroundTaskStatusView(APIView):
     {
         "is_busy": true,
         "active_count": 2,
+        "queued_count": 0,
         "max_workers": 4,
         "tasks": [
             {"id": "...", "label": "Project Edit: <id>", "state": "running", "started_at": "..."},
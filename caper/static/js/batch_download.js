@@ -0,0 +1,75 @@
+// Batch sample downloads (POST /batch-sample-download/).
+//
+// Small selections come back as the zip itself.  Larger ones are built as a
+// background job: the server answers 202 with the job's status_url and
+// download_url, and the archive is fetched once the job has completed.
+(function () {
+    const POLL_INTERVAL_MS = 3000;
+
+    function saveBlob(blob, disposition) {
+        let filename = 'batch_samples.zip';
+        if (disposition && disposition.indexOf('filename=') !== -1) {
+            const match = disposition.match(/filename="?([^"]+)"?/);
+            if (match && match[1]) {
+                filename = match[1];
+            }
+        }
+        const url = window.URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.style.display = 'none';
+        a.href = url;
+        a.download = filename;
+        document.body.appendChild(a);
+        a.click();
+        window.URL.revokeObjectURL(url);
+        document.body.removeChild(a);
+    }
+
+    function waitForJob(job) {
+        return new Promise(function (resolve, reject) {
+            function poll() {
+                fetch(job.status_url, {credentials: 'same-origin'})
+                    .then(function (response) {
+                        if (!response.ok) {
+                            throw new Error('Download job status ' + response.status);
+                        }
+                        return response.json();
+                    })
+                    .then(function (status) {
+                        if (status.state === 'completed') {
+                            // An attachment response, so the page stays put.
+                            window.location.href = job.download_url;
+                            resolve(status);
+                        } else if (status.state === 'running') {
+                            setTimeout(poll, POLL_INTERVAL_MS);
+                        } else {
+                            reject(new Error(status.error || 'The download could not be prepared.'));
+                        }
+                    })
+                    .catch(reject);
+            }
+            poll();
+        });
+    }
+
+    // Submit formData (samples, csrfmiddlewaretoken, ...) and download the
+    // archive; the returned promise settles when the download has started.
+    window.caperBatchDownload = function (formData) {
+        return fetch('/batch-sample-download/', {
+            method: 'POST',
+            body: formData,
+            credentials: 'same-origin',
+            headers: {'X-Requested-With': 'XMLHttpRequest'}
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error('Download request failed with status ' + response.status);
+            }
+            if (response.status === 202) {
+                return response.json().then(waitForJob);
+            }
+            return response.blob().then(function (blob) {
+                saveBlob(blob, response.headers.get('Content-Disposition'));
+            });
+        });
+    };
+})();
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Performance test for building the project page's stacked bar chart.
+
+Times the row-at-a-time construction the chart used to have (groupby, one
+df.loc insert per padding row, two iterrows passes for the sort key) against
+caper.StackedBarChart.sorted_class_counts on synthetic projects, checks the
+two give the same rows, and times the full chart for context.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'caper'))
+
+from caper.StackedBarChart import CLASS_ORDER, CLASSES, StackedBarChart, sorted_class_counts
+
+FA_CMAP = {'ecDNA': '#B33A3A', 'FAN': '#D87524', 'BFB': '#A85A8A', 'Complex non-cyclic': '#C49A32',
+           'Linear amplification': '#A7ADB4', 'Virus': '#287C8E'}
+
+
+def legacy_class_counts(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The rows the chart was built from before sorted_class_counts.
+    """
+    seen_classes = set(df['Classification'])
+    none_samps = set(df[df['AA_amplicon_number'].isna()]['Sample_name'])
+
+    df2 = df.groupby(['Sample_name', 'Classification'])['Classification'].count().reset_index(name='Count')
+    for x in set(CLASSES).difference(seen_classes):
+        df2.loc[len(df2)] = [df2['Sample_name'][0], x, 0]
+    for x in none_samps:
+        df2.loc[len(df2)] = [x, "None", 0]
+
+    class_count_per_sample = defaultdict(lambda: defaultdict(int))
+    for _, row in df2.iterrows():
+        class_count_per_sample[row['Sample_name']][row['Classification']] = row['Count']
+    cc_tuples = {x: [-y[c] for c in CLASSES] for x, y in class_count_per_sample.items()}
+    df2['sort_order_col'] = [(CLASS_ORDER.get(row['Classification'], 99), cc_tuples[row['Sample_name']], row['Sample_name'])
+                             for _, row in df2.iterrows()]
+    df2.sort_values(inplace=True, by=['sort_order_col'])
+    return df2.drop(columns='sort_order_col').reset_index(drop=True)
+
+
+def make_project(num_samples: int, seed: int = 0) -> pd.DataFrame:
+    """
+    A synthetic aggregated_results table: 1-8 amplicons per sample.
+    """
+    rng = random.Random(seed)
+    classes = ['ecDNA', 'FAN', 'BFB', 'Complex non-cyclic', 'Linear amplification', 'Virus']
+    rows = []
+    for n in range(num_samples):
+        for amplicon in range(1, rng.randint(1, 8) + 1):
+            rows.append({'Sample_name': f'sample_{n}',
+                         'Classification': rng.choice(classes),
+                         'AA_amplicon_number': amplicon if rng.random() > 0.05 else np.nan})
+    df = pd.DataFrame(rows)
+    df['Sample_name'] = df['Sample_name'].astype(str)
+    return df
+
+
+def time_function(fn: Callable, df: pd.DataFrame, repeats: int) -> List[float]:
+    """
+    Run fn on a copy of df repeats times; returns the elapsed seconds of each run.
+    """
+    times = []
+    for _ in range(repeats):
+        data = df.copy()
+        start = time.time()
+        fn(data)
+        times.append(time.time() - start)
+    return times
+
+
+def print_results(num_samples: int, num_rows: int, results: Dict[str, List[float]]):
+    """
+    Pretty print the timings for one project size.
+    """
+    legacy = statistics.median(results['legacy'])
+    vectorized = statistics.median(results['vectorized'])
+    print(f"\n{'='*60}")
+    print(f"  {num_samples} samples ({num_rows} amplicons)")
+    print(f"{'='*60}")
+    print("Median times (seconds):")
+    print(f"  Row-at-a-time:   {legacy:.4f}s")
+    print(f"  Vectorized:      {vectorized:.4f}s")
+    print(f"  Improvement:     {legacy / vectorized:.1f}x {'faster' if legacy > vectorized else 'slower'}")
+    if results.get('chart'):
+        print(f"  Full chart:      {statistics.median(results['chart']):.4f}s")
+    print(f"{'='*60}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test stacked bar chart construction performance')
+    parser.add_argument('--samples', type=int, nargs='+', default=[100, 1000, 5000],
+                        help='Project sizes to test, in samples (default: 100 1000 5000)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Runs per measurement (default: 3)')
+    parser.add_argument('--no-chart', action='store_true',
+                        help='Skip timing the full chart')
+
+    args = parser.parse_args()
+
+    print(f"\n{'='*60}")
+    print("  Stacked Bar Chart Performance Test")
+    print(f"{'='*60}")
+    print(f"Project sizes:     {', '.join(str(n) for n in args.samples)} samples")
+    print(f"Repeats:           {args.repeats}")
+    print(f"{'='*60}")
+
+    for num_samples in args.samples:
+        df = make_project(num_samples)
+
+        expected = legacy_class_counts(df.copy())
+        actual = sorted_class_counts(df.copy())
+        if not expected.equals(actual):
+            print(f"✗ Rows differ from the row-at-a-time construction for {num_samples} samples")
+            sys.exit(1)
+        print(f"\n✓ Same rows as the row-at-a-time construction for {num_samples} samples")
+
+        results = {
+            'legacy': time_function(legacy_class_counts, df, args.repeats),
+            'vectorized': time_function(sorted_class_counts, df, args.repeats),
+        }
+        if not args.no_chart:
+            results['chart'] = time_function(lambda data: StackedBarChart(data, FA_CMAP), df, args.repeats)
+        print_results(num_samples, len(df), results)
+
+
+if __name__ == '__main__':
+    main()
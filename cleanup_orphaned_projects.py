@@ -21,6 +21,11 @@ is cleaned up from:
   - Local disk (tmp/<project_id>/ directory)
   - S3 (if configured)
 
+GridFS files an orphan shares with another project (versions can reuse
+file ids) are kept when the gridfs_refs index has been built (see
+purge-local-db.py --rebuild-gridfs-refs); the orphan's index entries are
+removed with its document.
+
 After cleaning orphaned project documents the script also scans the
 tmp/ directory for UUID-like folders that have no corresponding project
 in the database and removes them (and their S3 counterparts).
@@ -42,6 +47,7 @@ import sys
 import shutil
 import logging
 import argparse
+import time
 
 from bson import ObjectId
 from pymongo import MongoClient
@@ -68,6 +74,16 @@ OBJECTID_RE = re.compile(r'^[0-9a-fA-F]{24}$')
 # Python uuid4().hex: exactly 32 hex characters
 UUID_HEX_RE = re.compile(r'^[0-9a-fA-F]{32}$')
 
+# Maintained by the app (caper/caper/gridfs_refs.py) and purge-local-db.py.
+REFS_COLLECTION = 'gridfs_refs'
+CHECKPOINTS_COLLECTION = 'purge_checkpoints'
+REFS_BACKFILL_CHECKPOINT = 'gridfs_refs_backfill'
+
+# Fields of an orphaned project read in Phase 2.
+ORPHAN_PROJECTION = {
+    'project_name': 1, 'current': 1, 'delete': 1, 'tarfile': 1, 'runs': 1,
+}
+
 
 # ─────────────────────────────────────────────────────────────────────
 # Helpers
@@ -203,18 +219,43 @@ def delete_s3_prefix(s3_client, bucket, prefix, dry_run=False):
     return deleted
 
 
-def delete_gridfs_files_for_project(fs_handle, project, dry_run=False):
+def refs_index_ready(db_handle):
+    """True once gridfs_refs has been fully backfilled."""
+    checkpoint = db_handle[CHECKPOINTS_COLLECTION].find_one({'_id': REFS_BACKFILL_CHECKPOINT})
+    return bool(checkpoint and checkpoint.get('completed_at'))
+
+
+def files_shared_with_other_projects(db_handle, project_id):
+    """
+    Return the ids (str) of GridFS files *project_id* references that some
+    other project also references, according to gridfs_refs.
+    """
+    refs = db_handle[REFS_COLLECTION]
+    own = refs.distinct('file_id', {'project_id': str(project_id)})
+    if not own:
+        return set()
+    return {
+        str(file_id) for file_id in refs.distinct(
+            'file_id', {'file_id': {'$in': own}, 'project_id': {'$ne': str(project_id)}})
+    }
+
+
+def delete_gridfs_files_for_project(fs_handle, project, dry_run=False, keep_ids=None):
     """
     Delete GridFS files owned by *project*:
       - the project tarfile
       - per-sample feature files (PNG, PDF, BED, graph, cycles, …)
+    Files whose id (str) is in *keep_ids* are left alone.
     Returns total count of files deleted / that would be deleted.
     """
     count = 0
+    keep_ids = keep_ids or set()
 
     # ── tarfile ──────────────────────────────────────────────────────
     tar_id = project.get('tarfile')
-    if tar_id:
+    if tar_id and str(tar_id) in keep_ids:
+        logger.debug(f"  Keeping GridFS tarfile shared with another project: {tar_id}")
+    elif tar_id:
         try:
             if dry_run:
                 logger.info(f"  [DRY RUN] Would delete GridFS tarfile: {tar_id}")
@@ -247,6 +288,8 @@ def delete_gridfs_files_for_project(fs_handle, project, dry_run=False):
                     continue
                 for key in feature_keys:
                     fid = feature.get(key)
+                    if fid and str(fid) in keep_ids:
+                        continue
                     if fid and fid != 'Not Provided':
                         try:
                             if dry_run:
@@ -296,6 +339,10 @@ def main():
     parser.add_argument(
         '--verbose', '-v', action='store_true',
         help='Enable DEBUG-level logging.')
+    parser.add_argument(
+        '--pause', type=float, default=0.0,
+        help='Seconds to sleep after each orphaned project, to limit load on '
+             'the database during production hours.')
     args = parser.parse_args()
 
     if args.verbose:
@@ -361,8 +408,8 @@ def main():
     protected_ids = collect_protected_ids(collection)
     logger.info(f"  Protected projects (reachable by app): {len(protected_ids)}")
 
-    all_projects = list(collection.find({}))
-    all_ids = {str(p['_id']) for p in all_projects}
+    # Ids only: orphaned documents are read one at a time in Phase 2.
+    all_ids = {str(p['_id']) for p in collection.find({}, {'_id': 1})}
     logger.info(f"  Total projects in database           : {len(all_ids)}")
 
     orphaned_ids = all_ids - protected_ids
@@ -377,8 +424,8 @@ def main():
     logger.info(f"    Previous versions / other reachable       : "
                 f"{len(protected_ids) - active_count - soft_del_count}")
 
-    orphaned_lookup = {str(p['_id']): p for p in all_projects
-                       if str(p['_id']) in orphaned_ids}
+    use_refs = refs_index_ready(db_handle)
+    logger.info(f"  gridfs_refs index available          : {use_refs}")
 
     # ═════════════════════════════════════════════════════════════════
     # PHASE 2 — Clean up orphaned projects
@@ -392,7 +439,10 @@ def main():
         logger.info("=" * 70)
 
         for idx, pid in enumerate(sorted(orphaned_ids), 1):
-            project = orphaned_lookup[pid]
+            project = collection.find_one({'_id': ObjectId(pid)}, ORPHAN_PROJECTION)
+            if project is None:
+                logger.info(f"  [{idx}/{len(orphaned_ids)}] {pid} already removed")
+                continue
             name = project.get('project_name', '<unnamed>')
             cur = project.get('current', 'NOT SET')
             dlt = project.get('delete', 'NOT SET')
@@ -402,8 +452,12 @@ def main():
             logger.info(f"    _id={pid}  current={cur}  delete={dlt}")
 
             # 2a. GridFS
+            keep_ids = files_shared_with_other_projects(db_handle, pid) if use_refs else set()
+            if keep_ids:
+                logger.info(f"    GridFS files shared with other projects (kept): {len(keep_ids)}")
             g = delete_gridfs_files_for_project(fs, project,
-                                                dry_run=args.dry_run)
+                                                dry_run=args.dry_run,
+                                                keep_ids=keep_ids)
             total_gridfs += g
             if g:
                 logger.info(f"    GridFS files "
@@ -425,10 +479,13 @@ def main():
             else:
                 try:
                     collection.delete_one({'_id': ObjectId(pid)})
+                    db_handle[REFS_COLLECTION].delete_many({'project_id': pid})
                     logger.info("    Deleted MongoDB document")
                 except Exception as e:
                     logger.error(f"    Failed to delete MongoDB document: {e}")
             total_mongo += 1
+            if args.pause:
+                time.sleep(args.pause)
 
         verb = "to remove" if args.dry_run else "removed"
         logger.info("")
@@ -13,23 +13,43 @@ Examples:
 
     # Legacy-style full project/GridFS purge, but explicit.
     python purge-local-db.py --all-project-data --db caper-dev --execute
+
+    # Build the gridfs_refs index once (resumable), then purge through it in
+    # rate-limited batches. Re-running with --resume continues where an
+    # interrupted purge stopped.
+    python purge-local-db.py --rebuild-gridfs-refs --execute
+    python purge-local-db.py --smart-gridfs-indexed --execute --pause 2 --resume
 """
 
 import argparse
 from collections import defaultdict
+import datetime
 import os
 import shutil
+import time
 
 import gridfs
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from cleanup_orphaned_projects import collect_protected_ids
 
 
 GRIDFS_COLLECTIONS = ('fs.files', 'fs.chunks')
+# Maintained by the app (caper/caper/gridfs_refs.py): one document per
+# (file_id, project_id, path) reference.
+REFS_COLLECTION = 'gridfs_refs'
+REFS_STALE_FLAG = 'gridfs_refs_stale'
+# Batch-download archives (caper/caper/download_jobs.py) are GridFS files
+# tagged download_artifact=<key> and have no gridfs_refs entry; one is live
+# while this collection still has a document with that key.
+ARTIFACTS_COLLECTION = 'download_artifacts'
+CHECKPOINTS_COLLECTION = 'purge_checkpoints'
+REFS_BACKFILL_CHECKPOINT = 'gridfs_refs_backfill'
+INDEXED_PURGE_CHECKPOINT = 'smart_gridfs_purge'
 APP_GRIDFS_KEYS = {
     'tarfile',
+    'tarfile_index',
     'AA PNG file',
     'AA PDF file',
     'Feature BED file',
@@ -121,7 +141,7 @@ def collect_gridfs_references_by_path(value, path=''):
 
 def reference_bucket(path):
     key = path.rsplit('.', 1)[-1]
-    if key == 'tarfile':
+    if key in {'tarfile', 'tarfile_index'}:
         return 'project tarfiles'
     if key in APP_GRIDFS_KEYS:
         return f'feature files: {key}'
@@ -163,9 +183,13 @@ def collect_project_referenced_ids(projects_collection, scope='reachable', strat
 
 
 def find_unreferenced_gridfs_files(db_handle, referenced_ids):
+    live_artifacts = {doc['_id'] for doc in db_handle[ARTIFACTS_COLLECTION].find({}, {'_id': 1})}
     unreferenced = []
-    for grid_file in db_handle['fs.files'].find({}, {'_id': 1, 'length': 1, 'filename': 1}):
+    for grid_file in db_handle['fs.files'].find(
+            {}, {'_id': 1, 'length': 1, 'filename': 1, 'download_artifact': 1}):
         file_id = str(grid_file['_id'])
+        if grid_file.get('download_artifact') in live_artifacts:
+            continue
         if file_id not in referenced_ids:
             unreferenced.append({
                 '_id': grid_file['_id'],
@@ -218,6 +242,254 @@ def smart_purge_gridfs(db_handle, execute=False, limit=None, scope='reachable',
     return count, total_bytes
 
 
+# ─────────────────────────────────────────────────────────────────────
+# gridfs_refs index: backfill and index-driven purge
+# ─────────────────────────────────────────────────────────────────────
+
+def collect_app_gridfs_refs(value, path='', parent_key=None):
+    """Yield (ObjectId, path) for ids in known GridFS fields, as the app records them."""
+    if parent_key in APP_GRIDFS_KEYS:
+        oid = object_id_string(value)
+        if oid:
+            yield ObjectId(oid), path
+        return
+
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from collect_app_gridfs_refs(child, f"{path}.{key}" if path else str(key), key)
+    elif isinstance(value, (list, tuple)):
+        for index, child in enumerate(value):
+            yield from collect_app_gridfs_refs(child, f"{path}.{index}", parent_key)
+
+
+def project_ref_ops(project):
+    project_id = str(project['_id'])
+    ops = []
+    for file_id, path in collect_app_gridfs_refs(
+            {key: value for key, value in project.items() if key != '_id'}):
+        ref = {'file_id': file_id, 'project_id': project_id, 'path': path}
+        ops.append(UpdateOne(ref, {'$setOnInsert': ref}, upsert=True))
+    return ops
+
+
+def ensure_refs_indexes(db_handle):
+    refs = get_collection_handle(db_handle, REFS_COLLECTION)
+    refs.create_index([('file_id', 1), ('project_id', 1), ('path', 1)], unique=True)
+    refs.create_index('project_id')
+
+
+def load_checkpoint(db_handle, name):
+    return get_collection_handle(db_handle, CHECKPOINTS_COLLECTION).find_one({'_id': name})
+
+
+def save_checkpoint(db_handle, name, **fields):
+    fields['updated_at'] = datetime.datetime.utcnow()
+    get_collection_handle(db_handle, CHECKPOINTS_COLLECTION).update_one(
+        {'_id': name}, {'$set': fields}, upsert=True)
+
+
+def index_projects(db_handle, query, batch_size=200, pause=0.0, on_batch=None):
+    """Record the GridFS refs of the projects matching *query*, in _id order and batches.
+
+    Only the GridFS-bearing fields are read. *on_batch(last_id, projects, refs)*
+    is called after each batch is written. Returns (projects, refs) written.
+    """
+    projects = get_collection_handle(db_handle, 'projects')
+    refs = get_collection_handle(db_handle, REFS_COLLECTION)
+    projection = {'tarfile': 1, 'tarfile_index': 1, 'runs': 1}
+    total_projects = total_refs = 0
+    batch = []
+
+    def write(batch):
+        nonlocal total_projects, total_refs
+        ops = [op for project in batch for op in project_ref_ops(project)]
+        if ops:
+            refs.bulk_write(ops, ordered=False)
+        ids = [project['_id'] for project in batch]
+        projects.update_many({'_id': {'$in': ids}, REFS_STALE_FLAG: True},
+                             {'$unset': {REFS_STALE_FLAG: ''}})
+        total_projects += len(batch)
+        total_refs += len(ops)
+        if on_batch:
+            on_batch(ids[-1], total_projects, total_refs)
+        if pause:
+            time.sleep(pause)
+
+    for project in projects.find(query, projection, batch_size=batch_size).sort('_id', 1):
+        batch.append(project)
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    return total_projects, total_refs
+
+
+def rebuild_gridfs_refs(db_handle, execute=False, batch_size=200, pause=0.0, resume=False):
+    """Backfill gridfs_refs from every project document, checkpointing after each batch."""
+    projects = get_collection_handle(db_handle, 'projects')
+    checkpoint = load_checkpoint(db_handle, REFS_BACKFILL_CHECKPOINT) if resume else None
+    query = {}
+    if checkpoint and checkpoint.get('last_id') is not None and not checkpoint.get('completed_at'):
+        query = {'_id': {'$gt': checkpoint['last_id']}}
+        print(f"Resuming gridfs_refs backfill after project {checkpoint['last_id']}")
+
+    remaining = projects.count_documents(query)
+    print(f"Projects to index: {remaining}")
+    if not execute:
+        print("DRY RUN: pass --execute to write gridfs_refs.")
+        return remaining
+
+    ensure_refs_indexes(db_handle)
+    if not query:
+        save_checkpoint(db_handle, REFS_BACKFILL_CHECKPOINT, started_at=datetime.datetime.utcnow(),
+                        last_id=None, completed_at=None)
+
+    def on_batch(last_id, done, refs):
+        save_checkpoint(db_handle, REFS_BACKFILL_CHECKPOINT, last_id=last_id)
+        print(f"Indexed {done}/{remaining} projects ({refs} references)...")
+
+    done, refs = index_projects(db_handle, query, batch_size=batch_size, pause=pause, on_batch=on_batch)
+    save_checkpoint(db_handle, REFS_BACKFILL_CHECKPOINT, completed_at=datetime.datetime.utcnow())
+    print(f"gridfs_refs backfill complete: {done} projects, {refs} references.")
+    return done
+
+
+def reindex_stale_projects(db_handle, batch_size=200):
+    """Re-record refs for projects whose ref write failed in the app."""
+    done, refs = index_projects(db_handle, {REFS_STALE_FLAG: True}, batch_size=batch_size)
+    if done:
+        print(f"Re-indexed {done} projects flagged {REFS_STALE_FLAG} ({refs} references).")
+    return done
+
+
+def orphan_scan_pipeline(after_id, uploaded_before, scan_batch):
+    """
+    One page of fs.files in _id order, each marked orphan if no gridfs_refs
+    entry names it and it is not a live download artifact.
+    """
+    match = {'uploadDate': {'$lt': uploaded_before}}
+    if after_id is not None:
+        match['_id'] = {'$gt': after_id}
+    return [
+        {'$match': match},
+        {'$sort': {'_id': 1}},
+        {'$limit': scan_batch},
+        {'$lookup': {
+            'from': REFS_COLLECTION,
+            'localField': '_id',
+            'foreignField': 'file_id',
+            'as': 'refs',
+        }},
+        # Files without download_artifact match no artifact (_id is never null).
+        {'$lookup': {
+            'from': ARTIFACTS_COLLECTION,
+            'localField': 'download_artifact',
+            'foreignField': '_id',
+            'as': 'artifacts',
+        }},
+        {'$project': {
+            'length': 1,
+            'filename': 1,
+            'orphan': {'$and': [
+                {'$eq': [{'$size': '$refs'}, 0]},
+                {'$eq': [{'$size': '$artifacts'}, 0]},
+            ]},
+        }},
+    ]
+
+
+def smart_purge_gridfs_indexed(db_handle, execute=False, limit=None, batch_size=500,
+                               pause=1.0, min_age_hours=24, resume=False):
+    """
+    Delete GridFS files with no gridfs_refs entry, scanning fs.files in
+    batches of *batch_size* with a server-side anti-join.  Download archives
+    are kept while their download_artifacts document exists.
+
+    Files younger than *min_age_hours* are never touched (their project may
+    still be extracting). Each candidate is re-checked against gridfs_refs
+    right before deletion. With --execute, progress is checkpointed after
+    every batch and *pause* seconds are slept between batches; --resume
+    continues after the last checkpointed file.
+    """
+    backfill = load_checkpoint(db_handle, REFS_BACKFILL_CHECKPOINT)
+    if not backfill or not backfill.get('completed_at'):
+        print("gridfs_refs has not been fully built; run --rebuild-gridfs-refs --execute first.")
+        return 0, 0
+    if execute:
+        reindex_stale_projects(db_handle)
+    elif get_collection_handle(db_handle, 'projects').find_one({REFS_STALE_FLAG: True}, {'_id': 1}):
+        print(f"Note: some projects are flagged {REFS_STALE_FLAG}; they are re-indexed before an --execute run.")
+
+    refs = get_collection_handle(db_handle, REFS_COLLECTION)
+    files = get_collection_handle(db_handle, 'fs.files')
+    fs_handle = gridfs.GridFS(db_handle)
+
+    after_id = None
+    totals = {'scanned': 0, 'orphans': 0, 'deleted': 0, 'bytes': 0}
+    checkpoint = load_checkpoint(db_handle, INDEXED_PURGE_CHECKPOINT) if resume else None
+    if checkpoint and not checkpoint.get('completed_at'):
+        after_id = checkpoint.get('last_id')
+        totals.update({key: checkpoint.get(key, 0) for key in totals})
+        uploaded_before = checkpoint['uploaded_before']
+        print(f"Resuming indexed purge after file {after_id}")
+    else:
+        uploaded_before = datetime.datetime.utcnow() - datetime.timedelta(hours=min_age_hours)
+        if execute:
+            save_checkpoint(db_handle, INDEXED_PURGE_CHECKPOINT, last_id=None, completed_at=None,
+                            uploaded_before=uploaded_before, started_at=datetime.datetime.utcnow(),
+                            **totals)
+
+    largest = []
+    while limit is None or totals['orphans'] < limit:
+        page = list(files.aggregate(orphan_scan_pipeline(after_id, uploaded_before, batch_size)))
+        if not page:
+            break
+        after_id = page[-1]['_id']
+        totals['scanned'] += len(page)
+        candidates = [f for f in page if f['orphan']]
+        if limit is not None and len(candidates) > limit - totals['orphans']:
+            candidates = candidates[:limit - totals['orphans']]
+            # Stop the checkpoint at the last file taken so --resume sees the rest.
+            after_id = candidates[-1]['_id']
+        if candidates:
+            # A reference may have been recorded since the scan.
+            still_referenced = set(refs.distinct('file_id', {'file_id': {'$in': [f['_id'] for f in candidates]}}))
+            candidates = [f for f in candidates if f['_id'] not in still_referenced]
+        totals['orphans'] += len(candidates)
+        largest = sorted(largest + candidates, key=lambda f: f.get('length', 0), reverse=True)[:20]
+
+        if execute:
+            for grid_file in candidates:
+                fs_handle.delete(grid_file['_id'])
+                totals['deleted'] += 1
+                totals['bytes'] += grid_file.get('length', 0)
+            save_checkpoint(db_handle, INDEXED_PURGE_CHECKPOINT, last_id=after_id, **totals)
+            print(f"Scanned {totals['scanned']} GridFS files, deleted {totals['deleted']}...")
+            if pause:
+                time.sleep(pause)
+        else:
+            totals['bytes'] += sum(f.get('length', 0) for f in candidates)
+
+    if execute and (limit is None or totals['orphans'] < limit):
+        save_checkpoint(db_handle, INDEXED_PURGE_CHECKPOINT, completed_at=datetime.datetime.utcnow())
+
+    print("Reference source: gridfs_refs index")
+    print(f"GridFS files scanned: {totals['scanned']}")
+    print(f"Unreferenced GridFS files: {totals['orphans']}")
+    print(f"Unreferenced GridFS bytes: {totals['bytes']} ({totals['bytes'] / 1024 / 1024 / 1024:.2f} GiB)")
+    if largest:
+        print("Largest unreferenced GridFS files:")
+        for grid_file in largest:
+            mib = grid_file.get('length', 0) / 1024 / 1024
+            print(f"  {mib:9.1f} MiB  {grid_file['_id']}  {grid_file.get('filename', '')}")
+    if execute:
+        print(f"Deleted {totals['deleted']} unreferenced GridFS files.")
+    else:
+        print("DRY RUN: pass --execute to delete these GridFS files.")
+    return totals['orphans'], totals['bytes']
+
+
 def gridfs_file_lengths(db_handle):
     return {
         str(f['_id']): f.get('length', 0)
@@ -463,6 +735,29 @@ def parse_args():
         default='recursive',
         help='How to collect protected GridFS ids. recursive is conservative; app-fields is more aggressive.',
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Files (or projects, for --rebuild-gridfs-refs) per batch in the indexed modes.',
+    )
+    parser.add_argument(
+        '--pause',
+        type=float,
+        default=1.0,
+        help='Seconds to sleep between batches in the indexed modes, to limit load on the database.',
+    )
+    parser.add_argument(
+        '--min-age-hours',
+        type=float,
+        default=24,
+        help='--smart-gridfs-indexed never deletes GridFS files uploaded more recently than this.',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue an interrupted --rebuild-gridfs-refs or --smart-gridfs-indexed run from its checkpoint.',
+    )
     parser.add_argument(
         '--tmp-folder',
         default='tmp',
@@ -475,6 +770,16 @@ def parse_args():
         action='store_true',
         help='Delete GridFS files not referenced anywhere in projects documents.',
     )
+    mode.add_argument(
+        '--smart-gridfs-indexed',
+        action='store_true',
+        help='Delete GridFS files with no gridfs_refs entry, in resumable rate-limited batches.',
+    )
+    mode.add_argument(
+        '--rebuild-gridfs-refs',
+        action='store_true',
+        help='Backfill the gridfs_refs index from every project document.',
+    )
     mode.add_argument(
         '--all-project-data',
         action='store_true',
@@ -514,6 +819,24 @@ def main():
                     scope=args.reference_scope,
                     strategy=args.reference_strategy,
                 )
+            elif args.smart_gridfs_indexed:
+                smart_purge_gridfs_indexed(
+                    db_handle,
+                    execute=args.execute,
+                    limit=args.limit,
+                    batch_size=args.batch_size,
+                    pause=args.pause,
+                    min_age_hours=args.min_age_hours,
+                    resume=args.resume,
+                )
+            elif args.rebuild_gridfs_refs:
+                rebuild_gridfs_refs(
+                    db_handle,
+                    execute=args.execute,
+                    batch_size=args.batch_size,
+                    pause=args.pause,
+                    resume=args.resume,
+                )
             elif args.all_project_data:
                 purge_project_data(db_handle, execute=args.execute)
                 clear_tmp(args.tmp_folder, execute=args.execute)
@@ -5,6 +5,13 @@ source /opt/venv/bin/activate
 
 source /srv/caper/config.sh
 
+# Queued background jobs run in their own niced process pool instead of inside
+# the gunicorn workers when the queue is enabled (see caper/caper/job_queue.py).
+if [ "${CAPER_AGGREGATION_QUEUE}" == "TRUE" ] || [ "${CAPER_JOB_QUEUE}" == "TRUE" ]; then
+    cd /srv/caper
+    python manage.py run_workers >> /srv/logs/workers.txt 2>&1 &
+fi
+
 # Run Django with Gunicorn for production
 # The application module is caper.wsgi:application (Django project name is 'caper')
 cd /srv/caper
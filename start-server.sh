@@ -7,4 +7,4 @@ source caper/config.sh
 #docker run -d --rm  --name=amplicon-prod -p 80:8000 -v /home/ubuntu/AmpliconRepository-prod/logs:/srv/logs -v /home/ubuntu/AmpliconRepository-prod/caper:/srv/caper/ -w /srv/  --env GOOGLE_SECRET_KEY --env GLOBUS_SECRET_KEY --env DB_URI_SECRET --env DB_NAME  --env S3_STATIC_FILES -t genepattern/amplicon-repo:dev /srv/run-manage-py.sh
 
 #docker rm amplicon-prod
-docker run -d --network="host"  --name=amplicon-${AMPLICON_ENV} -p ${AMPLICON_ENV_PORT}:8000 -v /home/ubuntu/.aws:/root/.aws  -v ${CAPER_ROOT}:${CAPER_ROOT}  -v ${CAPER_ROOT}/logs:/srv/logs -v ${CAPER_ROOT}:/srv/ -w /srv/caper  -v ${CAPER_ROOT}/.git:/srv/.git --env CAPER_ROOT --env NEO4J_PASSWORD_SECRET --env EMAIL_HOST_USER --env EMAIL_HOST_PASSWORD --env DJANGO_SECRET_KEY --env GOOGLE_SECRET_KEY --env GLOBUS_SECRET_KEY --env DB_URI_SECRET --env DB_NAME --env SITE_URL --env S3_STATIC_FILES --env S3_FILE_DOWNLOADS --env SECRET_KEY  -t genepattern/amplicon-repo:${AMPLICON_ENV} /srv/run-manage-py.sh
+docker run -d --network="host"  --name=amplicon-${AMPLICON_ENV} -p ${AMPLICON_ENV_PORT}:8000 -v /home/ubuntu/.aws:/root/.aws  -v ${CAPER_ROOT}:${CAPER_ROOT}  -v ${CAPER_ROOT}/logs:/srv/logs -v ${CAPER_ROOT}:/srv/ -w /srv/caper  -v ${CAPER_ROOT}/.git:/srv/.git --env CAPER_ROOT --env NEO4J_PASSWORD_SECRET --env EMAIL_HOST_USER --env EMAIL_HOST_PASSWORD --env DJANGO_SECRET_KEY --env GOOGLE_SECRET_KEY --env GLOBUS_SECRET_KEY --env DB_URI_SECRET --env DB_NAME --env SITE_URL --env S3_STATIC_FILES --env S3_FILE_DOWNLOADS --env CAPER_AGGREGATION_QUEUE --env CAPER_JOB_QUEUE --env CAPER_AGGREGATION_WORKERS --env CAPER_AGGREGATION_NICENESS --env SECRET_KEY  -t genepattern/amplicon-repo:${AMPLICON_ENV} /srv/run-manage-py.sh
@@ -30,3 +30,25 @@ def test_admin_stats_template_lists_private_projects_without_links():
     )[1].split('{% endfor %}', 1)[0]
     assert 'project.project_name' in private_section
     assert "url 'project_page'" not in private_section
+
+
+def test_solo_member_counts_normalize_visibility(monkeypatch):
+    from caper import views_admin
+
+    groups = [
+        {'_id': {'member': 'alice', 'private': 'public'}, 'count': 2},
+        {'_id': {'member': 'alice', 'private': False}, 'count': 1},
+        {'_id': {'member': 'alice', 'private': 'hidden_public'}, 'count': 1},
+        {'_id': {'member': 'bob@example.org'}, 'count': 3},
+    ]
+
+    class _Collection:
+        def aggregate(self, pipeline):
+            return iter(groups)
+
+    monkeypatch.setattr(views_admin, 'collection_handle', _Collection())
+
+    assert views_admin._solo_member_project_counts() == {
+        'alice': {'public': 3, 'private': 1},
+        'bob@example.org': {'public': 0, 'private': 3},
+    }
@@ -534,15 +534,13 @@ class TestProjectDownloadView:
 
         mock_s3client = MagicMock()
         mock_s3client.generate_presigned_url.return_value = presigned
-        mock_session = MagicMock()
-        mock_session.client.return_value = mock_s3client
 
         with override_settings(
             USE_S3_DOWNLOADS=True,
             S3_DOWNLOADS_BUCKET='test-bucket',
             S3_DOWNLOADS_BUCKET_PATH='',
         ), patch('caper.views_apis.get_one_project_sans_runs', return_value=proj), \
-             patch('boto3.Session', return_value=mock_session):
+             patch('caper.views_apis.get_s3_client', return_value=mock_s3client):
             req = self.rf.get('/api/v1/projects/x/download/')
             resp = self.view(req, project_id='x')
 
@@ -9,7 +9,7 @@ class _TaskCollection:
         self.docs = docs or []
         self.inserted = []
 
-    def find(self, query):
+    def find(self, query, projection=None):
         return self.docs
 
     def create_index(self, *args, **kwargs):
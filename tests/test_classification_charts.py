@@ -1,8 +1,11 @@
 """Regression tests for focal-amplification classification charts."""
 
-from caper.StackedBarChart import StackedBarChart
+from caper.StackedBarChart import StackedBarChart, sorted_class_counts
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
 
 def test_stacked_bar_chart_renders_fan_classification():
     samples = [
@@ -35,6 +38,24 @@ def test_stacked_bar_chart_does_not_crash_on_future_classification():
     assert "Future-classification" in html
 
 
+
+def test_stacked_bar_rows_are_ordered_by_class_then_counts_then_name():
+    df = pd.DataFrame({
+        "Sample_name": ["b", "b", "a", "a", "c", "c", "d"],
+        "Classification": ["ecDNA", "ecDNA", "ecDNA", "BFB", "ecDNA", "Future", "BFB"],
+        "AA_amplicon_number": [1, 2, 1, 2, 1, 2, np.nan],
+    })
+
+    rows = list(sorted_class_counts(df).itertuples(index=False, name=None))
+
+    assert rows[:6] == [
+        ("b", "ecDNA", 2), ("a", "ecDNA", 1), ("c", "ecDNA", 1),
+        ("a", "FAN", 0), ("a", "BFB", 1), ("d", "BFB", 1),
+    ]
+    # Every class gets a trace; d's unnumbered amplicon adds a "None" bar.
+    assert rows[-2:] == [("a", "None", 0), ("d", "None", 0)]
+    assert ("c", "Future", 1) in rows
+
 def test_site_focal_amplification_palette_is_muted_and_colorblind_friendly():
     views_source = (
         Path(__file__).parents[1] / "caper" / "caper" / "views.py"
@@ -95,3 +95,39 @@ def test_collect_protected_ids_preserves_deleted_version_tombstones():
     ])
 
     assert collect_protected_ids(collection) == {str(tombstone_id)}
+
+
+def test_delete_gridfs_files_for_project_keeps_files_shared_with_other_projects():
+    from cleanup_orphaned_projects import files_shared_with_other_projects
+
+    tar_id = ObjectId()
+    shared_png = ObjectId()
+    own_png = ObjectId()
+
+    class Refs:
+        refs = [
+            {'file_id': tar_id, 'project_id': 'orphan'},
+            {'file_id': shared_png, 'project_id': 'orphan'},
+            {'file_id': own_png, 'project_id': 'orphan'},
+            {'file_id': shared_png, 'project_id': 'newer-version'},
+        ]
+
+        def distinct(self, field, query):
+            matches = [r for r in self.refs
+                       if ('project_id' not in query or (
+                           r['project_id'] != query['project_id']['$ne']
+                           if isinstance(query['project_id'], dict)
+                           else r['project_id'] == query['project_id']))
+                       and ('file_id' not in query or r['file_id'] in query['file_id']['$in'])]
+            return list({r[field] for r in matches})
+
+    keep_ids = files_shared_with_other_projects({'gridfs_refs': Refs()}, 'orphan')
+    assert keep_ids == {str(shared_png)}
+
+    fs = FakeGridFS()
+    project = {
+        'tarfile': tar_id,
+        'runs': {'sample1': [{'AA PNG file': shared_png}, {'AA PNG file': own_png}]},
+    }
+    assert delete_gridfs_files_for_project(fs, project, keep_ids=keep_ids) == 2
+    assert fs.deleted == [str(tar_id), str(own_png)]
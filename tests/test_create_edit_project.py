@@ -274,7 +274,7 @@ def test_create_coral_ac2_project(
         download_request.user = test_user
         download_response = sample_download(download_request, project_id, sample_name)
         assert download_response.status_code == 200
-        with zipfile.ZipFile(io.BytesIO(download_response.content)) as archive:
+        with zipfile.ZipFile(io.BytesIO(b''.join(download_response.streaming_content))) as archive:
             names = archive.namelist()
             assert any(name.endswith('_cycles.png') for name in names)
             assert any(
@@ -841,6 +841,75 @@ def test_process_metadata_preserves_unlisted_samples_via_mongodb(
         mongo_collection.delete_one({'_id': ObjectId(project_id)})
 
 
+@pytest.mark.integration
+def test_metadata_edit_sets_only_changed_samples(monkeypatch):
+    """
+    A metadata upload writes the samples it changed as runs.<key>.<position>
+    paths in one bulk write, instead of $set-ing the whole runs dict.
+    """
+    from bson.objectid import ObjectId
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import RequestFactory
+    from pymongo import UpdateOne
+    from caper import extra_metadata
+
+    project_id = ObjectId()
+    runs = {
+        'Sample_A': [{'Sample_name': 'Sample_A', 'Features': [], 'Cancer_type': 'Lung',
+                      'extra_metadata_from_csv': {'original_sample_name': 'Sample_A',
+                                                  'Cancer_type': 'Lung'}}],
+        'Sample_B': [{'Sample_name': 'Sample_B', 'Features': []},
+                     {'Sample_name': 'Sample_B', 'Features': []}],
+        'Sample_C': [{'Sample_name': 'Sample_C', 'Features': []}],
+    }
+
+    class _Collection:
+        def __init__(self):
+            self.writes = []
+
+        def find_one(self, query):
+            return {'_id': project_id, 'runs': runs}
+
+        def bulk_write(self, ops):
+            self.writes.extend(ops)
+
+        def update_one(self, query, update):
+            raise AssertionError('runs must not be rewritten whole')
+
+    collection = _Collection()
+    monkeypatch.setattr(extra_metadata, 'collection_handle', collection)
+    monkeypatch.setattr(extra_metadata, 'invalidate_project_pages', lambda project_id: None)
+
+    # Sample_A is listed with the metadata it already has; only Sample_B changes.
+    csv_bytes = b"sample_name,Cancer_type\nSample_A,Lung\nSample_B,GBM\n"
+    req = RequestFactory().post('/', data={
+        'metadataFile': SimpleUploadedFile("metadata.csv", csv_bytes, content_type="text/csv")})
+
+    assert extra_metadata.process_metadata(req, str(project_id)) == 'complete'
+
+    assert len(collection.writes) == 1
+    op = collection.writes[0]
+    assert isinstance(op, UpdateOne)
+    assert op._filter == {'_id': project_id}
+    paths = op._doc['$set']
+    assert set(paths) == {'runs.Sample_B.0', 'runs.Sample_B.1', 'sample_index', 'sample_metadata_available'}
+    assert paths['sample_metadata_available'] is True
+    assert paths['runs.Sample_B.1']['Cancer_type'] == 'GBM'
+    assert paths['runs.Sample_B.0']['extra_metadata_from_csv'] == {
+        'original_sample_name': 'Sample_B', 'Cancer_type': 'GBM'}
+
+
+@pytest.mark.integration
+def test_changed_sample_updates_fall_back_for_dotted_keys():
+    """Sample keys that are not valid field paths force a whole-runs write."""
+    from caper.extra_metadata import changed_sample_updates
+
+    runs = {'s.1': [{'Sample_name': 's.1'}], 's2': [{'Sample_name': 's2'}]}
+    assert changed_sample_updates(runs, [('s2', 0)]) == [{'runs.s2.0': runs['s2'][0]}]
+    assert changed_sample_updates(runs, [('s2', 0), ('s.1', 0)]) is None
+    assert changed_sample_updates(runs, []) == []
+
+
 # ---------------------------------------------------------------------------
 # Tests
 # ---------------------------------------------------------------------------
@@ -879,6 +948,57 @@ def test_create_tar_only(request_factory, test_user, mongo_collection, tar_file)
             _cleanup_project(mongo_collection, pid)
 
 
+@pytest.mark.slow
+@pytest.mark.integration
+def test_created_project_files_are_not_orphans(request_factory, test_user, mongo_collection, tar_file):
+    """
+    A project created through the placeholder path records gridfs_refs for its
+    tarball, member index and sample files, so the indexed purge keeps them.
+    """
+    import datetime
+    import importlib.util
+    from pathlib import Path
+    from bson import ObjectId
+    from caper.gridfs_refs import drop_project_refs, iter_gridfs_refs
+    from caper.utils import db_handle, fs_handle
+    from caper.views import create_project
+
+    module_path = Path(__file__).resolve().parents[1] / 'purge-local-db.py'
+    spec = importlib.util.spec_from_file_location('purge_local_db', module_path)
+    purge_local_db = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(purge_local_db)
+
+    request, handles = _build_create_request(
+        request_factory, test_user, 'PyTest_GridfsRefs', tar_path=tar_file)
+    try:
+        response = create_project(request)
+    finally:
+        for h in handles:
+            h.close()
+    project_id = _project_id_from_redirect(response)
+    assert project_id, "Could not parse project_id from redirect"
+
+    try:
+        doc = _poll_until_finished(mongo_collection, project_id)
+        assert doc is not None, f"Timed out waiting for aggregation ({POLL_TIMEOUT}s)"
+        file_ids = {file_id for file_id, _ in iter_gridfs_refs(doc)}
+        assert doc['tarfile'] in file_ids and doc['tarfile_index'] in file_ids
+
+        pipeline = purge_local_db.orphan_scan_pipeline(
+            None, datetime.datetime.utcnow() + datetime.timedelta(hours=1), len(file_ids))
+        pipeline[0]['$match']['_id'] = {'$in': list(file_ids)}
+        scanned = list(db_handle['fs.files'].aggregate(pipeline))
+
+        assert {f['_id'] for f in scanned} == file_ids
+        assert [f['_id'] for f in scanned if f['orphan']] == []
+    finally:
+        doc = mongo_collection.find_one({'_id': ObjectId(project_id)}, {'tarfile_index': 1}) or {}
+        if doc.get('tarfile_index'):
+            fs_handle.delete(doc['tarfile_index'])
+        drop_project_refs(project_id)
+        _cleanup_project(mongo_collection, project_id)
+
+
 @pytest.mark.slow
 @pytest.mark.integration
 def test_create_tar_and_metadata_no_remap(
@@ -1087,7 +1207,7 @@ def test_alias_propagates_to_new_version_on_reaggregate(
     placeholder_ids = []
 
     def _fake_submit(fn, *args, **kwargs):
-        # submit(fn, file_fps, temp_proj_id, project_data_path, temp_directory, form_data, ...)
+        # submit_aggregation(fn, file_fps, temp_proj_id, project_data_path, temp_directory, form_data, ...)
         captured['form_data'] = args[4]
         placeholder_ids.append(args[1])   # temp_proj_id
         return MagicMock()                # mimic a concurrent.futures.Future
@@ -1107,8 +1227,7 @@ def test_alias_propagates_to_new_version_on_reaggregate(
         request = request_factory.post(f'/project/{project_id}/edit', data=data)
         request.user = test_user
 
-        with patch('caper.views._thread_executor') as mock_executor:
-            mock_executor.submit.side_effect = _fake_submit
+        with patch('caper.views.job_queue.submit_aggregation', side_effect=_fake_submit):
             edit_project_page(request, project_name=project_id)
 
         assert 'form_data' in captured, (
@@ -0,0 +1,180 @@
+"""
+Tests for background batch-download jobs (caper/download_jobs.py).
+
+The database-facing parts run against a small in-memory stand-in for the
+download_artifacts collection.  What matters is the cache key (same content,
+same key, whatever the selection order) and the claim protocol: one request
+builds, identical concurrent requests coalesce onto it, a finished archive is
+reused, and a failed or expired one is rebuilt.
+"""
+
+import datetime
+from types import SimpleNamespace
+
+from caper import download_jobs as dj
+
+
+def _entry(project_id, samples, version='2026-01-01', name='proj'):
+    return {'project_id': project_id, 'project_name': name,
+            'version': version, 'samples': samples}
+
+
+class _ArtifactCollection:
+    def __init__(self):
+        self.docs = {}
+
+    @staticmethod
+    def _matches(doc, query):
+        return all(doc.get(k) == v for k, v in query.items())
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        doc = self.docs.get(query['_id'])
+        if doc is None:
+            if upsert:
+                self.docs[query['_id']] = dict(update['$setOnInsert'], _id=query['_id'])
+            return None
+        return dict(doc)
+
+    def update_one(self, query, update):
+        doc = self.docs.get(query['_id'])
+        if doc is None or not self._matches(doc, query):
+            return SimpleNamespace(matched_count=0)
+        doc.update(update.get('$set', {}))
+        for key in update.get('$unset', {}):
+            doc.pop(key, None)
+        for key, value in update.get('$inc', {}).items():
+            doc[key] = doc.get(key, 0) + value
+        for key, value in update.get('$push', {}).items():
+            doc.setdefault(key, []).append(value)
+        return SimpleNamespace(matched_count=1)
+
+
+class _FS:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, file_id):
+        self.deleted.append(str(file_id))
+
+
+NOW = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _claim(col, fs, selection, recipient=None, now=NOW):
+    return dj._claim(col, fs, dj.artifact_key(selection), selection,
+                     'batch_samples', recipient, now)
+
+
+def test_artifact_key_ignores_order_and_duplicates():
+    a = [_entry('p1', ['s1', 's2']), _entry('p2', ['s3'])]
+    b = [_entry('p2', ['s3']), _entry('p1', ['s2', 's1', 's2'])]
+    assert dj.artifact_key(a) == dj.artifact_key(b)
+
+
+def test_artifact_key_changes_with_version_and_samples():
+    base = dj.artifact_key([_entry('p1', ['s1'])])
+    assert dj.artifact_key([_entry('p1', ['s1'], version='2026-02-01')]) != base
+    assert dj.artifact_key([_entry('p1', ['s1', 's2'])]) != base
+    assert dj.artifact_key([_entry('p1', ['s1'], name='renamed')]) != base
+
+
+def test_selection_entry_uses_update_date_as_version():
+    project = {'_id': 'abc', 'project_name': 'proj', 'date': 'd1', 'update_date': 'd2'}
+    entry = dj.selection_entry(project, ['s1', 's1', 's2'])
+    assert entry == {'project_id': 'abc', 'project_name': 'proj',
+                     'version': 'd2', 'samples': ['s1', 's2']}
+
+
+def test_identical_concurrent_requests_coalesce_onto_one_build():
+    col, fs = _ArtifactCollection(), _FS()
+    selection = [_entry('p1', ['s1', 's2'])]
+    recipient = {'username': 'u', 'email': 'u@example.org'}
+
+    job_id, action, _ = _claim(col, fs, selection)
+    assert action == 'build'
+    second, action, _ = _claim(col, fs, list(reversed(selection)), recipient)
+    assert (second, action) == (job_id, 'wait')
+
+    doc = col.docs[dj.artifact_key(selection)]
+    assert doc['waiters'] == 1
+    assert doc['notify'] == [recipient]
+
+
+def test_ready_artifact_is_reused_until_it_expires():
+    col, fs = _ArtifactCollection(), _FS()
+    selection = [_entry('p1', ['s1'])]
+    job_id, _, _ = _claim(col, fs, selection)
+    doc = col.docs[dj.artifact_key(selection)]
+    doc.update(state=dj.READY, file_id='64b7f0c2a1b2c3d4e5f60718',
+               expires_at=NOW + datetime.timedelta(hours=1))
+
+    assert _claim(col, fs, selection)[:2] == (job_id, 'ready')
+
+    later = NOW + datetime.timedelta(hours=2)
+    new_job, action, _ = _claim(col, fs, selection, now=later)
+    assert action == 'build' and new_job != job_id
+    assert fs.deleted == ['64b7f0c2a1b2c3d4e5f60718']
+    assert 'expires_at' not in doc and 'file_id' not in doc
+
+
+def test_failed_and_stale_builds_are_taken_over():
+    col, fs = _ArtifactCollection(), _FS()
+    selection = [_entry('p1', ['s1'])]
+    job_id, _, _ = _claim(col, fs, selection)
+    doc = col.docs[dj.artifact_key(selection)]
+
+    doc.update(state=dj.FAILED, error='boom')
+    retry, action, _ = _claim(col, fs, selection)
+    assert action == 'build' and retry != job_id
+    assert doc['state'] == dj.BUILDING and 'error' not in doc
+
+    much_later = NOW + datetime.timedelta(seconds=dj._STALE_THRESHOLD_SECONDS + 1)
+    takeover, action, _ = _claim(col, fs, selection, now=much_later)
+    assert action == 'build' and takeover not in (job_id, retry)
+
+
+def test_a_build_that_cannot_start_fails_its_waiters(monkeypatch):
+    import pytest
+
+    col, fs = _ArtifactCollection(), _FS()
+    selection = [_entry('p1', ['s1'])]
+
+    def _refuse(*args, **kwargs):
+        raise RuntimeError('executor shut down')
+
+    monkeypatch.setattr(dj, '_get_artifacts_collection', lambda: col)
+    monkeypatch.setattr(dj, '_get_fs', lambda: fs)
+    monkeypatch.setattr(dj._download_executor, 'submit', _refuse)
+
+    with pytest.raises(RuntimeError):
+        dj.submit_batch_download(selection, 'batch_samples')
+
+    doc = col.docs[dj.artifact_key(selection)]
+    assert (doc['state'], doc['error']) == (dj.FAILED, 'executor shut down')
+
+
+def test_a_build_that_raises_fails_its_waiters(monkeypatch):
+    import sys
+
+    import pytest
+
+    col, fs = _ArtifactCollection(), _FS()
+    col.find_one = lambda query: col.docs.get(query['_id'])
+    selection = [_entry('p1', ['s1'])]
+    job_id, _, _ = _claim(col, fs, selection)
+    key = dj.artifact_key(selection)
+    _claim(col, fs, selection)  # a second request waiting on the build
+
+    def _unreadable(selection, progress=None):
+        raise OSError('GridFS unavailable')
+
+    monkeypatch.setattr(dj, '_get_artifacts_collection', lambda: col)
+    monkeypatch.setattr(dj, '_get_fs', lambda: fs)
+    monkeypatch.setattr(dj._download_executor, 'update_progress', lambda *a, **k: None)
+    monkeypatch.setitem(sys.modules, 'caper.views', SimpleNamespace(batch_zip_members=_unreadable))
+
+    with pytest.raises(OSError):
+        dj._build_artifact(key, job_id)
+
+    assert col.docs[key]['state'] == dj.FAILED
+    assert col.docs[key]['waiters'] == 1
@@ -150,7 +150,7 @@ def test_ac2_single_and_batch_sample_download_contents(
         single_req.user = test_user
         single_response = sample_download(single_req, project_id, sample_name)
         assert single_response.status_code == 200
-        assert_download_zip(single_response.content, sample_name)
+        assert_download_zip(b''.join(single_response.streaming_content), sample_name)
 
         batch_req = request_factory.post('/batch-sample-download/', {
             'samples': [f'{project_id}:{sample_name}'],
@@ -159,7 +159,7 @@ def test_ac2_single_and_batch_sample_download_contents(
         batch_req.user = test_user
         batch_response = batch_sample_download(batch_req)
         assert batch_response.status_code == 200
-        assert_download_zip(batch_response.content, sample_name)
+        assert_download_zip(b''.join(batch_response.streaming_content), sample_name)
     finally:
         for handle in handles:
             handle.close()
@@ -193,7 +193,47 @@ def test_sample_download(loaded_datasets, request_factory, test_user, mongo_coll
     assert resp.status_code in (200, 302), \
         f"Unexpected status {resp.status_code} for sample_download"
     if resp.status_code == 200:
-        assert len(resp.content) > 0, "Sample download response must not be empty"
+        # Sample zips are streamed as they are built.
+        assert len(b''.join(resp.streaming_content)) > 0, "Sample download response must not be empty"
+
+
+@pytest.mark.integration
+@pytest.mark.functional
+def test_batch_sample_download_counts_each_sample_once(
+        loaded_datasets, request_factory, test_user, mongo_collection):
+    """
+    A batch download of several samples from one project must contain every
+    sample and add exactly that many to today's sample_downloads bucket.
+    """
+    from caper import project_counters
+    from caper.utils import get_date_short
+    from caper.views import batch_sample_download
+    pid = loaded_datasets['project_small']
+    doc = mongo_collection.find_one({'_id': ObjectId(pid)})
+    sample_names = [rows[0]['Sample_name'] for rows in doc.get('runs', {}).values() if rows][:3]
+    assert sample_names, "project_small has no samples"
+
+    def today_count():
+        project_counters.flush()
+        counts = project_counters.get_counts(pid, cached=False).get('sample_downloads') or {}
+        return counts.get(get_date_short(), 0)
+
+    before = today_count()
+    # A duplicate selection and an unknown sample must not change the count.
+    req = request_factory.post('/batch-sample-download/', {
+        'samples': [f'{pid}:{name}' for name in sample_names]
+                   + [f'{pid}:{sample_names[0]}', f'{pid}:no_such_sample'],
+        'emailResults': 'false',
+    })
+    req.user = test_user
+    resp = batch_sample_download(req)
+    assert resp.status_code == 200
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(resp.streaming_content))) as archive:
+        names = archive.namelist()
+    for name in sample_names:
+        assert any(n.endswith(f'/{name}/{name}_result_data.tsv') for n in names), name
+    assert today_count() == before + len(sample_names)
 
 
 @pytest.mark.integration
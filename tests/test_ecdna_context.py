@@ -0,0 +1,78 @@
+"""
+Tests for harvesting ecDNA context (utils.parse_ecDNA_context_calls,
+utils.ecDNA_context_from_directory and tar_utils.ecDNA_context_from_project_tar).
+
+Context is collected once, from the extracted tree at ingest or from the
+stored tarball by the backfill command; both must produce what the project
+page used to build by scanning the tarball on request.
+"""
+
+import io
+import tarfile
+
+import pytest
+from bson import ObjectId
+
+CALLS_1 = b'sample1_amplicon1_ecDNA_1\tSimple circular\nsample1_amplicon2_ecDNA_1\n\n'
+CALLS_2 = b'sample2_amplicon1_ecDNA_1   Two-foci ecDNA  \n'
+EXPECTED = {
+    'sample1_amplicon1_ecDNA_1': 'Simple circular',
+    'sample1_amplicon2_ecDNA_1': '',
+    'sample2_amplicon1_ecDNA_1': 'Two-foci ecDNA',
+}
+
+
+def _write_project_tar(path):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, body in [
+            ('results/run.json', b'{}'),
+            ('results/sample1/sample1_ecDNA_context_calls.tsv', CALLS_1),
+            ('results/sample2/sample2_ecDNA_context_calls.tsv', CALLS_2),
+        ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+
+
+class _FS:
+    def __init__(self, files):
+        self.files = files
+
+    def get(self, oid):
+        return io.BytesIO(self.files[oid])
+
+
+def test_parse_keeps_keys_without_a_call():
+    from caper.utils import parse_ecDNA_context_calls
+    context = parse_ecDNA_context_calls(CALLS_1)
+    parse_ecDNA_context_calls(CALLS_2.decode(), context)
+    assert context == EXPECTED
+
+
+def test_directory_harvest_matches_extracted_tree(tmp_path):
+    from caper.utils import ecDNA_context_from_directory
+    _write_project_tar(tmp_path / 'project.tar.gz')
+    with tarfile.open(tmp_path / 'project.tar.gz') as tar:
+        tar.extractall(tmp_path / 'extracted')
+    assert ecDNA_context_from_directory(str(tmp_path / 'extracted')) == EXPECTED
+
+
+@pytest.mark.parametrize('blocked,indexed', [(True, True), (True, False), (False, False)])
+def test_tarball_harvest_with_and_without_index(tmp_path, monkeypatch, blocked, indexed):
+    from caper import tar_index, tar_utils
+    source = tmp_path / 'project.tar.gz'
+    _write_project_tar(source)
+    tar_id, index_id = ObjectId(), ObjectId()
+    project = {'_id': ObjectId(), 'tarfile': str(tar_id)}
+    files = {tar_id: source.read_bytes()}
+    if blocked:
+        # Without its index a block-compressed tarball is streamed like an old one.
+        stored = tmp_path / 'blocked.tar.gz'
+        index = tar_index.write_blocked_tar_gz(str(source), str(stored), block_size=256)
+        files = {tar_id: stored.read_bytes()}
+        if indexed:
+            files[index_id] = tar_index.serialize_index(index)
+            project['tarfile_index'] = str(index_id)
+    monkeypatch.setattr(tar_utils, 'fs_handle', _FS(files))
+
+    assert tar_utils.ecDNA_context_from_project_tar(project) == EXPECTED
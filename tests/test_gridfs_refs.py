@@ -0,0 +1,82 @@
+"""
+Tests for the GridFS reference index written by the app (caper/gridfs_refs.py).
+"""
+
+from bson import ObjectId
+
+from caper import gridfs_refs
+
+
+def test_refs_cover_tarfiles_and_feature_files_with_paths():
+    tar_id = ObjectId()
+    png_id = ObjectId()
+    project = {
+        'tarfile': tar_id,
+        'runs': {'sample_1': [{'Feature_ID': 'f1', 'AA PNG file': str(png_id)},
+                              {'Feature_ID': 'f2', 'AA PDF file': 'Not Provided'}]},
+        'previous_versions': [{'linkid': str(ObjectId())}],
+    }
+
+    ops = gridfs_refs.ref_updates('p1', project)
+
+    assert [op._filter for op in ops] == [
+        {'file_id': tar_id, 'project_id': 'p1', 'path': 'tarfile'},
+        {'file_id': png_id, 'project_id': 'p1', 'path': 'runs.sample_1.0.AA PNG file'},
+    ]
+    assert all(op._upsert for op in ops)
+
+
+def test_failed_write_flags_project_for_reindexing(monkeypatch):
+    import sys
+    import types
+
+    class Refs:
+        def bulk_write(self, ops, ordered=True):
+            raise RuntimeError('primary unavailable')
+
+    flagged = []
+    projects = types.SimpleNamespace(update_one=lambda query, update: flagged.append((query, update)))
+    monkeypatch.setattr(gridfs_refs, '_refs_col', Refs())
+    monkeypatch.setitem(sys.modules, 'caper.utils',
+                        types.SimpleNamespace(collection_handle_primary=projects))
+
+    project_id = ObjectId()
+    assert gridfs_refs.record_project_refs(project_id, {'tarfile': ObjectId()}) == 0
+    assert flagged == [({'_id': project_id}, {'$set': {'gridfs_refs_stale': True}})]
+
+
+def test_files_another_version_still_uses_are_reported_shared(monkeypatch):
+    import sys
+    import types
+
+    shared_png, own_png, stale_bed = ObjectId(), ObjectId(), ObjectId()
+    queries = []
+
+    class Refs:
+        def distinct(self, field, query):
+            queries.append(query)
+            return [shared_png]
+
+    stale_project = {'_id': ObjectId(), 'gridfs_refs_stale': True,
+                     'runs': {'sample_1': [{'Feature BED file': str(stale_bed)}]}}
+    projects = types.SimpleNamespace(find=lambda query: iter([stale_project]))
+    monkeypatch.setattr(gridfs_refs, '_refs_col', Refs())
+    monkeypatch.setitem(sys.modules, 'caper.utils',
+                        types.SimpleNamespace(collection_handle_primary=projects))
+
+    shared = gridfs_refs.referenced_elsewhere('v2', [shared_png, str(own_png), stale_bed])
+
+    assert shared == {shared_png, stale_bed}
+    assert queries[0]['project_id'] == {'$ne': 'v2'}
+    assert gridfs_refs.referenced_elsewhere('v2', []) == set()
+
+
+def test_an_unreadable_index_protects_every_file(monkeypatch):
+    class Refs:
+        def distinct(self, field, query):
+            raise RuntimeError('primary unavailable')
+
+    monkeypatch.setattr(gridfs_refs, '_refs_col', Refs())
+    file_ids = {ObjectId(), ObjectId()}
+
+    assert gridfs_refs.referenced_elsewhere('v2', file_ids) == file_ids
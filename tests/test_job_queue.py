@@ -0,0 +1,224 @@
+"""
+Tests for the durable background job queue (caper/job_queue.py).
+
+background_tasks is a small in-memory stand-in and the worker pool is a
+ThreadPoolExecutor, so a test can run the daemon loop in a thread and watch
+the records move from queued to completed or failed.  Leases, retries and
+priorities are driven directly through claim_next / reap_expired_leases.
+"""
+
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.test import override_settings
+
+from caper import job_queue
+
+CALLS = []
+
+
+def record_call(*args, **kwargs):
+    CALLS.append((args, kwargs))
+
+
+def explode():
+    raise RuntimeError('aggregator crashed')
+
+
+def _matches(doc, query):
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == '$in' and value not in arg:
+                    return False
+                if op == '$lte' and not (value is not None and value <= arg):
+                    return False
+                if op == '$lt' and not (value is not None and value < arg):
+                    return False
+                if op == '$exists' and (field in doc) != arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+class _Result:
+    def __init__(self, matched_count):
+        self.matched_count = matched_count
+
+
+class _TasksCollection:
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        return None
+
+    def insert_one(self, doc):
+        self.docs[doc['_id']] = dict(doc)
+
+    @staticmethod
+    def _apply(doc, update):
+        doc.update(update.get('$set', {}))
+        for field, count in update.get('$inc', {}).items():
+            doc[field] = doc.get(field, 0) + count
+        for field in update.get('$unset', {}):
+            doc.pop(field, None)
+
+    def find(self, query, projection=None):
+        with self.lock:
+            return [dict(d) for d in self.docs.values() if _matches(d, query)]
+
+    def find_one_and_update(self, query, update, sort=None, return_document=None):
+        with self.lock:
+            due = [d for d in self.docs.values() if _matches(d, query)]
+            if not due:
+                return None
+            doc = min(due, key=lambda d: tuple(d[field] for field, _ in sort))
+            self._apply(doc, update)
+            return dict(doc)
+
+    def update_one(self, query, update):
+        with self.lock:
+            for doc in self.docs.values():
+                if _matches(doc, query):
+                    self._apply(doc, update)
+                    return _Result(1)
+            return _Result(0)
+
+    def update_many(self, query, update):
+        with self.lock:
+            matched = [d for d in self.docs.values() if _matches(d, query)]
+            for doc in matched:
+                self._apply(doc, update)
+            return _Result(len(matched))
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    col = _TasksCollection()
+    monkeypatch.setattr(job_queue, '_col', col)
+    monkeypatch.setattr(job_queue, '_HANDLER_PACKAGES', ('caper.', __name__))
+    CALLS.clear()
+    return col
+
+
+def _run_until(col, done, timeout=10):
+    stop = threading.Event()
+    worker = threading.Thread(target=job_queue.run_workers, kwargs={
+        'concurrency': 2, 'niceness': 0, 'poll_interval': 0.01, 'stop': stop,
+        'executor_factory': lambda concurrency, niceness: ThreadPoolExecutor(concurrency),
+    })
+    worker.start()
+    deadline = time.time() + timeout
+    while not done() and time.time() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    worker.join(timeout)
+    assert not worker.is_alive()
+
+
+def test_enqueue_stores_a_resolvable_call(tasks, tmp_path):
+    task_id = job_queue.enqueue(record_call, 'a', ('b', 1), task_label='Project Create: x',
+                                keep_dirs=[str(tmp_path)], flag=True)
+
+    doc = tasks.docs[task_id]
+    assert doc['state'] == job_queue.QUEUED
+    assert doc['handler'] == f'{__name__}:record_call'
+    assert doc['args'] == ['a', ['b', 1]]
+    assert doc['kwargs'] == {'flag': True}
+    assert doc['keep_dirs'] == [str(tmp_path)]
+    assert (doc['priority'], doc['attempts'], doc['max_attempts']) == (
+        job_queue.PRIORITY['aggregation'], 0, job_queue.MAX_ATTEMPTS['aggregation'])
+    # No updated_at: the TTL index must not expire a job that is still waiting.
+    assert 'updated_at' not in doc
+    assert job_queue.resolve_handler(doc['handler']) is record_call
+
+
+def test_calls_that_cannot_be_queued_run_on_the_thread_pool(tasks, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(job_queue._thread_executor, 'submit',
+                        lambda fn, *args, **kwargs: submitted.append((fn, args, kwargs)))
+    monkeypatch.setattr(job_queue, 'RETRY_BASE_SECONDS', 0)
+
+    with override_settings(AGGREGATION_QUEUE=True):
+        job_queue.submit_aggregation(record_call, object(), task_label='odd argument')
+        job_queue.submit_aggregation(lambda: None, task_label='closure')
+        job_queue.submit_aggregation(record_call, 1, task_label='queued')
+    with override_settings(AGGREGATION_QUEUE=False):
+        job_queue.submit_aggregation(record_call, 2, task_label='queue off')
+
+    assert [kwargs['task_label'] for _, _, kwargs in submitted] == ['odd argument', 'closure', 'queue off']
+    assert [doc['label'] for doc in tasks.docs.values()] == ['queued']
+
+
+def test_workers_run_queued_jobs_and_retry_failures(tasks, monkeypatch):
+    monkeypatch.setattr(job_queue, 'RETRY_BASE_SECONDS', 0)
+    ok = job_queue.enqueue(record_call, 1, task_label='first', key='value')
+    bad = job_queue.enqueue(explode, task_label='second', max_attempts=2)
+
+    _run_until(tasks, lambda: all(d['state'] in ('completed', 'failed') for d in tasks.docs.values()))
+
+    assert CALLS == [((1,), {'key': 'value'})]
+    assert tasks.docs[ok]['state'] == job_queue.COMPLETED
+    assert tasks.docs[ok]['updated_at'] and 'lease_owner' not in tasks.docs[ok]
+    assert tasks.docs[bad]['state'] == job_queue.FAILED
+    assert tasks.docs[bad]['attempts'] == 2
+    assert 'aggregator crashed' in tasks.docs[bad]['error']
+
+
+def test_claims_follow_priority_and_backoff(tasks):
+    maintenance = job_queue.enqueue(record_call, kind=job_queue.KIND_MAINTENANCE)
+    aggregation = job_queue.enqueue(record_call, kind=job_queue.KIND_AGGREGATION)
+    download = job_queue.enqueue(record_call, kind=job_queue.KIND_DOWNLOAD)
+    later = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    tasks.docs[download]['run_after'] = later   # waiting out a retry backoff
+
+    claimed = [job_queue.claim_next('w1')['_id'] for _ in range(2)]
+
+    assert claimed == [aggregation, maintenance]
+    assert job_queue.claim_next('w1') is None
+    assert job_queue.claim_next('w1', kinds=[job_queue.KIND_AGGREGATION]) is None
+    assert [job_queue.retry_delay(n) for n in (1, 2, 3)] == [
+        job_queue.RETRY_BASE_SECONDS, 2 * job_queue.RETRY_BASE_SECONDS, 4 * job_queue.RETRY_BASE_SECONDS]
+
+
+def test_expired_lease_is_requeued_and_the_old_owner_cannot_finish(tasks):
+    task_id = job_queue.enqueue(record_call, kind=job_queue.KIND_DOWNLOAD)
+    doc = job_queue.claim_next('dead-worker')
+    assert job_queue.heartbeat('dead-worker', [task_id]) == 1
+
+    # The worker stops heartbeating and its lease runs out.
+    tasks.docs[task_id]['lease_expires_at'] = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    assert job_queue.reap_expired_leases() == 1
+    assert tasks.docs[task_id]['state'] == job_queue.QUEUED
+    assert 'lease expired' in tasks.docs[task_id]['last_error']
+    assert 'updated_at' not in tasks.docs[task_id]
+
+    # Its late result is dropped instead of overwriting the retry.
+    job_queue._finish(doc, None, 'dead-worker')
+    assert tasks.docs[task_id]['state'] == job_queue.QUEUED
+    assert job_queue.heartbeat('dead-worker', [task_id]) == 0
+
+
+def test_tracker_submissions_go_to_the_queue_when_enabled(tasks, monkeypatch):
+    from caper.background_tasks import BackgroundTaskTracker
+
+    tracker = BackgroundTaskTracker(max_workers=1, cleanup_interval_seconds=None, queue_kind='download')
+    tracker._col = tasks
+    try:
+        with override_settings(JOB_QUEUE=True):
+            task_id = tracker.submit(record_call, 'x', task_id='job-1', task_label='Batch download')
+            future = tracker.submit(record_call, 'y', task_label='local', queue=False)
+        future.result(timeout=5)
+    finally:
+        tracker.shutdown()
+
+    assert task_id == 'job-1'
+    assert tasks.docs['job-1']['kind'] == job_queue.KIND_DOWNLOAD
+    assert CALLS == [(('y',), {})]
@@ -41,6 +41,14 @@ def _reset(middleware):
     middleware._my_slot = None
     middleware._my_slot_pid = None
     middleware._crawler_cache.clear()
+    for array in (middleware._m_admitted, middleware._m_shed, middleware._m_admission_hist,
+                  middleware._m_admission_sum, middleware._m_duration_hist,
+                  middleware._m_duration_sum, middleware._m_ring_minute,
+                  middleware._m_ring_admitted, middleware._m_ring_shed,
+                  middleware._sample_finished, middleware._sample_seconds,
+                  middleware._sample_next, middleware._adaptive_state):
+        for i in range(len(array)):
+            array[i] = 0
 
 
 def _occupy(middleware, count, request_class, *, pid=None, age=0.0):
@@ -726,3 +734,169 @@ def test_client_ip_comes_from_the_load_balancer_header(
         REMOTE_ADDR='10.0.1.5')
 
     assert middleware_module._client_ip(request) == '66.249.66.1'
+
+
+# --------------------------------------------------------------------------
+# Metrics
+# --------------------------------------------------------------------------
+
+def _metric(text, line_prefix):
+    """The value of the one sample line starting with `line_prefix`."""
+    values = [line.rsplit(' ', 1)[1] for line in text.splitlines()
+              if line.startswith(line_prefix + ' ')]
+    assert len(values) == 1, line_prefix
+    return float(values[0])
+
+
+def test_metrics_are_answered_before_the_application(middleware_module, request_factory):
+    """Same contract as /healthz: a scrape must work while pages are being shed."""
+    def get_response(request):  # pragma: no cover - must not run
+        raise AssertionError('metrics scrape fell through to the application')
+
+    response = middleware_module.HealthCheckMiddleware(get_response)(
+        request_factory.get('/healthz/metrics'))
+
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert response['Cache-Control'] == 'no-store'
+    assert b'# TYPE amprepo_load_shed_admitted_total counter' in response.content
+
+
+def test_metrics_count_admissions_sheds_and_durations(
+        middleware_module, request_factory, monkeypatch):
+    monkeypatch.setattr(middleware_module, 'UNREFERRED_CONCURRENCY', 1)
+    monkeypatch.setattr(middleware_module, 'PAGE_CONCURRENCY', 6)
+    shed, _ = _shedder(middleware_module)
+
+    assert shed(_sample_request(request_factory)).status_code == 200
+    _occupy(middleware_module, 1, middleware_module._PAGE_UNREFERRED)
+    assert shed(_sample_request(request_factory)).status_code == 503
+    assert shed(_sample_request(request_factory, referer='https://localhost/')).status_code == 200
+
+    text = middleware_module.render_metrics()
+    admitted = 'amprepo_load_shed_admitted_total{class="%s"}'
+    assert _metric(text, admitted % 'unreferred_page') == 1
+    assert _metric(text, admitted % 'page') == 1
+    assert _metric(text, 'amprepo_load_shed_shed_total{class="unreferred_page",cap="unreferred"}') == 1
+    assert _metric(text, 'amprepo_load_shed_shed_total{class="unreferred_page",cap="page"}') == 0
+    # Sheds are in the admission histogram but never in the duration one.
+    assert _metric(text, 'amprepo_load_shed_admission_seconds_count{class="unreferred_page"}') == 2
+    assert _metric(text, 'amprepo_load_shed_request_duration_seconds_count{class="unreferred_page"}') == 1
+    assert _metric(text, 'amprepo_load_shed_request_duration_seconds_bucket'
+                         '{class="unreferred_page",le="+Inf"}') == 1
+    assert _metric(text, 'amprepo_load_shed_in_flight{cap="unreferred"}') == 1
+    assert _metric(text, 'amprepo_load_shed_limit{cap="unreferred"}') == 1
+    assert _metric(text, 'amprepo_load_shed_recent_shed{class="unreferred_page",window="1m"}') == 1
+
+
+def test_metrics_survive_a_worker_recycle(middleware_module, request_factory):
+    """gunicorn replaces a worker every max_requests; its counts must not go with it.
+
+    The replacement claims the dead worker's row and adds to it, so the totals
+    only ever grow -- which is what a Prometheus counter promises.
+    """
+    shed, _ = _shedder(middleware_module)
+    shed(_sample_request(request_factory))
+    shed(_sample_request(request_factory))
+    dead_slot = middleware_module._my_slot
+
+    # The worker exits; a new process inherits the same table.
+    middleware_module._slot_pids[dead_slot] = 2 ** 31 - 1
+    middleware_module._my_slot = None
+    shed(_sample_request(request_factory))
+
+    assert middleware_module._my_slot == dead_slot
+    assert _metric(middleware_module.render_metrics(),
+                   'amprepo_load_shed_admitted_total{class="unreferred_page"}') == 3
+
+
+def test_recent_rates_forget_old_minutes(middleware_module):
+    now = 1_800_000_000.0
+    middleware_module._metrics_shed(0, middleware_module._PAGE, 'page', 0.0, now - 10 * 60)
+    middleware_module._metrics_shed(0, middleware_module._PAGE, 'page', 0.0, now - 2 * 60)
+    middleware_module._metrics_shed(0, middleware_module._PAGE, 'page', 0.0, now)
+    text = middleware_module.render_metrics(now=now)
+    recent = 'amprepo_load_shed_recent_shed{class="page",window="%s"}'
+    assert [_metric(text, recent % w) for w in ('1m', '5m', '15m')] == [1, 2, 3]
+
+    # Fifteen minutes after the first, its ring bucket is reused and emptied.
+    middleware_module._metrics_shed(0, middleware_module._PAGE, 'page', 0.0, now + 5 * 60)
+    text = middleware_module.render_metrics(now=now + 5 * 60)
+    assert [_metric(text, recent % w) for w in ('1m', '5m', '15m')] == [1, 1, 3]
+    assert _metric(text, 'amprepo_load_shed_shed_total{class="page",cap="page"}') == 4
+
+
+# --------------------------------------------------------------------------
+# Adaptive limits
+# --------------------------------------------------------------------------
+
+@pytest.fixture
+def adaptive(middleware_module, monkeypatch):
+    monkeypatch.setattr(middleware_module, 'ADAPTIVE', True)
+    monkeypatch.setattr(middleware_module, 'PAGE_CONCURRENCY', 6)
+    monkeypatch.setattr(middleware_module, 'UNREFERRED_CONCURRENCY', 2)
+    monkeypatch.setattr(middleware_module, 'UNREFERRED_DOWNLOAD_CONCURRENCY', 3)
+    return middleware_module
+
+
+def _step(middleware, now, seconds, count=20):
+    """Complete `count` page requests of `seconds` each, then run one AIMD step."""
+    for i in range(count):
+        middleware._record_service_time(i % 2, middleware._PAGE, seconds, now)
+    middleware._adapt_limits(now)
+    return middleware._effective_limits(now)
+
+
+def test_static_caps_apply_when_adaptive_mode_is_off(middleware_module, monkeypatch):
+    monkeypatch.setattr(middleware_module, 'PAGE_CONCURRENCY', 6)
+    middleware_module._adaptive_state[middleware_module._ADAPTIVE_UPDATED] = time.time()
+    middleware_module._adaptive_state[middleware_module._ADAPTIVE_LIMITS] = 1.0
+
+    assert middleware_module._effective_limits(time.time())[0] == 6
+
+
+def test_slow_pages_lower_the_limits_and_fast_ones_restore_them(adaptive):
+    now = time.time()
+    assert _step(adaptive, now, 0.2) == (6, 2, 3)       # establishes the baseline
+
+    now += adaptive._ADAPTIVE_WINDOW + 1
+    assert _step(adaptive, now, 1.0) == (4, 1, 2)       # 0.75x, floored at one
+    now += adaptive._ADAPTIVE_WINDOW + 1
+    assert _step(adaptive, now, 1.0) == (3, 1, 1)
+
+    # Back to normal: one more request per step, never past the static caps.
+    limits = []
+    for _ in range(4):
+        now += adaptive._ADAPTIVE_WINDOW + 1
+        limits.append(_step(adaptive, now, 0.2))
+    assert limits == [(4, 2, 2), (5, 2, 3), (6, 2, 3), (6, 2, 3)]
+
+
+def test_a_backed_off_limit_sheds_below_the_static_cap(adaptive, request_factory):
+    now = time.time()
+    _step(adaptive, now - 2 * adaptive._ADAPTIVE_WINDOW, 0.2)
+    _step(adaptive, now, 2.0)
+    assert adaptive._effective_limits(now)[0] == 4
+    _occupy(adaptive, 4, adaptive._PAGE)
+
+    shed, calls = _shedder(adaptive)
+    response = shed(_sample_request(request_factory, referer='https://localhost/'))
+
+    assert response.status_code == 503
+    assert calls == []
+    assert _metric(adaptive.render_metrics(), 'amprepo_load_shed_effective_limit{cap="page"}') == 4
+
+
+def test_too_little_traffic_never_lowers_a_limit(adaptive):
+    now = time.time()
+    _step(adaptive, now, 0.2)
+    assert _step(adaptive, now + 60, 30.0, count=adaptive._ADAPTIVE_MIN_SAMPLES - 1) == (6, 2, 3)
+
+
+def test_limits_that_stop_being_refreshed_fall_back_to_the_static_caps(adaptive):
+    """A stuck recalculation lock must not freeze the site at a backed-off limit."""
+    now = time.time()
+    _step(adaptive, now - 2 * adaptive._ADAPTIVE_WINDOW, 0.2)
+    assert _step(adaptive, now, 2.0)[0] == 4
+
+    assert adaptive._effective_limits(now + adaptive._ADAPTIVE_STALE + 1) == (6, 2, 3)
@@ -0,0 +1,136 @@
+"""
+Tests for project-update emails to subscribers (caper/notifications.py).
+
+Users and preferences come from the two batched lookups, replaced here; the
+emails go through Django's locmem backend, or a backend that drops the
+connection, so no mail server is needed.
+"""
+
+import smtplib
+
+import pytest
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import override_settings
+
+from caper import notifications
+
+LOCMEM = 'django.core.mail.backends.locmem.EmailBackend'
+
+
+class FlakyBackend(EmailBackend):
+    """Drops the connection after the first message of each of its first two connections."""
+    connections = 0
+
+    def open(self):
+        type(self).connections += 1
+        self.sent_here = 0
+
+    def send_messages(self, messages):
+        if type(self).connections <= 2 and self.sent_here == 1:
+            raise ConnectionResetError('connection dropped')
+        self.sent_here += 1
+        return super().send_messages(messages)
+
+
+class RefusingBackend(EmailBackend):
+    """Refuses recipients without an @, as an SMTP server would."""
+    opened = 0
+
+    def open(self):
+        type(self).opened += 1
+
+    def send_messages(self, messages):
+        if '@' not in messages[0].to[0]:
+            raise smtplib.SMTPRecipientsRefused({messages[0].to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+class UnreachableBackend(EmailBackend):
+    def open(self):
+        raise smtplib.SMTPConnectError(421, 'Service not available')
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    users = [('alice', 'alice@example.com'), ('bob', 'bob@example.com'), ('carol', 'carol@example.com')]
+    preferences = {'bob@example.com': {'email': 'bob@example.com', 'onProjectUpdate': False},
+                   'carol@example.com': {'email': 'carol@example.com'}}
+    calls = []
+
+    def find_users(identifiers):
+        calls.append(('users', list(identifiers)))
+        return [u for u in users if u[0] in identifiers or u[1] in identifiers]
+
+    def find_preferences(emails):
+        calls.append(('preferences', sorted(emails)))
+        return {e: preferences[e] for e in emails if e in preferences}
+
+    monkeypatch.setattr(notifications, '_find_users', find_users)
+    monkeypatch.setattr(notifications, '_find_preferences', find_preferences)
+    return calls
+
+
+def test_recipients_are_resolved_in_one_lookup_each(directory):
+    subscribers = ['alice', 'bob@example.com', 'carol@example.com', 'guest@example.com', 'alice@example.com']
+
+    assert notifications.resolve_recipients(subscribers) == [
+        'alice@example.com', 'carol@example.com', 'guest@example.com']
+    assert directory == [('users', subscribers),
+                         ('preferences', ['alice@example.com', 'bob@example.com', 'carol@example.com'])]
+
+
+def test_one_rendered_email_per_recipient(directory):
+    with override_settings(EMAIL_BACKEND=LOCMEM):
+        mail.outbox = []
+        sent = notifications.send_project_update('P1', 'abc123', 4, ['alice', 'bob', 'guest@example.com'])
+
+    assert sent == 2
+    assert [m.to for m in mail.outbox] == [['alice@example.com'], ['guest@example.com']]
+    assert all(m.content_subtype == 'html' and 'P1' in m.subject for m in mail.outbox)
+    assert mail.outbox[0].body == mail.outbox[1].body
+
+
+def test_a_dropped_connection_resends_only_the_unsent(directory, monkeypatch):
+    monkeypatch.setattr(notifications, 'NOTIFY_RETRY_BASE_SECONDS', 0)
+    FlakyBackend.connections = 0
+    messages = [mail.EmailMessage('s', 'b', 'from@example.com', [f'{n}@example.com']) for n in range(4)]
+
+    with override_settings(EMAIL_BACKEND=f'{__name__}.FlakyBackend'):
+        mail.outbox = []
+        assert notifications.send_messages(messages) == 4
+
+    assert FlakyBackend.connections == 3
+    assert [m.to for m in mail.outbox] == [m.to for m in messages]
+
+
+def test_a_refused_recipient_does_not_stop_the_others(directory):
+    RefusingBackend.opened = 0
+    messages = [mail.EmailMessage('s', 'b', 'from@example.com', [to])
+                for to in ('a@example.com', 'olduser', 'c@example.com')]
+
+    with override_settings(EMAIL_BACKEND=f'{__name__}.RefusingBackend'):
+        mail.outbox = []
+        assert notifications.send_messages(messages, retry_base_seconds=0) == 2
+
+    assert RefusingBackend.opened == 1
+    assert [m.to for m in mail.outbox] == [['a@example.com'], ['c@example.com']]
+
+
+def test_after_partial_delivery_the_rest_are_logged_not_raised(directory):
+    FlakyBackend.connections = -10
+    messages = [mail.EmailMessage('s', 'b', 'from@example.com', [f'{n}@example.com']) for n in range(3)]
+
+    with override_settings(EMAIL_BACKEND=f'{__name__}.FlakyBackend'):
+        mail.outbox = []
+        assert notifications.send_messages(messages, attempts=2, retry_base_seconds=0) == 2
+
+    assert [m.to for m in mail.outbox] == [['0@example.com'], ['1@example.com']]
+
+
+def test_gives_up_when_nothing_could_be_sent(directory):
+    messages = [mail.EmailMessage('s', 'b', 'from@example.com', ['a@example.com'])]
+
+    with override_settings(EMAIL_BACKEND=f'{__name__}.UnreachableBackend'), \
+            pytest.raises(smtplib.SMTPConnectError):
+        notifications.send_messages(messages, attempts=2, retry_base_seconds=0)
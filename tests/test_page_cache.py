@@ -0,0 +1,124 @@
+"""
+Tests for the rendered sample-page cache (caper/page_cache.py).
+
+The 'pages' cache is swapped for a LocMemCache so nothing touches /tmp.  What
+matters is the cache key (users never share entries), revalidation (a matching
+If-None-Match gets a 304 without a render), and invalidation (a project edit
+or a site-wide flag change turns every older entry into a miss).
+"""
+
+import re
+
+import pytest
+from django.http import HttpResponse
+from django.middleware.csrf import _does_token_match
+
+HOST = 'localhost'
+
+
+@pytest.fixture
+def page_cache():
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.test import override_settings
+    from caper import page_cache
+
+    locmem = dict(settings.CACHES, pages={
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test-page-cache',
+    })
+    with override_settings(CACHES=locmem):
+        caches['pages'].clear()
+        yield page_cache
+        caches['pages'].clear()
+
+
+def _request(request_factory, user=None, **headers):
+    from django.contrib.auth.models import AnonymousUser
+
+    request = request_factory.get('/project/p1/sample/s1', HTTP_HOST=HOST, **headers)
+    request.user = user or AnonymousUser()
+    return request
+
+
+class _User:
+    is_authenticated = True
+
+    def __init__(self, pk):
+        self.pk = pk
+
+
+def _store(page_cache, request_factory, body=b'<html>page</html>', project_id='p1'):
+    request = _request(request_factory)
+    key = page_cache.sample_page_key(request, 'p1', 's1', True)
+    response = page_cache.store_page(request, key, project_id, HttpResponse(body))
+    return key, response
+
+
+def test_key_is_partitioned_by_user_and_filter(page_cache, request_factory):
+    anon = page_cache.sample_page_key(_request(request_factory), 'p1', 's1', True)
+    alice = page_cache.sample_page_key(_request(request_factory, _User(1)), 'p1', 's1', True)
+    bob = page_cache.sample_page_key(_request(request_factory, _User(2)), 'p1', 's1', True)
+    all_chr = page_cache.sample_page_key(_request(request_factory), 'p1', 's1', False)
+    assert len({anon, alice, bob, all_chr}) == 4
+
+
+def test_hit_serves_cached_body_with_validators(page_cache, request_factory):
+    key, stored = _store(page_cache, request_factory)
+    assert stored['ETag']
+
+    hit = page_cache.get_cached_page(_request(request_factory), key)
+    assert hit.status_code == 200
+    assert hit.content == b'<html>page</html>'
+    assert hit['ETag'] == stored['ETag']
+    assert 'Last-Modified' in hit
+
+
+def test_matching_etag_gets_304(page_cache, request_factory):
+    key, stored = _store(page_cache, request_factory)
+    hit = page_cache.get_cached_page(_request(request_factory, HTTP_IF_NONE_MATCH=stored['ETag']), key)
+    assert hit.status_code == 304
+    miss_tag = page_cache.get_cached_page(_request(request_factory, HTTP_IF_NONE_MATCH='"other"'), key)
+    assert miss_tag.status_code == 200
+
+
+def test_non_200_responses_are_not_cached(page_cache, request_factory):
+    request = _request(request_factory)
+    key = page_cache.sample_page_key(request, 'p1', 's1', True)
+    page_cache.store_page(request, key, 'p1', HttpResponse(b'gone', status=404))
+    assert page_cache.get_cached_page(request, key) is None
+
+
+def test_project_invalidation_only_drops_that_project(page_cache, request_factory):
+    key, _ = _store(page_cache, request_factory, project_id='p1')
+    page_cache.invalidate_project_pages('p2')
+    assert page_cache.get_cached_page(_request(request_factory), key) is not None
+
+    page_cache.invalidate_project_pages('p1')
+    assert page_cache.get_cached_page(_request(request_factory), key) is None
+
+
+def test_site_invalidation_drops_everything(page_cache, request_factory):
+    key, _ = _store(page_cache, request_factory)
+    page_cache.invalidate_all_pages()
+    assert page_cache.get_cached_page(_request(request_factory), key) is None
+
+
+def test_csrf_token_is_not_shared_between_visitors(page_cache, request_factory):
+    form = b'<form><input type="hidden" name="csrfmiddlewaretoken" value="%s"></form>'
+    key, stored = _store(page_cache, request_factory, body=form % b'first-visitors-token')
+    assert b'first-visitors-token' in stored.content
+
+    request = _request(request_factory)
+    hit = page_cache.get_cached_page(request, key)
+
+    token = re.search(rb'value="([^"]*)"', hit.content).group(1).decode()
+    # A token for this visitor's own CSRF secret, which CsrfViewMiddleware
+    # then sets as their cookie.
+    assert _does_token_match(token, request.META['CSRF_COOKIE'])
+    assert hit.content == form % token.encode()
+
+    plain_request = _request(request_factory)
+    key, _ = _store(page_cache, request_factory, body=b'<html>no form</html>')
+    page_cache.get_cached_page(plain_request, key)
+    assert 'CSRF_COOKIE' not in plain_request.META
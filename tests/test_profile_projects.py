@@ -0,0 +1,54 @@
+def test_profile_projection_never_reads_runs():
+    from caper.views import _PROFILE_PROJECT_FIELDS
+
+    assert 'runs' not in _PROFILE_PROJECT_FIELDS
+    assert _PROFILE_PROJECT_FIELDS['sample_count'] == 1
+    assert _PROFILE_PROJECT_FIELDS['sample_metadata_available'] == 1
+
+
+def test_missing_summaries_are_computed_once_and_stored(monkeypatch):
+    from caper import views
+
+    class _Collection:
+        def __init__(self):
+            self.pipelines = []
+            self.writes = []
+
+        def aggregate(self, pipeline):
+            self.pipelines.append(pipeline)
+            return iter([{'_id': 'old', 'sample_count': 12, 'sample_metadata_available': True}])
+
+        def bulk_write(self, requests, ordered=True):
+            self.writes.extend(requests)
+
+    col = _Collection()
+    monkeypatch.setattr(views, 'collection_handle', col)
+    projects = [
+        {'_id': 'new', 'sample_count': 3, 'sample_metadata_available': False},
+        {'_id': 'old', 'sample_count': 7},
+    ]
+
+    views.fill_project_summaries(projects)
+
+    assert col.pipelines[0][0] == {'$match': {'_id': {'$in': ['old']}}}
+    # A stored value is kept; only the missing field is filled in and written.
+    assert projects[1] == {'_id': 'old', 'sample_count': 7, 'sample_metadata_available': True}
+    assert [(w._filter, w._doc) for w in col.writes] == [
+        ({'_id': 'old', 'sample_metadata_available': {'$exists': False}},
+         {'$set': {'sample_metadata_available': True}}),
+    ]
+
+    col.pipelines.clear()
+    views.fill_project_summaries(projects)
+    assert col.pipelines == []
+
+
+def test_sample_metadata_flag_matches_has_sample_metadata():
+    from caper.extra_metadata import has_sample_metadata, runs_have_sample_metadata
+
+    with_metadata = {'sample_1': [{'Sample_name': 'a'}, {'Sample_name': 'a', 'extra_metadata_from_csv': {}}]}
+    without = {'sample_1': [{'Sample_name': 'a'}], 'sample_2': []}
+
+    assert runs_have_sample_metadata(with_metadata) is has_sample_metadata({'runs': with_metadata}) is True
+    assert runs_have_sample_metadata(without) is has_sample_metadata({'runs': without}) is False
+    assert runs_have_sample_metadata(None) is False
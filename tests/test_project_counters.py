@@ -0,0 +1,125 @@
+"""
+Tests for the batched view/download counters (caper/project_counters.py).
+
+The project_counters collection is a small in-memory stand-in and the flush
+thread is not started, so each test decides when a flush happens.  What
+matters is that increments only touch memory, that a flush is one bulk write
+of upserting $inc updates (requeued if it fails), and that readers see the
+stored base plus the counters.
+"""
+
+import pytest
+from pymongo import UpdateOne
+
+TODAY = '2026-10-19'
+
+
+class _CountersCollection:
+    def __init__(self, docs=()):
+        self.docs = {d['_id']: dict(d) for d in docs}
+        self.bulk_writes = []
+        self.fail = False
+
+    def bulk_write(self, ops, ordered=True):
+        if self.fail:
+            raise RuntimeError('primary unavailable')
+        self.bulk_writes.append(ops)
+        for op in ops:
+            doc = self.docs.setdefault(op._filter['_id'], {'_id': op._filter['_id']})
+            for path, count in op._doc['$inc'].items():
+                field, _, day = path.partition('.')
+                if day:
+                    bucket = doc.setdefault(field, {})
+                    bucket[day] = bucket.get(day, 0) + count
+                else:
+                    doc[field] = doc.get(field, 0) + count
+
+    def find_one(self, query, projection=None):
+        doc = self.docs.get(query['_id'])
+        return None if doc is None else {k: v for k, v in doc.items() if k != '_id'}
+
+    def find(self, query):
+        return [dict(self.docs[i]) for i in query['_id']['$in'] if i in self.docs]
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    from collections import Counter, defaultdict
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.test import override_settings
+    from caper import project_counters
+
+    col = _CountersCollection()
+    monkeypatch.setattr(project_counters, '_counters_col', col)
+    monkeypatch.setattr(project_counters, '_pending', defaultdict(Counter))
+    monkeypatch.setattr(project_counters, '_ensure_flusher', lambda: None)
+    monkeypatch.setattr(project_counters, '_today', lambda: TODAY)
+    locmem = dict(settings.CACHES, default={
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test-project-counters',
+    })
+    with override_settings(CACHES=locmem):
+        caches['default'].clear()
+        yield project_counters, col
+        caches['default'].clear()
+
+
+def test_increments_flush_as_one_bulk_write(counters):
+    project_counters, col = counters
+    project_counters.increment('p1', 'views')
+    project_counters.increment('p1', 'views')
+    project_counters.increment('p1', 'sample_downloads', 3)
+    project_counters.increment('p2', 'downloads')
+    assert col.bulk_writes == []
+
+    assert project_counters.flush() == 2
+    assert len(col.bulk_writes) == 1
+    assert all(isinstance(op, UpdateOne) and op._upsert for op in col.bulk_writes[0])
+    assert col.docs['p1'] == {'_id': 'p1', 'views': 2, 'sample_downloads': {TODAY: 3}}
+    assert col.docs['p2'] == {'_id': 'p2', 'downloads': 1}
+    assert project_counters.flush() == 0
+
+
+def test_failed_flush_is_retried(counters):
+    project_counters, col = counters
+    project_counters.increment('p1', 'views')
+    col.fail = True
+    assert project_counters.flush() == 0
+    project_counters.increment('p1', 'views')
+
+    col.fail = False
+    project_counters.flush()
+    assert col.docs['p1']['views'] == 2
+
+
+def test_reads_add_counters_to_the_stored_base(counters):
+    project_counters, col = counters
+    col.docs['p1'] = {'_id': 'p1', 'views': 5, 'downloads': 1}
+    project = {'_id': 'p1', 'views': 100, 'downloads': 10}
+
+    assert project_counters.with_counts(project) == (105, 11)
+    # Cached: a flushed write from another worker is not seen yet...
+    col.docs['p1']['views'] = 50
+    # ...but this process's own unflushed counts are.
+    project_counters.increment('p1', 'views')
+    assert project_counters.with_counts(project) == (106, 11)
+    assert project_counters.with_counts(project, cached=False) == (151, 11)
+
+
+def test_merge_counts_combines_dated_buckets(counters):
+    project_counters, col = counters
+    col.docs['p1'] = {'_id': 'p1', 'downloads': 2, 'project_downloads': {TODAY: 2}}
+    col.docs['p2'] = {'_id': 'p2', 'sample_downloads': {TODAY: 4}}
+    projects = [
+        {'_id': 'p1', 'downloads': 1, 'project_downloads': {'2026-01-01': 1}},
+        {'_id': 'p2', 'sample_downloads': 7},
+        {'_id': 'p3'},
+    ]
+
+    project_counters.merge_counts(projects)
+
+    assert projects[0]['downloads'] == 3
+    assert projects[0]['project_downloads'] == {'2026-01-01': 1, TODAY: 2}
+    assert projects[1]['sample_downloads'] == {'legacy': 7, TODAY: 4}
+    assert projects[2] == {'_id': 'p3'}
@@ -0,0 +1,74 @@
+"""
+Tests for the background project files report (caper/project_files_report.py).
+
+S3 and GridFS are replaced with small stand-ins: what matters is that S3 is
+listed once for all projects and its keys land on the right project, and that
+GridFS sizes come from one query per batch.
+"""
+
+from django.test import override_settings
+
+
+class _Paginator:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def paginate(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(self.pages)
+
+
+class _S3:
+    def __init__(self, pages):
+        self.paginator = _Paginator(pages)
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return self.paginator
+
+
+class _FilesCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        wanted = set(pipeline[0]['$match']['_id']['$in'])
+        return iter([d for d in self.docs if d['_id'] in wanted])
+
+
+@override_settings(S3_DOWNLOADS_BUCKET='bucket', S3_DOWNLOADS_BUCKET_PATH='prod/')
+def test_s3_is_listed_once_and_bucketed_by_project(monkeypatch):
+    from caper import project_files_report as report
+
+    s3 = _S3([
+        {'Contents': [
+            {'Key': 'prod/p1/p1.tar.gz'},
+            {'Key': 'prod/p1/results/ecDNA_context_calls.tsv'},
+        ]},
+        {'Contents': [{'Key': 'prod/p2/other.txt'}]},
+        {},
+    ])
+    monkeypatch.setattr(report, 'get_s3_client', lambda: s3)
+
+    objects = report._list_s3_objects('ecDNA_context')
+
+    assert s3.paginator.calls == [{'Bucket': 'bucket', 'Prefix': 'prod/'}]
+    assert objects['p1'] == (True, ['results/ecDNA_context_calls.tsv'])
+    assert objects['p2'] == (False, [])
+
+
+def test_gridfs_sizes_resolved_in_one_query(monkeypatch):
+    from bson import ObjectId
+    from caper import project_files_report as report
+
+    present, missing = ObjectId(), ObjectId()
+    files = _FilesCollection([{'_id': present, 'length': 1234}])
+    monkeypatch.setattr(report, 'db_handle', {'fs.files': files})
+
+    sizes = report._gridfs_sizes([str(present), missing, 'not-an-id'])
+
+    assert sizes == {str(present): 1234}
+    assert len(files.pipelines) == 1
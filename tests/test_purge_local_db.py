@@ -29,10 +29,11 @@ class FakeCursorCollection:
 
 
 class FakeDb:
-    def __init__(self, projects, fs_files):
+    def __init__(self, projects, fs_files, download_artifacts=()):
         self.collections = {
             'projects': FakeCursorCollection(projects),
             'fs.files': FakeCursorCollection(fs_files),
+            'download_artifacts': FakeCursorCollection(list(download_artifacts)),
         }
 
     def __getitem__(self, name):
@@ -72,6 +73,33 @@ def test_find_unreferenced_gridfs_files_ignores_project_referenced_files():
     ]
 
 
+def test_live_download_artifacts_are_not_unreferenced():
+    live, expired = ObjectId(), ObjectId()
+    db = FakeDb(
+        projects=[],
+        fs_files=[
+            {'_id': live, 'length': 100, 'filename': 'batch.zip', 'download_artifact': 'k1'},
+            {'_id': expired, 'length': 200, 'filename': 'old.zip', 'download_artifact': 'k0'},
+        ],
+        download_artifacts=[{'_id': 'k1', 'state': 'ready'}],
+    )
+
+    assert purge_local_db.find_unreferenced_gridfs_files(db, set()) == [
+        {'_id': expired, 'length': 200, 'filename': 'old.zip'},
+    ]
+
+
+def test_orphan_scan_keeps_files_of_live_download_artifacts():
+    import datetime
+
+    pipeline = purge_local_db.orphan_scan_pipeline(None, datetime.datetime.utcnow(), 10)
+    lookups = [stage['$lookup'] for stage in pipeline if '$lookup' in stage]
+
+    assert {'from': 'download_artifacts', 'localField': 'download_artifact',
+            'foreignField': '_id', 'as': 'artifacts'} in lookups
+    assert {'$eq': [{'$size': '$artifacts'}, 0]} in pipeline[-1]['$project']['orphan']['$and']
+
+
 def test_reachable_scope_does_not_protect_deleted_non_current_projects():
     active_file = ObjectId()
     deleted_file = ObjectId()
@@ -184,3 +212,97 @@ def test_report_tarfile_references_handles_existing_missing_and_absent_tarfiles(
     assert 'Missing tarfile references: 1' in out
     assert 'Projects without tarfile field/value: 1' in out
     assert str(missing_tar) in out
+
+
+class FakeRefsCollection:
+    def __init__(self, refs):
+        self.refs = refs
+
+    def distinct(self, field, query):
+        wanted = set(query['file_id']['$in'])
+        return list({ref[field] for ref in self.refs if ref['file_id'] in wanted})
+
+
+class FakeFilesCollection:
+    """fs.files with just enough aggregate() for orphan_scan_pipeline."""
+
+    def __init__(self, files, refs, artifact_keys=()):
+        self.files = sorted(files, key=lambda f: f['_id'])
+        self.refs = refs
+        self.artifact_keys = set(artifact_keys)
+        self.pages = 0
+
+    def aggregate(self, pipeline):
+        self.pages += 1
+        match, limit = pipeline[0]['$match'], pipeline[2]['$limit']
+        after = match.get('_id', {}).get('$gt')
+        page = [f for f in self.files
+                if f['uploadDate'] < match['uploadDate']['$lt'] and (after is None or f['_id'] > after)]
+        referenced = {ref['file_id'] for ref in self.refs}
+        return [dict(f, orphan=f['_id'] not in referenced and f.get('download_artifact') not in self.artifact_keys)
+                for f in page[:limit]]
+
+
+class FakeCheckpoints:
+    def __init__(self, docs=()):
+        self.docs = {d['_id']: dict(d) for d in docs}
+
+    def find_one(self, query):
+        return self.docs.get(query['_id'])
+
+    def update_one(self, query, update, upsert=False):
+        self.docs.setdefault(query['_id'], {'_id': query['_id']}).update(update['$set'])
+
+
+class FakeProjects:
+    def find_one(self, query, projection=None):
+        return None
+
+
+def test_collect_app_gridfs_refs_records_mongo_paths():
+    tar_id = ObjectId()
+    png_id = ObjectId()
+    refs = list(purge_local_db.collect_app_gridfs_refs({
+        'tarfile': str(tar_id),
+        'runs': {'sample_1': [{'AA PNG file': png_id, 'Feature_ID': 'x'}]},
+        'legacy_unused_file': ObjectId(),
+    }))
+
+    assert refs == [(tar_id, 'tarfile'), (png_id, 'runs.sample_1.0.AA PNG file')]
+
+
+def test_indexed_purge_deletes_only_old_unreferenced_files_and_checkpoints(monkeypatch):
+    import datetime
+
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+    kept, orphan_a, orphan_b, fresh = sorted(ObjectId() for _ in range(4))
+    refs = [{'file_id': kept, 'project_id': 'p1', 'path': 'tarfile'}]
+    files = FakeFilesCollection([
+        {'_id': kept, 'uploadDate': old, 'length': 1},
+        {'_id': orphan_a, 'uploadDate': old, 'length': 10},
+        {'_id': orphan_b, 'uploadDate': old, 'length': 20},
+        {'_id': fresh, 'uploadDate': datetime.datetime.utcnow(), 'length': 30},
+    ], refs)
+    checkpoints = FakeCheckpoints([{'_id': 'gridfs_refs_backfill', 'completed_at': old}])
+    db = {
+        'fs.files': files, 'gridfs_refs': FakeRefsCollection(refs),
+        'purge_checkpoints': checkpoints, 'projects': FakeProjects(),
+    }
+    deleted = []
+    monkeypatch.setattr(purge_local_db.gridfs, 'GridFS',
+                        lambda _db: type('FS', (), {'delete': staticmethod(deleted.append)})())
+    monkeypatch.setattr(purge_local_db, 'reindex_stale_projects', lambda _db: 0)
+
+    assert purge_local_db.smart_purge_gridfs_indexed(
+        db, execute=True, batch_size=2, pause=0) == (2, 30)
+
+    assert deleted == [orphan_a, orphan_b]
+    assert files.pages == 3
+    state = checkpoints.docs['smart_gridfs_purge']
+    assert state['last_id'] == orphan_b and state['deleted'] == 2 and state['completed_at']
+
+
+def test_indexed_purge_requires_a_completed_backfill(capsys):
+    db = {'purge_checkpoints': FakeCheckpoints()}
+    assert purge_local_db.smart_purge_gridfs_indexed(db, execute=True) == (0, 0)
+    assert '--rebuild-gridfs-refs' in capsys.readouterr().out
@@ -0,0 +1,190 @@
+"""
+Tests for appending samples without re-aggregating the project
+(caper/sample_append.py).
+
+append_samples itself needs the aggregator, GridFS and MongoDB; what is
+checked here is everything it decides before touching them: which uploads
+can be appended at all, the run keys the new samples get, and the combined
+tarball, which must hold every old member unchanged plus the new ones, with
+run.json and aggregated_results.csv merged.  Removing samples is a streamed
+copy that drops exactly the removed samples' directories.
+"""
+
+import csv
+import io
+import json
+import tarfile
+
+import pytest
+
+from caper import sample_append
+from caper.sample_append import AppendFallback
+from caper.tar_index import write_blocked_tar_gz
+
+
+def _row(name, ref='hg38', **extra):
+    return {'Sample name': name, 'Reference version': ref, 'Feature BED file': f'samples/{name}/f.bed', **extra}
+
+
+def _csv(*rows, columns=('Sample name', 'Feature ID')):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return out.getvalue().encode('utf-8')
+
+
+def _add_file(tar, name, body):
+    info = tarfile.TarInfo(name)
+    info.size = len(body)
+    tar.addfile(info, io.BytesIO(body))
+
+
+def _add_dir(tar, name):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    tar.addfile(info)
+
+
+def _project_tar(path, runs, csv_bytes, files, prefix=''):
+    with tarfile.open(path, 'w:gz') as tar:
+        _add_dir(tar, f'{prefix}results')
+        _add_file(tar, f'{prefix}results/run.json', json.dumps({'runs': runs}).encode())
+        _add_file(tar, f'{prefix}results/aggregated_results.csv', csv_bytes)
+        _add_dir(tar, f'{prefix}results/samples')
+        for name, body in files.items():
+            _add_file(tar, f'{prefix}results/{name}', body)
+    return path
+
+
+def _blocked(path):
+    # As store_project_tarball keeps it: many gzip members, small enough here
+    # that every file spans several.
+    blocked = path.with_name('blocked-' + path.name)
+    write_blocked_tar_gz(str(path), str(blocked), block_size=4096)
+    return blocked
+
+
+def _members(path):
+    with tarfile.open(path) as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar if m.isfile()}
+
+
+def test_new_samples_are_numbered_after_the_highest_existing_key():
+    stored = {'sample_1': [{'Sample_name': 'a'}], 'sample_7': [{'Sample_name': 'b'}], 'odd key': []}
+    in_tar = {'sample_9': [_row('removed')]}
+    new = {'sample_1': [_row('c')], 'sample_2': [_row('d')]}
+
+    renumbered = sample_append.renumber_runs(new, stored, in_tar)
+
+    assert list(renumbered) == ['sample_10', 'sample_11']
+    assert renumbered['sample_10'] is new['sample_1']
+    assert sample_append.renumber_runs(new, {}) == {'sample_1': new['sample_1'], 'sample_2': new['sample_2']}
+
+
+@pytest.mark.parametrize('new, reason', [
+    ({'sample_1': [_row('c')], 'sample_2': [_row('a')]}, 'samples already in the project: a'),
+    ({'sample_1': [_row('c', ref='GRCh37')]}, 'multiple reference genomes: GRCh37, hg38'),
+])
+def test_uploads_that_need_a_full_aggregation_fall_back(new, reason):
+    stored = {'sample_1': [{'Sample_name': 'a', 'Reference_version': 'hg38'}]}
+
+    with pytest.raises(AppendFallback) as fallback:
+        sample_append.check_appendable(new, stored)
+
+    assert str(fallback.value) == reason
+
+
+def test_unknown_reference_genomes_do_not_block_an_append():
+    stored = {'sample_1': [{'Sample_name': 'a', 'Reference_version': 'hg38'}]}
+    sample_append.check_appendable({'sample_1': [_row('b', ref='Not Provided')]}, stored)
+
+
+def test_aggregated_csv_merge_keeps_every_row_and_column():
+    old = _csv(['a', '1'], ['c', '1'])
+    new = _csv(['b', '1', 'x'], columns=('Sample name', 'Feature ID', 'Tissue of origin'))
+
+    rows = list(csv.reader(io.StringIO(sample_append.merge_aggregated_csv(old, new).decode())))
+
+    assert rows == [['Sample name', 'Feature ID', 'Tissue of origin'],
+                    ['a', '1', ''], ['b', '1', 'x'], ['c', '1', '']]
+
+
+def test_appended_tar_streams_old_members_and_merges_the_indexes(tmp_path):
+    old_runs = {'sample_1': [_row('a')]}
+    new_runs = {'sample_2': [_row('b')]}
+    big = bytes(range(256)) * 1024
+    old = _project_tar(tmp_path / 'old.tar.gz', old_runs, _csv(['a', '1']),
+                       {'samples/a/f.bed': big, 'consolidated_classification/p1_result_table.tsv': b'old\n'},
+                       prefix='./')
+    new = _project_tar(tmp_path / 'new.tar.gz', {'sample_1': [_row('b')]}, _csv(['b', '1']),
+                       {'samples/b/f.bed': b'new bed\n', 'consolidated_classification/p2_result_table.tsv': b'new\n'})
+    dst = tmp_path / 'appended.tar'
+
+    with open(old, 'rb') as old_fileobj:
+        sample_append.write_appended_tar(old_fileobj, str(new), str(dst), {**old_runs, **new_runs})
+
+    members = _members(dst)
+    assert members['./results/samples/a/f.bed'] == big
+    assert members['./results/consolidated_classification/p1_result_table.tsv'] == b'old\n'
+    assert members['results/samples/b/f.bed'] == b'new bed\n'
+    assert members['results/consolidated_classification/p2_result_table.tsv'] == b'new\n'
+    # run.json and the CSV appear once, in the old archive's place.
+    assert json.loads(members['./results/run.json']) == {'runs': {**old_runs, **new_runs}}
+    assert 'results/run.json' not in members and 'results/aggregated_results.csv' not in members
+    assert [r[0] for r in csv.reader(io.StringIO(members['./results/aggregated_results.csv'].decode()))] == [
+        'Sample name', 'a', 'b']
+    with tarfile.open(dst) as tar:
+        assert [m.name for m in tar if m.isdir()] == ['./results', './results/samples']
+
+
+def test_appending_to_a_block_compressed_tarball(tmp_path):
+    old_runs = {'sample_1': [_row('a')]}
+    big = bytes(range(256)) * 1024
+    old = _blocked(_project_tar(tmp_path / 'old.tar.gz', old_runs, _csv(['a', '1']), {'samples/a/f.bed': big}))
+    new = _project_tar(tmp_path / 'new.tar.gz', {'sample_1': [_row('b')]}, _csv(['b', '1']),
+                       {'samples/b/f.bed': b'new bed\n'})
+    dst = tmp_path / 'appended.tar'
+
+    with open(old, 'rb') as old_fileobj:
+        sample_append.write_appended_tar(old_fileobj, str(new), str(dst), {**old_runs, 'sample_2': [_row('b')]})
+
+    members = _members(dst)
+    assert members['results/samples/a/f.bed'] == big
+    assert members['results/samples/b/f.bed'] == b'new bed\n'
+    assert set(json.loads(members['results/run.json'])['runs']) == {'sample_1', 'sample_2'}
+
+
+def test_a_file_in_both_archives_falls_back(tmp_path):
+    old = _project_tar(tmp_path / 'old.tar.gz', {}, _csv(), {'other_files/notes.txt': b'old\n'})
+    new = _project_tar(tmp_path / 'new.tar.gz', {}, _csv(), {'other_files/notes.txt': b'new\n'})
+
+    with open(old, 'rb') as old_fileobj, pytest.raises(AppendFallback):
+        sample_append.write_appended_tar(old_fileobj, str(new), str(tmp_path / 'appended.tar'), {})
+
+
+@pytest.mark.parametrize('blocked', [False, True])
+def test_removed_samples_are_filtered_out_in_one_stream(tmp_path, blocked):
+    kept = {
+        'other_files/b_classification/b_amplicon1.bed': b'b\n',
+        'other_files/a_classification_extra.txt': b'not a sample directory\n',
+        'AA_outputs/b_AA_results/b_summary.txt': b'b\n',
+        'AA_outputs/aa_AA_results/aa_summary.txt': b'another sample\n',
+    }
+    dropped = {
+        'other_files/a_classification/a_amplicon1.bed': b'a\n',
+        'AA_outputs/a_AA_results/a_summary.txt': b'a\n',
+        'AA_outputs/extracted_from_zips/a_AA_results/a_cycles.txt': b'a\n',
+    }
+    src = _project_tar(tmp_path / 'project.tar.gz', {}, _csv(), {**kept, **dropped}, prefix='./')
+    if blocked:
+        src = _blocked(src)
+    dst = tmp_path / 'stripped.tar.gz'
+
+    with open(src, 'rb') as src_fileobj:
+        count = sample_append.write_tar_without_samples(src_fileobj, str(dst), ['a'])
+
+    assert count == len(dropped)
+    members = _members(dst)
+    assert {name[len('./results/'):] for name in members} == set(kept) | {'run.json', 'aggregated_results.csv'}
+    assert all(members[f'./results/{name}'] == body for name, body in kept.items())
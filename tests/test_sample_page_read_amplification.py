@@ -194,3 +194,50 @@ def test_get_one_sample_missing_sample_returns_none(mongo_collection, test_user)
         assert next_sample is None
     finally:
         mongo_collection.delete_one({'_id': ObjectId(project_id)})
+
+
+def test_build_sample_index_orders_by_run_key():
+    from caper.utils import build_sample_index
+
+    runs = {
+        'run_02': [_feature_row('tumor_beta', 'b1')],
+        'run_01': [_feature_row('tumor_alpha', 'a1'), _feature_row('tumor_alpha', 'a2')],
+        'run_03': [],
+    }
+    assert build_sample_index(runs) == [
+        {'k': 'run_01', 's': 'tumor_alpha'},
+        {'k': 'run_02', 's': 'tumor_beta'},
+        {'k': 'run_03', 's': None},
+    ]
+
+
+@pytest.mark.integration
+def test_get_one_sample_stores_and_uses_sample_index(mongo_collection, test_user):
+    """A project without ``sample_index`` gets one on first view; later views use it.
+
+    Every position is checked so the slice around the first and last samples
+    (where there is no prev/next neighbour) is covered too.
+    """
+    from caper.utils import get_one_sample
+
+    runs = {f'run_{i:02d}': [_feature_row(f'S{i}', f'S{i}_amplicon1')]
+            for i in range(1, 6)}
+    result = mongo_collection.insert_one(
+        _project_doc('SampleIndexTest', runs, test_user.username)
+    )
+    project_id = str(result.inserted_id)
+
+    try:
+        get_one_sample(project_id, 'S3')
+        stored = mongo_collection.find_one({'_id': result.inserted_id}, {'sample_index': 1})
+        assert [entry['s'] for entry in stored['sample_index']] == ['S1', 'S2', 'S3', 'S4', 'S5']
+
+        for i in range(1, 6):
+            _, sample_data, prev_sample, next_sample = get_one_sample(project_id, f'S{i}')
+            assert sample_data[0]['Feature_ID'] == f'S{i}_amplicon1'
+            assert (prev_sample[0]['Sample_name'] if prev_sample else None) == \
+                (f'S{i - 1}' if i > 1 else None)
+            assert (next_sample[0]['Sample_name'] if next_sample else None) == \
+                (f'S{i + 1}' if i < 5 else None)
+    finally:
+        mongo_collection.delete_one({'_id': ObjectId(project_id)})
@@ -21,10 +21,29 @@ class FakeCollection:
         }
         self.update_calls = []
 
-    def find(self):
+        self.bulk_write_sizes = []
+
+    @staticmethod
+    def _matches(document, query):
+        for key, condition in (query or {}).items():
+            value = document.get(key)
+            if isinstance(condition, dict):
+                if '$ne' in condition and value == condition['$ne']:
+                    return False
+                if '$gte' in condition and (value is None or value < condition['$gte']):
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    def find(self, query=None, batch_size=None):
         # PyMongo returns independent dictionaries; previewing repairs must not
         # mutate the stored fake documents through shared references.
-        return [copy.deepcopy(document) for document in self.documents.values()]
+        return [copy.deepcopy(document) for document in self.documents.values()
+                if self._matches(document, query)]
+
+    def count_documents(self, query):
+        return sum(1 for document in self.documents.values() if self._matches(document, query))
 
     def update_one(self, query, update):
         self.update_calls.append((copy.deepcopy(query), copy.deepcopy(update)))
@@ -32,6 +51,11 @@ class FakeCollection:
         for path, value in update.get('$set', {}).items():
             _set_mongo_path(document, path, copy.deepcopy(value))
 
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_write_sizes.append(len(requests))
+        for request in requests:
+            self.update_one(request._filter, request._doc)
+
 
 class FakeDatabase:
     name = 'schema-test'
@@ -84,7 +108,7 @@ def _write_visibility_schema(tmp_path):
     return schema_path
 
 
-def _run_repair(monkeypatch, tmp_path, documents, *, apply_changes):
+def _run_repair(monkeypatch, tmp_path, documents, *, apply_changes, **options):
     collection = FakeCollection(documents)
     client = FakeMongoClient(FakeDatabase(collection))
     monkeypatch.setattr(schema_validate, 'mongo_client', client)
@@ -94,6 +118,7 @@ def _run_repair(monkeypatch, tmp_path, documents, *, apply_changes):
         collection_name='projects',
         schema_path=str(_write_visibility_schema(tmp_path)),
         apply_changes=apply_changes,
+        **options,
     )
     return collection, report
 
@@ -299,6 +324,66 @@ def test_validation_summary_distinguishes_deleted_documents(capsys):
     assert 'Valid documents: 1' in output
 
 
+def test_schema_repair_writes_in_bulk_batches(monkeypatch, tmp_path):
+    documents = [{'_id': ObjectId(), 'private': True, 'delete': False} for _ in range(5)]
+    collection, report = _run_repair(
+        monkeypatch, tmp_path, documents, apply_changes=True, batch_size=2)
+
+    assert collection.bulk_write_sizes == [2, 2, 1]
+    assert all(doc['private'] == 'private' for doc in collection.documents.values())
+    assert 'Updated documents: 5' in report
+
+
+def test_validation_since_and_jsonl_output(capsys):
+    import io
+
+    old_id, new_id = ObjectId(), ObjectId()
+    collection = FakeCollection([
+        {'_id': old_id, 'value': 'stale', 'update_date': '2025-12-31T23:59:59.000000'},
+        {'_id': new_id, 'value': 'recent', 'update_date': '2026-01-02T08:00:00.000000'},
+        {'_id': ObjectId(), 'value': 1, 'delete': True, 'update_date': '2026-01-03T00:00:00.000000'},
+    ])
+    schema = {
+        '$schema': 'http://json-schema.org/draft-07/schema#',
+        'type': 'object',
+        'properties': {'value': {'type': 'integer'}},
+    }
+    jsonl = io.StringIO()
+
+    assert schema_validate.validate_collection(
+        schema,
+        db_handle=FakeDatabase(collection),
+        collection_name='projects',
+        since='2026-01-01',
+        jsonl_out=jsonl,
+    ) == (2, 1, 0)
+
+    records = [json.loads(line) for line in jsonl.getvalue().splitlines()]
+    assert [r['_id'] for r in records[:-1]] == [str(new_id)]
+    assert records[0]['status'] == 'invalid'
+    assert records[0]['errors'][0]['path'] == '/value'
+    assert records[-1]['summary']['deleted_skipped'] == 1
+
+
+def test_parallel_validation_matches_serial(capsys):
+    collection = FakeCollection(
+        [{'_id': ObjectId(), 'value': i if i % 3 else str(i)} for i in range(12)])
+    schema = {
+        '$schema': 'http://json-schema.org/draft-07/schema#',
+        'type': 'object',
+        'properties': {'value': {'type': 'integer'}},
+    }
+
+    def run(workers):
+        totals = schema_validate.validate_collection(
+            schema, db_handle=FakeDatabase(collection), collection_name='projects',
+            batch_size=5, workers=workers)
+        output = capsys.readouterr().out
+        return totals, output[output.index('--- Validating'):]
+
+    assert run(2) == run(1)
+
+
 def test_admin_schema_repair_template_requires_preview_before_apply():
     template = (
         REPO_ROOT / 'caper' / 'templates' / 'pages' /
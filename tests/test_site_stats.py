@@ -25,8 +25,10 @@ def _cleanup_stats_since(start_id):
 
 
 def _latest_subset():
-    from caper.site_stats import get_latest_site_statistics
+    from caper.site_stats import get_latest_site_statistics, invalidate_site_statistics_cache
 
+    # Read the newest snapshot itself, not a copy cached by an earlier test run.
+    invalidate_site_statistics_cache()
     return _stat_subset(get_latest_site_statistics())
 
 
@@ -266,6 +268,78 @@ def test_regenerate_matches_incremental_stats_for_every_visibility():
         _cleanup_stats_since(start_id)
 
 
+@pytest.mark.slow
+@pytest.mark.integration
+def test_regenerate_reuses_stored_contributions():
+    """Regeneration sums stored contribution vectors; it reads a project's runs only the first
+    time it sees the project."""
+    from caper.utils import collection_handle
+    from caper.site_stats import get_latest_site_statistics, regenerate_site_statistics
+
+    start_id = get_latest_site_statistics()['_id']
+    project = _project([('ecDNA', 'brain'), ('BFB', 'lung')], visibility='public')
+
+    try:
+        before = _stat_subset(regenerate_site_statistics())
+        collection_handle.insert_one(project)
+        counted = _stat_subset(regenerate_site_statistics())
+        assert counted['public_sample_count'] == before['public_sample_count'] + 2
+
+        # The stored contribution, not the runs, is what regeneration sums now.
+        collection_handle.update_one({'_id': project['_id']}, {'$set': {'runs': {}}})
+        assert _stat_subset(regenerate_site_statistics()) == counted
+
+        # A visibility change is picked up without re-reading runs.
+        collection_handle.update_one({'_id': project['_id']}, {'$set': {'private': 'private'}})
+        moved = _stat_subset(regenerate_site_statistics())
+        assert moved['public_sample_count'] == before['public_sample_count']
+        assert moved['all_private_sample_count'] == before['all_private_sample_count'] + 2
+    finally:
+        collection_handle.delete_one({'_id': project['_id']})
+        regenerate_site_statistics()
+        _cleanup_stats_since(start_id)
+
+
+@pytest.mark.slow
+@pytest.mark.integration
+def test_first_change_before_the_ledger_is_built_counts_every_project():
+    """Until the ledger has been built, an add must not publish totals of only the projects
+    changed since deploy."""
+    from caper.utils import collection_handle
+    from caper.site_stats import (
+        add_project_to_site_statistics,
+        delete_project_from_site_statistics,
+        get_latest_site_statistics,
+        regenerate_site_statistics,
+        site_stats_checkpoints_handle,
+        site_stats_contributions_handle,
+    )
+
+    start_id = get_latest_site_statistics()['_id']
+    existing = _project([('ecDNA', 'brain')], visibility='public')
+    project = _project([('BFB', 'lung'), ('ecDNA', 'lung')], visibility='public')
+
+    try:
+        collection_handle.insert_one(existing)
+        before = _stat_subset(regenerate_site_statistics())
+
+        # As first deployed: no contributions and no record that they were ever built.
+        site_stats_checkpoints_handle.delete_many({})
+        site_stats_contributions_handle.delete_many({})
+
+        add_project_to_site_statistics(project, 'public')
+        after_add = _latest_subset()
+        assert after_add['public_proj_count'] == before['public_proj_count'] + 1
+        assert after_add['public_sample_count'] == before['public_sample_count'] + 2
+
+        delete_project_from_site_statistics(project, 'public')
+        assert _latest_subset() == before
+    finally:
+        collection_handle.delete_one({'_id': existing['_id']})
+        regenerate_site_statistics()
+        _cleanup_stats_since(start_id)
+
+
 def _upload_placeholder(visibility='public', failed=False):
     """A project document as views.py leaves it when an upload is still aggregating
     (aggregation_in_progress) or aggregation failed. Both stay current/undeleted."""
@@ -437,11 +511,16 @@ def _legacy_stats_document():
 @pytest.mark.slow
 @pytest.mark.integration
 def test_latest_statistics_fills_in_buckets_missing_from_older_documents():
-    from caper.site_stats import get_latest_site_statistics, site_statistics_handle
+    from caper.site_stats import (
+        get_latest_site_statistics,
+        invalidate_site_statistics_cache,
+        site_statistics_handle,
+    )
 
     start_id = get_latest_site_statistics()['_id']
     try:
         site_statistics_handle.insert_one(_legacy_stats_document())
+        invalidate_site_statistics_cache()
         latest = get_latest_site_statistics()
 
         assert latest['hidden_public_proj_count'] == 0
@@ -468,7 +547,11 @@ def test_admin_stats_table_renders_from_a_document_written_before_the_unlisted_b
     from django.template.loader import render_to_string
     from django.test import RequestFactory
 
-    from caper.site_stats import get_latest_site_statistics, site_statistics_handle
+    from caper.site_stats import (
+        get_latest_site_statistics,
+        invalidate_site_statistics_cache,
+        site_statistics_handle,
+    )
 
     # the page's own context processors need a request; the stats table itself only reads site_stats
     request = RequestFactory().get('/admin-stats/')
@@ -477,6 +560,7 @@ def test_admin_stats_table_renders_from_a_document_written_before_the_unlisted_b
     start_id = get_latest_site_statistics()['_id']
     try:
         site_statistics_handle.insert_one(_legacy_stats_document())
+        invalidate_site_statistics_cache()
         html = render_to_string('pages/admin_stats.html',
                                 {'site_stats': get_latest_site_statistics()},
                                 request=request)
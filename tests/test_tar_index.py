@@ -0,0 +1,141 @@
+"""
+Tests for block-compressed project tarballs and their member index
+(caper/tar_index.py).
+
+The rewrite has to be invisible to everything that already reads stored
+tarballs — downloads, ``tarfile``, the Aggregator — so the first property
+checked is that the output is still an ordinary .tar.gz with identical
+contents.  The rest pin down random access: a member read through the index
+is byte-for-byte what ``tarfile`` would return, including members that span
+several blocks and members that start mid-block.
+"""
+
+import io
+import os
+import tarfile
+
+import pytest
+
+from caper import tar_index
+
+
+RUN_JSON = b'{"runs": {"sample1": []}}\n'
+
+
+def _add_file(tar, name, body):
+    info = tarfile.TarInfo(name)
+    info.size = len(body)
+    tar.addfile(info, io.BytesIO(body))
+
+
+def _add_dir(tar, name):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    tar.addfile(info)
+
+
+@pytest.fixture
+def source_tar(tmp_path):
+    """A small project-shaped tarball with one member larger than a block."""
+    path = tmp_path / 'project.tar.gz'
+    big = os.urandom(300 * 1024)
+    with tarfile.open(path, 'w:gz') as tar:
+        _add_dir(tar, 'results')
+        _add_file(tar, 'results/run.json', RUN_JSON)
+        _add_dir(tar, 'results/other_files')
+        _add_file(tar, 'results/other_files/big.bin', big)
+        _add_file(tar, 'results/other_files/notes.txt', b'hello\n')
+    return path, big
+
+
+def _blocked(tmp_path, source, block_size=64 * 1024):
+    dst = tmp_path / 'blocked.tar.gz'
+    index = tar_index.write_blocked_tar_gz(str(source), str(dst), block_size=block_size)
+    return dst, index
+
+
+def test_blocked_archive_is_an_ordinary_tar_gz(tmp_path, source_tar):
+    source, _ = source_tar
+    dst, index = _blocked(tmp_path, source)
+
+    with tarfile.open(source, 'r:gz') as original, tarfile.open(dst, 'r:gz') as rewritten:
+        assert original.getnames() == rewritten.getnames()
+        for member in original.getmembers():
+            if member.isfile():
+                assert (original.extractfile(member).read()
+                        == rewritten.extractfile(member.name).read())
+
+    assert len(index['blocks']) > 1
+    assert tar_index.member_names(index) == [
+        'results', 'results/run.json', 'results/other_files',
+        'results/other_files/big.bin', 'results/other_files/notes.txt',
+    ]
+
+
+def test_read_member_matches_tarfile(tmp_path, source_tar):
+    source, big = source_tar
+    dst, index = _blocked(tmp_path, source)
+
+    with open(dst, 'rb') as fh:
+        assert tar_index.read_member(fh, index, 'results/run.json') == RUN_JSON
+        # Spans several blocks and starts part-way into one.
+        assert tar_index.read_member(fh, index, 'results/other_files/big.bin') == big
+        assert tar_index.read_member(fh, index, './results/other_files/notes.txt') == b'hello\n'
+
+
+def test_small_blocks_split_members_across_many_gzip_members(tmp_path, source_tar):
+    source, big = source_tar
+    dst, index = _blocked(tmp_path, source, block_size=1000)
+
+    with open(dst, 'rb') as fh:
+        chunks = list(tar_index.iter_member(fh, index, 'results/other_files/big.bin'))
+    assert len(chunks) > 1
+    assert b''.join(chunks) == big
+
+
+def test_missing_and_non_file_members_raise_key_error(tmp_path, source_tar):
+    source, _ = source_tar
+    dst, index = _blocked(tmp_path, source)
+
+    with open(dst, 'rb') as fh:
+        with pytest.raises(KeyError):
+            tar_index.read_member(fh, index, 'results/missing.json')
+        with pytest.raises(KeyError):
+            tar_index.read_member(fh, index, 'results/other_files')
+
+
+def test_member_names_filters_by_prefix(tmp_path, source_tar):
+    source, _ = source_tar
+    _, index = _blocked(tmp_path, source)
+
+    assert tar_index.member_names(index, 'results/other_files/') == [
+        'results/other_files', 'results/other_files/big.bin',
+        'results/other_files/notes.txt',
+    ]
+
+
+def test_uncompressed_source_is_accepted(tmp_path):
+    source = tmp_path / 'plain.tar'
+    with tarfile.open(source, 'w') as tar:
+        _add_file(tar, 'results/run.json', RUN_JSON)
+    dst, index = _blocked(tmp_path, source)
+
+    with open(dst, 'rb') as fh:
+        assert tar_index.read_member(fh, index, 'results/run.json') == RUN_JSON
+
+
+def test_index_round_trips_and_rejects_garbage(tmp_path, source_tar):
+    source, _ = source_tar
+    _, index = _blocked(tmp_path, source)
+
+    assert tar_index.deserialize_index(tar_index.serialize_index(index)) == index
+    assert tar_index.deserialize_index(b'not an index') is None
+    stale = dict(index, version=tar_index.INDEX_VERSION + 1)
+    assert tar_index.deserialize_index(tar_index.serialize_index(stale)) is None
+
+
+def test_non_tar_source_raises(tmp_path):
+    source = tmp_path / 'junk.tar.gz'
+    source.write_bytes(b'this is not a tarball')
+    with pytest.raises(tarfile.TarError):
+        tar_index.write_blocked_tar_gz(str(source), str(tmp_path / 'out.tar.gz'))
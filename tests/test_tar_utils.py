@@ -0,0 +1,57 @@
+"""
+Tests for reading single members out of a project's stored tarball
+(tar_utils.read_project_tar_member), with and without its member index.
+"""
+
+import io
+import tarfile
+
+import pytest
+from bson import ObjectId
+
+MEMBERS = [
+    ('results/run.json', b'{"runs": {}}'),
+    ('results/other_files/notes.txt', b'notes\n' * 200),
+]
+
+
+class _FS:
+    def __init__(self, files):
+        self.files = files
+
+    def get(self, oid):
+        return io.BytesIO(self.files[oid])
+
+
+def _stored_project(tmp_path, monkeypatch, blocked, indexed):
+    from caper import tar_index, tar_utils
+    source = tmp_path / 'project.tar.gz'
+    with tarfile.open(source, 'w:gz') as tar:
+        for name, body in MEMBERS:
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+
+    tar_id, index_id = ObjectId(), ObjectId()
+    project = {'_id': ObjectId(), 'tarfile': str(tar_id)}
+    files = {tar_id: source.read_bytes()}
+    if blocked:
+        stored = tmp_path / 'blocked.tar.gz'
+        index = tar_index.write_blocked_tar_gz(str(source), str(stored), block_size=256)
+        files = {tar_id: stored.read_bytes()}
+        if indexed:
+            files[index_id] = tar_index.serialize_index(index)
+            project['tarfile_index'] = str(index_id)
+    monkeypatch.setattr(tar_utils, 'fs_handle', _FS(files))
+    return project
+
+
+@pytest.mark.parametrize('blocked,indexed', [(True, True), (True, False), (False, False)])
+def test_members_are_read_with_and_without_an_index(tmp_path, monkeypatch, blocked, indexed):
+    from caper.tar_utils import read_project_tar_member
+    project = _stored_project(tmp_path, monkeypatch, blocked, indexed)
+
+    for name, body in MEMBERS:
+        assert read_project_tar_member(project, name) == body
+    with pytest.raises(KeyError):
+        read_project_tar_member(project, 'results/missing.txt')
@@ -0,0 +1,138 @@
+"""
+Tests for resumable upload sessions (caper/upload_sessions.py).
+
+The views in views_apis.py are thin wrappers that map UploadSessionError to
+a response, so the protocol is exercised here directly against a temporary
+MEDIA_ROOT: parts arriving out of order, resent, corrupted or missing, and
+a finalize that must reproduce the uploaded bytes exactly.
+"""
+
+import hashlib
+import io
+import os
+import time
+
+import pytest
+from django.test import override_settings
+
+from caper import upload_sessions
+from caper.upload_sessions import UploadSessionError
+
+PART = upload_sessions.MIN_PART_SIZE
+
+
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def media_root(tmp_path):
+    with override_settings(MEDIA_ROOT=str(tmp_path)):
+        yield tmp_path
+
+
+@pytest.fixture
+def payload():
+    # Two full parts and a short last one.
+    return os.urandom(2 * PART + 1234)
+
+
+def _open(payload, **kwargs):
+    return upload_sessions.create_session(
+        'project.tar.gz', len(payload), {'project_name': 'p'}, 'alice', part_size=PART, **kwargs)
+
+
+def _part(payload, n):
+    return payload[(n - 1) * PART:n * PART]
+
+
+def test_parts_in_any_order_reassemble_to_the_original(media_root, payload):
+    manifest = _open(payload, sha256=_sha(payload))
+    sid = manifest['session_id']
+    assert manifest['part_count'] == 3
+
+    for n in (3, 1):
+        assert upload_sessions.put_part(sid, n, io.BytesIO(_part(payload, n)), _sha(_part(payload, n)))
+    status = upload_sessions.session_status(sid)
+    assert (status['received_parts'], status['missing_parts']) == ([1, 3], [2])
+
+    with pytest.raises(UploadSessionError) as missing:
+        upload_sessions.finalize_session(sid)
+    assert missing.value.status_code == 409
+    assert missing.value.details == {'missing_parts': [2]}
+
+    upload_sessions.put_part(sid, 2, io.BytesIO(_part(payload, 2)), _sha(_part(payload, 2)))
+    _, reconstructed = upload_sessions.finalize_session(sid)
+
+    assert reconstructed == os.path.join(str(media_root), sid, upload_sessions.RECONSTRUCTED_NAME)
+    with open(reconstructed, 'rb') as f:
+        assert f.read() == payload
+    assert not [name for name in os.listdir(media_root / 'upload_sessions' / sid) if name.startswith('part-')]
+    # A client that lost the first response can ask again without a second project.
+    manifest, again = upload_sessions.finalize_session(sid)
+    assert again is None and manifest['state'] == upload_sessions.FINALIZED
+    assert upload_sessions.session_status(sid)['missing_parts'] == []
+
+
+def test_resent_parts_are_idempotent_and_conflicts_refused(media_root, payload):
+    sid = _open(payload)['session_id']
+    first = _part(payload, 1)
+
+    assert upload_sessions.put_part(sid, 1, io.BytesIO(first), _sha(first)) is True
+    unread = io.BytesIO(first)
+    assert upload_sessions.put_part(sid, 1, unread, _sha(first).upper()) is False
+    assert unread.tell() == 0   # acknowledged without reading the body again
+
+    other = os.urandom(PART)
+    with pytest.raises(UploadSessionError) as conflict:
+        upload_sessions.put_part(sid, 1, io.BytesIO(other), _sha(other))
+    assert conflict.value.status_code == 409
+
+
+@pytest.mark.parametrize('body, digest, status_code', [
+    (b'x' * PART, _sha(b'y' * PART), 422),         # corrupted in transit
+    (b'x' * (PART - 1), _sha(b'x' * (PART - 1)), 400),  # truncated
+    (b'x' * (PART + 1), _sha(b'x' * (PART + 1)), 400),  # oversized
+    (b'x' * PART, 'not-a-digest', 400),
+])
+def test_bad_parts_are_rejected_and_leave_nothing_behind(media_root, payload, body, digest, status_code):
+    sid = _open(payload)['session_id']
+
+    with pytest.raises(UploadSessionError) as rejected:
+        upload_sessions.put_part(sid, 1, io.BytesIO(body), digest)
+
+    assert rejected.value.status_code == status_code
+    assert os.listdir(media_root / 'upload_sessions' / sid) == ['session.json']
+
+
+def test_finalize_checks_the_whole_file_digest(media_root, payload):
+    sid = _open(payload, sha256=_sha(b'something else'))['session_id']
+    for n in (1, 2, 3):
+        upload_sessions.put_part(sid, n, io.BytesIO(_part(payload, n)), _sha(_part(payload, n)))
+
+    with pytest.raises(UploadSessionError) as mismatch:
+        upload_sessions.finalize_session(sid)
+
+    assert mismatch.value.status_code == 422
+    assert not os.path.exists(os.path.join(str(media_root), sid, upload_sessions.RECONSTRUCTED_NAME))
+    # The lock is released and the parts kept, so the session can still be inspected.
+    assert upload_sessions.session_status(sid)['state'] == upload_sessions.OPEN
+
+
+def test_unknown_sessions_and_parts_are_not_found(media_root, payload):
+    sid = _open(payload)['session_id']
+    for session_id, part in (('../../etc', 1), ('0' * 32, 1), (sid, 4), (sid, 0)):
+        with pytest.raises(UploadSessionError) as missing:
+            upload_sessions.put_part(session_id, part, io.BytesIO(b''), _sha(b''))
+        assert missing.value.status_code == 404
+
+
+def test_expired_sessions_are_purged(media_root, payload):
+    old = _open(payload)['session_id']
+    fresh = _open(payload)['session_id']
+    manifest = media_root / 'upload_sessions' / old / 'session.json'
+    stale = time.time() - upload_sessions.UPLOAD_SESSION_TTL_SECONDS - 60
+    os.utime(manifest, (stale, stale))
+
+    assert upload_sessions.purge_expired_sessions() == 1
+    assert sorted(os.listdir(media_root / 'upload_sessions')) == [fresh]